@@ -2,7 +2,7 @@
 import os
 import yaml
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Literal
 from functools import lru_cache
 from pydantic import BaseModel, Field, BeforeValidator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -77,6 +77,240 @@ class DeGirumConfig(BaseModel):
     lancedb_uri: str = Field(str(LANCEDB_DATA_DIR), description="LanceDB 数据库文件的存储目录。")
     # 用于存储人脸特征的表名
     lancedb_table_name: str = Field("faces_table", description="用于存储人脸特征的表名。")
+    # 人脸特征在 LanceDB 中的存储精度，修改后启动时会自动迁移已有数据表。
+    # float16 不保留 float32 原始向量：重排与快照都只能使用半精度值，相似度带有半精度舍入误差，没有精确重排
+    vector_storage: Literal["float32", "float16"] = Field("float32", description="特征向量的磁盘存储精度（float16 时相似度含半精度舍入误差）。")
+    # 检索方式：lancedb 直接在数据库中检索；float16/int8 使用常驻内存的紧凑索引筛选候选；
+    # snapshot 使用按表版本落盘的内存映射快照对表中存储的向量做全量检索，多进程共享物理内存
+    vector_index: Literal["lancedb", "float16", "int8", "snapshot"] = Field("lancedb", description="特征检索索引类型。")
+    snapshot_dir: str = Field(str(DATA_DIR / "gallery_snapshot"), description="人脸库内存映射快照的存储目录。")
+    # 累计写入多少次后在后台合并数据文件与标量索引（0 表示不自动合并）
+    index_optimize_writes: int = Field(500, description="触发后台索引合并的写入次数。")
+    # 紧凑索引/半精度存储下，按表中存储的向量重排的候选数量（仅 float32 存储时重排得分是精确的）
+    rerank_candidates: int = Field(20, description="按表中存储的向量重排的候选数量。")
+    # 紧凑索引检查数据表版本（感知其他进程写入）的时间间隔
+    index_refresh_seconds: float = Field(5.0, description="紧凑索引检查数据表版本的间隔（秒）。")
+    # 人员级聚合索引：按 sn 聚合为质心 + 代表模板，识别时先检索人员，启用后优先于 vector_index
+    person_index: bool = Field(False, description="是否启用按人员聚合的模板索引。")
+    person_exemplars: int = Field(5, description="每个人员保留的最大代表模板数量。")
+    person_candidates: int = Field(10, description="按质心粗排后参与代表模板精确比对的人员数量。")
+
+
+class EmbeddingCacheConfig(BaseModel):
+    # 是否启用基于内容哈希的检测/特征缓存
+    enabled: bool = Field(True, description="是否启用基于内容哈希的检测结果与特征向量缓存。")
+    # 缓存条目上限（图像级与人脸裁剪级条目合计）
+    max_entries: int = Field(2048, description="缓存的最大条目数，超出后按LRU淘汰。")
+    # 缓存条目存活时间
+    ttl_seconds: float = Field(600.0, description="缓存条目的存活时间（秒），<=0 表示不过期。")
+
+
+class MotionGateConfig(BaseModel):
+    # 是否默认对视频流启用运动门控（可在启动流时单独覆盖）
+    enabled: bool = Field(False, description="是否默认启用运动门控，静止画面跳过人脸检测。")
+    # 帧差计算前将画面缩放到的宽度，越小越省CPU
+    downscale_width: int = Field(160, description="运动检测时画面缩放后的宽度（像素）。")
+    # 单个像素被视为“变化”的灰度差阈值
+    pixel_threshold: int = Field(25, description="像素灰度差超过该值即视为变化。")
+    # 变化像素占比超过该值即认为画面有运动（灵敏度，越小越灵敏）
+    min_changed_ratio: float = Field(0.003, description="变化像素占比阈值（灵敏度），越小越灵敏。")
+    # 无论是否有运动，距上次检测超过该间隔时强制执行一次检测
+    force_detect_interval_seconds: float = Field(2.0, description="强制检测的最大间隔（秒），作为安全兜底。")
+
+
+class StreamWorkerConfig(BaseModel):
+    # 是否将视频流流水线放到独立的工作进程中运行（默认在 API 进程内以线程运行）
+    enabled: bool = Field(False, description="是否启用多进程视频流分片，避免所有流争用同一个GIL。")
+    # 工作进程数量
+    num_workers: int = Field(2, description="视频流工作进程数量。")
+    # 每个工作进程加载的模型套数，即每个进程可同时承载的视频流路数
+    models_per_worker: int = Field(2, description="每个工作进程的模型池大小（即可承载的视频流路数）。")
+    # 共享内存环形缓冲的槽位数
+    ring_slots: int = Field(4, description="每路视频流共享内存环形缓冲的槽位数。")
+    # 单个槽位可容纳的最大编码帧字节数
+    ring_slot_bytes: int = Field(4 * 1024 * 1024, description="共享内存单个槽位的最大字节数（需大于单帧JPEG大小）。")
+
+
+class CaptureConfig(BaseModel):
+    # 默认视频采集后端：opencv 使用 cv2.VideoCapture，ffmpeg 使用 ffmpeg 子进程解码
+    backend: Literal["opencv", "ffmpeg"] = Field("opencv", description="默认视频采集后端。")
+    # ffmpeg 后端在解码阶段缩放到的工作分辨率；只填宽度时按原始宽高比计算高度，均不填则保持原始分辨率
+    working_width: Optional[int] = Field(None, description="ffmpeg 解码输出宽度（像素）。")
+    working_height: Optional[int] = Field(None, description="ffmpeg 解码输出高度（像素）。")
+    # ffmpeg 解码线程数，0 表示由 ffmpeg 自动决定
+    decode_threads: int = Field(0, description="ffmpeg 解码线程数，0 表示自动。")
+    # 是否启用低延迟解码标志 (-fflags nobuffer -flags low_delay)
+    low_delay: bool = Field(False, description="是否启用 ffmpeg 低延迟解码标志。")
+    rtsp_transport: str = Field("tcp", description="RTSP 传输协议 (tcp/udp)。")
+    ffmpeg_path: str = Field("ffmpeg", description="ffmpeg 可执行文件路径。")
+    ffprobe_path: str = Field("ffprobe", description="ffprobe 可执行文件路径。")
+    # 预分配的解码缓冲帧数量，与队列深度无关；全部在途时临时分配新帧
+    buffer_pool_size: int = Field(6, ge=2, le=32, description="ffmpeg 后端预分配的解码缓冲帧数量。")
+
+
+class FaceQualityConfig(BaseModel):
+    # 人脸质量门控：不合格的人脸不做特征提取，注册时直接拒绝
+    enabled: bool = Field(True, description="是否启用人脸质量门控。")
+    min_face_size: int = Field(40, description="检测框短边的最小像素数。")
+    # 由 5 点关键点估计的姿态角上限（度）
+    max_yaw: float = Field(45.0, description="允许的最大偏航角（度）。")
+    max_pitch: float = Field(35.0, description="允许的最大俯仰角（度）。")
+    # 对齐后 112x112 人脸灰度图的拉普拉斯方差下限，越小越模糊
+    min_sharpness: float = Field(30.0, description="对齐人脸的最小清晰度（拉普拉斯方差）。")
+
+
+class EventLogConfig(BaseModel):
+    # 识别事件日志：视频流中的每次识别结果按天分区写入 Parquet，供考勤等系统查询
+    enabled: bool = Field(True, description="是否记录视频流识别事件。")
+    dir: str = Field(str(DATA_DIR / "events"), description="识别事件日志的存储目录。")
+    batch_size: int = Field(500, description="单次批量写入的最大事件数。")
+    flush_interval_seconds: float = Field(2.0, description="未攒满一批时的最长写入间隔（秒）。")
+    # 内存中待写入事件的上限，超过后新事件被丢弃并计数，保证不阻塞视频流水线
+    max_pending: int = Field(10000, description="内存中待写入事件的最大数量。")
+    record_unknown: bool = Field(False, description="是否记录未识别 (Unknown) 的人脸。")
+    # 同一视频流内同一人员持续在画面中时逐帧都会被识别，窗口内只记录一条事件
+    dedup_seconds: float = Field(5.0, ge=0, description="同一视频流内同一人员两次记录的最小间隔（秒），0 表示不去重。")
+    # 每次写出都会生成一个小文件，定期把本进程（及已退出进程）的小文件合并为一个按时间排序的文件
+    compact_interval_seconds: float = Field(300.0, description="小文件合并的检查间隔（秒），<=0 表示不合并。")
+    compact_min_files: int = Field(8, ge=2, description="同一天分区内可合并的文件数达到该值时触发合并。")
+
+
+class WebhookConfig(BaseModel):
+    # 识别事件的 HTTP 推送：批量发送、同一视频流内同一人员去抖，失败后退避重试
+    enabled: bool = Field(False, description="是否向外部系统推送识别事件。")
+    urls: List[str] = Field(default_factory=list, description="接收事件的 Webhook 地址列表，每个地址独立投递与重试。")
+    headers: Dict[str, str] = Field(default_factory=dict, description="随请求附加的 HTTP 头（如鉴权令牌）。")
+    batch_size: int = Field(50, description="单个请求携带的最大事件数。")
+    max_delay_seconds: float = Field(1.0, description="未攒满一批时，事件最长等待发送的时间（秒）。")
+    cooldown_seconds: float = Field(10.0, description="同一视频流内同一人员 (sn) 两次推送的最小间隔（秒）。")
+    timeout_seconds: float = Field(5.0, description="单次 HTTP 请求的超时时间（秒）。")
+    max_retries: int = Field(8, description="单个批次的最大重试次数，超过后丢弃。")
+    retry_backoff_seconds: float = Field(1.0, description="首次重试的等待时间，之后按指数增长（秒）。")
+    max_backoff_seconds: float = Field(300.0, description="重试等待时间的上限（秒）。")
+    # 内存中待发送事件的上限，超过后新事件被丢弃并计数，保证不阻塞视频流水线
+    max_pending: int = Field(5000, description="每个地址内存中待发送事件的最大数量。")
+    max_retry_batches: int = Field(100, description="每个地址内存中待重试批次的上限，超出部分写入磁盘。")
+    spool_dir: str = Field(str(DATA_DIR / "webhook_spool"), description="待重试批次的磁盘暂存目录，重启后继续投递。")
+    max_spool_files: int = Field(10000, description="磁盘暂存批次的上限，超出后丢弃最旧的批次。")
+
+
+class StartupConfig(BaseModel):
+    # 启动阶段：重量级依赖在后台线程预导入（与模型加载并行），就绪前用自检图片预热每套模型与数据库
+    preload_modules: List[str] = Field(default_factory=lambda: ["lancedb", "pyarrow.dataset"],
+                                       description="启动时在后台线程中预导入的模块，与模型加载并行进行。")
+    warmup_enabled: bool = Field(True, description="就绪前是否用自检图片预热全部模型与人脸库检索。")
+    warmup_image: str = Field(str(BASE_DIR / "app" / "static" / "self_test_face.jpg"), description="预热使用的自检人脸图片。")
+    warmup_timeout_seconds: float = Field(30.0, description="预热时从模型池获取每套模型的最长等待时间（秒）。")
+
+
+class TracingConfig(BaseModel):
+    # 调用链追踪：按采样率记录请求/帧在解码、检测、对齐、特征提取、检索各步骤的耗时
+    enabled: bool = Field(False, description="是否按采样率记录并导出调用链。")
+    sample_rate: float = Field(0.01, description="API 请求的采样率 (0~1)。")
+    frame_sample_rate: float = Field(0.001, description="视频流逐帧处理的采样率 (0~1)。")
+    exporter: Literal["file", "otlp"] = Field("file", description="导出方式：本地 JSONL 文件或 OTLP/HTTP (JSON) 收集器。")
+    file_path: str = Field(str(DATA_DIR / "traces" / "spans.jsonl"), description="file 导出方式的输出文件。")
+    otlp_endpoint: str = Field("http://127.0.0.1:4318/v1/traces", description="OTLP/HTTP 收集器的 traces 地址。")
+    service_name: str = Field("face-rec", description="导出时使用的服务名。")
+    # 请求带上该请求头时（无论是否采样）在响应的 Server-Timing 头中返回各步骤耗时，留空则关闭
+    debug_header: str = Field("X-Debug-Timing", description="触发即时耗时明细的请求头名称。")
+    max_pending: int = Field(2000, description="内存中待导出调用链的上限，超出后丢弃。")
+    export_batch_size: int = Field(100, description="单次导出的最大调用链数。")
+    flush_interval_seconds: float = Field(2.0, description="导出线程的最长等待间隔（秒）。")
+
+
+QueuePolicy = Literal["drop_oldest", "drop_newest", "latest_only", "block"]
+
+
+class StageQueueConfig(BaseModel):
+    policy: QueuePolicy = Field("block", description="队列满时的策略：drop_oldest / drop_newest / latest_only / block。")
+    depth: int = Field(30, ge=1, description="队列深度（latest_only 固定为 1）。")
+
+
+class PipelineQueueConfig(BaseModel):
+    # 视频流水线各级队列：读帧 -> 预处理 -> 检测 -> 识别；默认值与原先的固定行为一致
+    preprocess: StageQueueConfig = Field(default_factory=lambda: StageQueueConfig(policy="drop_newest"),
+                                         description="读帧线程 -> 预处理线程的队列。")
+    inference: StageQueueConfig = Field(default_factory=StageQueueConfig, description="预处理线程 -> 检测线程的队列。")
+    postprocess: StageQueueConfig = Field(default_factory=StageQueueConfig, description="检测线程 -> 识别线程的队列。")
+    # 自采集起超过该时延的帧在送入 NPU（检测/识别）前直接丢弃，0 表示不限制
+    latency_budget_ms: int = Field(0, ge=0, description="帧的最大允许时延（毫秒），0 表示不限制。")
+
+
+class FeedConfig(BaseModel):
+    # MJPEG 推流：默认画面按 jpeg_quality 编码全分辨率；观众可通过 max_width / quality 参数订阅缩小或低质量的变体，
+    # 每个变体只在有观众时编码，且每帧只编码一次供所有订阅者共享
+    jpeg_quality: int = Field(95, ge=1, le=100, description="默认推流画面的 JPEG 质量。")
+    max_variants_per_stream: int = Field(4, ge=0, description="每路视频流同时存在的画质变体上限，0 表示不允许变体。")
+    min_width: int = Field(160, ge=16, description="变体允许的最小宽度（像素）。")
+    # 默认画面同样只在有观众时编码；最后一个观众离开或最近一次快照请求之后继续编码一段时间，避免重连/轮询时等待
+    idle_encode_seconds: float = Field(5.0, ge=0, description="默认画面在没有观众后继续编码的时间（秒）。")
+    # 快照接口：缩小后的快照按 (帧, 宽度) 缓存，画面未更新时直接返回缓存或 304
+    snapshot_jpeg_quality: int = Field(80, ge=1, le=100, description="缩小后快照的 JPEG 质量。")
+    snapshot_cache_widths: int = Field(8, ge=1, description="每路视频流缓存的快照宽度种类上限。")
+
+
+VideoOutputFormat = Literal["mjpeg", "fmp4", "hls"]
+
+
+class VideoOutputConfig(BaseModel):
+    # 视频流输出格式：mjpeg 逐帧推送 JPEG；fmp4 / hls 由每路流一个 ffmpeg 软件编码器输出 H.264，所有观众共享
+    default_format: VideoOutputFormat = Field("mjpeg", description="默认视频输出格式：mjpeg / fmp4 / hls。")
+    bitrate_kbps: int = Field(1500, gt=0, description="H.264 目标码率 (kbps)。")
+    fps: int = Field(15, gt=0, description="H.264 输出帧率，识别帧率不足时重复上一帧。")
+    # 关键帧间隔决定 fMP4 分片时长与新观众的起播等待时间
+    gop_seconds: float = Field(1.0, gt=0, description="关键帧间隔（秒）。")
+    preset: str = Field("veryfast", description="libx264 编码预设，越快占用 CPU 越少、压缩率越低。")
+    max_width: int = Field(1280, ge=0, description="编码前将画面缩放到的最大宽度（像素），0 表示保持原始分辨率。")
+    viewer_buffer_fragments: int = Field(8, ge=1, description="每个 fMP4 观众最多缓冲的分片数，超出后断开该观众。")
+    hls_dir: str = Field(str(DATA_DIR / "hls"), description="HLS 分段与播放列表的输出目录（每路流一个子目录）。")
+    hls_segment_seconds: float = Field(2.0, gt=0, description="HLS 分段时长（秒），应为关键帧间隔的整数倍。")
+    hls_list_size: int = Field(5, ge=1, description="HLS 播放列表中保留的分段数。")
+    # 编码器只在有观众时运行；HLS 以最近一次请求播放列表/分段的时间判断是否仍有观众
+    idle_stop_seconds: float = Field(10.0, ge=0, description="最后一个观众离开后停止 ffmpeg 编码进程的等待时间（秒）。")
+
+
+class SyncConfig(BaseModel):
+    # 多台设备之间的人脸库增量同步（拉模式）：每个节点记录版本化的变更日志，定期从对等节点拉取新变更并批量应用
+    changelog_enabled: bool = Field(True, description="是否记录人脸库变更日志（本节点作为同步数据源的前提）。")
+    node_id: Optional[str] = Field(None, description="本节点标识，为空时自动生成并保存在 LanceDB 目录中。")
+    peers: List[str] = Field(default_factory=list, description="拉取变更的对等节点地址（如 http://10.0.0.2:8000），为空时不启动同步线程。")
+    token: Optional[str] = Field(None, description="节点间共享的同步令牌：变更接口校验请求的 Authorization: Bearer 令牌，拉取对等节点时自动携带。未设置时本节点不对外提供变更。")
+    headers: Dict[str, str] = Field(default_factory=dict, description="请求对等节点时附加的其他 HTTP 头。")
+    interval_seconds: float = Field(30.0, gt=0, description="两轮拉取之间的间隔（秒）。")
+    batch_size: int = Field(500, ge=1, le=5000, description="单次拉取并批量应用的最大变更数。")
+    vector_dtype: Literal["float32", "float16"] = Field("float32", description="传输特征向量的精度，float16 体积减半。")
+    timeout_seconds: float = Field(10.0, gt=0, description="单次 HTTP 请求的超时时间（秒）。")
+    state_file: str = Field(str(DATA_DIR / "sync_state.json"), description="记录各对等节点已应用版本号的状态文件。")
+
+
+class FaceImageConfig(BaseModel):
+    # 注册人脸图片的存储：按内容寻址（相同裁剪图只存一份），由后台线程编码落盘并生成缩略图，注册请求不等待磁盘
+    queue_size: int = Field(256, ge=1, description="待写入图片队列的上限，队列满时在请求线程中直接写入。")
+    jpeg_quality: int = Field(95, ge=1, le=100, description="原图的 JPEG 质量。")
+    fsync: bool = Field(True, description="后台写入后是否 fsync，保证断电后图片不丢失。")
+    thumbnail_size: int = Field(128, ge=16, description="缩略图最长边（像素）。")
+    thumbnail_format: Literal["webp", "jpeg"] = Field("webp", description="缩略图格式。")
+    thumbnail_quality: int = Field(80, ge=1, le=100, description="缩略图的编码质量。")
+
+
+class ReembedConfig(BaseModel):
+    # 更换识别模型后，用已保存的人脸图片在后台重新提取特征，写入按模型命名的暂存表，完成后原子切换
+    auto_start: bool = Field(False, description="启动时发现人脸库特征与当前识别模型不一致，是否自动开始重新提取。")
+    batch_size: int = Field(16, ge=1, le=256, description="每次借用模型处理的图片数。")
+    max_duty_cycle: float = Field(0.3, gt=0, le=1, description="占用模型的时间比例上限，其余时间让给实时识别。")
+    acquire_timeout_seconds: float = Field(0.05, gt=0, description="借用模型的等待时间，超时视为模型池繁忙。")
+    busy_backoff_seconds: float = Field(0.5, ge=0, description="模型池繁忙时的退避时间（秒）。")
+    checkpoint_rows: int = Field(256, ge=1, description="累计多少条结果后写入暂存表并保存进度。")
+    crop_padding: float = Field(0.3, ge=0, le=2, description="重新检测前在人脸裁剪图四周补边的比例（相对最长边）。")
+    state_file: str = Field(str(DATA_DIR / "reembed_state.json"), description="重新提取任务的进度文件。")
+
+
+class GalleryArchiveConfig(BaseModel):
+    # 人脸库整体导出/导入（Arrow IPC 或 Parquet），用于新设备快速开通，无需逐张重新注册
+    tmp_dir: str = Field(str(DATA_DIR / "gallery_archive"), description="API 导出/上传导入时临时文件的存储目录。")
+    batch_size: int = Field(8192, ge=1, description="流式读写人脸库时每批的行数。")
+    parquet_compression: str = Field("zstd", description="Parquet 文件的压缩算法（none / snappy / zstd 等）。")
 
 
 # --- 主配置类 ---
@@ -85,6 +319,22 @@ class AppSettings(BaseSettings):
     server: ServerConfig = Field(default_factory=ServerConfig)
     logging: LoggingConfig = Field(default_factory=LoggingConfig)
     degirum: DeGirumConfig = Field(default_factory=DeGirumConfig) # ✅ 使用新的配置模型
+    embedding_cache: EmbeddingCacheConfig = Field(default_factory=EmbeddingCacheConfig)
+    motion_gate: MotionGateConfig = Field(default_factory=MotionGateConfig)
+    stream_worker: StreamWorkerConfig = Field(default_factory=StreamWorkerConfig)
+    capture: CaptureConfig = Field(default_factory=CaptureConfig)
+    face_quality: FaceQualityConfig = Field(default_factory=FaceQualityConfig)
+    event_log: EventLogConfig = Field(default_factory=EventLogConfig)
+    webhook: WebhookConfig = Field(default_factory=WebhookConfig)
+    startup: StartupConfig = Field(default_factory=StartupConfig)
+    tracing: TracingConfig = Field(default_factory=TracingConfig)
+    pipeline_queues: PipelineQueueConfig = Field(default_factory=PipelineQueueConfig)
+    video_output: VideoOutputConfig = Field(default_factory=VideoOutputConfig)
+    feed: FeedConfig = Field(default_factory=FeedConfig)
+    sync: SyncConfig = Field(default_factory=SyncConfig)
+    gallery_archive: GalleryArchiveConfig = Field(default_factory=GalleryArchiveConfig)
+    face_image: FaceImageConfig = Field(default_factory=FaceImageConfig)
+    reembed: ReembedConfig = Field(default_factory=ReembedConfig)
 
     model_config = SettingsConfigDict(
         env_file=ENV_FILE, env_file_encoding="utf-8", case_sensitive=False,
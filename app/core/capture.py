@@ -0,0 +1,188 @@
+# app/core/capture.py
+import shutil
+import subprocess
+import sys
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.cfg.config import CaptureConfig
+from app.cfg.logging import app_logger
+
+
+class FrameSource(ABC):
+    """视频采集后端的统一接口，方法命名与 cv2.VideoCapture 保持一致，便于直接替换。"""
+
+    @abstractmethod
+    def isOpened(self) -> bool: pass
+
+    @abstractmethod
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]: pass
+
+    @abstractmethod
+    def release(self): pass
+
+
+class OpenCVCapture(FrameSource):
+    """基于 cv2.VideoCapture 的默认采集后端。"""
+
+    def __init__(self, source: str):
+        self._cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+    def isOpened(self) -> bool:
+        return self._cap.isOpened()
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        return self._cap.read()
+
+    def release(self):
+        self._cap.release()
+
+
+def probe_resolution(source: str, ffprobe_path: str = "ffprobe") -> Optional[Tuple[int, int]]:
+    """使用 ffprobe 获取视频源的原始分辨率，失败时返回 None。"""
+    try:
+        output = subprocess.run(
+            [ffprobe_path, "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "stream=width,height", "-of", "csv=p=0:s=x", source],
+            capture_output=True, text=True, timeout=15, check=True,
+        ).stdout.strip().splitlines()
+        width, height = output[0].split("x")[:2]
+        return int(width), int(height)
+    except Exception as e:
+        app_logger.warning(f"ffprobe 获取视频源 '{source}' 分辨率失败: {e}")
+        return None
+
+
+class FFmpegCapture(FrameSource):
+    """
+    基于 ffmpeg 子进程的采集后端。
+
+    - 在解码阶段直接缩放到工作分辨率（-vf scale），下游不再处理全分辨率帧；
+    - 以 rawvideo/bgr24 从管道读取，并 readinto 到预分配的少量缓冲区中，避免每帧申请新数组；
+    - 解码线程数、低延迟标志、RTSP 传输协议均可配置。
+
+    缓冲区只在下游不再引用时复用（以引用计数判断，切片视图也会持有引用），
+    池中缓冲区全部在途时临时申请新数组，因此池大小与流水线队列深度无关。
+    """
+
+    def __init__(self, source: str, width: Optional[int] = None, height: Optional[int] = None,
+                 decode_threads: int = 0, low_delay: bool = False, rtsp_transport: str = "tcp",
+                 buffer_count: int = 8, ffmpeg_path: str = "ffmpeg", ffprobe_path: str = "ffprobe"):
+        self.source = source
+        self._proc: Optional[subprocess.Popen] = None
+        self._buffers: List[np.ndarray] = []
+        self._next_buffer = 0
+        self._eof = False
+        self.pool_misses = 0
+
+        if shutil.which(ffmpeg_path) is None:
+            app_logger.error(f"未找到 ffmpeg 可执行文件: '{ffmpeg_path}'")
+            return
+
+        input_args: List[str] = []
+        if source.isdigit():
+            input_args += ["-f", "v4l2"]
+            source = f"/dev/video{source}"
+        elif source.startswith("rtsp://"):
+            input_args += ["-rtsp_transport", rtsp_transport]
+
+        if not (width and height):
+            original = probe_resolution(source, ffprobe_path)
+            if original is None:
+                return
+            if width:
+                # 只指定宽度时按原始宽高比计算高度（取偶数，满足像素格式要求）
+                height = max(2, int(round(original[1] * width / original[0] / 2.0)) * 2)
+            else:
+                width, height = original
+        self.width, self.height = int(width), int(height)
+        self._frame_bytes = self.width * self.height * 3
+
+        command = [ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin"]
+        if decode_threads > 0:
+            command += ["-threads", str(decode_threads)]
+        if low_delay:
+            command += ["-fflags", "nobuffer", "-flags", "low_delay"]
+        command += input_args + ["-i", source, "-an", "-sn",
+                                 "-vf", f"scale={self.width}:{self.height}",
+                                 "-pix_fmt", "bgr24", "-f", "rawvideo", "pipe:1"]
+        try:
+            self._proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        except OSError as e:
+            app_logger.error(f"启动 ffmpeg 解码进程失败: {e}")
+            return
+        self._buffers = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(max(2, buffer_count))]
+        app_logger.info(f"ffmpeg 解码进程已启动: {self.width}x{self.height}, 线程={decode_threads or 'auto'}, 低延迟={low_delay}")
+
+    def isOpened(self) -> bool:
+        return self._proc is not None and not self._eof
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self._proc is None or self._proc.stdout is None:
+            return False, None
+        frame = self._take_buffer()
+        view = memoryview(frame).cast("B")
+        filled = 0
+        while filled < self._frame_bytes:
+            n = self._proc.stdout.readinto(view[filled:])
+            if not n:
+                # 管道关闭：文件读完或解码进程退出
+                self._eof = True
+                return False, None
+            filled += n
+        return True, frame
+
+    def _take_buffer(self) -> np.ndarray:
+        """取一个下游已不再引用的缓冲区；全部在途时申请新数组（该帧多一次分配，但不会覆盖在途的帧）。"""
+        count = len(self._buffers)
+        for i in range(count):
+            index = (self._next_buffer + i) % count
+            buffer = self._buffers[index]
+            # 只剩缓冲池列表与 getrefcount 参数两处引用时，下游已全部释放该帧
+            if sys.getrefcount(buffer) <= 3:
+                self._next_buffer = (index + 1) % count
+                return buffer
+        self.pool_misses += 1
+        if self.pool_misses == 1:
+            app_logger.info(f"ffmpeg 解码缓冲池 ({count} 个) 已全部在途，后续不足时临时分配新帧。")
+        return np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def release(self):
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.kill()
+            try:
+                self._proc.wait(timeout=2.0)
+            except subprocess.TimeoutExpired:
+                pass
+            if self._proc.stdout:
+                self._proc.stdout.close()
+        self._proc = None
+        self._buffers = []
+
+
+def create_capture(source: str, cfg: CaptureConfig, backend: Optional[str] = None,
+                   width: Optional[int] = None, height: Optional[int] = None,
+                   decode_threads: Optional[int] = None, low_delay: Optional[bool] = None,
+                   buffer_count: Optional[int] = None) -> FrameSource:
+    """按后端名称创建采集对象；未显式指定的参数使用全局配置的默认值。"""
+    backend = backend or cfg.backend
+    if backend == "ffmpeg":
+        # 单路视频流指定了分辨率时整体覆盖全局配置，避免宽高分别取自两处导致画面变形
+        if width is None and height is None:
+            width, height = cfg.working_width, cfg.working_height
+        return FFmpegCapture(
+            source,
+            width=width,
+            height=height,
+            decode_threads=cfg.decode_threads if decode_threads is None else decode_threads,
+            low_delay=cfg.low_delay if low_delay is None else low_delay,
+            rtsp_transport=cfg.rtsp_transport,
+            buffer_count=cfg.buffer_pool_size if buffer_count is None else buffer_count,
+            ffmpeg_path=cfg.ffmpeg_path,
+            ffprobe_path=cfg.ffprobe_path,
+        )
+    return OpenCVCapture(source)
@@ -0,0 +1,128 @@
+# app/core/embedding_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+# 单张图像的缓存值：[(检测结果元数据, 特征向量或None), ...]
+FaceEntries = List[Tuple[Dict[str, Any], Optional[np.ndarray]]]
+
+
+class EmbeddingCache:
+    """
+    基于内容哈希的线程安全 LRU 缓存，用于消除重复的 NPU 推理。
+
+    - 图像级条目：以原始图像字节的哈希为键，缓存整张图的检测结果及对应特征向量。
+    - 人脸级条目：以对齐后人脸裁剪图的哈希为键，缓存单张人脸的特征向量。
+
+    模型只在模型池创建时加载、运行期间不会更换，缓存随进程重建即随模型失效；
+    模型签名（检测模型名 + 识别模型名）仅随统计信息一并返回，便于确认缓存对应的模型。
+    """
+    IMAGE = "image"
+    CROP = "crop"
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 600.0, model_signature: str = "", enabled: bool = True):
+        self.enabled = enabled
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._model_signature = model_signature
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = {self.IMAGE: 0, self.CROP: 0}
+        self._misses = {self.IMAGE: 0, self.CROP: 0}
+        self._evictions = 0
+        self._expirations = 0
+
+    # --- 键计算 ---
+    @staticmethod
+    def image_key(image_bytes: bytes) -> str:
+        """计算原始图像字节的内容哈希。"""
+        return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+    @staticmethod
+    def crop_key(crop: np.ndarray) -> str:
+        """计算对齐人脸裁剪图的内容哈希（形状参与哈希，避免不同尺寸的数据碰撞）。"""
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(str(crop.shape).encode())
+        hasher.update(np.ascontiguousarray(crop).data)
+        return hasher.hexdigest()
+
+    @property
+    def model_signature(self) -> str:
+        return self._model_signature
+
+    # --- 读写接口 ---
+    def get_image(self, key: str) -> Optional[FaceEntries]:
+        return self._get(self.IMAGE, key)
+
+    def put_image(self, key: str, faces: FaceEntries):
+        self._put(self.IMAGE, key, [(meta, self._freeze(emb)) for meta, emb in faces])
+
+    def get_crop(self, key: str) -> Optional[np.ndarray]:
+        return self._get(self.CROP, key)
+
+    def put_crop(self, key: str, embedding: np.ndarray):
+        self._put(self.CROP, key, self._freeze(embedding))
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中率等统计信息。"""
+        with self._lock:
+            hits = sum(self._hits.values())
+            lookups = hits + sum(self._misses.values())
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "model_signature": self._model_signature,
+                "image_hits": self._hits[self.IMAGE],
+                "image_misses": self._misses[self.IMAGE],
+                "crop_hits": self._hits[self.CROP],
+                "crop_misses": self._misses[self.CROP],
+                "hit_rate": (hits / lookups) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+    # --- 内部实现 ---
+    @staticmethod
+    def _freeze(embedding: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        # 缓存中的向量被多个请求共享，设为只读以防被意外修改
+        if embedding is None:
+            return None
+        frozen = np.array(embedding, dtype=np.float32)
+        frozen.setflags(write=False)
+        return frozen
+
+    def _get(self, kind: str, key: str) -> Any:
+        if not self.enabled:
+            return None
+        full_key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is None:
+                self._misses[kind] += 1
+                return None
+            expires_at, value = entry
+            if expires_at and time.monotonic() >= expires_at:
+                del self._entries[full_key]
+                self._expirations += 1
+                self._misses[kind] += 1
+                return None
+            self._entries.move_to_end(full_key)
+            self._hits[kind] += 1
+            return value
+
+    def _put(self, kind: str, key: str, value: Any):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        with self._lock:
+            self._entries[(kind, key)] = (expires_at, value)
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
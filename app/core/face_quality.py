@@ -0,0 +1,100 @@
+# app/core/face_quality.py
+import math
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.cfg.config import FaceQualityConfig
+
+
+class FaceQuality(NamedTuple):
+    """单张人脸的质量评估结果。issue 为 None 表示通过质量门控。"""
+    score: float
+    issue: Optional[str]
+    face_size: float
+    yaw: float
+    pitch: float
+    sharpness: float
+
+
+def estimate_pose(landmarks: List[List[float]]) -> Tuple[float, float]:
+    """
+    根据 5 点关键点粗略估计偏航角/俯仰角（单位：度）。
+    先以两眼连线建立人脸坐标系以消除平面内旋转：
+    - 偏航：鼻尖相对两眼中点的横向偏移 / 眼距；
+    - 俯仰：鼻尖在“眼线-嘴线”之间的相对位置，正脸约为 0.5。
+    仅用于过滤明显的侧脸/低头抬头，不追求精确角度。
+    """
+    left_eye, right_eye, nose, left_mouth, right_mouth = (np.asarray(p, dtype=np.float32) for p in landmarks)
+    eye_vec = right_eye - left_eye
+    eye_dist = float(np.linalg.norm(eye_vec))
+    if eye_dist < 1e-6:
+        return 90.0, 90.0
+    x_axis = eye_vec / eye_dist
+    y_axis = np.array([-x_axis[1], x_axis[0]], dtype=np.float32)
+    eye_mid = (left_eye + right_eye) / 2
+    mouth_mid = (left_mouth + right_mouth) / 2
+
+    yaw_ratio = float(np.dot(nose - eye_mid, x_axis)) / eye_dist
+    yaw = math.degrees(math.asin(max(-1.0, min(1.0, 2.0 * yaw_ratio))))
+
+    face_height = float(np.dot(mouth_mid - eye_mid, y_axis))
+    if face_height < 1e-6:
+        return yaw, 90.0
+    pitch_ratio = float(np.dot(nose - eye_mid, y_axis)) / face_height
+    pitch = math.degrees(math.asin(max(-1.0, min(1.0, 2.0 * (pitch_ratio - 0.5)))))
+    return yaw, pitch
+
+
+def laplacian_sharpness(aligned_face: np.ndarray) -> float:
+    """对齐后人脸的拉普拉斯方差，越小越模糊。"""
+    gray = cv2.cvtColor(aligned_face, cv2.COLOR_BGR2GRAY) if aligned_face.ndim == 3 else aligned_face
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class FaceQualityScorer:
+    """
+    人脸质量门控：由检测框尺寸、关键点估计的姿态和对齐人脸的清晰度组成，全部在 CPU 上完成，
+    耗时远小于一次识别推理。未通过门控的人脸不做特征提取，也不进入数据库检索。
+    """
+
+    def __init__(self, cfg: FaceQualityConfig):
+        self.cfg = cfg
+
+    @property
+    def enabled(self) -> bool:
+        return self.cfg.enabled
+
+    def precheck(self, face_data: Dict[str, Any]) -> Optional[str]:
+        """对齐前即可完成的检查（尺寸、姿态），返回不合格原因或 None。"""
+        if not self.cfg.enabled:
+            return None
+        x1, y1, x2, y2 = face_data["bbox"]
+        face_size = min(x2 - x1, y2 - y1)
+        if face_size < self.cfg.min_face_size:
+            return f"人脸尺寸过小 ({face_size:.0f}px < {self.cfg.min_face_size}px)"
+        yaw, pitch = estimate_pose([lm["landmark"] for lm in face_data.get("landmarks", [])])
+        if abs(yaw) > self.cfg.max_yaw:
+            return f"侧脸角度过大 (偏航 {yaw:.0f}°)"
+        if abs(pitch) > self.cfg.max_pitch:
+            return f"俯仰角度过大 (俯仰 {pitch:.0f}°)"
+        return None
+
+    def assess(self, face_data: Dict[str, Any], aligned_face: np.ndarray) -> FaceQuality:
+        """完整评估，返回 0~1 的综合质量分与不合格原因。"""
+        x1, y1, x2, y2 = face_data["bbox"]
+        face_size = float(min(x2 - x1, y2 - y1))
+        yaw, pitch = estimate_pose([lm["landmark"] for lm in face_data.get("landmarks", [])])
+        sharpness = laplacian_sharpness(aligned_face) if aligned_face is not None and aligned_face.size else 0.0
+
+        # 各项归一化到 0~1：达到阈值的 2 倍视为满分，综合分取最差的一项
+        size_score = min(1.0, face_size / (2.0 * max(1, self.cfg.min_face_size)))
+        pose_score = max(0.0, 1.0 - max(abs(yaw) / max(1.0, 2.0 * self.cfg.max_yaw), abs(pitch) / max(1.0, 2.0 * self.cfg.max_pitch)))
+        blur_score = min(1.0, sharpness / (2.0 * max(1e-6, self.cfg.min_sharpness)))
+        score = round(min(size_score, pose_score, blur_score), 3)
+
+        issue = self.precheck(face_data)
+        if issue is None and self.cfg.enabled and sharpness < self.cfg.min_sharpness:
+            issue = f"人脸图像模糊 (清晰度 {sharpness:.0f} < {self.cfg.min_sharpness:.0f})"
+        return FaceQuality(score, issue, face_size, yaw, pitch, sharpness)
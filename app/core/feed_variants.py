@@ -0,0 +1,99 @@
+# app/core/feed_variants.py
+import queue
+import threading
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 画质变体：(最大宽度, JPEG 质量)，最大宽度为 None 表示保持原始分辨率
+VariantKey = Tuple[Optional[int], int]
+
+
+def variant_name(key: VariantKey) -> str:
+    max_width, quality = key
+    return f"{max_width or 'full'}w-q{quality}"
+
+
+def resize_to_width(frame: np.ndarray, max_width: int) -> np.ndarray:
+    """按比例缩小到不超过 max_width；画面本身不超过该宽度时原样返回，不放大。"""
+    height, width = frame.shape[:2]
+    if width <= max_width:
+        return frame
+    target_height = max(2, int(round(height * max_width / width)))
+    return cv2.resize(frame, (max_width, target_height), interpolation=cv2.INTER_AREA)
+
+
+def downscale_jpeg(data: bytes, max_width: int, quality: int) -> bytes:
+    """把一帧 JPEG 缩小后重新编码；本身不超过 max_width 时直接返回原图。"""
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None or frame.shape[1] <= max_width:
+        return data
+    flag, encoded = cv2.imencode(".jpg", resize_to_width(frame, max_width), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if flag else data
+
+
+def encode_variants(frame: np.ndarray, sinks: Dict[VariantKey, object]):
+    """
+    把一帧按各变体缩放并编码后写入对应的输出（put_nowait）。
+    同一宽度的不同质量只缩放一次；画面本身不超过最大宽度时不放大。
+    """
+    resized: Dict[int, np.ndarray] = {}
+    for key, sink in sinks.items():
+        max_width, quality = key
+        image = frame
+        if max_width:
+            image = resized.get(max_width)
+            if image is None:
+                image = resized[max_width] = resize_to_width(frame, max_width)
+        flag, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if flag:
+            sink.put_nowait(encoded.tobytes())
+
+
+class FrameBroadcast:
+    """
+    进程内单写多读的最新帧广播，与共享内存环 (SharedFrameRing) 语义一致：
+    只保留最新一帧，每个读取者各自记录读到的序号，慢读取者直接跳到最新帧。线程模式下的画质变体使用它分发。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._data: Optional[bytes] = None
+        self._closed = False
+
+    def put_nowait(self, item: Optional[bytes]):
+        with self._cond:
+            if item is None:
+                self._closed = True
+            else:
+                self._seq += 1
+                self._data = item
+            self._cond.notify_all()
+
+    def open_reader(self) -> "BroadcastReader":
+        return BroadcastReader(self)
+
+
+class BroadcastReader:
+    """FrameBroadcast 的单观众读取游标，提供与 queue.Queue 相同的 get/empty 语义；流结束后 get 返回 None。"""
+
+    def __init__(self, broadcast: FrameBroadcast):
+        self._broadcast = broadcast
+        # 从上一帧开始读，新观众连接后立即拿到最新画面
+        self._last_seq = max(0, broadcast._seq - 1)
+
+    def empty(self) -> bool:
+        return self._broadcast._seq <= self._last_seq
+
+    def get(self, timeout: float = 0.02) -> Optional[bytes]:
+        b = self._broadcast
+        with b._cond:
+            b._cond.wait_for(lambda: b._seq > self._last_seq or b._closed, timeout=timeout)
+            if b._seq > self._last_seq:
+                self._last_seq = b._seq
+                return b._data
+            if b._closed:
+                return None
+            raise queue.Empty
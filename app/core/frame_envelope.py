@@ -0,0 +1,83 @@
+# app/core/frame_envelope.py
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class FrameEnvelope:
+    """
+    在流水线各级之间传递的单帧数据。时间戳均为 time.monotonic()：
+
+    - captured_at：读帧线程从采集后端拿到该帧的时刻；
+    - detect_started_at / detected_at：检测线程取出该帧与完成检测（或被运动门控跳过）的时刻；
+    - recognize_started_at / recognized_at：识别线程取出该帧与完成识别、绘制的时刻；
+    - emitted_at：编码后写入输出队列的时刻。
+    """
+    __slots__ = (
+        "seq", "frame", "captured_at", "detect_started_at", "detected_at", "recognize_started_at",
+        "recognized_at", "emitted_at", "detections", "reuse_last", "trace",
+    )
+
+    def __init__(self, seq: int, frame: np.ndarray, captured_at: float, trace=None):
+        self.seq = seq
+        self.frame = frame
+        self.captured_at = captured_at
+        self.detect_started_at: Optional[float] = None
+        self.detected_at: Optional[float] = None
+        self.recognize_started_at: Optional[float] = None
+        self.recognized_at: Optional[float] = None
+        self.emitted_at: Optional[float] = None
+        self.detections: Optional[List[Dict[str, Any]]] = None
+        self.reuse_last = False
+        self.trace = trace
+
+    def age(self, now: float) -> float:
+        return now - self.captured_at
+
+
+class LatencyTracker:
+    """
+    按阶段保存最近 window 帧的耗时（环形缓冲区），按需计算分位数。
+    每一帧完成识别后即记录，与是否编码输出画面无关（无人观看时跳过编码，时延照常统计）；
+    end_to_end 为采集到完成识别的时延。记录只发生在识别线程，读取来自统计上报线程，用一把小锁保护。
+    """
+
+    STAGES = ("queue_to_detect", "detect", "queue_to_recognize", "recognize", "end_to_end")
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {stage: np.zeros(window, dtype=np.float32) for stage in self.STAGES}
+        self._count = 0
+
+    def record(self, envelope: FrameEnvelope):
+        if envelope.recognized_at is None or envelope.recognize_started_at is None:
+            return
+        # 运动门控跳过的帧同样经过检测线程，detect 阶段耗时为门控判断耗时
+        values = (
+            envelope.detect_started_at - envelope.captured_at,
+            envelope.detected_at - envelope.detect_started_at,
+            envelope.recognize_started_at - envelope.detected_at,
+            envelope.recognized_at - envelope.recognize_started_at,
+            envelope.recognized_at - envelope.captured_at,
+        )
+        with self._lock:
+            slot = self._count % self.window
+            for stage, value in zip(self.STAGES, values):
+                self._samples[stage][slot] = value
+            self._count += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """返回各阶段最近 window 帧的 p50/p95/p99/max（毫秒）。"""
+        with self._lock:
+            n = min(self._count, self.window)
+            samples = {stage: values[:n].copy() for stage, values in self._samples.items()}
+        if n == 0:
+            return {}
+        result = {}
+        for stage, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            result[stage] = {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+                             "max": round(float(values.max() * 1000), 2), "samples": n}
+        return result
@@ -0,0 +1,82 @@
+# app/core/frame_queue.py
+import collections
+import queue
+import threading
+import time
+from typing import Any, Optional
+
+QUEUE_POLICIES = ("drop_oldest", "drop_newest", "latest_only", "block")
+
+
+class FrameQueue:
+    """
+    流水线级间的有界帧队列，满时的行为由策略决定：
+
+    - drop_oldest：丢弃队首最旧的帧，为新帧腾出位置（保证下游总是处理较新的画面）；
+    - drop_newest：丢弃新到的帧（原读帧线程的行为）；
+    - latest_only：深度固定为 1，新帧直接替换尚未被取走的旧帧；
+    - block：阻塞生产者直到有空位或流水线停止（原后续各级的行为）。
+
+    dropped 只由生产者线程写入；结束标记 (None) 通过 put_sentinel() 写入，不受容量与策略限制。
+    """
+
+    def __init__(self, maxsize: int = 30, policy: str = "block"):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"不支持的队列策略: {policy}")
+        self.policy = policy
+        self.maxsize = 1 if policy == "latest_only" else max(1, maxsize)
+        self.dropped = 0
+        self._items: collections.deque = collections.deque()
+        self._cond = threading.Condition()
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def put(self, item: Any, stop_event: Optional[threading.Event] = None) -> bool:
+        """按策略放入一帧，返回该帧是否入队（被替换/挤出的旧帧计入 dropped）。"""
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.policy == "block":
+                    while len(self._items) >= self.maxsize:
+                        if stop_event is not None and stop_event.is_set():
+                            return False
+                        self._cond.wait(timeout=0.2)
+                else:
+                    while len(self._items) >= self.maxsize:
+                        self._items.popleft()
+                        self.dropped += 1
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def put_sentinel(self):
+        with self._cond:
+            self._items.append(None)
+            self._cond.notify_all()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """取出一帧；超时抛出 queue.Empty，与 queue.Queue 的用法保持一致。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(timeout=remaining)
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def get_nowait(self) -> Any:
+        return self.get(timeout=0)
+
+    def clear(self):
+        with self._cond:
+            self._items.clear()
+            self._cond.notify_all()
@@ -1,11 +1,12 @@
 # app/core/image_utils.py
 import numpy as np
 import cv2
-import uuid
 from typing import List, Tuple, Union
-from pathlib import Path
 from fastapi import HTTPException
 
+from app.core.tracing import traced
+
+@traced("decode_image")
 def decode_image(image_bytes: bytes) -> np.ndarray:
     """
     将图像的字节数据解码为OpenCV图像对象。
@@ -19,20 +20,8 @@ def decode_image(image_bytes: bytes) -> np.ndarray:
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"无效的图像文件: {e}")
 
-def save_face_image(face_img: np.ndarray, sn: str, base_path: Path) -> Path:
-    """
-    将裁剪的人脸图像保存到指定路径。
-    """
-    file_uuid = str(uuid.uuid4())
-    sn_dir = base_path / sn
-    sn_dir.mkdir(parents=True, exist_ok=True)
-    file_path = sn_dir / f"face_{sn}_{file_uuid}.jpg"
-    success = cv2.imwrite(str(file_path), face_img)
-    if not success:
-        raise HTTPException(status_code=500, detail=f"无法将图像文件写入到路径: {file_path}")
-    return file_path
-
 
+@traced("align_and_crop")
 def align_and_crop(img: np.ndarray, landmarks: List[Union[List[float], np.ndarray]], image_size: int = 112) -> Tuple[np.ndarray, np.ndarray]:
     """
     根据给定的关键点对齐并裁剪图像中的人脸。
@@ -1,18 +1,23 @@
 # app/core/model_manager.py
 import gc
 import queue
-from typing import Tuple, Optional
-
-import degirum as dg
+from typing import TYPE_CHECKING, Any, Tuple, Optional
 
 from app.cfg.config import AppSettings
 from app.cfg.logging import app_logger
+from app.core.tracing import traced
 from .process_utils import get_all_degirum_worker_pids, cleanup_degirum_workers_by_pids
 
-DeGirumModel = dg.model.Model
+# degirum（连同 pandas）在首次加载模型时才导入，只做类型标注的模块无需为此付出导入开销
+if TYPE_CHECKING:
+    from degirum.model import Model as DeGirumModel
+else:
+    DeGirumModel = Any
 
 def create_degirum_model(model_name: str, zoo_url: str) -> DeGirumModel:
     """通用模型加载函数，保持不变。"""
+    import degirum as dg
+
     app_logger.info(f"--- 正在加载 DeGirum 模型: '{model_name}' from '{zoo_url}' ---")
     try:
         model = dg.load_model(
@@ -54,6 +59,7 @@ class ModelPool:
             app_logger.error(f"❌ 初始化模型池失败: {e}")
             raise
 
+    @traced("model_pool.acquire")
     def acquire(self, timeout: float = 0.1) -> Optional[Tuple[DeGirumModel, DeGirumModel]]:
         """从池中获取一套模型。"""
         try:
@@ -0,0 +1,70 @@
+# app/core/motion_gate.py
+import time
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    轻量级运动门控：在缩小后的灰度图上与“上次检测时的参考帧”做帧差，
+    画面无明显变化时告知调用方跳过本帧的人脸检测。
+
+    以上次检测帧为参考（而非前一帧），可以累积缓慢的运动，避免慢速移动的人被漏检；
+    同时每隔 force_interval_seconds 强制检测一次作为兜底。
+    """
+
+    def __init__(self, downscale_width: int = 160, pixel_threshold: int = 25,
+                 min_changed_ratio: float = 0.003, force_interval_seconds: float = 2.0):
+        self.downscale_width = max(16, downscale_width)
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.force_interval_seconds = force_interval_seconds
+        self._reference: Optional[np.ndarray] = None
+        self._last_detect_at = 0.0
+        self.frames_checked = 0
+        self.frames_skipped = 0
+
+    def _prepare(self, frame: np.ndarray, mask: Optional[np.ndarray]) -> Tuple[np.ndarray, int]:
+        """缩放、灰度化并模糊，返回处理后的图像及有效区域的像素数。"""
+        h, w = frame.shape[:2]
+        scale = self.downscale_width / float(w)
+        small = cv2.resize(frame, (self.downscale_width, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        if mask is None:
+            return gray, gray.size
+        small_mask = cv2.resize(mask, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_NEAREST)
+        return cv2.bitwise_and(gray, gray, mask=small_mask), max(1, int(np.count_nonzero(small_mask)))
+
+    def should_detect(self, frame: np.ndarray, mask: Optional[np.ndarray] = None) -> bool:
+        """
+        判断本帧是否需要执行检测。
+
+        Args:
+            frame: BGR 原始帧。
+            mask: 可选的单通道感兴趣区域掩码（非零为有效区域），尺寸与 frame 相同。
+        """
+        self.frames_checked += 1
+        now = time.monotonic()
+        current, area = self._prepare(frame, mask)
+
+        motion = True
+        if self._reference is not None and self._reference.shape == current.shape:
+            diff = cv2.absdiff(current, self._reference)
+            changed = int(np.count_nonzero(diff > self.pixel_threshold))
+            motion = (changed / float(area)) >= self.min_changed_ratio
+
+        if motion or (now - self._last_detect_at) >= self.force_interval_seconds:
+            self._reference = current
+            self._last_detect_at = now
+            return True
+
+        self.frames_skipped += 1
+        return False
+
+    def reset(self):
+        """丢弃参考帧，下一帧必定触发检测。"""
+        self._reference = None
+        self._last_detect_at = 0.0
@@ -11,7 +11,19 @@ from app.cfg.config import AppSettings
 from app.cfg.logging import app_logger
 from app.core.model_manager import ModelPool, DeGirumModel
 from app.core.image_utils import align_and_crop
-from app.service.face_dao import LanceDBFaceDataDAO, FaceDataDAO
+from app.core.capture import create_capture
+from app.core.motion_gate import MotionGate
+from app.core.face_quality import FaceQualityScorer
+from app.core.feed_variants import VariantKey, encode_variants, variant_name
+from app.core.frame_envelope import FrameEnvelope, LatencyTracker
+from app.core.frame_queue import FrameQueue
+from app.core.roi import RegionOfInterest, RoiCropper
+from app.core.tracing import activate, get_tracer, span
+from app.core.video_encoder import VideoStreamEncoder
+from app.schema.face_schema import StreamStartRequest
+from app.service.face_dao import FaceDataDAO, create_face_dao
+from app.service.event_sink import RecognitionEventSink
+from app.service.webhook_dispatcher import WebhookDispatcher
 
 def _draw_results_on_frame(frame: np.ndarray, results: List[Dict[str, Any]]):
     """在帧上绘制识别结果 (保持不变)"""
@@ -29,10 +41,13 @@ def _draw_results_on_frame(frame: np.ndarray, results: List[Dict[str, Any]]):
         cv2.putText(frame, label, (box[0] + 5, box[1] - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
 
 class FaceStreamPipeline:
-    def __init__(self, settings: AppSettings, stream_id: str, video_source: str, model_pool: ModelPool, output_queue: queue.Queue):
+    def __init__(self, settings: AppSettings, stream_id: str, video_source: str, model_pool: ModelPool, output_queue: queue.Queue,
+                 options: Optional[StreamStartRequest] = None, face_dao: Optional[FaceDataDAO] = None,
+                 event_sink: Optional[RecognitionEventSink] = None, webhook: Optional[WebhookDispatcher] = None):
         self.settings = settings
         self.stream_id = stream_id
         self.video_source = video_source
+        self.options = options or StreamStartRequest(source=video_source)
         self.output_queue = output_queue
         self.model_pool = model_pool
         self.models: Optional[Tuple[DeGirumModel, DeGirumModel]] = None
@@ -40,10 +55,138 @@ class FaceStreamPipeline:
         self.rec_model: Optional[DeGirumModel] = None
         self.stop_event = threading.Event()
         self.threads: List[threading.Thread] = []
-        self.face_dao: FaceDataDAO = LanceDBFaceDataDAO(db_uri=self.settings.degirum.lancedb_uri, table_name=self.settings.degirum.lancedb_table_name)
-        self.preprocess_queue = queue.Queue(maxsize=30)
-        self.inference_queue = queue.Queue(maxsize=30)
-        self.postprocess_queue = queue.Queue(maxsize=30)
+        self.face_dao: FaceDataDAO = face_dao or create_face_dao(self.settings)
+        self.event_sink = event_sink
+        self.webhook = webhook
+        self.preprocess_queue, self.inference_queue, self.postprocess_queue = self._create_queues()
+        budget_ms = self.options.latency_budget_ms
+        if budget_ms is None:
+            budget_ms = self.settings.pipeline_queues.latency_budget_ms
+        self.latency_budget: Optional[float] = budget_ms / 1000.0 if budget_ms else None
+        self.motion_gate: Optional[MotionGate] = self._create_motion_gate()
+        self.roi_cropper: Optional[RoiCropper] = RoiCropper(
+            [RegionOfInterest(rect=r.rect, polygon=r.polygon) for r in self.options.rois]
+        ) if self.options.rois else None
+        self.quality_scorer = FaceQualityScorer(self.settings.face_quality)
+        self.video_encoder: Optional[VideoStreamEncoder] = self._create_video_encoder()
+        # 有观众订阅的画质变体及其输出；整体替换而非原地修改，编码线程无需加锁即可遍历
+        self._feed_variants: Dict[VariantKey, Any] = {}
+        # 画质变体在独立线程中缩放与编码，识别线程只交付最新一帧
+        self._variant_frames = FrameQueue(policy="latest_only")
+        # 默认画面只在有观众（或最近有快照请求）时编码
+        self._feed_lock = threading.Lock()
+        self._feed_viewers = 0
+        self._feed_demand_until = 0.0
+        # 最近一帧已绘制结果的默认画面 (帧序号, JPEG)，供快照接口直接返回
+        self.latest_frame: Optional[Tuple[int, bytes]] = None
+        # 按帧采样的调用链随帧在各级队列间传递，由后处理线程结束
+        self.tracer = get_tracer()
+        self.frame_sample_rate = self.settings.tracing.frame_sample_rate
+        # 运动门控跳过检测时，复用最近一次的识别结果
+        self._last_results: List[Dict[str, Any]] = []
+        self.stats: Dict[str, int] = {
+            "frames_read": 0, "frames_processed": 0, "frames_detected": 0, "frames_skipped_by_motion": 0,
+            "faces_rejected_by_quality": 0, "frames_dropped_output": 0, "frames_not_encoded": 0,
+        }
+        self.stale_drops: Dict[str, int] = {"inference": 0, "postprocess": 0}
+        # 帧序号只由读帧线程递增；各阶段时延分布由后处理线程在输出时记录
+        self._seq = 0
+        self.latency = LatencyTracker()
+
+    def _create_queues(self) -> Tuple[FrameQueue, FrameQueue, FrameQueue]:
+        """按配置创建各级队列；请求中指定的策略/深度覆盖所有级别。"""
+        cfg = self.settings.pipeline_queues
+        return tuple(
+            FrameQueue(maxsize=self.options.queue_depth or stage.depth, policy=self.options.queue_policy or stage.policy)
+            for stage in (cfg.preprocess, cfg.inference, cfg.postprocess)
+        )
+
+    def _is_stale(self, captured_at: float, stage: str) -> bool:
+        """帧自采集起已超出时延预算时计数并返回 True，调用方不应再为该帧占用 NPU。"""
+        if self.latency_budget is None or time.monotonic() - captured_at <= self.latency_budget:
+            return False
+        self.stale_drops[stage] += 1
+        return True
+
+    def _create_motion_gate(self) -> Optional[MotionGate]:
+        cfg = self.settings.motion_gate
+        enabled = self.options.motion_gate if self.options.motion_gate is not None else cfg.enabled
+        if not enabled:
+            return None
+        return MotionGate(
+            downscale_width=cfg.downscale_width,
+            pixel_threshold=cfg.pixel_threshold,
+            min_changed_ratio=(cfg.min_changed_ratio if self.options.motion_sensitivity is None
+                               else self.options.motion_sensitivity),
+            force_interval_seconds=cfg.force_detect_interval_seconds,
+        )
+
+    def _create_video_encoder(self) -> Optional[VideoStreamEncoder]:
+        cfg = self.settings.video_output
+        fmt = self.options.video_output or cfg.default_format
+        if fmt == "mjpeg":
+            return None
+        return VideoStreamEncoder(
+            self.stream_id, fmt, cfg, ffmpeg_path=self.settings.capture.ffmpeg_path,
+            bitrate_kbps=self.options.video_bitrate_kbps, gop_seconds=self.options.video_gop_seconds,
+        )
+
+    # --- 默认画面的观众 ---
+    def add_feed_viewer(self):
+        with self._feed_lock:
+            self._feed_viewers += 1
+
+    def remove_feed_viewer(self):
+        with self._feed_lock:
+            self._feed_viewers = max(0, self._feed_viewers - 1)
+            if self._feed_viewers == 0:
+                # 观众刷新页面重连时不必等待编码重新开始
+                self._feed_demand_until = time.monotonic() + self.settings.feed.idle_encode_seconds
+
+    def touch_feed(self) -> bool:
+        """记录一次快照请求，返回此前默认画面是否已在编码（否则调用方需等待新的一帧）。"""
+        now = time.monotonic()
+        with self._feed_lock:
+            active = self._feed_viewers > 0 or now < self._feed_demand_until
+            self._feed_demand_until = max(self._feed_demand_until, now + self.settings.feed.idle_encode_seconds)
+        return active
+
+    def _feed_wanted(self) -> bool:
+        return self._feed_viewers > 0 or time.monotonic() < self._feed_demand_until
+
+    def touch_video_output(self):
+        """记录一次 HLS 观看请求，使 H.264 编码器保持（或开始）运行。"""
+        if self.video_encoder is not None:
+            self.video_encoder.touch()
+
+    def add_feed_variant(self, key: VariantKey, sink):
+        """开始为某个画质变体编码，编码结果写入 sink（put_nowait，流结束时写入 None）。"""
+        self._feed_variants = {**self._feed_variants, key: sink}
+
+    def remove_feed_variant(self, key: VariantKey):
+        self._feed_variants = {k: v for k, v in self._feed_variants.items() if k != key}
+
+    def _detect(self, frame: np.ndarray) -> List[Dict[str, Any]]:
+        """执行人脸检测；配置了 ROI 时只检测各 ROI 裁剪区域，并将坐标映射回原图。"""
+        if self.roi_cropper is None:
+            return self.det_model.predict(frame).results
+        crops = self.roi_cropper.crops(frame)
+        if not crops:
+            return []
+        if len(crops) == 1:
+            results = [self.det_model.predict(crops[0][0]).results]
+        else:
+            results = [r.results for r in self.det_model.predict_batch([c for c, _ in crops])]
+        return self.roi_cropper.map_detections(frame.shape, [(r, offset) for r, (_, offset) in zip(results, crops)])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回流水线的运行统计（各计数器只由单一线程写入，读取无需加锁）。"""
+        queue_drops = {"preprocess": self.preprocess_queue.dropped, "inference": self.inference_queue.dropped,
+                       "postprocess": self.postprocess_queue.dropped, "output": self.stats["frames_dropped_output"]}
+        return {"stream_id": self.stream_id, **self.stats, "queue_drops": queue_drops, "stale_drops": dict(self.stale_drops),
+                "latency_ms": self.latency.summary(),
+                "video_output": self.video_encoder.stats() if self.video_encoder is not None else None,
+                "feed_variants": [variant_name(key) for key in self._feed_variants]}
 
     def start(self):
         app_logger.info(f"【流水线 {self.stream_id}】正在启动，并尝试获取模型...")
@@ -56,8 +199,12 @@ class FaceStreamPipeline:
             self.det_model, self.rec_model = self.models
             app_logger.info(f"【流水线 {self.stream_id}】成功获取模型，准备打开视频源...")
 
-            source_for_cv = int(self.video_source) if self.video_source.isdigit() else self.video_source
-            self.cap = cv2.VideoCapture(source_for_cv)
+            self.cap = create_capture(
+                self.video_source, self.settings.capture,
+                backend=self.options.capture_backend,
+                width=self.options.capture_width, height=self.options.capture_height,
+                decode_threads=self.options.decode_threads, low_delay=self.options.low_delay,
+            )
             if not self.cap.isOpened():
                 raise RuntimeError(f"无法打开视频源: {self.video_source}")
 
@@ -88,15 +235,16 @@ class FaceStreamPipeline:
                 app_logger.error(f"【流水线 {self.stream_id}】线程 {t.name} 未能快速停止，可能被I/O阻塞。")
 
         # 释放视频捕捉对象
-        if hasattr(self, 'cap') and self.cap.isOpened():
+        if hasattr(self, 'cap'):
             self.cap.release()
             app_logger.info(f"【流水线 {self.stream_id}】视频捕捉已释放。")
 
+        if self.video_encoder is not None:
+            self.video_encoder.close()
+
         # 清空所有中间队列
         for q in [self.preprocess_queue, self.inference_queue, self.postprocess_queue]:
-            while not q.empty():
-                try: q.get_nowait()
-                except queue.Empty: break
+            q.clear()
 
         # 归还模型到池中
         if self.models:
@@ -113,7 +261,8 @@ class FaceStreamPipeline:
             "Reader": self._reader_thread,
             "Preprocessor": self._preprocessor_thread,
             "Inference": self._inference_thread,
-            "Postprocessor": self._postprocessor_thread
+            "Postprocessor": self._postprocessor_thread,
+            "VariantEncoder": self._variant_encoder_thread,
         }
         for name, target in thread_targets.items():
             thread = threading.Thread(target=target, name=f"{self.stream_id}-{name}", daemon=True)
@@ -139,29 +288,28 @@ class FaceStreamPipeline:
                 time.sleep(0.01)
                 continue
 
-            try:
-                # 优化：使用非阻塞的put_nowait，避免长时间阻塞
-                self.preprocess_queue.put_nowait(frame)
-            except queue.Full:
-                # 当下游处理慢导致队列满时，丢弃帧并立即继续循环以检查stop_event
-                # app_logger.warning(f"【T1:读帧 {self.stream_id}】预处理队列已满，丢弃当前帧以保持实时性。")
+            self.stats["frames_read"] += 1
+            self._seq += 1
+            trace = self.tracer.start_trace("stream.frame", sample_rate=self.frame_sample_rate, stream_id=self.stream_id, seq=self._seq)
+            envelope = FrameEnvelope(self._seq, frame, time.monotonic(), trace)
+            # 队列满时按策略丢帧或阻塞（block 策略下停止信号可打断等待）
+            if not self.preprocess_queue.put(envelope, self.stop_event) and self.preprocess_queue.policy == "drop_newest":
                 # 增加短暂休眠，防止在队列持续满时CPU空转
                 time.sleep(0.01)
-                continue
 
         # 发送停止信号给下一个线程
-        self.preprocess_queue.put(None)
+        self.preprocess_queue.put_sentinel()
         app_logger.info(f"【T1:读帧 {self.stream_id}】已停止。")
 
     def _preprocessor_thread(self):
         app_logger.info(f"【T2:预处理 {self.stream_id}】启动。")
         while not self.stop_event.is_set():
             try:
-                frame = self.preprocess_queue.get(timeout=0.2)
-                if frame is None:
-                    self.inference_queue.put(None)
+                item = self.preprocess_queue.get(timeout=0.2)
+                if item is None:
+                    self.inference_queue.put_sentinel()
                     break
-                self.inference_queue.put(frame)
+                self.inference_queue.put(item, self.stop_event)
             except queue.Empty:
                 continue
         app_logger.info(f"【T2:预处理 {self.stream_id}】已停止。")
@@ -170,13 +318,35 @@ class FaceStreamPipeline:
         app_logger.info(f"【T3:推理-检测 {self.stream_id}】启动。")
         while not self.stop_event.is_set():
             try:
-                frame = self.inference_queue.get(timeout=0.2)
-                if frame is None:
-                    self.postprocess_queue.put(None)
+                envelope: Optional[FrameEnvelope] = self.inference_queue.get(timeout=0.2)
+                if envelope is None:
+                    self.postprocess_queue.put_sentinel()
                     break
-                
-                detection_results = self.det_model.predict(frame).results if self.det_model else []
-                self.postprocess_queue.put((frame, detection_results))
+                envelope.detect_started_at = time.monotonic()
+                # 检测前已超出时延预算的帧直接丢弃，下游很快会收到更新的画面
+                if self._is_stale(envelope.captured_at, "inference"):
+                    self.tracer.finish(envelope.trace)
+                    continue
+
+                frame = envelope.frame
+                with activate(envelope.trace):
+                    # 运动门控：画面静止时跳过检测，交由后处理复用上一次的结果
+                    roi_mask = self.roi_cropper.mask(frame.shape) if self.roi_cropper else None
+                    if self.motion_gate is not None:
+                        with span("motion_gate"):
+                            should_detect = self.motion_gate.should_detect(frame, roi_mask)
+                        if not should_detect:
+                            self.stats["frames_skipped_by_motion"] += 1
+                            envelope.reuse_last = True
+                            envelope.detected_at = time.monotonic()
+                            self.postprocess_queue.put(envelope, self.stop_event)
+                            continue
+
+                    with span("detect.predict"):
+                        envelope.detections = self._detect(frame) if self.det_model else []
+                envelope.detected_at = time.monotonic()
+                self.stats["frames_detected"] += 1
+                self.postprocess_queue.put(envelope, self.stop_event)
             except queue.Empty:
                 continue
             except Exception as e:
@@ -188,40 +358,87 @@ class FaceStreamPipeline:
         threshold = self.settings.degirum.recognition_similarity_threshold
         while not self.stop_event.is_set():
             try:
-                data = self.postprocess_queue.get(timeout=0.2)
-                if data is None:
+                envelope: Optional[FrameEnvelope] = self.postprocess_queue.get(timeout=0.2)
+                if envelope is None:
                     break
-                original_frame, detected_faces_data = data
-                final_results = []
-                if detected_faces_data and self.rec_model:
-                    aligned_faces, valid_faces_meta = [], []
-                    for face_data in detected_faces_data:
-                        landmarks = [lm["landmark"] for lm in face_data.get("landmarks", [])]
-                        if len(landmarks) == 5:
-                            aligned_face, _ = align_and_crop(original_frame, landmarks)
-                            if aligned_face.size > 0:
-                                aligned_faces.append(aligned_face)
-                                valid_faces_meta.append(face_data)
-
-                    if aligned_faces:
-                        batch_rec_results = self.rec_model.predict_batch(aligned_faces)
-                        for i, rec_result in enumerate(batch_rec_results):
-                            embedding = np.array(rec_result.results[0]['data'][0])
-                            face_meta = valid_faces_meta[i]
-                            search_res = self.face_dao.search(embedding, threshold)
-                            result_item = {"box": list(map(int, face_meta['bbox'])), "name": "Unknown", "similarity": None}
-                            if search_res:
-                                name, sn, similarity = search_res
-                                result_item.update({"name": name, "sn": sn, "similarity": similarity})
-                            final_results.append(result_item)
-
-                _draw_results_on_frame(original_frame, final_results)
-                (flag, encodedImage) = cv2.imencode(".jpg", original_frame)
-                if flag:
-                    try:
-                        self.output_queue.put_nowait(encodedImage.tobytes())
-                    except queue.Full:
-                        pass
+                envelope.recognize_started_at = time.monotonic()
+                original_frame, detected_faces_data = envelope.frame, envelope.detections
+                # 识别同样占用 NPU：有人脸待识别但已超出时延预算时跳过识别，画面仍照常输出并复用上一次的结果
+                reuse_last = envelope.reuse_last
+                if detected_faces_data and not reuse_last and self._is_stale(envelope.captured_at, "postprocess"):
+                    reuse_last = True
+                with activate(envelope.trace):
+                    final_results = []
+                    if reuse_last:
+                        final_results = self._last_results
+                    elif detected_faces_data and self.rec_model:
+                        aligned_faces, valid_faces_meta = [], []
+                        for face_data in detected_faces_data:
+                            landmarks = [lm["landmark"] for lm in face_data.get("landmarks", [])]
+                            if len(landmarks) != 5:
+                                continue
+                            # 尺寸/姿态不合格的人脸无需对齐，直接标记为未识别
+                            issue = self.quality_scorer.precheck(face_data)
+                            aligned_face = None
+                            if issue is None:
+                                aligned_face, _ = align_and_crop(original_frame, landmarks)
+                                if aligned_face.size == 0:
+                                    continue
+                                quality = self.quality_scorer.assess(face_data, aligned_face)
+                                issue = quality.issue
+                            if issue is not None:
+                                self.stats["faces_rejected_by_quality"] += 1
+                                final_results.append({"box": list(map(int, face_data['bbox'])), "name": "Unknown", "similarity": None})
+                                continue
+                            aligned_faces.append(aligned_face)
+                            valid_faces_meta.append(face_data)
+
+                        if aligned_faces:
+                            with span("recognize.predict_batch", faces=len(aligned_faces)):
+                                batch_rec_results = list(self.rec_model.predict_batch(aligned_faces))
+                            for i, rec_result in enumerate(batch_rec_results):
+                                embedding = np.array(rec_result.results[0]['data'][0])
+                                face_meta = valid_faces_meta[i]
+                                search_res = self.face_dao.search(embedding, threshold)
+                                result_item = {"box": list(map(int, face_meta['bbox'])), "name": "Unknown", "similarity": None}
+                                if search_res:
+                                    name, sn, similarity = search_res
+                                    result_item.update({"name": name, "sn": sn, "similarity": similarity})
+                                final_results.append(result_item)
+
+                    if not reuse_last:
+                        self._last_results = final_results
+                        # 复用的结果不是新的观测，不重复记录事件
+                        if self.event_sink is not None and final_results:
+                            self.event_sink.publish_results(self.stream_id, final_results)
+                        if self.webhook is not None and final_results:
+                            self.webhook.publish_results(self.stream_id, final_results)
+                    if self.roi_cropper is not None:
+                        self.roi_cropper.draw(original_frame)
+                    _draw_results_on_frame(original_frame, final_results)
+                    envelope.recognized_at = time.monotonic()
+                    self.latency.record(envelope)
+                    if self.video_encoder is not None:
+                        self.video_encoder.submit(original_frame)
+                    self.stats["frames_processed"] += 1
+                    if self._feed_variants:
+                        self._variant_frames.put(original_frame)
+                    if not self._feed_wanted():
+                        # 没有观众时不编码默认画面，也不写入输出队列
+                        self.stats["frames_not_encoded"] += 1
+                        self.tracer.finish(envelope.trace)
+                        continue
+                    with span("encode_jpeg"):
+                        (flag, encodedImage) = cv2.imencode(".jpg", original_frame, [cv2.IMWRITE_JPEG_QUALITY, self.settings.feed.jpeg_quality])
+                    if flag:
+                        frame_bytes = encodedImage.tobytes()
+                        self.latest_frame = (envelope.seq, frame_bytes)
+                        try:
+                            self.output_queue.put_nowait(frame_bytes)
+                            envelope.emitted_at = time.monotonic()
+                        except queue.Full:
+                            self.stats["frames_dropped_output"] += 1
+                self.tracer.finish(envelope.trace)
             except queue.Empty:
                 continue
             except Exception as e:
@@ -231,4 +448,25 @@ class FaceStreamPipeline:
             self.output_queue.put_nowait(None)
         except queue.Full:
              pass
-        app_logger.info(f"【T4:后处理-识别 {self.stream_id}】已停止。")
\ No newline at end of file
+        self._variant_frames.put_sentinel()
+        app_logger.info(f"【T4:后处理-识别 {self.stream_id}】已停止。")
+
+    def _variant_encoder_thread(self):
+        """按各画质变体缩放并编码最新一帧；编码跟不上时只处理最新的画面，不拖慢识别线程。"""
+        while True:
+            try:
+                frame = self._variant_frames.get(timeout=0.2)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    break
+                continue
+            if frame is None:
+                break
+            feed_variants = self._feed_variants
+            if feed_variants:
+                try:
+                    encode_variants(frame, feed_variants)
+                except Exception as e:
+                    app_logger.error(f"【画质变体 {self.stream_id}】编码失败: {e}", exc_info=True)
+        for sink in self._feed_variants.values():
+            sink.put_nowait(None)
\ No newline at end of file
@@ -0,0 +1,131 @@
+# app/core/roi.py
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+Box = Tuple[int, int, int, int]
+
+
+class RegionOfInterest:
+    """
+    单个感兴趣区域，坐标为相对画面宽高的归一化值 (0~1)，可以是矩形或多边形。
+    归一化坐标与视频源分辨率无关，解码端缩放后依然有效。
+    """
+
+    def __init__(self, rect: Optional[Sequence[float]] = None, polygon: Optional[Sequence[Sequence[float]]] = None):
+        if (rect is None) == (polygon is None):
+            raise ValueError("ROI 必须且只能指定 rect 或 polygon 其中之一。")
+        if rect is not None:
+            x1, y1, x2, y2 = rect
+            polygon = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+            self.is_polygon = False
+        else:
+            self.is_polygon = True
+        self._norm_points = np.array(polygon, dtype=np.float32)
+        self._resolved_for: Optional[Tuple[int, int]] = None
+        self._box: Box = (0, 0, 0, 0)
+        self._points: np.ndarray = np.zeros((0, 2), dtype=np.int32)
+
+    def resolve(self, width: int, height: int) -> Tuple[Box, np.ndarray]:
+        """将归一化坐标换算为像素坐标，返回外接矩形及多边形顶点（按画面尺寸缓存）。"""
+        if self._resolved_for != (width, height):
+            points = self._norm_points * np.array([width, height], dtype=np.float32)
+            points = np.round(points).astype(np.int32)
+            points[:, 0] = np.clip(points[:, 0], 0, width)
+            points[:, 1] = np.clip(points[:, 1], 0, height)
+            x1, y1 = points.min(axis=0)
+            x2, y2 = points.max(axis=0)
+            self._box = (int(x1), int(y1), int(x2), int(y2))
+            self._points = points
+            self._resolved_for = (width, height)
+        return self._box, self._points
+
+    def contains(self, x: float, y: float, width: int, height: int) -> bool:
+        """判断像素坐标点是否落在区域内。"""
+        (x1, y1, x2, y2), points = self.resolve(width, height)
+        if not self.is_polygon:
+            return x1 <= x <= x2 and y1 <= y <= y2
+        return cv2.pointPolygonTest(points.reshape(-1, 1, 2), (float(x), float(y)), False) >= 0
+
+
+def _iou(a: Sequence[float], b: Sequence[float]) -> float:
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    if inter <= 0:
+        return 0.0
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class RoiCropper:
+    """
+    按 ROI 裁剪画面并将检测结果映射回原图坐标。
+    检测只在各 ROI 的外接矩形上运行，小目标在 640x640 检测输入中的占比因此变大。
+    """
+
+    def __init__(self, rois: List[RegionOfInterest], dedup_iou: float = 0.5):
+        self.rois = rois
+        self.dedup_iou = dedup_iou
+        self._mask_cache: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def crops(self, frame: np.ndarray) -> List[Tuple[np.ndarray, Tuple[int, int]]]:
+        """返回 [(ROI 裁剪图, (x偏移, y偏移)), ...]，忽略面积为零的区域。"""
+        h, w = frame.shape[:2]
+        result = []
+        for roi in self.rois:
+            (x1, y1, x2, y2), _ = roi.resolve(w, h)
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                continue
+            result.append((np.ascontiguousarray(frame[y1:y2, x1:x2]), (x1, y1)))
+        return result
+
+    def mask(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """返回与画面同尺寸的单通道掩码（ROI 内为 255），供运动门控使用。"""
+        h, w = shape[:2]
+        cached = self._mask_cache.get((w, h))
+        if cached is None:
+            cached = np.zeros((h, w), dtype=np.uint8)
+            for roi in self.rois:
+                _, points = roi.resolve(w, h)
+                cv2.fillPoly(cached, [points.reshape(-1, 1, 2)], 255)
+            self._mask_cache = {(w, h): cached}
+        return cached
+
+    def map_detections(self, shape: Tuple[int, ...], results_per_roi: List[Tuple[List[Dict[str, Any]], Tuple[int, int]]]) -> List[Dict[str, Any]]:
+        """
+        将各 ROI 的检测结果平移回原图坐标，剔除中心点不在多边形内的人脸，
+        并对重叠 ROI 中重复检出的人脸按 IoU 去重（保留得分更高者）。
+        """
+        h, w = shape[:2]
+        mapped: List[Dict[str, Any]] = []
+        for roi, (results, (ox, oy)) in zip(self.rois, results_per_roi):
+            for face in results:
+                bx1, by1, bx2, by2 = face["bbox"]
+                bbox = [bx1 + ox, by1 + oy, bx2 + ox, by2 + oy]
+                if roi.is_polygon and not roi.contains((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2, w, h):
+                    continue
+                shifted = dict(face)
+                shifted["bbox"] = bbox
+                shifted["landmarks"] = [
+                    {**lm, "landmark": [lm["landmark"][0] + ox, lm["landmark"][1] + oy]}
+                    for lm in face.get("landmarks", [])
+                ]
+                mapped.append(shifted)
+
+        if len(self.rois) <= 1:
+            return mapped
+        mapped.sort(key=lambda f: f.get("score", 0.0), reverse=True)
+        kept: List[Dict[str, Any]] = []
+        for face in mapped:
+            if all(_iou(face["bbox"], k["bbox"]) < self.dedup_iou for k in kept):
+                kept.append(face)
+        return kept
+
+    def draw(self, frame: np.ndarray):
+        """在画面上绘制 ROI 轮廓。"""
+        h, w = frame.shape[:2]
+        for roi in self.rois:
+            _, points = roi.resolve(w, h)
+            cv2.polylines(frame, [points.reshape(-1, 1, 2)], True, (0, 255, 255), 1)
@@ -0,0 +1,167 @@
+# app/core/shm_ring.py
+import queue
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+# 全局头：最新写入序号、流是否已结束
+_HEADER = struct.Struct("<QQ")
+# 槽位头：该槽位数据的序号、数据长度
+_SLOT_HEADER = struct.Struct("<QQ")
+
+
+class SharedFrameRing:
+    """
+    基于 multiprocessing.shared_memory 的单写多读帧环形缓冲区。
+
+    工作进程把编码后的帧直接写入共享内存槽位，API 进程按序号读取最新帧，
+    全程不经过 pickle。每个槽位使用序号做 seqlock 校验：读取前后序号一致才视为有效，
+    写入方覆盖正在被读取的槽位时，读取方会自动重试。
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, slot_bytes: int, owner: bool):
+        self._shm = shm
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._owner = owner
+        self._slot_stride = _SLOT_HEADER.size + slot_bytes
+        self._released = False
+        self._write_seq = self._read_header()[0]
+        self.dropped_oversize = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @classmethod
+    def create(cls, slots: int, slot_bytes: int) -> "SharedFrameRing":
+        """创建新的共享内存环（由 API 进程持有并负责最终 unlink）。"""
+        size = _HEADER.size + slots * (_SLOT_HEADER.size + slot_bytes)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, 0, 0)
+        for i in range(slots):
+            _SLOT_HEADER.pack_into(shm.buf, _HEADER.size + i * (_SLOT_HEADER.size + slot_bytes), 0, 0)
+        return cls(shm, slots, slot_bytes, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, slots: int, slot_bytes: int) -> "SharedFrameRing":
+        """在工作进程中按名称挂载已存在的共享内存环。"""
+        return cls(shared_memory.SharedMemory(name=name), slots, slot_bytes, owner=False)
+
+    def _read_header(self) -> Tuple[int, int]:
+        if self._released:
+            return self._write_seq, 1
+        return _HEADER.unpack_from(self._shm.buf, 0)
+
+    def _slot_offset(self, seq: int) -> int:
+        return _HEADER.size + ((seq - 1) % self.slots) * self._slot_stride
+
+    # --- 写入端（单写者） ---
+    def write(self, data: bytes) -> bool:
+        """写入一帧；超过槽位容量的帧会被丢弃并返回 False。"""
+        length = len(data)
+        if length > self.slot_bytes:
+            self.dropped_oversize += 1
+            return False
+        seq = self._write_seq + 1
+        offset = self._slot_offset(seq)
+        buf = self._shm.buf
+        # 先将槽位序号置 0 标记为写入中，再写数据，最后发布序号
+        _SLOT_HEADER.pack_into(buf, offset, 0, length)
+        data_start = offset + _SLOT_HEADER.size
+        buf[data_start:data_start + length] = data
+        _SLOT_HEADER.pack_into(buf, offset, seq, length)
+        _HEADER.pack_into(buf, 0, seq, 0)
+        self._write_seq = seq
+        return True
+
+    def mark_closed(self):
+        """标记流已结束，读取方读完剩余帧后会收到结束信号。"""
+        if not self._released:
+            _HEADER.pack_into(self._shm.buf, 0, self.latest_seq(), 1)
+
+    # --- 读取端 ---
+    def latest_seq(self) -> int:
+        return self._read_header()[0]
+
+    def is_closed(self) -> bool:
+        return bool(self._read_header()[1])
+
+    def read_latest(self, after_seq: int) -> Optional[Tuple[int, bytes]]:
+        """读取序号大于 after_seq 的最新一帧；没有新帧时返回 None。"""
+        for _ in range(3):
+            seq = self.latest_seq()
+            if seq <= after_seq or self._released:
+                return None
+            offset = self._slot_offset(seq)
+            try:
+                slot_seq, length = _SLOT_HEADER.unpack_from(self._shm.buf, offset)
+                if slot_seq != seq:
+                    continue
+                data_start = offset + _SLOT_HEADER.size
+                data = bytes(self._shm.buf[data_start:data_start + length])
+                if _SLOT_HEADER.unpack_from(self._shm.buf, offset)[0] == seq:
+                    return seq, data
+            except (ValueError, TypeError):
+                # 共享内存已被其他线程释放，按流结束处理
+                return None
+        return None
+
+    def close(self):
+        """释放本进程对共享内存的映射；创建方同时删除共享内存段。"""
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._shm.close()
+        except BufferError:
+            # 仍有 memoryview 引用时无法关闭，交由进程退出时回收
+            return
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class RingFeedReader:
+    """
+    共享内存环的单观众读取游标，提供与 queue.Queue 相同的 get/empty 语义，
+    使视频流推送逻辑无需区分线程模式与进程模式。流结束后 get 返回 None。
+    """
+
+    def __init__(self, ring: SharedFrameRing, poll_interval: float = 0.005):
+        self.ring = ring
+        self.poll_interval = poll_interval
+        # 从上一帧开始读，新观众连接后立即拿到最新画面
+        self._last_seq = max(0, ring.latest_seq() - 1)
+
+    def empty(self) -> bool:
+        return self.ring.latest_seq() <= self._last_seq
+
+    def get(self, timeout: float = 0.02) -> Optional[bytes]:
+        deadline = time.monotonic() + timeout
+        while True:
+            item = self.ring.read_latest(self._last_seq)
+            if item is not None:
+                self._last_seq, data = item
+                return data
+            if self.ring.is_closed():
+                return None
+            if time.monotonic() >= deadline:
+                raise queue.Empty
+            time.sleep(self.poll_interval)
+
+
+class RingOutput:
+    """把共享内存环包装成流水线所需的 output_queue（只使用 put_nowait）。"""
+
+    def __init__(self, ring: SharedFrameRing):
+        self.ring = ring
+
+    def put_nowait(self, item: Optional[bytes]):
+        if item is None:
+            self.ring.mark_closed()
+        else:
+            self.ring.write(item)
@@ -0,0 +1,140 @@
+# app/core/startup.py
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from app.cfg.config import StartupConfig
+from app.cfg.logging import app_logger
+
+
+class StartupProfile:
+    """
+    记录一次启动的各阶段耗时、模块导入耗时与预热结果，供 /ready 接口和日志使用。
+    ready 在全部阶段（含预热）完成后才置为 True。
+    """
+
+    def __init__(self, import_seconds: Optional[float] = None):
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.ready = False
+        self.error: Optional[str] = None
+        self.ready_seconds: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.imports: Dict[str, float] = {}
+        self.warmup: List[Dict[str, Any]] = []
+        if import_seconds is not None:
+            self.phases["import_app"] = round(import_seconds, 3)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = round(time.perf_counter() - started, 3)
+
+    def record_import(self, module: str, seconds: float):
+        with self._lock:
+            self.imports[module] = round(seconds, 3)
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_seconds = round(time.perf_counter() - self._started, 3)
+
+    def mark_failed(self, error: str):
+        self.error = error
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self.ready, "error": self.error, "ready_seconds": self.ready_seconds,
+                "phases": dict(self.phases), "imports": dict(self.imports), "warmup": list(self.warmup),
+            }
+
+
+def preload_modules(modules: List[str], profile: Optional[StartupProfile] = None) -> threading.Thread:
+    """
+    在后台线程中导入重量级模块并记录各自耗时。
+    模型加载主要在等待 NPU / 模型文件 I/O，期间并行完成导入，后续真正使用时直接命中 sys.modules。
+    """
+    def _run():
+        for module in modules:
+            if module in sys.modules:
+                continue
+            started = time.perf_counter()
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                app_logger.warning(f"预导入模块 {module} 失败: {e}")
+                continue
+            if profile is not None:
+                profile.record_import(module, time.perf_counter() - started)
+
+    thread = threading.Thread(target=_run, name="ModulePreload", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_up(cfg: StartupConfig, model_pool, face_dao=None, threshold: float = 0.5) -> List[Dict[str, Any]]:
+    """
+    用自检图片依次跑通模型池中的每一套模型（检测 -> 对齐 -> 特征提取）以及一次人脸库检索，
+    使首个真实请求不再承担模型首次推理、内存分配与索引加载的开销。返回每套模型的预热耗时。
+    """
+    # 仅预热时用到，不放在模块顶层，避免 app.main 的导入链为此加载 cv2
+    import cv2
+    import numpy as np
+
+    from app.core.image_utils import align_and_crop
+
+    img = cv2.imread(cfg.warmup_image)
+    if img is None:
+        app_logger.warning(f"预热图片不存在或无法读取: {cfg.warmup_image}，跳过预热。")
+        return []
+
+    # 一次借出全部模型，保证每套都被预热到；结束后统一归还
+    borrowed = []
+    results: List[Dict[str, Any]] = []
+    try:
+        for _ in range(model_pool.pool_size):
+            models = model_pool.acquire(timeout=cfg.warmup_timeout_seconds)
+            if models is None:
+                break
+            borrowed.append(models)
+
+        embedding = None
+        for index, (detection_model, recognition_model) in enumerate(borrowed):
+            started = time.perf_counter()
+            faces = detection_model.predict(img).results
+            detect_ms = 1000 * (time.perf_counter() - started)
+
+            aligned = None
+            for face_data in faces:
+                landmarks = [lm["landmark"] for lm in face_data.get("landmarks", [])]
+                if len(landmarks) == 5:
+                    aligned, _ = align_and_crop(img, landmarks)
+                    break
+            if aligned is None or aligned.size == 0:
+                # 自检图片中未检出人脸时仍预热识别模型，输入为整幅图缩放到模型尺寸
+                aligned = cv2.resize(img, (112, 112))
+            started = time.perf_counter()
+            rec_result = recognition_model.predict_batch([aligned])
+            embedding = np.array(next(iter(rec_result)).results[0]['data'][0], dtype=np.float32)
+            recognize_ms = 1000 * (time.perf_counter() - started)
+            results.append({"target": f"models#{index}", "faces": len(faces),
+                            "detect_ms": round(detect_ms, 1), "recognize_ms": round(recognize_ms, 1)})
+    finally:
+        for models in borrowed:
+            model_pool.release(models)
+
+    if face_dao is not None:
+        query = embedding if embedding is not None else np.ones(512, dtype=np.float32)
+        started = time.perf_counter()
+        face_dao.search(query, threshold)
+        results.append({"target": "face_dao", "search_ms": round(1000 * (time.perf_counter() - started), 1)})
+    if len(borrowed) < model_pool.pool_size:
+        app_logger.warning(f"预热时只借到 {len(borrowed)}/{model_pool.pool_size} 套模型。")
+    return results
@@ -0,0 +1,370 @@
+# app/core/stream_worker.py
+import multiprocessing as mp
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.cfg.config import AppSettings
+from app.cfg.logging import app_logger
+from app.core.shm_ring import SharedFrameRing, RingFeedReader, RingOutput
+
+
+def _worker_main(worker_index: int, settings_data: Dict[str, Any], command_queue: mp.Queue, event_queue: mp.Queue):
+    """
+    视频流工作进程入口（spawn 启动，拥有独立的 GIL 与模型池）。
+    通过 command_queue 接收启停指令，通过 event_queue 回报状态与统计；帧数据走共享内存环。
+    """
+    # 在子进程内部导入重量级模块，避免 API 进程在 spawn 时产生额外开销
+    from app.cfg.logging import setup_logging
+    from app.core.model_manager import ModelPool
+    from app.core.pipeline import FaceStreamPipeline
+    from app.schema.face_schema import StreamStartRequest
+    from app.service.face_dao import create_face_dao
+    from app.service.event_sink import RecognitionEventSink
+    from app.service.webhook_dispatcher import WebhookDispatcher
+    from app.core.startup import preload_modules, warm_up
+    from app.core.tracing import setup_tracing
+
+    settings = AppSettings.model_validate(settings_data)
+    setup_logging(settings)
+    tracer = setup_tracing(settings.tracing)
+    tag = f"【流工作进程 #{worker_index}】"
+    app_logger.info(f"{tag}启动，正在加载 {settings.stream_worker.models_per_worker} 套模型...")
+
+    try:
+        preload_modules(settings.startup.preload_modules)
+        model_pool = ModelPool(settings=settings, pool_size=settings.stream_worker.models_per_worker)
+        # 同一工作进程内的视频流共享一个 DAO，紧凑索引只需加载一次
+        face_dao = create_face_dao(settings)
+        event_sink = RecognitionEventSink(settings.event_log) if settings.event_log.enabled else None
+        webhook = WebhookDispatcher(settings.webhook) if settings.webhook.enabled and settings.webhook.urls else None
+    except Exception as e:
+        app_logger.error(f"❌{tag}模型池初始化失败: {e}")
+        event_queue.put(("worker_failed", worker_index, str(e)))
+        return
+    if settings.startup.warmup_enabled:
+        try:
+            app_logger.info(f"{tag}预热完成: {warm_up(settings.startup, model_pool, face_dao, settings.degirum.recognition_similarity_threshold)}")
+        except Exception as e:
+            app_logger.warning(f"{tag}预热失败: {e}")
+    event_queue.put(("worker_ready", worker_index, None))
+
+    pipelines: Dict[str, Dict[str, Any]] = {}
+    # 已停用的画质变体共享内存环：识别线程可能仍持有旧的变体快照（正在编码当前帧），延后一段时间再关闭映射
+    retired_rings: List[Tuple[float, SharedFrameRing]] = []
+    last_report = 0.0
+    running = True
+    while running:
+        try:
+            command = command_queue.get(timeout=0.5)
+        except queue.Empty:
+            command = None
+
+        while retired_rings and time.monotonic() - retired_rings[0][0] > 2.0:
+            retired_rings.pop(0)[1].close()
+
+        if command is not None:
+            action = command[0]
+            if action == "start":
+                _, stream_id, request_data, ring_name = command
+                try:
+                    ring = SharedFrameRing.attach(ring_name, settings.stream_worker.ring_slots, settings.stream_worker.ring_slot_bytes)
+                    request = StreamStartRequest.model_validate(request_data)
+                    pipeline = FaceStreamPipeline(
+                        settings=settings, stream_id=stream_id, video_source=request.source,
+                        model_pool=model_pool, output_queue=RingOutput(ring), options=request, face_dao=face_dao,
+                        event_sink=event_sink, webhook=webhook,
+                    )
+                    thread = threading.Thread(target=pipeline.start, name=f"{stream_id}-Pipeline", daemon=True)
+                    thread.start()
+                    pipelines[stream_id] = {"pipeline": pipeline, "thread": thread, "ring": ring, "variant_rings": {}}
+                    app_logger.info(f"{tag}已启动视频流 {stream_id}。")
+                except Exception as e:
+                    app_logger.error(f"❌{tag}启动视频流 {stream_id} 失败: {e}", exc_info=True)
+                    event_queue.put(("ended", stream_id, str(e)))
+            elif action == "stop":
+                ctx = pipelines.pop(command[1], None)
+                if ctx:
+                    _stop_pipeline(ctx)
+                    event_queue.put(("ended", command[1], None))
+            elif action == "variant_on":
+                _, stream_id, key, ring_name = command
+                ctx = pipelines.get(stream_id)
+                if ctx:
+                    variant_ring = SharedFrameRing.attach(ring_name, settings.stream_worker.ring_slots, settings.stream_worker.ring_slot_bytes)
+                    ctx["variant_rings"][key] = variant_ring
+                    ctx["pipeline"].add_feed_variant(key, RingOutput(variant_ring))
+            elif action == "variant_off":
+                _, stream_id, key = command
+                ctx = pipelines.get(stream_id)
+                if ctx and key in ctx["variant_rings"]:
+                    ctx["pipeline"].remove_feed_variant(key)
+                    retired_rings.append((time.monotonic(), ctx["variant_rings"].pop(key)))
+            elif action == "feed_viewer":
+                _, stream_id, delta = command
+                ctx = pipelines.get(stream_id)
+                if ctx:
+                    if delta > 0:
+                        ctx["pipeline"].add_feed_viewer()
+                    else:
+                        ctx["pipeline"].remove_feed_viewer()
+            elif action == "feed_touch":
+                ctx = pipelines.get(command[1])
+                if ctx:
+                    ctx["pipeline"].touch_feed()
+            elif action == "video_touch":
+                ctx = pipelines.get(command[1])
+                if ctx:
+                    ctx["pipeline"].touch_video_output()
+            elif action == "shutdown":
+                running = False
+
+        # 回收已自行结束的流水线（如视频文件读完、源断开）
+        for stream_id in [sid for sid, ctx in pipelines.items() if not ctx["thread"].is_alive()]:
+            _stop_pipeline(pipelines.pop(stream_id))
+            event_queue.put(("ended", stream_id, None))
+
+        now = time.monotonic()
+        if now - last_report >= 1.0:
+            last_report = now
+            event_queue.put(("stats", worker_index, {sid: ctx["pipeline"].get_stats() for sid, ctx in pipelines.items()}))
+
+    for stream_id, ctx in list(pipelines.items()):
+        _stop_pipeline(ctx)
+        event_queue.put(("ended", stream_id, None))
+    if event_sink is not None:
+        event_sink.close()
+    if webhook is not None:
+        webhook.close()
+    tracer.close()
+    # 注意：此处不调用 model_pool.dispose()，它会按命令行清理系统内所有 DeGirum 进程，
+    # 由 API 进程在全部工作进程退出后统一执行。
+    app_logger.info(f"{tag}已退出。")
+
+
+def _stop_pipeline(ctx: Dict[str, Any]):
+    ctx["pipeline"].stop()
+    ctx["thread"].join(timeout=5.0)
+    ctx["ring"].close()
+    for ring in ctx["variant_rings"].values():
+        ring.close()
+
+
+class RemoteStreamHandle:
+    """
+    API 进程中代表一个运行在工作进程里的视频流。
+    对外提供与线程模式一致的 is_alive/join/stop/get_stats 接口。
+    """
+
+    def __init__(self, stream_id: str, worker: "StreamWorker", ring: SharedFrameRing, idle_encode_seconds: float = 5.0):
+        self.stream_id = stream_id
+        self.idle_encode_seconds = idle_encode_seconds
+        self.worker = worker
+        self.ring = ring
+        self.stats: Dict[str, Any] = {"stream_id": stream_id}
+        self._ended = threading.Event()
+        # 画质变体各自使用一个共享内存环，由 API 侧创建并负责释放
+        self.variant_rings: Dict[Any, SharedFrameRing] = {}
+        self._last_touch = 0.0
+        # 默认画面的观众数与快照需求在 API 侧记录一份，用于判断工作进程是否已在编码
+        self._feed_lock = threading.Lock()
+        self._feed_viewers = 0
+        self._feed_demand_until = 0.0
+        self._last_feed_touch = 0.0
+
+    def is_alive(self) -> bool:
+        return not self._ended.is_set()
+
+    def join(self, timeout: Optional[float] = None):
+        self._ended.wait(timeout)
+
+    def stop(self):
+        if self.is_alive():
+            self.worker.command_queue.put(("stop", self.stream_id))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+    def open_reader(self) -> RingFeedReader:
+        return RingFeedReader(self.ring)
+
+    def add_feed_viewer(self):
+        with self._feed_lock:
+            self._feed_viewers += 1
+        self.worker.command_queue.put(("feed_viewer", self.stream_id, 1))
+
+    def remove_feed_viewer(self):
+        with self._feed_lock:
+            self._feed_viewers = max(0, self._feed_viewers - 1)
+            if self._feed_viewers == 0:
+                self._feed_demand_until = time.monotonic() + self.idle_encode_seconds
+        if self.is_alive():
+            self.worker.command_queue.put(("feed_viewer", self.stream_id, -1))
+
+    def touch_feed(self) -> bool:
+        """转发快照请求（每秒最多一次），返回工作进程此前是否已在编码默认画面。"""
+        now = time.monotonic()
+        with self._feed_lock:
+            active = self._feed_viewers > 0 or now < self._feed_demand_until
+            self._feed_demand_until = max(self._feed_demand_until, now + self.idle_encode_seconds)
+            send = now - self._last_feed_touch >= 1.0
+            if send:
+                self._last_feed_touch = now
+        if send and self.is_alive():
+            self.worker.command_queue.put(("feed_touch", self.stream_id))
+        return active
+
+    def touch_video_output(self):
+        """转发 HLS 观看请求；播放器每个分段都会请求多次，每秒最多通知工作进程一次。"""
+        now = time.monotonic()
+        if self.is_alive() and now - self._last_touch >= 1.0:
+            self._last_touch = now
+            self.worker.command_queue.put(("video_touch", self.stream_id))
+
+    def add_feed_variant(self, key) -> SharedFrameRing:
+        """为画质变体创建共享内存环并通知工作进程开始编码。"""
+        ring = SharedFrameRing.create(self.ring.slots, self.ring.slot_bytes)
+        self.variant_rings[key] = ring
+        self.worker.command_queue.put(("variant_on", self.stream_id, key, ring.name))
+        return ring
+
+    def remove_feed_variant(self, key):
+        ring = self.variant_rings.pop(key, None)
+        if ring is not None:
+            if self.is_alive():
+                self.worker.command_queue.put(("variant_off", self.stream_id, key))
+            ring.close()
+
+    def mark_ended(self):
+        self.ring.mark_closed()
+        for ring in self.variant_rings.values():
+            ring.mark_closed()
+        self._ended.set()
+
+    def release(self):
+        """释放共享内存环。由 API 侧在流从活动列表移除后调用。"""
+        self.ring.close()
+        for ring in self.variant_rings.values():
+            ring.close()
+        self.variant_rings.clear()
+
+
+class StreamWorker:
+    """单个工作进程的句柄。"""
+
+    def __init__(self, index: int, process: mp.Process, command_queue: mp.Queue, capacity: int):
+        self.index = index
+        self.process = process
+        self.command_queue = command_queue
+        self.capacity = capacity
+        self.ready = False
+        self.streams: Dict[str, RemoteStreamHandle] = {}
+
+    @property
+    def load(self) -> int:
+        return len(self.streams)
+
+
+class StreamWorkerPool:
+    """
+    视频流工作进程池：负责进程创建、流的放置（最少负载优先）、状态回收与关闭。
+    每个工作进程持有 models_per_worker 套模型，即最多同时运行同等数量的视频流。
+    """
+
+    def __init__(self, settings: AppSettings):
+        self.settings = settings
+        self.cfg = settings.stream_worker
+        self._ctx = mp.get_context("spawn")
+        self._event_queue = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.workers: List[StreamWorker] = []
+
+        settings_data = settings.model_dump()
+        for i in range(self.cfg.num_workers):
+            command_queue = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=_worker_main, args=(i, settings_data, command_queue, self._event_queue),
+                name=f"StreamWorker-{i}", daemon=True,
+            )
+            process.start()
+            self.workers.append(StreamWorker(i, process, command_queue, self.cfg.models_per_worker))
+        app_logger.info(f"✅ 已启动 {len(self.workers)} 个视频流工作进程 (每个进程 {self.cfg.models_per_worker} 路)。")
+
+        self._event_thread = threading.Thread(target=self._event_loop, name="StreamWorkerEvents", daemon=True)
+        self._event_thread.start()
+
+    def _event_loop(self):
+        # 各工作进程每秒都会上报统计，队列可能一直不空：按单调时钟定期检查退出的工作进程，与是否收到事件无关
+        next_reap = time.monotonic() + 0.5
+        while not self._stop_event.is_set():
+            if time.monotonic() >= next_reap:
+                self._reap_dead_workers()
+                next_reap = time.monotonic() + 0.5
+            try:
+                kind, key, payload = self._event_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                if kind == "worker_ready":
+                    self.workers[key].ready = True
+                elif kind == "worker_failed":
+                    app_logger.error(f"❌ 视频流工作进程 #{key} 初始化失败: {payload}")
+                elif kind == "stats":
+                    for stream_id, stats in payload.items():
+                        handle = self.workers[key].streams.get(stream_id)
+                        if handle:
+                            handle.stats = stats
+                elif kind == "ended":
+                    for worker in self.workers:
+                        handle = worker.streams.pop(key, None)
+                        if handle:
+                            handle.mark_ended()
+
+    def _reap_dead_workers(self):
+        with self._lock:
+            for worker in self.workers:
+                if worker.process.is_alive() or not worker.streams:
+                    continue
+                app_logger.error(f"❌ 视频流工作进程 #{worker.index} 意外退出，其上的 {worker.load} 路视频流已终止。")
+                for handle in worker.streams.values():
+                    handle.mark_ended()
+                worker.streams.clear()
+
+    def start_stream(self, stream_id: str, request_data: Dict[str, Any]) -> RemoteStreamHandle:
+        """把视频流放置到负载最低且有空闲模型的工作进程上。"""
+        with self._lock:
+            candidates = [w for w in self.workers if w.process.is_alive() and w.load < w.capacity]
+            if not candidates:
+                raise RuntimeError("所有视频流工作进程均已满载。")
+            worker = min(candidates, key=lambda w: (not w.ready, w.load))
+            ring = SharedFrameRing.create(self.cfg.ring_slots, self.cfg.ring_slot_bytes)
+            handle = RemoteStreamHandle(stream_id, worker, ring, self.settings.feed.idle_encode_seconds)
+            worker.streams[stream_id] = handle
+        worker.command_queue.put(("start", stream_id, request_data, ring.name))
+        app_logger.info(f"视频流 {stream_id} 已放置到工作进程 #{worker.index} (当前负载 {worker.load}/{worker.capacity})。")
+        return handle
+
+    def shutdown(self, timeout: float = 10.0):
+        for worker in self.workers:
+            try:
+                worker.command_queue.put(("shutdown",))
+            except (ValueError, OSError):
+                pass
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.process.join(timeout=max(0.1, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                app_logger.warning(f"视频流工作进程 #{worker.index} 未能按时退出，强制终止。")
+                worker.process.terminate()
+        self._stop_event.set()
+        with self._lock:
+            for worker in self.workers:
+                for handle in worker.streams.values():
+                    handle.mark_ended()
+                    handle.release()
+                worker.streams.clear()
+        app_logger.info("✅ 所有视频流工作进程已关闭。")
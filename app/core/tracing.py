@@ -0,0 +1,258 @@
+# app/core/tracing.py
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.cfg.config import TracingConfig
+from app.cfg.logging import app_logger
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "duration_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.duration_ns = 0
+        self.attributes = attributes or {}
+
+
+class Trace:
+    """
+    一次请求或一帧画面的调用链。子 span 由各线程追加到 spans（list.append 线程安全），
+    结束后关闭，之后的 span 调用不再记录。
+    sampled 决定是否导出；collect 表示调用方需要即时取回耗时明细（调试请求头）。
+    """
+    __slots__ = ("root", "trace_id", "sampled", "collect", "spans", "closed", "_started")
+
+    def __init__(self, name: str, sampled: bool, collect: bool, attributes: Optional[Dict[str, Any]] = None):
+        self.root = Span(name, None, attributes)
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.collect = collect
+        self.spans: List[Span] = []
+        self.closed = False
+        self._started = time.perf_counter_ns()
+
+    def breakdown(self) -> List[Tuple[str, float, int]]:
+        """按 span 名称汇总耗时，返回 [(名称, 总毫秒, 次数), ...]，最后一项为整体耗时。"""
+        totals: Dict[str, List[float]] = {}
+        for s in self.spans:
+            entry = totals.setdefault(s.name, [0.0, 0])
+            entry[0] += s.duration_ns / 1e6
+            entry[1] += 1
+        result = [(name, round(ms, 3), count) for name, (ms, count) in totals.items()]
+        result.append(("total", round(self.root.duration_ns / 1e6, 3), 1))
+        return result
+
+
+# 当前调用链与父 span；跨线程传递时由 activate() 显式恢复
+_current: ContextVar[Optional[Tuple[Trace, str]]] = ContextVar("face_rec_trace", default=None)
+
+
+class _SpanScope:
+    __slots__ = ("_span", "_trace", "_token", "_started")
+
+    def __init__(self, trace: Trace, parent_id: str, name: str, attributes: Dict[str, Any]):
+        self._trace = trace
+        self._span = Span(name, parent_id, attributes)
+
+    def __enter__(self) -> Span:
+        self._token = _current.set((self._trace, self._span.span_id))
+        self._started = time.perf_counter_ns()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.duration_ns = time.perf_counter_ns() - self._started
+        if exc_type is not None:
+            self._span.attributes["error"] = exc_type.__name__
+        _current.reset(self._token)
+        if not self._trace.closed:
+            self._trace.spans.append(self._span)
+        return False
+
+
+class _NoopScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopScope()
+
+
+def span(name: str, **attributes):
+    """在当前调用链下记录一个子 span；不在调用链内（未采样）时几乎零开销。"""
+    current = _current.get()
+    if current is None or current[0].closed:
+        return _NOOP
+    return _SpanScope(current[0], current[1], name, attributes)
+
+
+def traced(name: str):
+    """把函数整体记录为一个 span 的装饰器。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class activate:
+    """在当前线程/协程中恢复某个调用链，使其下的 span() 记录到该链上。trace 为 None 时不做任何事。"""
+    __slots__ = ("_trace", "_token")
+
+    def __init__(self, trace: Optional[Trace]):
+        self._trace = trace
+        self._token = None
+
+    def __enter__(self) -> Optional[Trace]:
+        if self._trace is not None:
+            self._token = _current.set((self._trace, self._trace.root.span_id))
+        return self._trace
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current.reset(self._token)
+        return False
+
+
+class Tracer:
+    """按采样率创建调用链，结束时交给后台导出线程（本地 JSONL 文件或 OTLP/HTTP JSON 收集器）。"""
+
+    def __init__(self, cfg: TracingConfig):
+        self.cfg = cfg
+        self._queue: "queue.Queue[Trace]" = queue.Queue(maxsize=cfg.max_pending)
+        self._stop_event = threading.Event()
+        self.stats_counters = {"traces": 0, "exported_spans": 0, "dropped": 0, "export_errors": 0}
+        self._exporter: Optional[threading.Thread] = None
+        if cfg.enabled:
+            if cfg.exporter == "file":
+                Path(cfg.file_path).parent.mkdir(parents=True, exist_ok=True)
+            self._exporter = threading.Thread(target=self._export_loop, name="TraceExporter", daemon=True)
+            self._exporter.start()
+
+    def start_trace(self, name: str, sample_rate: Optional[float] = None, collect: bool = False, **attributes) -> Optional[Trace]:
+        """按采样率决定是否开启调用链；未采样且不需要即时明细时返回 None。"""
+        rate = self.cfg.sample_rate if sample_rate is None else sample_rate
+        sampled = self.cfg.enabled and rate > 0 and random.random() < rate
+        if not (sampled or collect):
+            return None
+        return Trace(name, sampled, collect, attributes)
+
+    def finish(self, trace: Optional[Trace]):
+        if trace is None or trace.closed:
+            return
+        trace.root.duration_ns = time.perf_counter_ns() - trace._started
+        trace.closed = True
+        if trace.sampled and self._exporter is not None:
+            try:
+                self._queue.put_nowait(trace)
+                self.stats_counters["traces"] += 1
+            except queue.Full:
+                self.stats_counters["dropped"] += 1
+
+    # --- 导出 ---
+    def _export_loop(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch: List[Trace] = []
+            try:
+                batch.append(self._queue.get(timeout=self.cfg.flush_interval_seconds))
+                while len(batch) < self.cfg.export_batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                continue
+            try:
+                if self.cfg.exporter == "otlp":
+                    self._export_otlp(batch)
+                else:
+                    self._export_file(batch)
+                self.stats_counters["exported_spans"] += sum(len(t.spans) + 1 for t in batch)
+            except Exception as e:
+                self.stats_counters["export_errors"] += 1
+                app_logger.warning(f"导出调用链失败 ({len(batch)} 条): {e}")
+
+    def _export_file(self, batch: List[Trace]):
+        with open(self.cfg.file_path, "a", encoding="utf-8") as f:
+            for trace in batch:
+                for s in [trace.root, *trace.spans]:
+                    f.write(json.dumps({
+                        "trace_id": trace.trace_id, "span_id": s.span_id, "parent_id": s.parent_id, "name": s.name,
+                        "start_unix_nano": s.start_ns, "duration_ms": round(s.duration_ns / 1e6, 3),
+                        "attributes": s.attributes, "service": self.cfg.service_name,
+                    }, ensure_ascii=False, default=str) + "\n")
+
+    def _export_otlp(self, batch: List[Trace]):
+        def attrs(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+            out = []
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    out.append({"key": key, "value": {"boolValue": value}})
+                elif isinstance(value, int):
+                    out.append({"key": key, "value": {"intValue": str(value)}})
+                elif isinstance(value, float):
+                    out.append({"key": key, "value": {"doubleValue": value}})
+                else:
+                    out.append({"key": key, "value": {"stringValue": str(value)}})
+            return out
+
+        spans = [
+            {
+                "traceId": trace.trace_id, "spanId": s.span_id, "name": s.name, "kind": 1,
+                **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                "startTimeUnixNano": str(s.start_ns), "endTimeUnixNano": str(s.start_ns + s.duration_ns),
+                "attributes": attrs(s.attributes),
+            }
+            for trace in batch for s in [trace.root, *trace.spans]
+        ]
+        body = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": attrs({"service.name": self.cfg.service_name})},
+            "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": spans}],
+        }]}).encode("utf-8")
+        request = urllib.request.Request(self.cfg.otlp_endpoint, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=5.0) as response:
+            response.read()
+
+    def close(self, timeout: float = 5.0):
+        self._stop_event.set()
+        if self._exporter is not None:
+            self._exporter.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.stats_counters, "pending": self._queue.qsize()}
+
+
+# 进程级单例：span() 分布在图像处理、模型池、DAO 等各层，与日志一样在启动时统一初始化
+_tracer = Tracer(TracingConfig(enabled=False))
+
+
+def setup_tracing(cfg: TracingConfig) -> Tracer:
+    global _tracer
+    _tracer.close()
+    _tracer = Tracer(cfg)
+    if cfg.enabled:
+        app_logger.info(f"调用链追踪已启用: 导出到 {cfg.exporter}, 请求采样率 {cfg.sample_rate}, 帧采样率 {cfg.frame_sample_rate}")
+    return _tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer
@@ -0,0 +1,343 @@
+# app/core/video_encoder.py
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.cfg.config import VideoOutputConfig
+from app.cfg.logging import app_logger
+from app.core.frame_queue import FrameQueue
+
+VIDEO_FORMATS = ("fmp4", "hls")
+HLS_PLAYLIST = "index.m3u8"
+
+
+class EncodedSubscription:
+    """单个观众的 fMP4 读取游标：第一项为初始化段 (ftyp+moov)，之后是以关键帧开头的分片；流结束或观众掉队时返回 None。"""
+
+    def __init__(self, maxsize: int):
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=maxsize)
+        self.closed = False
+        # 加入时编码器尚未产出初始化段，需在第一个分片前补发
+        self.needs_init = True
+
+    def offer(self, data: bytes) -> bool:
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        self.closed = True
+
+    def get(self, timeout: float = 0.5) -> Optional[bytes]:
+        if self.closed and self._queue.empty():
+            return None
+        return self._queue.get(timeout=timeout)
+
+
+@lru_cache(maxsize=None)
+def _frame_rate_mode_args(ffmpeg_path: str) -> Tuple[str, ...]:
+    """-fps_mode 需要 ffmpeg >= 5.1；更早的版本只支持（之后已弃用的）-vsync。按帮助输出探测一次并缓存。"""
+    try:
+        result = subprocess.run([ffmpeg_path, "-hide_banner", "-h", "long"], capture_output=True, text=True, timeout=10)
+        if "-fps_mode" in result.stdout:
+            return ("-fps_mode", "cfr")
+    except (OSError, subprocess.SubprocessError) as e:
+        app_logger.warning(f"探测 ffmpeg 支持的选项失败，使用 -vsync: {e}")
+    return ("-vsync", "cfr")
+
+
+class _EncoderRun:
+    """一次 ffmpeg 编码进程的运行状态；观众全部离开后整体丢弃，下次有观众时重新创建。"""
+
+    def __init__(self, process: subprocess.Popen, shape: tuple):
+        self.process = process
+        self.shape = shape
+        self.frames = FrameQueue(policy="latest_only")
+        self.stop_event = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+
+class VideoStreamEncoder:
+    """
+    一路视频流的 H.264 编码器（ffmpeg 子进程，软件编码），由该流的所有观众共享：
+
+    - fmp4：输出分片 MP4 到管道，按 box 切分为初始化段与分片后分发给各观众；
+      分片在关键帧处切分，新观众从下一个关键帧开始播放，GOP 越短起播越快；
+    - hls：ffmpeg 直接在 hls_dir/<stream_id>/ 下滚动写入短分段与播放列表，由 API 以静态文件提供。
+
+    帧以 latest_only 方式交给写入线程，编码跟不上时丢弃旧帧，不阻塞识别线程；
+    输入使用墙钟时间戳，输出按固定帧率补帧/丢帧，保证播放速度与实际一致。
+    ffmpeg 只在有观众时运行：第一个 fMP4 观众连接（或 HLS 播放列表/分段被请求）后，在下一帧到达时启动
+    （此时才知道画面尺寸）；最后一个观众离开 idle_stop_seconds 后在后台停止，不占用 CPU。
+    """
+
+    def __init__(self, stream_id: str, fmt: str, cfg: VideoOutputConfig, ffmpeg_path: str = "ffmpeg",
+                 bitrate_kbps: Optional[int] = None, gop_seconds: Optional[float] = None):
+        if fmt not in VIDEO_FORMATS:
+            raise ValueError(f"不支持的视频输出格式: {fmt}")
+        self.stream_id = stream_id
+        self.fmt = fmt
+        self.cfg = cfg
+        self.ffmpeg_path = ffmpeg_path
+        self.bitrate_kbps = bitrate_kbps or cfg.bitrate_kbps
+        self.gop_frames = max(1, int(round((gop_seconds or cfg.gop_seconds) * cfg.fps)))
+        self.hls_dir = Path(cfg.hls_dir) / stream_id
+        self.error: Optional[str] = None
+        self.stats_counters = {"frames_submitted": 0, "frames_written": 0, "bytes_out": 0, "fragments": 0,
+                               "viewers_dropped": 0, "starts": 0, "idle_stops": 0}
+
+        self._run: Optional[_EncoderRun] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._init_segment: Optional[bytes] = None
+        self._subscribers: List[EncodedSubscription] = []
+        # 最近一次有观众的时间：fMP4 为最后一个观众离开的时间，HLS 为最近一次请求播放列表/分段的时间
+        self._last_demand = float("-inf")
+        # HLS 播放器按分段时长轮询播放列表，空闲判定至少覆盖几个分段
+        self._idle_seconds = cfg.idle_stop_seconds if fmt == "fmp4" else max(cfg.idle_stop_seconds, 3 * cfg.hls_segment_seconds)
+
+    # --- 编码 ---
+    def _command(self, width: int, height: int) -> List[str]:
+        command = [self.ffmpeg_path, "-hide_banner", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}",
+                   "-use_wallclock_as_timestamps", "1", "-i", "pipe:0", "-an"]
+        if self.cfg.max_width and width > self.cfg.max_width:
+            command += ["-vf", f"scale={self.cfg.max_width}:-2"]
+        bitrate = f"{self.bitrate_kbps}k"
+        command += ["-c:v", "libx264", "-preset", self.cfg.preset, "-tune", "zerolatency", "-pix_fmt", "yuv420p",
+                    "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", f"{self.bitrate_kbps * 2}k",
+                    "-g", str(self.gop_frames), "-keyint_min", str(self.gop_frames), "-sc_threshold", "0",
+                    *_frame_rate_mode_args(self.ffmpeg_path), "-r", str(self.cfg.fps)]
+        if self.fmt == "fmp4":
+            command += ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof", "pipe:1"]
+        else:
+            command += ["-f", "hls", "-hls_time", str(self.cfg.hls_segment_seconds),
+                        "-hls_list_size", str(self.cfg.hls_list_size),
+                        "-hls_flags", "delete_segments+independent_segments+omit_endlist",
+                        "-hls_segment_filename", str(self.hls_dir / "seg_%06d.ts"), str(self.hls_dir / HLS_PLAYLIST)]
+        return command
+
+    def _start(self, shape: tuple) -> bool:
+        if shutil.which(self.ffmpeg_path) is None:
+            self.error = f"未找到 ffmpeg 可执行文件: '{self.ffmpeg_path}'"
+            app_logger.error(f"❌【视频编码 {self.stream_id}】{self.error}")
+            return False
+        height, width = shape[:2]
+        if self.fmt == "hls":
+            self.hls_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            process = subprocess.Popen(
+                self._command(width, height), stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE if self.fmt == "fmp4" else subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            self.error = f"启动 ffmpeg 编码进程失败: {e}"
+            app_logger.error(f"❌【视频编码 {self.stream_id}】{self.error}")
+            return False
+        run = _EncoderRun(process, shape)
+        targets = {"Writer": self._writer_loop}
+        if self.fmt == "fmp4":
+            targets["Muxer"] = self._fmp4_reader_loop
+        for name, target in targets.items():
+            thread = threading.Thread(target=target, args=(run,), name=f"{self.stream_id}-Video{name}", daemon=True)
+            run.threads.append(thread)
+            thread.start()
+        with self._lock:
+            self._init_segment = None
+            self._run = run
+        self.stats_counters["starts"] += 1
+        app_logger.info(f"【视频编码 {self.stream_id}】已启动 {self.fmt}: {width}x{height} -> "
+                        f"{self.bitrate_kbps}kbps, {self.cfg.fps}fps, GOP {self.gop_frames} 帧")
+        return True
+
+    def _has_demand(self, now: float) -> bool:
+        with self._lock:
+            return bool(self._subscribers) or now - self._last_demand < self._idle_seconds
+
+    def touch(self):
+        """记录一次 HLS 请求；编码器未运行时会在下一帧到达时启动。"""
+        with self._lock:
+            self._last_demand = time.monotonic()
+
+    def submit(self, frame: np.ndarray):
+        """交付一帧已绘制结果的画面（非阻塞）。调用方之后不应再修改该帧。没有观众时不编码。"""
+        if self.error is not None or self._stop_event.is_set():
+            return
+        run = self._run
+        if not self._has_demand(time.monotonic()):
+            if run is not None:
+                # 停止需要等待 ffmpeg 写完并退出，放到后台线程，不阻塞识别线程
+                self._detach_run(run)
+                self.stats_counters["idle_stops"] += 1
+                app_logger.info(f"【视频编码 {self.stream_id}】已无观众，停止编码。")
+                threading.Thread(target=self._stop_run, args=(run,), name=f"{self.stream_id}-VideoStop", daemon=True).start()
+            return
+        if run is None:
+            if not self._start(frame.shape):
+                return
+            run = self._run
+        if frame.shape != run.shape:
+            return
+        self.stats_counters["frames_submitted"] += 1
+        run.frames.put(frame)
+
+    def _detach_run(self, run: _EncoderRun):
+        with self._lock:
+            if self._run is run:
+                self._run = None
+                self._init_segment = None
+        run.stop_event.set()
+
+    def _writer_loop(self, run: _EncoderRun):
+        stdin = run.process.stdin
+        while not run.stop_event.is_set():
+            try:
+                frame = run.frames.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                stdin.write(np.ascontiguousarray(frame).data)
+                stdin.flush()
+                self.stats_counters["frames_written"] += 1
+            except (BrokenPipeError, ValueError, OSError) as e:
+                if not run.stop_event.is_set():
+                    self.error = f"ffmpeg 编码进程已退出: {e}"
+                    app_logger.error(f"❌【视频编码 {self.stream_id}】{self.error}")
+                break
+
+    def _stop_run(self, run: _EncoderRun):
+        run.stop_event.set()
+        # 先等写入线程退出再关闭 stdin，ffmpeg 读到 EOF 后写完最后的分片/分段
+        for thread in run.threads[:1]:
+            thread.join(timeout=2.0)
+        try:
+            run.process.stdin.close()
+            run.process.wait(timeout=3.0)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            run.process.kill()
+        for thread in run.threads[1:]:
+            thread.join(timeout=2.0)
+        if self.fmt == "hls":
+            # 停止后的播放列表不会再更新，删除后新的请求会等待下一次启动生成
+            with self._lock:
+                restarted = self._run is not None
+            if not restarted:
+                shutil.rmtree(self.hls_dir, ignore_errors=True)
+
+    # --- fMP4 分发 ---
+    @staticmethod
+    def _read_exact(stream, size: int) -> Optional[bytes]:
+        chunks, remaining = [], size
+        while remaining > 0:
+            chunk = stream.read(remaining)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def _fmp4_reader_loop(self, run: _EncoderRun):
+        """按 MP4 box 切分 ffmpeg 输出：ftyp+moov 组成初始化段，每组 moof+mdat 为一个分片。"""
+        stdout = run.process.stdout
+        pending: List[bytes] = []
+        while True:
+            header = self._read_exact(stdout, 8)
+            if header is None:
+                break
+            size, box_type = struct.unpack(">I4s", header)
+            if size == 1:
+                extended = self._read_exact(stdout, 8)
+                if extended is None:
+                    break
+                header += extended
+                size = struct.unpack(">Q", extended)[0]
+            body = self._read_exact(stdout, size - len(header))
+            if body is None:
+                break
+            pending.append(header + body)
+            self.stats_counters["bytes_out"] += size
+            if box_type == b"moov":
+                with self._lock:
+                    if self._run is run:
+                        self._init_segment = b"".join(pending)
+                pending = []
+            elif box_type == b"mdat":
+                self._broadcast(run, b"".join(pending))
+                pending = []
+        if run.stop_event.is_set():
+            return
+        # ffmpeg 意外退出：断开当前观众，由播放器重连
+        with self._lock:
+            for sub in self._subscribers:
+                sub.close()
+            self._subscribers.clear()
+
+    def _broadcast(self, run: _EncoderRun, fragment: bytes):
+        with self._lock:
+            # 已停止的编码进程最后输出的分片不再分发，新观众等待下一次启动的初始化段
+            if self._run is not run:
+                return
+            self.stats_counters["fragments"] += 1
+            for sub in list(self._subscribers):
+                if sub.needs_init:
+                    sub.needs_init = not sub.offer(self._init_segment)
+                # 分片之间有解码依赖，掉队的观众直接断开，由播放器重连后从新的关键帧开始
+                if sub.needs_init or not sub.offer(fragment):
+                    sub.close()
+                    self._subscribers.remove(sub)
+                    self._last_demand = time.monotonic()
+                    self.stats_counters["viewers_dropped"] += 1
+
+    def subscribe(self) -> EncodedSubscription:
+        """注册一个 fMP4 观众；编码器尚未运行或尚未产出初始化段时，观众会在第一个分片前收到它。"""
+        sub = EncodedSubscription(self.cfg.viewer_buffer_fragments + 1)
+        with self._lock:
+            if self._stop_event.is_set() or self.error is not None:
+                sub.close()
+                return sub
+            if self._init_segment is not None:
+                sub.needs_init = not sub.offer(self._init_segment)
+            self._subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: EncodedSubscription):
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+                self._last_demand = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            viewers = len(self._subscribers)
+            run = self._run
+        return {"format": self.fmt, "bitrate_kbps": self.bitrate_kbps, "gop_frames": self.gop_frames,
+                "running": run is not None and run.process.poll() is None,
+                "viewers": viewers, "dropped_frames": run.frames.dropped if run is not None else 0,
+                "error": self.error, **self.stats_counters}
+
+    def close(self):
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        run = self._run
+        if run is not None:
+            self._detach_run(run)
+            self._stop_run(run)
+        with self._lock:
+            for sub in self._subscribers:
+                sub.close()
+            self._subscribers.clear()
+        if self.fmt == "hls":
+            shutil.rmtree(self.hls_dir, ignore_errors=True)
+        app_logger.info(f"【视频编码 {self.stream_id}】已停止。")
@@ -1,4 +1,7 @@
 # app/main.py
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
@@ -14,12 +17,22 @@ from app.cfg.config import get_app_settings
 from app.cfg.logging import app_logger
 
 from app.core.model_manager import ModelPool
+from app.core.startup import StartupProfile, preload_modules, warm_up
+from app.core.tracing import activate, get_tracer, setup_tracing, span
 from app.router.face_router import router as face_router
 
 from app.service.face_operation_service import FaceOperationService
 from app.service.stream_manager_service import StreamManagerService
+from app.service.face_dao import create_face_dao
+from app.service.event_sink import RecognitionEventSink
+from app.service.webhook_dispatcher import WebhookDispatcher
+from app.service.gallery_sync import GallerySyncService
+from app.service.reembed_job import ReembedJob
 from app.schema.face_schema import ApiResponse
 
+# 本模块自身的导入耗时（重量级依赖已改为按需导入），计入启动画像
+APP_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -29,20 +42,42 @@ async def lifespan(app: FastAPI):
     app_logger.info("============== 应用程序启动 ==============")
     settings = get_app_settings()
     app.state.settings = settings
+    profile = StartupProfile(import_seconds=APP_IMPORT_SECONDS)
+    app.state.startup_profile = profile
+    setup_tracing(settings.tracing)
+    # lancedb 等重量级模块在后台线程导入，与模型加载并行
+    preload_modules(settings.startup.preload_modules, profile)
 
     # 1. ❗ 初始化统一模型池，大小设置为2
     app_logger.info("--> 正在初始化模型池...")
-    model_pool = ModelPool(settings=settings, pool_size=settings.app.max_concurrent_tasks)
+    with profile.phase("model_pool"):
+        model_pool = ModelPool(settings=settings, pool_size=settings.app.max_concurrent_tasks)
     app.state.model_pool = model_pool
     app_logger.info("✅ 统一模型池初始化完成。")
 
-    # 2. ❗ 初始化服务，并将模型池注入
+    # 2. ❗ 初始化服务，并将模型池与共享的人脸数据 DAO 注入
     app_logger.info("--> 正在初始化服务...")
-    face_op_service = FaceOperationService(settings=settings, model_pool=model_pool)
+    with profile.phase("face_dao"):
+        face_dao = create_face_dao(settings)
+    app.state.face_dao = face_dao
+    face_op_service = FaceOperationService(settings=settings, model_pool=model_pool, face_dao=face_dao)
     app.state.face_op_service = face_op_service
 
-    stream_manager_service = StreamManagerService(settings=settings, model_pool=model_pool)
+    event_sink = RecognitionEventSink(settings.event_log) if settings.event_log.enabled else None
+    app.state.event_sink = event_sink
+    webhook = WebhookDispatcher(settings.webhook) if settings.webhook.enabled and settings.webhook.urls else None
+    app.state.webhook = webhook
+    stream_manager_service = StreamManagerService(settings=settings, model_pool=model_pool, face_dao=face_dao,
+                                                  event_sink=event_sink, webhook=webhook)
     app.state.stream_manager_service = stream_manager_service
+    gallery_sync = None
+    if settings.sync.peers:
+        gallery_sync = GallerySyncService(settings.sync, face_dao, face_dao.node_id)
+        app_logger.info(f"✅ 人脸库同步已启动: 本节点 {face_dao.node_id}, 对等节点 {settings.sync.peers}")
+    app.state.gallery_sync = gallery_sync
+    reembed_job = ReembedJob(settings.reembed, face_dao, model_pool, settings.degirum.lancedb_uri,
+                             settings.degirum.lancedb_table_name, settings.degirum.recognition_model_name)
+    app.state.reembed_job = reembed_job
     app_logger.info("✅ 所有服务初始化完成。")
 
     # 3. 启动后台任务 (保持不变)
@@ -51,6 +86,24 @@ async def lifespan(app: FastAPI):
     app.state.cleanup_task = cleanup_task
     app_logger.info("✅ 启动了周期性清理过期视频流的后台任务。")
 
+    # 继续上次未完成的特征重新提取（或在识别模型更换后按配置自动开始）
+    reembed_job.maybe_start()
+
+    # 4. 预热：自检图片跑通每套模型与一次人脸库检索后才报告就绪
+    if settings.startup.warmup_enabled:
+        app_logger.info("--> 正在预热模型与人脸库...")
+        try:
+            with profile.phase("warmup"):
+                profile.warmup = warm_up(settings.startup, model_pool, face_dao,
+                                         settings.degirum.recognition_similarity_threshold)
+            app_logger.info(f"✅ 预热完成: {profile.warmup}")
+        except Exception as e:
+            profile.mark_failed(f"预热失败: {e}")
+            app_logger.error(f"❌ 预热失败，/ready 将返回 503: {e}", exc_info=True)
+    if profile.error is None:
+        profile.mark_ready()
+    app_logger.info(f"启动画像: {profile.summary()}")
+
     app_logger.info("🎉============== 应用程序准备就绪 ==============🎉")
     yield
     # --- 关闭任务 ---
@@ -69,21 +122,54 @@ async def lifespan(app: FastAPI):
     app_logger.info("--> 正在停止所有活动视频流...")
     if hasattr(app.state, 'stream_manager_service'):
         await app.state.stream_manager_service.stop_all_streams()
+        await app.state.stream_manager_service.shutdown()
         app_logger.info("✅ 所有活动视频流已停止。")
 
+    # 特征重新提取在释放模型池前停止，进度已按检查点保存，下次启动时继续
+    if hasattr(app.state, 'reembed_job'):
+        app.state.reembed_job.close()
+
     # 3. ❗ 释放模型池中的所有资源（这将触发进程清理）
     app_logger.info("--> 正在释放模型池并执行最终清理...")
     if hasattr(app.state, 'model_pool'):
         app.state.model_pool.dispose()
     app_logger.info("✅ 模型池已释放。")
 
+    # 4. 将内存中剩余的识别事件写入磁盘
+    if getattr(app.state, 'event_sink', None) is not None:
+        app.state.event_sink.close()
+        app_logger.info("✅ 识别事件日志已落盘。")
+    if getattr(app.state, 'webhook', None) is not None:
+        app.state.webhook.close()
+        app_logger.info("✅ Webhook 推送已停止，未送达的批次已暂存。")
+    if getattr(app.state, 'gallery_sync', None) is not None:
+        app.state.gallery_sync.close()
+        app_logger.info("✅ 人脸库同步已停止。")
+    if hasattr(app.state, 'face_op_service'):
+        app.state.face_op_service.close()
+        app_logger.info("✅ 注册人脸图片已全部落盘。")
+
+    get_tracer().close()
+
+    # 5. 释放人脸数据 DAO（快照模式下会把增量写入合并落盘）
+    if hasattr(app.state, 'face_dao'):
+        app.state.face_dao.dispose()
+
     app_logger.info("✅==============所有清理任务完成，再见==============✅")
 
+class TracedJSONResponse(JSONResponse):
+    """把响应体的 JSON 序列化计入当前调用链。"""
+    def render(self, content) -> bytes:
+        with span("json.serialize"):
+            return super().render(content)
+
+
 def create_app() -> FastAPI:
     # 此函数内容基本不变
     app_settings = get_app_settings()
     app = FastAPI(
         lifespan=lifespan,
+        default_response_class=TracedJSONResponse,
         title=app_settings.app.title,
         description=app_settings.app.description,
         version=app_settings.app.version,
@@ -94,11 +180,33 @@ def create_app() -> FastAPI:
     @app.exception_handler(HTTPException)
     async def http_exception_handler(request: Request, exc: HTTPException):
         return JSONResponse(status_code=exc.status_code,
-                            content=ApiResponse(code=exc.status_code, msg=exc.detail).model_dump())
+                            content=ApiResponse(code=exc.status_code, msg=exc.detail).model_dump(), headers=exc.headers)
     @app.exception_handler(Exception)
     async def generic_exception_handler(request: Request, exc: Exception):
         app_logger.exception(f"未处理的服务器内部错误: {exc}")
         return JSONResponse(status_code=500, content=ApiResponse(code=500, msg="服务器内部错误").model_dump())
+
+    # 调用链：按采样率或调试请求头开启；带调试请求头时在 Server-Timing 中返回各步骤耗时
+    debug_header = app_settings.tracing.debug_header
+    @app.middleware("http")
+    async def tracing_middleware(request: Request, call_next):
+        tracer = get_tracer()
+        collect = bool(debug_header) and debug_header in request.headers
+        trace = tracer.start_trace(f"{request.method} {request.url.path}", collect=collect,
+                                   method=request.method, path=request.url.path)
+        if trace is None:
+            return await call_next(request)
+        with activate(trace):
+            response = await call_next(request)
+        trace.root.attributes["status_code"] = response.status_code
+        tracer.finish(trace)
+        if trace.collect:
+            response.headers["Server-Timing"] = ", ".join(
+                f'{name};dur={ms};desc="x{count}"' for name, ms, count in trace.breakdown()
+            )
+            response.headers["X-Trace-Id"] = trace.trace_id
+        return response
+
     app.include_router(face_router, prefix="/api/face", tags=["人脸服务"])
     
     # 挂载静态文件和数据目录
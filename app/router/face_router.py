@@ -1,20 +1,35 @@
 # app/router/face_router.py
-from typing import List, Optional
+import secrets
+from datetime import datetime
+from pathlib import Path
+from typing import List, Literal, Optional
 from fastapi import (
     APIRouter, Depends, status, File, UploadFile, Form,
-    HTTPException, Request, Query, Path as FastApiPath
+    HTTPException, Request, Query, Header, Path as FastApiPath
 )
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 
 from app.schema.face_schema import (
     ApiResponse, FaceRegisterResponseData, FaceRecognitionResult,
-    GetAllFacesResponseData, DeleteFaceResponseData, HealthCheckResponseData,
+    GetAllFacesResponseData, DeleteFaceResponseData, HealthCheckResponseData, ReadinessResponseData,
     UpdateFaceRequest, UpdateFaceResponseData, FaceInfo,
-    StreamStartRequest, StreamDetail, GetAllStreamsResponseData, StopStreamResponseData
+    StreamStartRequest, StreamDetail, GetAllStreamsResponseData, StopStreamResponseData,
+    CacheStatsResponseData, StreamStatsResponseData, FaceListFilter,
+    RecognitionEvent, RecognitionEventsResponseData, EventLogStatsResponseData, WebhookStatsResponseData,
+    GallerySyncStatsResponseData, GalleryImportResponseData, ReembedStatusResponseData
 )
 # ✅ 导入新的服务类
 from app.service.face_operation_service import FaceOperationService
 from app.service.stream_manager_service import StreamManagerService
+from app.service.event_sink import RecognitionEventSink
+from app.service.webhook_dispatcher import WebhookDispatcher
+from app.service.face_dao import FaceDataDAO
+from app.service.face_changelog import SYNC_MEDIA_TYPE, encode_changes
+from app.service.gallery_sync import GallerySyncService
+from app.service.gallery_archive import ARCHIVE_MEDIA_TYPES
+from app.service.reembed_job import ReembedJob
 
 router = APIRouter()
 
@@ -27,6 +42,47 @@ def get_stream_manager_service(request: Request) -> StreamManagerService:
     """依赖注入：获取视频流管理服务实例。"""
     return request.app.state.stream_manager_service
 
+def get_event_sink(request: Request) -> RecognitionEventSink:
+    """依赖注入：获取识别事件日志（未启用时返回 503）。"""
+    event_sink = getattr(request.app.state, "event_sink", None)
+    if event_sink is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="识别事件日志未启用。")
+    return event_sink
+
+def get_webhook(request: Request) -> WebhookDispatcher:
+    """依赖注入：获取 Webhook 推送器（未启用时返回 503）。"""
+    webhook = getattr(request.app.state, "webhook", None)
+    if webhook is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Webhook 推送未启用。")
+    return webhook
+
+def get_face_dao(request: Request) -> FaceDataDAO:
+    """依赖注入：获取应用级共享的人脸数据 DAO。"""
+    return request.app.state.face_dao
+
+def get_gallery_sync(request: Request) -> GallerySyncService:
+    """依赖注入：获取人脸库同步服务（未配置对等节点时返回 503）。"""
+    gallery_sync = getattr(request.app.state, "gallery_sync", None)
+    if gallery_sync is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="人脸库同步未启用（未配置对等节点）。")
+    return gallery_sync
+
+def verify_sync_token(request: Request, authorization: Optional[str] = Header(None, description="Bearer <sync.token>")):
+    """依赖注入：校验对等节点的同步令牌。变更接口会返回全部特征向量与姓名，本节点未配置令牌时一律拒绝。"""
+    token = request.app.state.settings.sync.token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="本节点未配置同步令牌 (sync.token)，不对外提供人脸库变更。")
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not credentials:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="缺少同步令牌。",
+                            headers={"WWW-Authenticate": "Bearer"})
+    if not secrets.compare_digest(credentials.strip().encode(), token.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="同步令牌无效。")
+
+def get_reembed_job(request: Request) -> ReembedJob:
+    """依赖注入：获取特征重新提取任务。"""
+    return request.app.state.reembed_job
+
 # --- 健康检查 API ---
 @router.get(
     "/health",
@@ -39,6 +95,32 @@ async def health_check():
     return ApiResponse(data=HealthCheckResponseData())
 
 
+@router.get(
+    "/ready",
+    response_model=ApiResponse[ReadinessResponseData],
+    summary="就绪检查（含启动画像）",
+    tags=["系统"]
+)
+async def readiness_check(request: Request):
+    """模型池、人脸库与预热全部完成后返回 200 及各阶段耗时，否则返回 503。"""
+    profile = getattr(request.app.state, "startup_profile", None)
+    if profile is None or not profile.ready:
+        reason = profile.error if profile is not None and profile.error else "服务正在启动。"
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=reason)
+    return ApiResponse(data=ReadinessResponseData(**profile.summary()))
+
+
+@router.get(
+    "/cache/stats",
+    response_model=ApiResponse[CacheStatsResponseData],
+    summary="获取特征缓存统计",
+    tags=["系统"]
+)
+async def get_cache_stats(face_op_service: FaceOperationService = Depends(get_face_op_service)):
+    """返回基于内容哈希的检测/特征缓存的条目数与命中率等统计信息。"""
+    return ApiResponse(data=CacheStatsResponseData(**face_op_service.get_cache_stats()))
+
+
 # --- 人脸库管理 API ---
 @router.post(
     "/faces",
@@ -70,13 +152,84 @@ async def register_face(
 @router.get(
     "/faces",
     response_model=ApiResponse[GetAllFacesResponseData],
-    summary="获取所有已注册的人脸信息",
+    summary="分页获取已注册的人脸信息",
     tags=["人脸管理"]
 )
-async def get_all_faces(face_op_service: FaceOperationService = Depends(get_face_op_service)): # ✅ 依赖注入
-    """获取数据库中所有已注册人脸的元数据列表。"""
-    faces = await face_op_service.get_all_faces()
-    return ApiResponse(data=GetAllFacesResponseData(count=len(faces), faces=faces))
+async def get_all_faces(
+        limit: int = Query(100, ge=1, le=1000, description="每页返回的条数。"),
+        offset: int = Query(0, ge=0, description="跳过的条数（未指定 cursor 时生效）。"),
+        cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，指定后忽略 offset。"),
+        filters: FaceListFilter = Depends(),
+        face_op_service: FaceOperationService = Depends(get_face_op_service) # ✅ 依赖注入
+):
+    """分页获取已注册人脸的元数据（不含特征向量），支持按 SN/姓名前缀和注册时间范围筛选。"""
+    data = await face_op_service.list_faces(filters, limit=limit, offset=offset, cursor=cursor)
+    return ApiResponse(data=data)
+
+
+@router.get(
+    "/faces/stream",
+    summary="流式导出已注册的人脸信息 (NDJSON)",
+    tags=["人脸管理"]
+)
+async def stream_all_faces(
+        filters: FaceListFilter = Depends(),
+        face_op_service: FaceOperationService = Depends(get_face_op_service)
+):
+    """以 NDJSON 格式逐行返回全部匹配的人脸元数据，服务端按批次读取，内存占用与人脸库大小无关。"""
+    return StreamingResponse(face_op_service.stream_faces(filters), media_type="application/x-ndjson")
+
+
+@router.get(
+    "/gallery/export",
+    summary="导出整个人脸库（Parquet / Arrow）",
+    response_class=FileResponse,
+    tags=["人脸管理"]
+)
+async def export_gallery(
+        format: Literal["parquet", "arrow"] = Query("parquet", description="归档格式：parquet（压缩）或 arrow（IPC 文件，可内存映射）。"),
+        include_images: bool = Query(False, description="是否附带注册时保存的人脸图片。"),
+        vector_dtype: Literal["float32", "float16"] = Query("float32", description="特征向量的存储精度。"),
+        face_op_service: FaceOperationService = Depends(get_face_op_service)
+):
+    """流式导出全部人脸记录与特征向量，用于新设备开通时整体导入，无需逐张重新注册。"""
+    result = await run_in_threadpool(face_op_service.export_gallery, format, include_images, vector_dtype)
+    path = Path(result["path"])
+    return FileResponse(path, media_type=ARCHIVE_MEDIA_TYPES[format], filename=f"gallery.{format}",
+                        background=BackgroundTask(path.unlink, missing_ok=True))
+
+
+@router.post(
+    "/gallery/import",
+    response_model=ApiResponse[GalleryImportResponseData],
+    summary="从 Parquet / Arrow 归档批量导入人脸库",
+    tags=["人脸管理"]
+)
+async def import_gallery(
+        archive_file: UploadFile = File(..., description="由导出接口或 gallery-export 命令生成的归档文件（按扩展名识别格式）。"),
+        write_images: bool = Form(True, description="归档附带人脸图片时，是否写入本地图片目录。"),
+        force: bool = Form(False, description="忽略识别模型不一致的检查。"),
+        face_op_service: FaceOperationService = Depends(get_face_op_service)
+):
+    """校验向量并按 uuid 去重后一次性批量写入，随后重建内存索引；已存在的记录会被跳过，可重复导入。"""
+    result = await face_op_service.import_gallery(archive_file, write_images=write_images, force=force)
+    return ApiResponse(data=GalleryImportResponseData(**result))
+
+
+@router.get(
+    "/thumbnails/{image_path:path}",
+    summary="获取注册人脸图片的缩略图",
+    response_class=FileResponse,
+    tags=["人脸管理"]
+)
+async def get_face_thumbnail(
+        image_path: str = FastApiPath(..., description="图片相对于人脸图片目录的路径（即人脸信息中 thumbnail_url 的后半部分）。"),
+        face_op_service: FaceOperationService = Depends(get_face_op_service)
+):
+    """返回注册图片的小尺寸缩略图（首次访问时生成并保存），供管理界面列表展示，避免加载原图。"""
+    thumbnail = await run_in_threadpool(face_op_service.get_thumbnail, image_path)
+    media_type = "image/webp" if thumbnail.suffix == ".webp" else "image/jpeg"
+    return FileResponse(thumbnail, media_type=media_type, headers={"Cache-Control": "public, max-age=86400"})
 
 
 @router.get(
@@ -175,9 +328,21 @@ async def start_stream(
     - **lifetime_minutes**: 流的生命周期（分钟），-1表示永久，不传则使用默认配置。
     """
     stream_info = await stream_manager.start_stream(start_request)
-    feed_url = request.url_for('get_stream_feed', stream_id=stream_info.stream_id)
-    response_data = StreamDetail(**stream_info.model_dump(), feed_url=str(feed_url))
-    return ApiResponse(data=response_data)
+    return ApiResponse(data=_stream_detail(request, stream_info))
+
+
+def _stream_detail(request: Request, info) -> StreamDetail:
+    """补充 MJPEG 推流地址，以及启用了 H.264 输出时的视频地址。"""
+    video_url = None
+    if info.video_output == "fmp4":
+        video_url = str(request.url_for('get_stream_video', stream_id=info.stream_id))
+    elif info.video_output == "hls":
+        video_url = str(request.url_for('get_stream_hls', stream_id=info.stream_id, filename="index.m3u8"))
+    return StreamDetail(
+        **info.model_dump(),
+        feed_url=str(request.url_for('get_stream_feed', stream_id=info.stream_id)),
+        video_url=video_url,
+    )
 
 
 @router.get(
@@ -192,18 +357,95 @@ async def start_stream(
 )
 async def get_stream_feed(
         stream_id: str,
+        max_width: Optional[int] = Query(None, gt=0, le=7680, description="画面最大宽度（像素），超出时按比例缩小；不填则为原始分辨率。"),
+        quality: Optional[int] = Query(None, ge=1, le=100, description="JPEG 质量 (1-100)，不填则使用配置默认值。"),
         stream_manager: StreamManagerService = Depends(get_stream_manager_service) # ✅ 依赖注入
 ):
     """
     通过此端点获取由 `/streams/start` 启动的视频流。
     此端点专为用在HTML `<img>` 标签的 `src` 属性或类似的流媒体播放器中而设计。
+    - **max_width** / **quality**: 为缩略图、移动端等场景订阅缩小或低质量的画面；
+      相同参数的观众共享同一份编码结果，每路流同时存在的组合数量有上限。
     """
     return StreamingResponse(
-        stream_manager.get_stream_feed(stream_id),
+        await stream_manager.get_stream_feed(stream_id, max_width, quality),
         media_type="multipart/x-mixed-replace; boundary=frame"
     )
 
 
+@router.get(
+    "/streams/{stream_id}/snapshot",
+    summary="获取指定视频流的最新画面快照",
+    tags=["视频流管理"],
+    responses={
+        200: {"content": {"image/jpeg": {}}},
+        304: {"description": "画面未更新 (If-None-Match 命中)。"},
+        404: {"description": "Stream not found."},
+        503: {"description": "视频流尚未产生画面。"}
+    }
+)
+async def get_stream_snapshot(
+        stream_id: str,
+        max_width: Optional[int] = Query(None, gt=0, le=7680, description="快照最大宽度（像素），超出时按比例缩小；不填则为原始分辨率。"),
+        if_none_match: Optional[str] = Header(None),
+        stream_manager: StreamManagerService = Depends(get_stream_manager_service)
+):
+    """
+    返回最近一帧已绘制识别结果的 JPEG，适合多路缩略图墙定时轮询，无需为每路保持 MJPEG 长连接。
+    响应带有 ETag，轮询时带上 If-None-Match，画面未更新时返回 304。
+    """
+    image, etag = await stream_manager.get_snapshot(stream_id, max_width, if_none_match)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if image is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=image, media_type="image/jpeg", headers=headers)
+
+
+@router.get(
+    "/streams/video/{stream_id}",
+    summary="获取指定ID的 H.264 分片 MP4 视频流",
+    tags=["视频流管理"],
+    name="get_stream_video",
+    responses={
+        200: {"content": {"video/mp4": {}}},
+        404: {"description": "Stream not found or fmp4 output not enabled."}
+    }
+)
+async def get_stream_video(
+        stream_id: str,
+        stream_manager: StreamManagerService = Depends(get_stream_manager_service)
+):
+    """
+    以 `video_output=fmp4` 启动的视频流的 H.264 输出（分片 MP4），可直接用于 HTML `<video>` 标签或 MSE 播放器。
+    同一路流的所有观众共享一个编码器；新观众从下一个关键帧开始播放。
+    """
+    return StreamingResponse(
+        await stream_manager.get_video_feed(stream_id),
+        media_type="video/mp4",
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+@router.get(
+    "/streams/hls/{stream_id}/{filename}",
+    summary="获取指定ID视频流的 HLS 播放列表与分段",
+    tags=["视频流管理"],
+    name="get_stream_hls",
+    responses={404: {"description": "Stream, hls output or file not found."}}
+)
+async def get_stream_hls(
+        stream_id: str,
+        filename: str,
+        stream_manager: StreamManagerService = Depends(get_stream_manager_service)
+):
+    """以 `video_output=hls` 启动的视频流的播放列表 (`index.m3u8`) 与 TS 分段。"""
+    path = await stream_manager.get_hls_file(stream_id, filename)
+    if path.suffix == ".m3u8":
+        # 播放列表持续滚动更新，不能被缓存
+        return FileResponse(path, media_type="application/vnd.apple.mpegurl", headers={"Cache-Control": "no-cache"})
+    return FileResponse(path, media_type="video/mp2t")
+
+
 @router.post(
     "/streams/stop/{stream_id}",
     response_model=ApiResponse[StopStreamResponseData],
@@ -221,6 +463,21 @@ async def stop_stream(
     return ApiResponse(data=StopStreamResponseData(stream_id=stream_id))
 
 
+@router.get(
+    "/streams/{stream_id}/stats",
+    response_model=ApiResponse[StreamStatsResponseData],
+    summary="获取指定视频流的运行统计",
+    tags=["视频流管理"]
+)
+async def get_stream_stats(
+        stream_id: str,
+        stream_manager: StreamManagerService = Depends(get_stream_manager_service)
+):
+    """返回视频流的读帧、检测、运动门控跳过等计数。"""
+    stats = await stream_manager.get_stream_stats(stream_id)
+    return ApiResponse(data=StreamStatsResponseData(**stats))
+
+
 @router.get(
     "/streams",
     response_model=ApiResponse[GetAllStreamsResponseData],
@@ -234,16 +491,156 @@ async def get_all_streams(
     """查询并返回当前服务器上所有正在运行的视频流的详细信息列表，包含播放URL。"""
     active_streams_info = await stream_manager.get_all_active_streams_info()
 
-    streams_with_details = [
-        StreamDetail(
-            **info.model_dump(),
-            feed_url=str(request.url_for('get_stream_feed', stream_id=info.stream_id))
-        )
-        for info in active_streams_info
-    ]
+    streams_with_details = [_stream_detail(request, info) for info in active_streams_info]
 
     response_data = GetAllStreamsResponseData(
         active_streams_count=len(streams_with_details),
         streams=streams_with_details
     )
-    return ApiResponse(data=response_data)
\ No newline at end of file
+    return ApiResponse(data=response_data)
+
+
+# --- 识别事件 API ---
+@router.get(
+    "/events",
+    response_model=ApiResponse[RecognitionEventsResponseData],
+    summary="按时间范围查询视频流识别事件",
+    tags=["识别事件"]
+)
+async def query_events(
+        start: Optional[datetime] = Query(None, description="起始时间（含）。"),
+        end: Optional[datetime] = Query(None, description="结束时间（不含）。"),
+        sn: Optional[str] = Query(None, description="只返回指定人员SN的事件。"),
+        stream_id: Optional[str] = Query(None, description="只返回指定视频流的事件。"),
+        limit: int = Query(1000, ge=1, le=10000, description="最多返回的事件数。"),
+        event_sink: RecognitionEventSink = Depends(get_event_sink)
+):
+    """事件按天分区存储，查询时只扫描时间范围覆盖的分区。"""
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="起始时间必须早于结束时间。")
+    rows = await run_in_threadpool(event_sink.query, start, end, sn, stream_id, limit)
+    events = [RecognitionEvent.model_validate(row) for row in rows]
+    return ApiResponse(data=RecognitionEventsResponseData(count=len(events), events=events))
+
+
+@router.get(
+    "/events/stats",
+    response_model=ApiResponse[EventLogStatsResponseData],
+    summary="获取识别事件日志的写入统计",
+    tags=["识别事件"]
+)
+async def get_event_stats(event_sink: RecognitionEventSink = Depends(get_event_sink)):
+    """返回已提交、已丢弃、已写入及待写入的事件数量。"""
+    return ApiResponse(data=EventLogStatsResponseData(**event_sink.stats()))
+
+
+@router.get(
+    "/webhooks/stats",
+    response_model=ApiResponse[WebhookStatsResponseData],
+    summary="获取识别事件 Webhook 推送统计",
+    tags=["识别事件"]
+)
+async def get_webhook_stats(webhook: WebhookDispatcher = Depends(get_webhook)):
+    """返回去抖、投递、重试及磁盘暂存的批次与事件数量（仅统计 API 进程内的线程模式视频流）。"""
+    return ApiResponse(data=WebhookStatsResponseData(**webhook.stats()))
+
+
+# --- 人脸库同步 API ---
+@router.get(
+    "/sync/changes",
+    summary="拉取人脸库增量变更（供对等节点同步）",
+    response_class=Response,
+    dependencies=[Depends(verify_sync_token)],
+    responses={200: {"content": {SYNC_MEDIA_TYPE: {}}, "description": "Arrow IPC 流，分页信息在 schema 元数据中。"}},
+    tags=["人脸库同步"]
+)
+async def get_sync_changes(
+        since: int = Query(0, ge=0, description="已应用到的版本号，返回其后的变更。"),
+        limit: int = Query(500, ge=1, le=5000, description="本次最多覆盖的版本数。"),
+        exclude_origin: Optional[str] = Query(None, description="不返回由该节点产生的变更（通常为请求方自身）。"),
+        vector_dtype: Literal["float32", "float16"] = Query("float32", description="特征向量的传输精度。"),
+        face_dao: FaceDataDAO = Depends(get_face_dao)
+):
+    """
+    返回版本号位于 (since, since + limit] 内的变更，create 携带特征向量。
+    元数据 node_id / latest_seq / next_since / has_more / gallery_model（本节点人脸库的模型）同时写入响应头，
+    调用方以 next_since 作为下一次的 since。
+    """
+    def build():
+        changes, next_since, latest = face_dao.changes_since(since, limit, exclude_origin)
+        meta = {"node_id": getattr(face_dao, "node_id", ""), "latest_seq": latest, "next_since": next_since,
+                "has_more": "true" if next_since < latest else "false",
+                "gallery_model": getattr(face_dao, "gallery_model", "")}
+        return encode_changes(changes, meta, vector_dtype), meta
+
+    payload, meta = await run_in_threadpool(build)
+    headers = {f"X-Sync-{key.replace('_', '-').title()}": str(value) for key, value in meta.items()}
+    return Response(content=payload, media_type=SYNC_MEDIA_TYPE, headers=headers)
+
+
+@router.post(
+    "/sync/pull",
+    response_model=ApiResponse[GallerySyncStatsResponseData],
+    summary="立即从对等节点拉取一轮变更",
+    tags=["人脸库同步"]
+)
+async def pull_sync_changes(gallery_sync: GallerySyncService = Depends(get_gallery_sync)):
+    """不等待下一个同步周期，立即向所有对等节点拉取并应用变更，返回同步后的统计。"""
+    await run_in_threadpool(gallery_sync.pull_once)
+    return ApiResponse(data=GallerySyncStatsResponseData(**gallery_sync.stats()))
+
+
+@router.get(
+    "/sync/stats",
+    response_model=ApiResponse[GallerySyncStatsResponseData],
+    summary="获取人脸库同步统计",
+    tags=["人脸库同步"]
+)
+async def get_sync_stats(gallery_sync: GallerySyncService = Depends(get_gallery_sync)):
+    """返回拉取轮数、已应用的增删改数量及各对等节点的同步进度。"""
+    return ApiResponse(data=GallerySyncStatsResponseData(**gallery_sync.stats()))
+
+
+# --- 特征重新提取 API ---
+@router.post(
+    "/reembed/start",
+    response_model=ApiResponse[ReembedStatusResponseData],
+    summary="开始或继续特征重新提取（更换识别模型后）",
+    tags=["特征重新提取"]
+)
+async def start_reembed(
+        force: bool = Query(False, description="人脸库特征已由当前模型提取时，仍然全部重新提取。"),
+        reembed_job: ReembedJob = Depends(get_reembed_job)
+):
+    """
+    用已保存的人脸图片在后台以限速方式重新提取全部特征，完成后原子切换；
+    有同一模型未完成的任务时从断点继续。
+    """
+    try:
+        data = await run_in_threadpool(reembed_job.start, force)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return ApiResponse(data=ReembedStatusResponseData(**data))
+
+
+@router.post(
+    "/reembed/pause",
+    response_model=ApiResponse[ReembedStatusResponseData],
+    summary="暂停特征重新提取",
+    tags=["特征重新提取"]
+)
+async def pause_reembed(reembed_job: ReembedJob = Depends(get_reembed_job)):
+    """等待当前批次完成并保存进度后暂停，之后可再次开始从断点继续。"""
+    data = await run_in_threadpool(reembed_job.pause)
+    return ApiResponse(data=ReembedStatusResponseData(**data))
+
+
+@router.get(
+    "/reembed/status",
+    response_model=ApiResponse[ReembedStatusResponseData],
+    summary="获取特征重新提取进度",
+    tags=["特征重新提取"]
+)
+async def get_reembed_status(reembed_job: ReembedJob = Depends(get_reembed_job)):
+    """返回任务状态、进度、处理速度与预计剩余时间，以及人脸库特征当前所属的模型。"""
+    return ApiResponse(data=ReembedStatusResponseData(**reembed_job.status()))
@@ -1,6 +1,6 @@
 # app/schema/face_schema.py
-from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional, TypeVar, Generic, Dict, Any
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import List, Optional, TypeVar, Generic, Dict, Any, Literal
 from datetime import datetime
 import numpy as np
 
@@ -23,6 +23,7 @@ class FaceInfo(BaseModel):
     sn: str = Field(..., description="人脸所属人员的唯一标识SN。")
     registration_time: datetime = Field(..., description="人脸注册时间。")
     image_path: str = Field(..., description="注册图像在文件系统中的路径。")
+    thumbnail_url: Optional[str] = Field(None, description="注册图像缩略图的访问地址（图片不在本机图片目录下时为空）。")
     extra_info: Optional[Dict[str, Any]] = Field(None, description="预留的额外信息字段。")
 
     class Config:
@@ -49,6 +50,7 @@ class FaceRecognitionResult(BaseModel):
     box: List[int] = Field(..., description="人脸在图像中的边界框 [x1, y1, x2, y2]。")
     detection_confidence: float = Field(..., description="人脸检测置信度。")
     landmark: Optional[List[List[int]]] = Field(None, description="人脸关键点坐标。")
+    quality: Optional[float] = Field(None, description="人脸质量分 (0~1)，综合尺寸、姿态与清晰度。")
 
     @field_validator('landmark', mode='before')
     @classmethod
@@ -62,9 +64,18 @@ class FaceRecognitionResult(BaseModel):
 
 
 class GetAllFacesResponseData(BaseModel):
-    """获取所有人脸列表的响应数据"""
-    count: int = Field(..., description="人脸总数。")
-    faces: List[FaceInfo] = Field(..., description="已注册人脸的列表。")
+    """分页获取人脸列表的响应数据"""
+    count: int = Field(..., description="满足筛选条件的人脸总数。")
+    faces: List[FaceInfo] = Field(..., description="当前页的人脸列表。")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，为空表示已到最后一页。")
+
+
+class FaceListFilter(BaseModel):
+    """人脸列表的服务端筛选条件（作为查询参数传入）"""
+    sn_prefix: Optional[str] = Field(None, description="按 SN 前缀筛选。")
+    name_prefix: Optional[str] = Field(None, description="按姓名前缀筛选。")
+    registered_after: Optional[datetime] = Field(None, description="注册时间下限（含）。")
+    registered_before: Optional[datetime] = Field(None, description="注册时间上限（不含）。")
 
 
 class DeleteFaceResponseData(BaseModel):
@@ -86,7 +97,58 @@ class HealthCheckResponseData(BaseModel):
     message: str = Field("人脸识别服务正常运行。", description="服务状态信息。")
 
 
+class ReadinessResponseData(BaseModel):
+    """就绪检查响应数据（含启动画像）"""
+    ready: bool = Field(..., description="模型池、人脸库与预热是否全部完成。")
+    error: Optional[str] = Field(None, description="启动或预热失败的原因。")
+    ready_seconds: Optional[float] = Field(None, description="从开始启动到就绪的耗时（秒）。")
+    phases: Dict[str, float] = Field({}, description="各启动阶段的耗时（秒）。")
+    imports: Dict[str, float] = Field({}, description="后台预导入的模块及其耗时（秒）。")
+    warmup: List[Dict[str, Any]] = Field([], description="每套模型及人脸库检索的预热耗时。")
+
+
+class CacheStatsResponseData(BaseModel):
+    """特征缓存统计信息"""
+    enabled: bool = Field(..., description="缓存是否启用。")
+    entries: int = Field(..., description="当前缓存条目数。")
+    max_entries: int = Field(..., description="缓存条目上限。")
+    ttl_seconds: float = Field(..., description="缓存条目存活时间（秒）。")
+    model_signature: str = Field(..., description="缓存绑定的模型签名。")
+    image_hits: int = Field(..., description="图像级缓存命中次数。")
+    image_misses: int = Field(..., description="图像级缓存未命中次数。")
+    crop_hits: int = Field(..., description="人脸裁剪级缓存命中次数。")
+    crop_misses: int = Field(..., description="人脸裁剪级缓存未命中次数。")
+    hit_rate: float = Field(..., description="总体命中率。")
+    evictions: int = Field(..., description="因容量上限被淘汰的条目数。")
+    expirations: int = Field(..., description="因过期被移除的条目数。")
+
+
 # --- 视频流管理 Schema ---
+class StreamRoi(BaseModel):
+    """视频流感兴趣区域，坐标为相对画面宽高的归一化值 (0~1)"""
+    rect: Optional[List[float]] = Field(None, description="矩形区域 [x1, y1, x2, y2]。", example=[0.3, 0.2, 0.7, 0.9])
+    polygon: Optional[List[List[float]]] = Field(None, description="多边形顶点 [[x, y], ...]，至少3个点。")
+
+    @model_validator(mode='after')
+    def check_shape(self):
+        if (self.rect is None) == (self.polygon is None):
+            raise ValueError("ROI 必须且只能指定 rect 或 polygon 其中之一。")
+        if self.rect is not None:
+            if len(self.rect) != 4:
+                raise ValueError("rect 必须为 [x1, y1, x2, y2] 四个值。")
+            x1, y1, x2, y2 = self.rect
+            if not (x1 < x2 and y1 < y2):
+                raise ValueError("rect 必须满足 x1 < x2 且 y1 < y2。")
+            points = [[x1, y1], [x2, y2]]
+        else:
+            if len(self.polygon) < 3 or any(len(p) != 2 for p in self.polygon):
+                raise ValueError("polygon 至少需要3个 [x, y] 顶点。")
+            points = self.polygon
+        if any(not (0.0 <= v <= 1.0) for p in points for v in p):
+            raise ValueError("ROI 坐标必须是 0~1 之间的归一化值。")
+        return self
+
+
 class StreamStartRequest(BaseModel):
     """启动视频流请求体"""
     source: str = Field(..., description="视频源。可以是摄像头ID(如 '0') 或 视频文件/URL。", example="0")
@@ -95,6 +157,37 @@ class StreamStartRequest(BaseModel):
         description="视频流生命周期（分钟）。-1表示永久，不填则使用配置默认值。",
         example=10
     )
+    motion_gate: Optional[bool] = Field(
+        None, description="是否启用运动门控（静止画面跳过检测），不填则使用配置默认值。"
+    )
+    motion_sensitivity: Optional[float] = Field(
+        None, ge=0, le=1,
+        description="运动灵敏度：变化像素占比阈值，越小越灵敏（0 表示任何变化都触发检测），不填则使用配置默认值。",
+        example=0.003
+    )
+    rois: Optional[List[StreamRoi]] = Field(
+        None, description="感兴趣区域列表。指定后仅在这些区域内做人脸检测，不填则检测全画面。"
+    )
+    capture_backend: Optional[Literal["opencv", "ffmpeg"]] = Field(
+        None, description="视频采集后端 (opencv/ffmpeg)，不填则使用配置默认值。"
+    )
+    capture_width: Optional[int] = Field(None, gt=0, description="ffmpeg 后端解码输出宽度，不填则使用配置默认值。", example=1280)
+    capture_height: Optional[int] = Field(None, gt=0, description="ffmpeg 后端解码输出高度，不填则按宽高比计算。")
+    decode_threads: Optional[int] = Field(None, ge=0, description="ffmpeg 解码线程数，0 表示自动。")
+    low_delay: Optional[bool] = Field(None, description="是否启用 ffmpeg 低延迟解码标志。")
+    queue_policy: Optional[Literal["drop_oldest", "drop_newest", "latest_only", "block"]] = Field(
+        None, description="流水线各级队列满时的策略，不填则使用配置中各级的默认值。"
+    )
+    queue_depth: Optional[int] = Field(None, ge=1, le=256, description="流水线各级队列深度，不填则使用配置默认值。", example=4)
+    latency_budget_ms: Optional[int] = Field(
+        None, ge=0, description="帧的最大允许时延（毫秒），超时的帧在检测/识别前丢弃；0 表示不限制，不填则使用配置默认值。",
+        example=500
+    )
+    video_output: Optional[Literal["mjpeg", "fmp4", "hls"]] = Field(
+        None, description="视频输出格式：mjpeg (默认) / fmp4 (HTTP 分片 MP4) / hls，不填则使用配置默认值。"
+    )
+    video_bitrate_kbps: Optional[int] = Field(None, gt=0, description="H.264 目标码率 (kbps)，不填则使用配置默认值。", example=800)
+    video_gop_seconds: Optional[float] = Field(None, gt=0, description="H.264 关键帧间隔（秒），不填则使用配置默认值。")
 
 
 class ActiveStreamInfo(BaseModel):
@@ -104,6 +197,7 @@ class ActiveStreamInfo(BaseModel):
     started_at: datetime = Field(..., description="流启动时间。")
     expires_at: Optional[datetime] = Field(None, description="流过期时间，None表示永不过期。")
     lifetime_minutes: int = Field(..., description="生命周期（分钟），-1表示永久。")
+    video_output: str = Field("mjpeg", description="视频输出格式：mjpeg / fmp4 / hls。")
 
     class Config:
         from_attributes = True
@@ -111,7 +205,8 @@ class ActiveStreamInfo(BaseModel):
 
 class StreamDetail(ActiveStreamInfo):
     """用于API响应的单个视频流的详细信息"""
-    feed_url: str = Field(..., description="用于播放该视频流的完整URL。")
+    feed_url: str = Field(..., description="用于播放该视频流的完整URL (MJPEG)。")
+    video_url: Optional[str] = Field(None, description="H.264 视频地址：fmp4 为分片 MP4 流，hls 为播放列表；mjpeg 输出时为空。")
 
 
 class StopStreamResponseData(BaseModel):
@@ -120,6 +215,124 @@ class StopStreamResponseData(BaseModel):
     message: str = Field("Stream stopped successfully.", description="操作结果信息。")
 
 
+class StreamStatsResponseData(BaseModel):
+    """单个视频流的运行统计"""
+    stream_id: str = Field(..., description="流的唯一ID。")
+    frames_read: int = Field(0, description="已读取的帧数。")
+    frames_processed: int = Field(0, description="已完成后处理并输出的帧数。")
+    frames_detected: int = Field(0, description="实际执行了人脸检测的帧数。")
+    frames_skipped_by_motion: int = Field(0, description="因画面静止被运动门控跳过检测的帧数。")
+    faces_rejected_by_quality: int = Field(0, description="未通过质量门控而跳过特征提取的人脸数。")
+    frames_not_encoded: int = Field(0, description="没有观众而未编码默认 MJPEG 画面的帧数。")
+    queue_drops: Dict[str, int] = Field({}, description="各级队列因策略丢弃的帧数（含输出队列）。")
+    stale_drops: Dict[str, int] = Field({}, description="因超出时延预算而跳过 NPU 的帧数：inference 为检测前丢弃的帧，postprocess 为跳过识别、复用上一次结果输出的帧。")
+    video_output: Optional[Dict[str, Any]] = Field(None, description="H.264 编码器的运行统计（仅 fmp4 / hls 输出）。")
+    feed_variants: List[str] = Field([], description="当前有观众订阅、正在编码的 MJPEG 画质变体 (宽度-质量)。")
+    latency_ms: Dict[str, Dict[str, float]] = Field({}, description="最近处理帧各阶段耗时分布 (p50/p95/p99/max，毫秒)，end_to_end 为采集到完成识别的端到端时延，不受画面是否编码输出影响。")
+
+
+class RecognitionEvent(BaseModel):
+    """单条识别事件"""
+    timestamp: datetime = Field(..., description="识别发生的时间。")
+    stream_id: str = Field(..., description="产生事件的视频流ID。")
+    sn: Optional[str] = Field(None, description="识别到的人员SN，未识别时为空。")
+    name: Optional[str] = Field(None, description="识别到的人员姓名。")
+    similarity: Optional[float] = Field(None, description="与已知人脸特征的余弦相似度。")
+    bbox: Optional[List[int]] = Field(None, description="人脸在画面中的边界框 [x1, y1, x2, y2]。")
+    crop_path: Optional[str] = Field(None, description="人脸截图的存储路径（如有）。")
+
+
+class RecognitionEventsResponseData(BaseModel):
+    """识别事件查询的响应数据"""
+    count: int = Field(..., description="本次返回的事件数。")
+    events: List[RecognitionEvent] = Field(..., description="按时间升序排列的事件列表。")
+
+
+class EventLogStatsResponseData(BaseModel):
+    """识别事件日志的运行统计"""
+    published: int = Field(..., description="已提交的事件数。")
+    dropped: int = Field(..., description="因队列已满被丢弃的事件数。")
+    deduplicated: int = Field(..., description="去重窗口内被跳过的重复事件数。")
+    written: int = Field(..., description="已写入磁盘的事件数。")
+    files: int = Field(..., description="已写出的 Parquet 文件数。")
+    compactions: int = Field(..., description="已完成的小文件合并次数。")
+    write_errors: int = Field(..., description="写入或合并失败的次数。")
+    pending: int = Field(..., description="内存中待写入的事件数。")
+    max_pending: int = Field(..., description="内存中待写入事件的上限。")
+
+
+class WebhookStatsResponseData(BaseModel):
+    """Webhook 推送的运行统计"""
+    published: int = Field(..., description="进入发送队列的事件数。")
+    debounced: int = Field(..., description="因冷却窗口内重复出现而跳过的事件数。")
+    dropped: int = Field(..., description="因队列已满被丢弃的事件数（按地址累计）。")
+    delivered: int = Field(..., description="已成功送达的事件数（按地址累计）。")
+    requests: int = Field(..., description="已发出的 HTTP 请求数。")
+    retried: int = Field(..., description="进入重试的批次数。")
+    failed: int = Field(..., description="最终放弃投递的事件数（按地址累计）。")
+    spooled: int = Field(..., description="写入磁盘暂存目录的批次数。")
+    pending: int = Field(..., description="内存中待发送的事件数。")
+    retrying: int = Field(..., description="内存中等待重试的批次数。")
+    urls: int = Field(..., description="已配置的 Webhook 地址数。")
+
+
+class GalleryImportResponseData(BaseModel):
+    """人脸库批量导入的结果"""
+    total: int = Field(..., description="归档文件中的记录数。")
+    imported: int = Field(..., description="实际写入的记录数。")
+    duplicates: int = Field(..., description="因 uuid 已存在（或文件内重复）而跳过的记录数。")
+    invalid: int = Field(..., description="因字段缺失或向量无效（维度、NaN、零向量）而跳过的记录数。")
+    images_written: int = Field(..., description="写入本地图片目录的人脸图片数。")
+    seconds: float = Field(..., description="导入耗时（秒）。")
+
+
+class SyncPeerStatus(BaseModel):
+    """单个对等节点的同步进度"""
+    peer: str = Field(..., description="对等节点地址。")
+    node_id: Optional[str] = Field(None, description="对等节点的节点标识（首次拉取前为空）。")
+    seq: int = Field(0, description="已应用到的对方版本号。")
+    latest_seq: Optional[int] = Field(None, description="最近一次拉取时对方的最新版本号。")
+    last_sync: Optional[str] = Field(None, description="最近一次成功拉取的时间。")
+    error: Optional[str] = Field(None, description="最近一次拉取失败的原因。")
+
+
+class GallerySyncStatsResponseData(BaseModel):
+    """人脸库增量同步的运行统计"""
+    node_id: str = Field(..., description="本节点标识。")
+    rounds: int = Field(..., description="已执行的拉取轮数。")
+    requests: int = Field(..., description="已发出的 HTTP 请求数。")
+    created: int = Field(..., description="已写入的同步人脸记录数。")
+    updated: int = Field(..., description="已应用更新的人脸记录数。")
+    deleted: int = Field(..., description="已应用删除的人脸记录数。")
+    reembedded: int = Field(..., description="已替换为对方重新提取的特征的人脸记录数。")
+    rejected: int = Field(..., description="因特征由其他识别模型提取而拒绝的变更数。")
+    skipped: int = Field(..., description="因已存在或目标不存在而跳过的变更数。")
+    errors: int = Field(..., description="拉取或应用失败的次数。")
+    peers: List[SyncPeerStatus] = Field(default_factory=list, description="各对等节点的同步进度。")
+
+
+class ReembedStatusResponseData(BaseModel):
+    """更换识别模型后特征重新提取任务的进度"""
+    status: str = Field(..., description="任务状态：idle / running / paused / completed / failed。")
+    running: bool = Field(..., description="后台线程是否正在运行。")
+    gallery_model: str = Field(..., description="人脸库现有特征所属的识别模型。")
+    recognition_model: str = Field(..., description="当前配置的识别模型。")
+    source_model: Optional[str] = Field(None, description="任务开始时人脸库特征所属的模型。")
+    target_model: Optional[str] = Field(None, description="重新提取使用的目标模型。")
+    started_at: Optional[datetime] = Field(None, description="任务开始时间，此前注册的记录需要重新提取。")
+    finished_at: Optional[datetime] = Field(None, description="切换完成时间。")
+    total: int = Field(0, description="需要重新提取的记录数。")
+    done: int = Field(0, description="已完成并写入暂存表的记录数。")
+    failed: int = Field(0, description="图片缺失或未检测到人脸、保留旧特征的记录数。")
+    switched: int = Field(0, description="切换时实际替换特征的记录数。")
+    rows_per_second: Optional[float] = Field(None, description="本次运行的处理速度（条/秒）。")
+    eta_seconds: Optional[int] = Field(None, description="预计剩余时间（秒）。")
+    batches: int = Field(0, description="本进程已处理的批次数。")
+    busy_waits: int = Field(0, description="因模型池繁忙而退避的次数。")
+    busy_seconds: float = Field(0.0, description="本进程占用模型的累计时间（秒）。")
+    error: Optional[str] = Field(None, description="最近一次失败的原因。")
+
+
 class GetAllStreamsResponseData(BaseModel):
     """获取所有活动流的响应数据"""
     active_streams_count: int = Field(..., description="当前活动的视频流数量。")
@@ -0,0 +1,275 @@
+# app/service/event_sink.py
+import fcntl
+import os
+import queue
+import threading
+import time
+from datetime import datetime, date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.cfg.config import EventLogConfig
+from app.cfg.logging import app_logger
+
+EVENT_SCHEMA = pa.schema([
+    pa.field("timestamp", pa.timestamp("ms")),
+    pa.field("stream_id", pa.string()),
+    pa.field("sn", pa.string()),
+    pa.field("name", pa.string()),
+    pa.field("similarity", pa.float32()),
+    pa.field("bbox", pa.list_(pa.int32(), 4)),
+    pa.field("crop_path", pa.string()),
+])
+
+_PARTITION_PREFIX = "day="
+# 已足够大的文件不再参与合并，避免每次合并都重写当天的全部数据
+_COMPACT_MAX_FILE_BYTES = 64 * 1024 * 1024
+# 每个天分区的合并锁（flock，持有进程退出时由内核释放，不会残留）
+_COMPACT_LOCK_FILE = ".compact.lock"
+# 查询期间文件被并发合并删除时，重新列出分区文件后重试的次数
+_QUERY_RETRIES = 3
+
+
+class RecognitionEventSink:
+    """
+    识别事件的只追加日志。
+
+    - publish() 只把事件放入有界内存队列，从不阻塞调用方；队列满时拒绝并计数（背压），
+      由调用方决定是否降级；publish_results() 对同一视频流内的同一人员在 dedup_seconds 窗口内只记录一次；
+    - 后台线程按 batch_size 条或 flush_interval 秒批量写出，每批一个 Parquet 文件，
+      按天分区存放于 day=YYYY-MM-DD 目录，文件名含进程号，多进程可写同一目录；
+    - 同一后台线程定期把本进程（及已退出进程）写出的小文件合并为一个按时间排序的文件，避免文件数无限增长；
+      合并前先取得分区的合并锁，多个进程不会同时合并同一批已退出进程的文件而写出重复事件；
+    - 查询时先按时间范围裁剪分区目录，再在 Parquet 上做谓词下推，逐天排序后截取 limit 条；
+      读取期间文件被并发的合并删除时，重新列出该分区的文件（此时已包含合并结果）再读。
+    """
+
+    def __init__(self, cfg: EventLogConfig):
+        self.cfg = cfg
+        self.root = Path(cfg.dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=cfg.max_pending)
+        self._stop_event = threading.Event()
+        self._file_seq = 0
+        self._dedup_lock = threading.Lock()
+        self._last_recorded: Dict[Tuple[str, str], float] = {}
+        self._last_prune = time.monotonic()
+        self._next_compact_at = time.monotonic() + max(0.0, cfg.compact_interval_seconds)
+        self.stats_counters = {"published": 0, "dropped": 0, "deduplicated": 0, "written": 0, "files": 0,
+                               "compactions": 0, "write_errors": 0}
+        self._writer = threading.Thread(target=self._writer_loop, name="EventSinkWriter", daemon=True)
+        self._writer.start()
+
+    # --- 写入端 ---
+    def publish(self, event: Dict[str, Any]) -> bool:
+        """提交一条事件；队列已满时丢弃并返回 False。"""
+        try:
+            self._queue.put_nowait(event)
+            self.stats_counters["published"] += 1
+            return True
+        except queue.Full:
+            self.stats_counters["dropped"] += 1
+            return False
+
+    def _is_duplicate(self, stream_id: str, sn: str, now: float) -> bool:
+        window = self.cfg.dedup_seconds
+        if window <= 0:
+            return False
+        key = (stream_id, sn)
+        with self._dedup_lock:
+            last = self._last_recorded.get(key)
+            if last is not None and now - last < window:
+                return True
+            self._last_recorded[key] = now
+            if now - self._last_prune > max(60.0, window):
+                self._last_prune = now
+                self._last_recorded = {k: t for k, t in self._last_recorded.items() if now - t < window}
+            return False
+
+    def publish_results(self, stream_id: str, results: List[Dict[str, Any]], timestamp: Optional[datetime] = None):
+        """
+        把一帧的识别结果转换为事件写入日志；未识别的人脸按配置决定是否记录（无法按人员去重，逐帧记录），
+        已识别的人员在去重窗口内重复出现时跳过。
+        """
+        timestamp = timestamp or datetime.now()
+        now = time.monotonic()
+        for res in results:
+            sn = res.get("sn")
+            if sn is None and not self.cfg.record_unknown:
+                continue
+            if sn is not None and self._is_duplicate(stream_id, sn, now):
+                self.stats_counters["deduplicated"] += 1
+                continue
+            self.publish({
+                "timestamp": timestamp, "stream_id": stream_id, "sn": sn, "name": res.get("name"),
+                "similarity": res.get("similarity"), "bbox": res.get("box"), "crop_path": res.get("crop_path"),
+            })
+
+    def _writer_loop(self):
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.cfg.flush_interval_seconds
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            try:
+                batch.append(self._queue.get(timeout=max(0.01, min(0.5, deadline - time.monotonic()))))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.cfg.batch_size or (batch and time.monotonic() >= deadline):
+                self._write_batch(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.cfg.flush_interval_seconds
+            if self.cfg.compact_interval_seconds > 0 and time.monotonic() >= self._next_compact_at:
+                self._next_compact_at = time.monotonic() + self.cfg.compact_interval_seconds
+                self.compact()
+        if batch:
+            self._write_batch(batch)
+
+    def _write_table(self, partition: Path, table: pa.Table, first: datetime) -> Path:
+        self._file_seq += 1
+        name = f"part-{first:%H%M%S%f}-{os.getpid()}-{self._file_seq:06d}.parquet"
+        # 先写临时文件再改名，查询方不会读到半个文件
+        tmp_path = partition / f".{name}.tmp"
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, partition / name)
+        return partition / name
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        by_day: Dict[date, List[Dict[str, Any]]] = {}
+        for event in batch:
+            by_day.setdefault(event["timestamp"].date(), []).append(event)
+        for day, events in by_day.items():
+            partition = self.root / f"{_PARTITION_PREFIX}{day.isoformat()}"
+            partition.mkdir(parents=True, exist_ok=True)
+            try:
+                self._write_table(partition, pa.Table.from_pylist(events, schema=EVENT_SCHEMA), events[0]["timestamp"])
+                self.stats_counters["written"] += len(events)
+                self.stats_counters["files"] += 1
+            except Exception as e:
+                self.stats_counters["write_errors"] += 1
+                app_logger.error(f"写入识别事件日志失败 ({len(events)} 条): {e}", exc_info=True)
+
+    # --- 小文件合并 ---
+    @staticmethod
+    def _file_pid(path: Path) -> Optional[int]:
+        # 文件名格式: part-<时间>-<进程号>-<序号>.parquet
+        parts = path.stem.split("-")
+        return int(parts[2]) if len(parts) == 4 and parts[2].isdigit() else None
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            return True
+        return True
+
+    def compact(self):
+        """
+        把每个天分区中由本进程或已退出进程写出的小文件合并为一个按时间排序的文件，
+        其他存活进程的文件由它们各自合并。合并结果先原子落盘再删除源文件。
+        分区的合并锁被其他进程持有时跳过该分区，持有锁后才列出候选文件，已被别人合并掉的文件不会再读到。
+        """
+        for partition in sorted(self.root.glob(f"{_PARTITION_PREFIX}*")):
+            try:
+                lock = open(partition / _COMPACT_LOCK_FILE, "a")
+            except OSError as e:
+                app_logger.warning(f"无法打开识别事件日志 {partition.name} 的合并锁: {e}")
+                continue
+            with lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                self._compact_partition(partition)
+
+    def _compact_partition(self, partition: Path):
+        """在持有分区合并锁时合并该分区的小文件。"""
+        own_pid = os.getpid()
+        candidates = []
+        for path in sorted(partition.glob("part-*.parquet")):
+            pid = self._file_pid(path)
+            if pid is None or path.stat().st_size >= _COMPACT_MAX_FILE_BYTES:
+                continue
+            if pid == own_pid or not self._pid_alive(pid):
+                candidates.append(path)
+        if len(candidates) < self.cfg.compact_min_files:
+            return
+        try:
+            table = pq.read_table(candidates, schema=EVENT_SCHEMA).sort_by("timestamp")
+            if table.num_rows:
+                self._write_table(partition, table, table.column("timestamp")[0].as_py())
+            for path in candidates:
+                path.unlink(missing_ok=True)
+            self.stats_counters["compactions"] += 1
+            app_logger.info(f"识别事件日志 {partition.name} 已合并 {len(candidates)} 个文件 ({table.num_rows} 条)。")
+        except Exception as e:
+            self.stats_counters["write_errors"] += 1
+            app_logger.error(f"合并识别事件日志 {partition} 失败: {e}", exc_info=True)
+
+    def close(self, timeout: float = 10.0):
+        """停止写线程，并把队列中剩余的事件全部落盘。"""
+        self._stop_event.set()
+        self._writer.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.stats_counters, "pending": self._queue.qsize(), "max_pending": self.cfg.max_pending}
+
+    # --- 查询端 ---
+    def _partitions(self, start: Optional[datetime], end: Optional[datetime]) -> List[Path]:
+        """按时间范围裁剪天分区，按日期顺序返回分区目录。"""
+        first = start.date().isoformat() if start else None
+        last = end.date().isoformat() if end else None
+        partitions: List[Path] = []
+        for partition in sorted(self.root.glob(f"{_PARTITION_PREFIX}*")):
+            day = partition.name[len(_PARTITION_PREFIX):]
+            if (first and day < first) or (last and day > last):
+                continue
+            partitions.append(partition)
+        return partitions
+
+    @staticmethod
+    def _read_partition(partition: Path, condition) -> Optional[pa.Table]:
+        """读取一个分区中满足条件的事件；文件在读取期间被合并删除时重新列出后重试。分区为空时返回 None。"""
+        import pyarrow.dataset as pds
+
+        for attempt in range(_QUERY_RETRIES):
+            files = [str(p) for p in sorted(partition.glob("part-*.parquet"))]
+            if not files:
+                return None
+            try:
+                return pds.dataset(files, schema=EVENT_SCHEMA, format="parquet").to_table(filter=condition)
+            except FileNotFoundError:
+                if attempt == _QUERY_RETRIES - 1:
+                    raise
+        return None
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None, sn: Optional[str] = None,
+              stream_id: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """按时间范围（左闭右开）、SN 与视频流筛选事件，按时间升序最多返回 limit 条。"""
+        import pyarrow.dataset as pds
+
+        partitions = self._partitions(start, end)
+        condition = None
+        for expr in (
+            pds.field("timestamp") >= pa.scalar(start, type=pa.timestamp("ms")) if start else None,
+            pds.field("timestamp") < pa.scalar(end, type=pa.timestamp("ms")) if end else None,
+            pds.field("sn") == sn if sn else None,
+            pds.field("stream_id") == stream_id if stream_id else None,
+        ):
+            if expr is not None:
+                condition = expr if condition is None else condition & expr
+        # 多进程写出的文件之间时间交错，须在分区内排序后再截取；各天分区互不重叠，凑够 limit 条即可停止
+        rows: List[Dict[str, Any]] = []
+        for partition in partitions:
+            table = self._read_partition(partition, condition)
+            if table is None:
+                continue
+            rows.extend(table.sort_by("timestamp").slice(0, limit - len(rows)).to_pylist())
+            if len(rows) >= limit:
+                break
+        return rows
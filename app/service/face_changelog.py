@@ -0,0 +1,243 @@
+# app/service/face_changelog.py
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from app.cfg.logging import app_logger
+
+if TYPE_CHECKING:
+    import lancedb
+
+CHANGE_OPS = ("create", "update", "delete", "reembed")
+# 同步接口以 Arrow IPC 流传输变更，向量为定长列表列，不经过 JSON
+SYNC_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NODE_ID_FILE = "node_id"
+# 同步而来的记录的注册图片保存在来源节点上，本地以 remote://<来源节点>/<原路径> 标记
+REMOTE_IMAGE_PREFIX = "remote://"
+
+
+def changelog_schema(dim: int = 512, vector_type: pa.DataType = pa.float32()) -> pa.Schema:
+    """
+    变更日志的表结构。create 携带完整记录与向量；update / delete 按记录逐行写入，
+    填写 uuid / sn（及更新后的 name），向量为空；reembed 为更换识别模型后重新提取的特征，携带完整记录与新向量。
+    origin 为最初产生该变更的节点，用于避免变更在节点间来回传播；
+    record_origin 为被变更的记录最初注册所在的节点，与 uuid 一起唯一确定一条记录；
+    model 为提取向量所用的识别模型，对方据此拒绝与自身模型不一致的向量。
+    """
+    return pa.schema([
+        pa.field("seq", pa.int64(), nullable=False),
+        pa.field("op", pa.string(), nullable=False),
+        pa.field("uuid", pa.string()),
+        pa.field("sn", pa.string()),
+        pa.field("name", pa.string()),
+        pa.field("image_path", pa.string()),
+        pa.field("registration_time", pa.timestamp("us")),
+        pa.field("vector", pa.list_(vector_type, dim)),
+        pa.field("origin", pa.string(), nullable=False),
+        pa.field("record_origin", pa.string()),
+        pa.field("model", pa.string()),
+        pa.field("changed_at", pa.timestamp("us"), nullable=False),
+    ])
+
+
+def vector_column(vectors: List[Optional[np.ndarray]], dim: int = 512,
+                  vector_type: pa.DataType = pa.float32()) -> pa.FixedSizeListArray:
+    """把 (可能为空的) 向量列表转换为定长列表列；空向量所在的槽位以 0 填充并标记为 null。"""
+    values = np.zeros((len(vectors), dim), dtype=np.float32)
+    mask = np.ones(len(vectors), dtype=bool)
+    for i, vector in enumerate(vectors):
+        if vector is not None:
+            values[i] = np.asarray(vector, dtype=np.float32).reshape(-1)
+            mask[i] = False
+    column = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), dim, mask=pa.array(mask))
+    return column.cast(pa.list_(vector_type, dim))
+
+
+def is_remote_image(image_path: Optional[str]) -> bool:
+    return bool(image_path) and image_path.startswith(REMOTE_IMAGE_PREFIX)
+
+
+def remote_image_path(origin: str, image_path: Optional[str]) -> str:
+    """把来源节点上的图片路径改写为远端标记；已是远端标记的路径（经中间节点转发）保持不变。"""
+    if not image_path or is_remote_image(image_path):
+        return image_path or ""
+    return f"{REMOTE_IMAGE_PREFIX}{origin}/{image_path.lstrip('/')}"
+
+
+def load_node_id(db_uri: str, configured: Optional[str] = None) -> str:
+    """返回本节点标识：优先使用配置值，否则读取（首次时生成并写入）数据库目录下的 node_id 文件。"""
+    if configured:
+        return configured
+    path = Path(db_uri) / NODE_ID_FILE
+    try:
+        node_id = path.read_text(encoding="utf-8").strip()
+        if node_id:
+            return node_id
+    except OSError:
+        pass
+    node_id = uuid.uuid4().hex
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(node_id, encoding="utf-8")
+    app_logger.info(f"已生成本节点标识: {node_id}")
+    return node_id
+
+
+class FaceChangeLog:
+    """
+    人脸库的版本化变更日志，保存在与人脸表同库的 LanceDB 表 (<人脸表名>_changes) 中：
+
+    - 每次 create / update / delete 追加一行，seq 在本节点内单调递增且连续，即本节点人脸库的版本号；
+    - 对等节点按 (since, since + limit] 的 seq 区间拉取增量，区间查询经 seq 标量索引定位；
+    - seq 由进程内的锁分配；追加前检查表版本，发现其他进程（如命令行导入）写入过时先重新读取最大值。
+    """
+
+    def __init__(self, db: "lancedb.DBConnection", table_name: str, node_id: str, dim: int = 512):
+        self.table_name = table_name
+        self.node_id = node_id
+        self.dim = dim
+        self.schema = changelog_schema(dim)
+        self._lock = threading.Lock()
+        self.created = table_name not in db.table_names()
+        if self.created:
+            app_logger.info(f"LanceDB 变更日志表 '{table_name}' 不存在，正在创建...")
+            self.table = db.create_table(table_name, schema=self.schema)
+        else:
+            self.table = db.open_table(table_name)
+            self._migrate_schema()
+        self._seq = self._max_seq()
+        self._version = self.table.version
+        self._seq_indexed = any("seq" in idx.columns for idx in self.table.list_indices())
+
+    def _migrate_schema(self):
+        """旧版本的日志表缺少 record_origin / model 列时补上空列（旧的 update / delete 行没有 uuid，应用时会被跳过）。"""
+        missing = [field for field in self.schema if field.name not in self.table.schema.names]
+        if missing:
+            self.table.add_columns(missing)
+            app_logger.info(f"已为变更日志表 '{self.table_name}' 补充列: {[f.name for f in missing]}")
+
+    def _max_seq(self) -> int:
+        if self.table.count_rows() == 0:
+            return 0
+        seqs = self.table.search().select(["seq"]).to_arrow().column("seq")
+        return int(pc.max(seqs).as_py())
+
+    def _reload_if_changed(self):
+        self.table.checkout_latest()
+        if self.table.version != self._version:
+            self._seq = self._max_seq()
+            self._version = self.table.version
+
+    @property
+    def latest_seq(self) -> int:
+        return self._seq
+
+    def append(self, rows: List[Dict[str, Any]], origin: Optional[str] = None) -> int:
+        """追加若干条变更（未提供 origin 的行记为本节点产生），返回最后一条的 seq。"""
+        if not rows:
+            return self._seq
+        columns = {name: [row.get(name) for row in rows]
+                   for name in ("op", "uuid", "sn", "name", "image_path", "registration_time", "model")}
+        columns["vector"] = vector_column([row.get("vector") for row in rows], self.dim)
+        columns["origin"] = [row.get("origin") or origin or self.node_id for row in rows]
+        columns["record_origin"] = [row.get("record_origin") for row in rows]
+        return self.append_arrow(pa.table(columns))
+
+    def append_arrow(self, changes: pa.Table) -> int:
+        """以列式数据批量追加变更（不含 seq 与 changed_at 列，缺少 origin 时记为本节点），用于批量写入与首次回填。"""
+        with self._lock:
+            self._reload_if_changed()
+            start = self._seq + 1
+            count = changes.num_rows
+            now = pa.array([datetime.now()] * count, type=pa.timestamp("us"))
+            columns = {"seq": pa.array(np.arange(start, start + count, dtype=np.int64)), "changed_at": now}
+            for field in self.schema:
+                if field.name in columns:
+                    continue
+                if field.name in changes.column_names:
+                    column = changes.column(field.name)
+                elif field.name == "origin":
+                    column = pa.array([self.node_id] * count)
+                else:
+                    column = pa.nulls(count)
+                columns[field.name] = column.cast(field.type)
+            # 未注明记录来源的行（新注册的记录、旧版本的变更）即由变更的来源节点注册
+            columns["record_origin"] = pc.coalesce(columns["record_origin"], columns["origin"])
+            self.table.add(pa.table({f.name: columns[f.name] for f in self.schema}, schema=self.schema))
+            self._seq = start + count - 1
+            self._version = self.table.version
+        self._ensure_seq_index()
+        return self._seq
+
+    def _ensure_seq_index(self):
+        if self._seq_indexed:
+            return
+        try:
+            self.table.create_scalar_index("seq")
+            app_logger.info(f"已为变更日志表 '{self.table_name}' 的 'seq' 列创建标量索引。")
+        except Exception as e:
+            app_logger.warning(f"为变更日志的 'seq' 列创建标量索引失败（将退化为全表扫描）: {e}")
+        self._seq_indexed = True
+
+    def changes_since(self, since: int, limit: int, exclude_origin: Optional[str] = None) -> Tuple[pa.Table, int]:
+        """
+        返回 seq 位于 (since, since + limit] 内的变更（按 seq 升序）及下一次拉取的起点。
+        exclude_origin 过滤掉由请求方自己产生的变更；即使本页全部被过滤，起点也照常前进。
+        """
+        with self._lock:
+            self._reload_if_changed()
+            latest = self._seq
+        upper = min(since + limit, latest)
+        if upper <= since:
+            return self.schema.empty_table(), since
+        where = f"seq > {int(since)} AND seq <= {int(upper)}"
+        if exclude_origin:
+            where += " AND origin != '" + exclude_origin.replace("'", "''") + "'"
+        changes = self.table.search().where(where).to_arrow()
+        return changes.select(self.schema.names).sort_by("seq"), upper
+
+    def deleted_uuids(self, uuids: List[str]) -> Set[str]:
+        """返回其中在日志里有 delete 变更的 uuid，避免迟到的变更把已删除的记录重新写回。"""
+        if not uuids:
+            return set()
+        quoted = ", ".join("'" + u.replace("'", "''") + "'" for u in uuids)
+        rows = self.table.search().where(f"op = 'delete' AND uuid IN ({quoted})").select(["uuid"]).to_arrow()
+        return set(rows.column("uuid").to_pylist())
+
+    def optimize(self):
+        try:
+            self.table.optimize()
+        except Exception as e:
+            app_logger.warning(f"合并变更日志表 '{self.table_name}' 失败: {e}")
+
+
+def encode_changes(changes: pa.Table, metadata: Dict[str, Any], vector_dtype: str = "float32") -> bytes:
+    """把一页变更编码为 Arrow IPC 流，可选以 float16 传输向量；分页信息写入 schema 元数据。"""
+    if vector_dtype == "float16":
+        dim = changes.schema.field("vector").type.list_size
+        index = changes.schema.get_field_index("vector")
+        changes = changes.set_column(index, pa.field("vector", pa.list_(pa.float16(), dim)),
+                                     changes.column("vector").cast(pa.list_(pa.float16(), dim)))
+    changes = changes.replace_schema_metadata({k: str(v) for k, v in metadata.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, changes.schema) as writer:
+        writer.write_table(changes)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_changes(payload: bytes) -> Tuple[pa.Table, Dict[str, str]]:
+    """解析同步接口返回的 Arrow IPC 流，返回 (变更表, 分页元数据)。向量统一还原为 float32。"""
+    with pa.ipc.open_stream(pa.py_buffer(payload)) as reader:
+        changes = reader.read_all()
+    metadata = {k.decode(): v.decode() for k, v in (changes.schema.metadata or {}).items()}
+    vector_type = changes.schema.field("vector").type
+    if vector_type.value_type != pa.float32():
+        index = changes.schema.get_field_index("vector")
+        target = pa.list_(pa.float32(), vector_type.list_size)
+        changes = changes.set_column(index, pa.field("vector", target), changes.column("vector").cast(target))
+    return changes.replace_schema_metadata(None), metadata
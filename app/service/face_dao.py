@@ -1,26 +1,135 @@
 # app/service/face_dao.py
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional, Tuple
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Dict, Any, Iterator, Optional, Set, Tuple, Type, Union
 from pathlib import Path
+import os
+import threading
+import time
 import numpy as np
 from fastapi import HTTPException, status
 from datetime import datetime
 import uuid
-import lancedb
-from lancedb.pydantic import LanceModel, Vector
+import pyarrow as pa
+import pyarrow.compute as pc
 from pydantic import Field
 
+from app.cfg.config import AppSettings
 from app.cfg.logging import app_logger
+from app.core.tracing import traced
+from app.service.vector_index import CompactVectorIndex, PersonTemplateIndex, l2_normalize
+from app.service.gallery_snapshot import GallerySnapshot
+from app.service.face_changelog import FaceChangeLog, load_node_id, remote_image_path
 
+if TYPE_CHECKING:
+    import lancedb
+    from lancedb.pydantic import LanceModel
 
-# LanceFaceSchema 和 FaceDataDAO 接口定义保持不变
-class LanceFaceSchema(LanceModel):
-    uuid: str = Field(..., description="特征记录的唯一ID")
-    vector: Vector(512) = Field(description="512维的人脸特征向量")
-    name: str = Field(description="人员姓名")
-    sn: str = Field(description="人员唯一标识 (如工号)", default=None)
-    image_path: str = Field(description="注册时使用的图片路径")
-    registration_time: datetime = Field(description="注册时间", default_factory=datetime.now)
+
+@lru_cache(maxsize=None)
+def _face_schemas() -> Dict[str, Type["LanceModel"]]:
+    """
+    构建 LanceDB 表结构。lancedb 的导入耗时数秒（主要在 lance_namespace 客户端），
+    因此推迟到首次连接数据库时再导入，使 API 进程可以先加载模型、更快完成启动。
+    """
+    from lancedb.pydantic import LanceModel, Vector
+
+    class LanceFaceSchema(LanceModel):
+        uuid: str = Field(..., description="特征记录的唯一ID")
+        vector: Vector(512) = Field(description="512维的人脸特征向量")
+        name: str = Field(description="人员姓名")
+        sn: str = Field(description="人员唯一标识 (如工号)", default=None)
+        image_path: str = Field(description="注册时使用的图片路径")
+        registration_time: datetime = Field(description="注册时间", default_factory=datetime.now)
+        origin: Optional[str] = Field(None, description="同步而来的记录最初注册所在的节点标识，本节点注册的记录为空")
+
+    class LanceFaceSchemaFP16(LanceFaceSchema):
+        vector: Vector(512, value_type=pa.float16()) = Field(description="512维的人脸特征向量（半精度存储）")
+
+    return {"float32": LanceFaceSchema, "float16": LanceFaceSchemaFP16}
+
+
+def __getattr__(name: str):
+    # 保持 LanceFaceSchema / LanceFaceSchemaFP16 / FACE_SCHEMAS 的模块级访问方式，首次访问时才构建
+    if name == "FACE_SCHEMAS":
+        return _face_schemas()
+    if name in ("LanceFaceSchema", "LanceFaceSchemaFP16"):
+        return _face_schemas()["float32" if name == "LanceFaceSchema" else "float16"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _vectors_from_arrow(column: pa.ChunkedArray) -> np.ndarray:
+    """将 Arrow 的定长列表列转换为 float32 的二维 numpy 数组。"""
+    if len(column) == 0:
+        return np.zeros((0, 512), dtype=np.float32)
+    flat = column.combine_chunks().flatten().to_numpy(zero_copy_only=False)
+    return np.asarray(flat, dtype=np.float32).reshape(len(column), -1)
+
+
+def _sql_in(values: List[str]) -> str:
+    return ", ".join("'" + v.replace("'", "''") + "'" for v in values)
+
+
+def _sql_str(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _sn_filter(sn: str) -> str:
+    return f"sn = {_sql_str(sn)}"
+
+
+# 列表/导出类查询只读取元数据列，从不加载 512 维向量
+FACE_META_COLUMNS = ["uuid", "name", "sn", "image_path", "registration_time"]
+
+
+def build_face_filter(sn_prefix: Optional[str] = None, name_prefix: Optional[str] = None,
+                      registered_after: Optional[datetime] = None, registered_before: Optional[datetime] = None,
+                      image_path: Optional[str] = None, local_only: bool = False) -> Optional[str]:
+    """将列表筛选条件组装为 LanceDB 的 where 表达式，无条件时返回 None。local_only 只保留本节点注册的记录。"""
+    clauses = []
+    if local_only:
+        clauses.append("origin IS NULL")
+    if image_path:
+        clauses.append(f"image_path = {_sql_str(str(image_path))}")
+    if sn_prefix:
+        clauses.append(f"starts_with(sn, {_sql_str(sn_prefix)})")
+    if name_prefix:
+        clauses.append(f"starts_with(name, {_sql_str(name_prefix)})")
+    if registered_after:
+        clauses.append(f"registration_time >= timestamp '{registered_after.replace(tzinfo=None).isoformat(sep=' ')}'")
+    if registered_before:
+        clauses.append(f"registration_time < timestamp '{registered_before.replace(tzinfo=None).isoformat(sep=' ')}'")
+    return " AND ".join(clauses) or None
+
+
+# 人脸库现有特征所属的识别模型，记录在数据库目录下的 <表名>.model 文件中
+GALLERY_MODEL_SUFFIX = ".model"
+
+
+def gallery_model_path(db_uri: str, table_name: str) -> Path:
+    return Path(db_uri) / f"{table_name}{GALLERY_MODEL_SUFFIX}"
+
+
+def load_gallery_model(db_uri: str, table_name: str, configured: str) -> str:
+    """返回人脸库现有特征所属的识别模型；标记文件不存在时（新库或旧版本升级）视为与当前配置一致并写入。"""
+    path = gallery_model_path(db_uri, table_name)
+    try:
+        model = path.read_text(encoding="utf-8").strip()
+        if model:
+            return model
+    except OSError:
+        pass
+    if configured:
+        save_gallery_model(db_uri, table_name, configured)
+    return configured
+
+
+def save_gallery_model(db_uri: str, table_name: str, model: str):
+    path = gallery_model_path(db_uri, table_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(model, encoding="utf-8")
+    os.replace(tmp_path, path)
 
 
 class FaceDataDAO(ABC):
@@ -30,34 +139,118 @@ class FaceDataDAO(ABC):
     @abstractmethod
     def get_all(self) -> List[Dict[str, Any]]: pass
 
+    @abstractmethod
+    def list_page(self, where: Optional[str], limit: int, offset: int = 0,
+                  cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]: pass
+
+    @abstractmethod
+    def iter_meta(self, where: Optional[str] = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]: pass
+
+    @abstractmethod
+    def count(self, where: Optional[str] = None) -> int: pass
+
     @abstractmethod
     def get_features_by_sn(self, sn: str) -> List[Dict[str, Any]]: pass
 
     @abstractmethod
-    def delete_by_sn(self, sn: str) -> int: pass
+    def count_by_sn(self, sn: str) -> int: pass
+
+    def exists_sn(self, sn: str) -> bool:
+        return self.count_by_sn(sn) > 0
+
+    @abstractmethod
+    def delete_by_sn(self, sn: str, expected_count: Optional[int] = None) -> int: pass
 
     @abstractmethod
-    def update_by_sn(self, sn: str, update_data: Dict[str, Any]) -> int: pass
+    def update_by_sn(self, sn: str, update_data: Dict[str, Any], expected_count: Optional[int] = None) -> int: pass
 
     @abstractmethod
     def search(self, embedding: np.ndarray, threshold: float, top_k: int = 1) -> Optional[Tuple[str, str, float]]: pass
 
+    def changes_since(self, since: int, limit: int, exclude_origin: Optional[str] = None) -> Tuple[pa.Table, int, int]:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="当前存储不支持变更日志。")
+
+    def apply_changes(self, changes: pa.Table, source_model: Optional[str] = None) -> Dict[str, int]:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="当前存储不支持变更日志。")
+
+    def iter_records(self, batch_size: int = 8192) -> Iterator[pa.RecordBatch]:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="当前存储不支持批量导出。")
+
+    def existing_uuids(self) -> set:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="当前存储不支持批量导入。")
+
+    def bulk_insert(self, records: pa.Table, model: Optional[str] = None) -> int:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="当前存储不支持批量导入。")
+
+    def replace_vectors(self, vectors: pa.Table, model: str) -> int:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="当前存储不支持批量替换特征向量。")
+
     @abstractmethod
     def dispose(self): pass
 
 
 class LanceDBFaceDataDAO(FaceDataDAO):
-    def __init__(self, db_uri: str, table_name: str):
+    def __init__(self, db_uri: str, table_name: str, vector_storage: str = "float32", vector_index: str = "lancedb",
+                 rerank_candidates: int = 20, index_refresh_seconds: float = 5.0, person_index: bool = False,
+                 person_exemplars: int = 5, person_candidates: int = 10, snapshot_dir: Optional[str] = None,
+                 index_optimize_writes: int = 500, changelog: bool = True, node_id: Optional[str] = None,
+                 recognition_model: str = ""):
         self.db_uri = db_uri
         self.table_name = table_name
+        # 当前配置的识别模型（新写入的特征由它提取）与人脸库现有特征所属的模型（更换模型后重新提取完成前两者不同）
+        self.recognition_model = recognition_model
+        self.gallery_model = load_gallery_model(db_uri, table_name, recognition_model)
+        self.vector_storage = vector_storage
+        self.schema = _face_schemas()[vector_storage]
+        self.rerank_candidates = max(1, rerank_candidates)
+        self.person_candidates = max(1, person_candidates)
+        self.index_refresh_seconds = index_refresh_seconds
+        import lancedb
+
         self.db = lancedb.connect(self.db_uri)
         self.table = self._initialize_table()
+        self._migrate_vector_storage()
+
+        # sn 上的 BTree 标量索引使按人员的增删改查与人脸库规模无关；表为空时延迟到首次写入后创建
+        self._pending_scalar_indices: set = set()
+        self._ensure_scalar_index("sn")
+        # uuid 上的索引供键集分页、同步合并与按记录更新使用
+        self._ensure_scalar_index("uuid")
+        # 新写入的行在索引合并前按未索引分片扫描，累计一定写入次数后在后台合并
+        self.index_optimize_writes = index_optimize_writes
+        self._writes_since_optimize = 0
+        self._optimizing = threading.Lock()
+        self._optimize_thread: Optional[threading.Thread] = None
+
+        # 可选的常驻内存紧凑索引（float16 / int8），检索时取回表中存储的向量重排（float32 存储时为精确相似度）；
+        # snapshot 模式则直接映射磁盘上的 float32 快照做精确检索，多进程共享同一份物理内存
+        self.compact_index: Optional[Union[CompactVectorIndex, GallerySnapshot]] = None
+        # 写入与索引重建互斥：重建在新对象上进行后整体替换引用，检索只读取引用，不会看到构建了一半的索引
+        self._index_lock = threading.RLock()
+        self._index_version = -1
+        self._index_checked_at = 0.0
+        if vector_index == "snapshot":
+            self.compact_index = GallerySnapshot(Path(snapshot_dir) / table_name, dim=512)
+        elif vector_index != "lancedb":
+            self.compact_index = CompactVectorIndex(dim=512, dtype=vector_index)
+        # 可选的人员级聚合索引：每个 sn 一个质心 + 若干代表模板，检索量与人数而非照片数成正比
+        self.person_index: Optional[PersonTemplateIndex] = None
+        if person_index:
+            self.person_index = PersonTemplateIndex(dim=512, max_exemplars=person_exemplars)
+        self.refresh_index()
 
-    def _initialize_table(self) -> lancedb.table.Table:
+        # 版本化变更日志：首次写入或被拉取时才打开，只做检索的视频流工作进程不会创建或写入它
+        self.changelog_enabled = changelog
+        self.node_id = load_node_id(db_uri, node_id)
+        self._changelog: Optional[FaceChangeLog] = None
+        self._changelog_lock = threading.Lock()
+        self._migrate_origin_column()
+
+    def _initialize_table(self) -> "lancedb.table.Table":
         try:
             if self.table_name not in self.db.table_names():
                 app_logger.info(f"LanceDB 表 '{self.table_name}' 不存在，正在创建...")
-                return self.db.create_table(self.table_name, schema=LanceFaceSchema)
+                return self.db.create_table(self.table_name, schema=self.schema)
             else:
                 app_logger.info(f"成功连接到已存在的 LanceDB 表: '{self.table_name}'")
                 return self.db.open_table(self.table_name)
@@ -65,52 +258,684 @@ class LanceDBFaceDataDAO(FaceDataDAO):
             app_logger.error(f"初始化 LanceDB 表失败: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"数据库表初始化失败: {e}")
 
+    def _migrate_vector_storage(self):
+        """
+        当已有表的向量精度与配置不一致时，流式读取旧版本数据并转换精度后整体覆盖写入。
+        Lance 的覆盖写是一次原子提交，迁移中断不会破坏原表，旧版本仍可回滚。
+        """
+        target_type = self.schema.to_arrow_schema().field("vector").type
+        current_type = self.table.schema.field("vector").type
+        if current_type == target_type:
+            return
+        rows = self.table.count_rows()
+        app_logger.warning(f"正在将表 '{self.table_name}' 的向量存储从 {current_type} 迁移为 {target_type} (共 {rows} 条)...")
+        target_schema = pa.schema([
+            pa.field(f.name, target_type, f.nullable) if f.name == "vector" else f for f in self.table.schema
+        ])
+
+        def converted_batches():
+            for batch in self.table.search().to_batches(4096):
+                columns = [col.cast(target_type) if name == "vector" else col for name, col in zip(batch.schema.names, batch.columns)]
+                yield pa.RecordBatch.from_arrays(columns, schema=target_schema)
+
+        try:
+            started = time.perf_counter()
+            self.table = self.db.create_table(
+                self.table_name, data=pa.RecordBatchReader.from_batches(target_schema, converted_batches()), mode="overwrite"
+            )
+            app_logger.info(f"✅ 向量存储迁移完成，耗时 {time.perf_counter() - started:.2f}s。")
+        except Exception as e:
+            app_logger.error(f"向量存储迁移失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"向量存储迁移失败: {e}")
+
+    def _migrate_origin_column(self):
+        """
+        旧版本的人脸表没有 origin 列时补上空列，并按变更日志中由其他节点产生的 create
+        回填同步而来的记录的来源节点，同时把其图片路径改写为远端标记。
+        """
+        if "origin" in self.table.schema.names:
+            return
+        try:
+            self.table.add_columns(pa.field("origin", pa.string()))
+            log_name = f"{self.table_name}_changes"
+            if log_name not in self.db.table_names():
+                return
+            synced = (self.db.open_table(log_name).search()
+                      .where(f"op = 'create' AND origin != {_sql_str(self.node_id)}")
+                      .select(["uuid", "origin", "image_path"]).to_arrow())
+            if synced.num_rows:
+                origins, paths = synced.column("origin").to_pylist(), synced.column("image_path").to_pylist()
+                synced = pa.table({"uuid": synced.column("uuid"), "origin": synced.column("origin"),
+                                   "image_path": [remote_image_path(o, p) for o, p in zip(origins, paths)]})
+                self.table.merge_insert("uuid").when_matched_update_all().execute(synced)
+            app_logger.info(f"已为表 '{self.table_name}' 补充 origin 列，回填了 {synced.num_rows} 条同步记录的来源。")
+        except Exception as e:
+            app_logger.error(f"为表 '{self.table_name}' 补充 origin 列失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"人脸表结构迁移失败: {e}")
+
+    def _ensure_scalar_index(self, column: str):
+        """为标量列建立 BTree 索引（已存在时跳过，表为空时记为待创建）。"""
+        try:
+            if any(column in idx.columns for idx in self.table.list_indices()):
+                self._pending_scalar_indices.discard(column)
+                return
+            if self.table.count_rows() == 0:
+                self._pending_scalar_indices.add(column)
+                return
+            self.table.create_scalar_index(column)
+            self._pending_scalar_indices.discard(column)
+            app_logger.info(f"已为表 '{self.table_name}' 的 '{column}' 列创建标量索引。")
+        except Exception as e:
+            self._pending_scalar_indices.discard(column)
+            app_logger.warning(f"为 '{column}' 列创建标量索引失败（将退化为全表扫描）: {e}")
+
+    def _after_write(self):
+        """写入后的索引维护：补建延迟的标量索引，并定期在后台合并未索引的新数据。"""
+        for column in list(self._pending_scalar_indices):
+            self._ensure_scalar_index(column)
+        if self.index_optimize_writes <= 0:
+            return
+        self._writes_since_optimize += 1
+        if self._writes_since_optimize < self.index_optimize_writes:
+            return
+        self._start_optimize()
+
+    def _start_optimize(self):
+        """在后台合并数据文件与索引；已有合并在进行时跳过。保留线程句柄，dispose() 时等待其结束。"""
+        if self.index_optimize_writes <= 0 or self._optimizing.locked():
+            return
+        self._writes_since_optimize = 0
+        self._optimize_thread = threading.Thread(target=self._optimize_indices, name="LanceDBOptimize", daemon=True)
+        self._optimize_thread.start()
+
+    def _optimize_indices(self):
+        with self._optimizing:
+            try:
+                started = time.perf_counter()
+                self.table.optimize()
+                app_logger.info(f"已合并表 '{self.table_name}' 的数据文件与索引，耗时 {time.perf_counter() - started:.2f}s。")
+            except Exception as e:
+                app_logger.warning(f"合并表 '{self.table_name}' 的索引失败: {e}")
+            if self._changelog is not None:
+                self._changelog.optimize()
+
+    # --- 变更日志 ---
+    @property
+    def changelog(self) -> Optional[FaceChangeLog]:
+        if not self.changelog_enabled:
+            return None
+        if self._changelog is None:
+            with self._changelog_lock:
+                if self._changelog is None:
+                    self._changelog = self._open_changelog()
+        return self._changelog
+
+    def _open_changelog(self) -> FaceChangeLog:
+        """打开变更日志；日志表是新建的而人脸表已有数据时，先把现有记录回填为 create 变更。"""
+        log = FaceChangeLog(self.db, f"{self.table_name}_changes", self.node_id, dim=512)
+        if log.created and self.table.count_rows() > 0:
+            started = time.perf_counter()
+            columns = ["uuid", "sn", "name", "image_path", "registration_time", "vector"]
+            for batch in self.table.search().select(columns).to_batches(4096):
+                batch_table = pa.Table.from_batches([batch])
+                log.append_arrow(batch_table.append_column("op", pa.array(["create"] * batch_table.num_rows))
+                                 .append_column("origin", pa.array([self.node_id] * batch_table.num_rows))
+                                 .append_column("model", pa.array([self.gallery_model or None] * batch_table.num_rows,
+                                                                  pa.string())))
+            app_logger.info(f"已将现有的 {log.latest_seq} 条人脸记录回填到变更日志，耗时 {time.perf_counter() - started:.2f}s。")
+        return log
+
+    def _open_changelog_before_write(self):
+        # 首次打开日志时会回填人脸表中的现有记录，必须在本次写入之前完成，否则本次写入会被记录两次
+        _ = self.changelog
+
+    def _record_change(self, rows: List[Dict[str, Any]]):
+        """把本次写入记入变更日志；日志写入失败不影响已成功的人脸库写入，只记录错误。"""
+        log = self.changelog
+        if log is None:
+            return
+        try:
+            log.append(rows)
+        except Exception as e:
+            app_logger.error(f"写入人脸库变更日志失败，对等节点将无法同步本次变更: {e}", exc_info=True)
+
+    def changes_since(self, since: int, limit: int, exclude_origin: Optional[str] = None) -> Tuple[pa.Table, int, int]:
+        """返回 (变更, 下一次拉取的起点, 本节点最新版本号)，语义见 FaceChangeLog.changes_since。"""
+        log = self.changelog
+        if log is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="人脸库变更日志未启用。")
+        try:
+            changes, next_since = log.changes_since(since, limit, exclude_origin)
+            return changes, next_since, log.latest_seq
+        except Exception as e:
+            app_logger.error(f"读取人脸库变更日志失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库读取失败: {e}")
+
+    def apply_changes(self, changes: pa.Table, source_model: Optional[str] = None) -> Dict[str, int]:
+        """
+        按 seq 顺序应用从对等节点拉取的一批变更，直接写入对方提供的特征向量，不重新做识别：
+        连续的 create 合并为一次批量写入并按 uuid 去重（重复拉取同一批是幂等的）；
+        连续的 update / delete 按 (record_origin, uuid) 只作用于对方变更的那几条记录，本节点自己注册的同 sn 记录不受影响；
+        reembed 按 (record_origin, uuid) 替换已有记录的向量。
+        携带向量的变更若由与本节点人脸库不同的识别模型提取（行内 model 缺省时取 source_model，即对方人脸库的模型），
+        不同模型的向量不可比较，计入 rejected 并跳过。
+        应用后的变更保留原始 origin 记入本节点日志，链式拓扑下可以继续向下游传播。
+        """
+        result = {"created": 0, "updated": 0, "deleted": 0, "reembedded": 0, "rejected": 0, "skipped": 0}
+        if changes.num_rows == 0:
+            return result
+        changes = changes.sort_by("seq")
+        # 旧版本节点的变更没有 record_origin / model 列，记录即由变更的来源节点注册、由对方人脸库的模型提取
+        record_origin = changes.column("origin")
+        if "record_origin" in changes.column_names:
+            record_origin = pc.coalesce(changes.column("record_origin"), record_origin)
+            changes = changes.drop(["record_origin"])
+        changes = changes.append_column("record_origin", record_origin)
+        model = pa.nulls(changes.num_rows, pa.string())
+        if "model" in changes.column_names:
+            model = changes.column("model")
+            changes = changes.drop(["model"])
+        if source_model:
+            model = pc.coalesce(model, pa.scalar(source_model))
+        changes = changes.append_column("model", model)
+        if self.gallery_model:
+            mismatched = pc.and_(pc.is_valid(changes.column("vector")),
+                                 pc.fill_null(pc.not_equal(changes.column("model"), self.gallery_model), False))
+            rejected = pc.sum(mismatched).as_py() or 0
+            if rejected:
+                app_logger.warning(f"⚠️ 拒绝 {rejected} 条同步变更：其特征向量由其他识别模型提取，"
+                                   f"与本节点人脸库的模型 '{self.gallery_model}' 不一致。")
+                changes = changes.filter(pc.invert(mismatched))
+                result["rejected"] = rejected
+        ops = changes.column("op").to_pylist()
+        start = 0
+        while start < len(ops):
+            end = start + 1
+            while end < len(ops) and ops[end] == ops[start]:
+                end += 1
+            run = changes.slice(start, end - start)
+            if ops[start] == "create":
+                applied = self._apply_creates(run)
+                result["created"] += applied
+            elif ops[start] in ("update", "delete"):
+                applied = self._apply_record_changes(ops[start], run)
+                result["updated" if ops[start] == "update" else "deleted"] += applied
+            elif ops[start] == "reembed":
+                applied = self._apply_reembeds(run)
+                result["reembedded"] += applied
+            else:
+                applied = 0
+                app_logger.warning(f"忽略 {end - start} 条未知类型的同步变更: {ops[start]}")
+            result["skipped"] += end - start - applied
+            start = end
+        return result
+
+    def _record_filter(self, keys: List[Tuple[str, str]]) -> str:
+        """由 (record_origin, uuid) 构造过滤条件；本节点注册的记录在表中的 origin 为空。"""
+        by_origin: Dict[str, List[str]] = {}
+        for origin, record_uuid in keys:
+            by_origin.setdefault(origin, []).append(record_uuid)
+        clauses = []
+        for origin, uuids in by_origin.items():
+            origin_clause = "origin IS NULL" if origin == self.node_id else f"origin = {_sql_str(origin)}"
+            clauses.append(f"({origin_clause} AND uuid IN ({_sql_in(uuids)}))")
+        return " OR ".join(clauses)
+
+    def _record_keys(self, where: str) -> List[Tuple[str, str]]:
+        """返回匹配记录的 (record_origin, uuid)，用于按记录写入变更日志。"""
+        rows = self.table.search().where(where).select(["uuid", "origin"]).to_arrow().to_pylist()
+        return [(row["origin"] or self.node_id, row["uuid"]) for row in rows]
+
+    def _apply_creates(self, changes: pa.Table) -> int:
+        """
+        批量写入一段连续的 create 变更，已存在的 uuid 跳过。记录标记来源节点，
+        图片只保存在来源节点上，image_path 改写为远端标记。返回实际写入的条数。
+        """
+        uuids = changes.column("uuid").to_pylist()
+        try:
+            existing = set()
+            if self.table.count_rows() > 0:
+                existing = set(self.table.search().where(f"uuid IN ({_sql_in(uuids)})").select(["uuid"])
+                               .to_arrow().column("uuid").to_pylist())
+            if existing:
+                changes = changes.filter(pa.array([u not in existing for u in uuids]))
+            if changes.num_rows == 0:
+                return 0
+            origins = [None if origin == self.node_id else origin for origin in changes.column("record_origin").to_pylist()]
+            image_paths = [path if origin is None else remote_image_path(origin, path)
+                           for origin, path in zip(origins, changes.column("image_path").to_pylist())]
+            changes = changes.set_column(changes.schema.get_field_index("image_path"), "image_path",
+                                         pa.array(image_paths, type=pa.string()))
+            self._open_changelog_before_write()
+            vector_type = self.table.schema.field("vector").type
+            records = pa.table({
+                "uuid": changes.column("uuid"),
+                "vector": changes.column("vector").cast(vector_type),
+                "name": changes.column("name"),
+                "sn": changes.column("sn"),
+                "image_path": changes.column("image_path"),
+                "registration_time": changes.column("registration_time"),
+                "origin": pa.array(origins, type=pa.string()),
+            })
+            vectors = _vectors_from_arrow(changes.column("vector"))
+            sns, names = changes.column("sn").to_pylist(), changes.column("name").to_pylist()
+            with self._index_lock:
+                self.table.add(records.select(self.table.schema.names).cast(self.table.schema))
+                if self.compact_index is not None:
+                    self.compact_index.add(changes.column("uuid").to_pylist(), sns, names, vectors)
+                if self.person_index is not None:
+                    for i, (sn, name) in enumerate(zip(sns, names)):
+                        self.person_index.add(sn, name, vectors[i])
+                self._mark_index_current()
+            self._after_write()
+        except Exception as e:
+            app_logger.error(f"批量写入同步的人脸记录失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库写入失败: {e}")
+        self._log_applied(changes)
+        return changes.num_rows
+
+    def _apply_record_changes(self, op: str, changes: pa.Table) -> int:
+        """
+        按 (record_origin, uuid) 应用一段连续的 update 或 delete 变更，返回受影响的记录数。
+        本地没有对应记录的变更与旧版本按 sn 记录的变更（没有 uuid）跳过。
+        """
+        changes = changes.filter(pc.is_valid(changes.column("uuid")))
+        if changes.num_rows == 0:
+            return 0
+        rows = changes.select(["uuid", "name", "record_origin"]).to_pylist()
+        try:
+            self._open_changelog_before_write()
+            with self._index_lock:
+                matched = set(self._record_keys(self._record_filter([(r["record_origin"], r["uuid"]) for r in rows])))
+                keep = [(r["record_origin"], r["uuid"]) in matched for r in rows]
+                if not matched:
+                    return 0
+                if op == "delete":
+                    affected = self.table.delete(self._record_filter(list(matched))).num_deleted_rows
+                else:
+                    # 同一条记录在本段内多次改名时以最后一次为准，再按新姓名分组更新
+                    final_names = {(r["record_origin"], r["uuid"]): r["name"] for r, k in zip(rows, keep) if k}
+                    by_name: Dict[str, List[Tuple[str, str]]] = {}
+                    for key, name in final_names.items():
+                        by_name.setdefault(name, []).append(key)
+                    affected = sum(self.table.update(where=self._record_filter(keys), values={"name": name}).rows_updated
+                                   for name, keys in by_name.items())
+                self._reindex_records([key[1] for key in matched], {sn for sn in changes.column("sn").to_pylist() if sn})
+                self._mark_index_current()
+            self._after_write()
+        except Exception as e:
+            app_logger.error(f"应用同步的 {op} 变更失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库写入失败: {e}")
+        self._log_applied(changes.filter(pa.array(keep)))
+        return affected
+
+    def _apply_reembeds(self, changes: pa.Table) -> int:
+        """
+        按 (record_origin, uuid) 以对方重新提取的特征替换本地记录的向量，同一条记录在本段内出现多次时以最后一次为准。
+        本地还没有的记录（尚未拉取到其 create）按 create 写入，本节点已删除过的记录除外。返回替换与补写的记录数。
+        """
+        changes = changes.filter(pc.and_(pc.is_valid(changes.column("uuid")), pc.is_valid(changes.column("vector"))))
+        if changes.num_rows == 0:
+            return 0
+        rows = changes.select(["uuid", "record_origin"]).to_pylist()
+        last = {(r["record_origin"], r["uuid"]): i for i, r in enumerate(rows)}
+        changes = changes.take(pa.array(sorted(last.values())))
+        keys = [(r["record_origin"], r["uuid"]) for r in changes.select(["uuid", "record_origin"]).to_pylist()]
+        try:
+            self._open_changelog_before_write()
+            with self._index_lock:
+                matched = set(self._record_keys(self._record_filter(keys)))
+                keep = pa.array([key in matched for key in keys])
+                replaced = 0
+                if matched:
+                    vector_type = self.table.schema.field("vector").type
+                    source = changes.filter(keep)
+                    source = pa.table({"uuid": source.column("uuid"), "vector": source.column("vector").cast(vector_type)})
+                    replaced = self.table.merge_insert("uuid").when_matched_update_all().execute(source).num_updated_rows
+                    self._reindex_records([key[1] for key in matched], {sn for sn in changes.column("sn").to_pylist() if sn})
+                    self._mark_index_current()
+            if matched:
+                self._after_write()
+        except Exception as e:
+            app_logger.error(f"应用同步的 reembed 变更失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库写入失败: {e}")
+        if matched:
+            self._log_applied(changes.filter(keep))
+        missing = changes.filter(pc.invert(keep))
+        if missing.num_rows:
+            deleted = set()
+            log = self.changelog
+            if log is not None:
+                deleted = log.deleted_uuids(missing.column("uuid").to_pylist())
+            if deleted:
+                missing = missing.filter(pa.array([u not in deleted for u in missing.column("uuid").to_pylist()]))
+            replaced += self._apply_creates(missing) if missing.num_rows else 0
+        return replaced
+
+    def _reindex_records(self, uuids: List[str], sns: Set[str], chunk: int = 4096):
+        """
+        把按记录应用的同步变更（改名、删除、替换向量）增量同步到内存索引，代价与变更的记录数而非库大小成正比：
+        紧凑索引 / 快照按 uuid 移除这些记录后，从表中取回仍存在的记录重新加入；
+        人员索引按人员聚合，受影响的 sn 从表中重新读取该人的全部模板后重建。调用方持有 _index_lock。
+        """
+        if not self._has_memory_index or not uuids:
+            return
+        if self.compact_index is not None:
+            self.compact_index.remove_uuids(uuids)
+            for start in range(0, len(uuids), chunk):
+                rows = (self.table.search().where(f"uuid IN ({_sql_in(uuids[start:start + chunk])})")
+                        .select(["uuid", "sn", "name", "vector"]).to_arrow())
+                sns.update(rows.column("sn").to_pylist())
+                if rows.num_rows:
+                    self.compact_index.add(rows.column("uuid").to_pylist(), rows.column("sn").to_pylist(),
+                                           rows.column("name").to_pylist(), _vectors_from_arrow(rows.column("vector")))
+        if self.person_index is not None:
+            for sn in sns:
+                self.person_index.remove(sn)
+                rows = self.table.search().where(_sn_filter(sn)).select(["name", "vector"]).to_arrow()
+                if rows.num_rows:
+                    self.person_index.add(sn, rows.column("name")[-1].as_py(), _vectors_from_arrow(rows.column("vector")))
+
+    def _log_applied(self, changes: pa.Table):
+        """把已应用的同步变更（保留原始 origin 与 record_origin）记入本节点日志，供下游节点继续拉取。"""
+        log = self.changelog
+        if log is None:
+            return
+        try:
+            log.append_arrow(changes.drop(["seq", "changed_at"]))
+        except Exception as e:
+            app_logger.error(f"写入人脸库变更日志失败，下游节点将无法同步本批变更: {e}", exc_info=True)
+
+    @property
+    def _has_memory_index(self) -> bool:
+        return self.compact_index is not None or self.person_index is not None
+
+    def refresh_index(self):
+        """
+        从 LanceDB 分批读取全部向量，在新的索引对象上重建紧凑索引与人员索引，完成后在锁内整体替换引用；
+        重建期间的检索继续使用旧索引，不会看到构建了一半的索引。
+        """
+        if not self._has_memory_index:
+            return
+        started = time.perf_counter()
+        with self._index_lock:
+            version = self.table.version
+            snapshot = self.compact_index if isinstance(self.compact_index, GallerySnapshot) else None
+            compact_index = None
+            if snapshot is not None:
+                snapshot.sync(self.table, self.gallery_model)
+            elif self.compact_index is not None:
+                compact_index = CompactVectorIndex(dim=512, dtype=self.compact_index.dtype)
+            person_index = None
+            if self.person_index is not None:
+                person_index = PersonTemplateIndex(dim=512, max_exemplars=self.person_index.max_exemplars)
+            # 有快照时从内存映射中读取向量，否则从 LanceDB 分批读取
+            batches = snapshot.iter_batches(8192) if snapshot is not None else self._iter_table_batches(8192)
+            for uuids, sns, names, vectors in batches:
+                if compact_index is not None:
+                    compact_index.add(uuids, sns, names, vectors)
+                if person_index is not None:
+                    for i, (sn, name) in enumerate(zip(sns, names)):
+                        person_index.add(sn, name, vectors[i])
+            if compact_index is not None:
+                self.compact_index = compact_index
+            if person_index is not None:
+                self.person_index = person_index
+            self._index_version = version
+        self._index_checked_at = time.monotonic()
+        if snapshot is not None:
+            app_logger.info(
+                f"人脸库快照已加载: 版本 {snapshot.version}, {len(snapshot)} 条, "
+                f"映射 {snapshot.mapped_bytes / 1024 / 1024:.1f} MB, 耗时 {time.perf_counter() - started:.2f}s。"
+            )
+        elif self.compact_index is not None:
+            app_logger.info(
+                f"紧凑索引 ({self.compact_index.dtype}) 已重建: {len(self.compact_index)} 条, "
+                f"占用 {self.compact_index.nbytes / 1024 / 1024:.1f} MB, 耗时 {time.perf_counter() - started:.2f}s。"
+            )
+        if self.person_index is not None:
+            app_logger.info(
+                f"人员索引已重建: {len(self.person_index)} 人 / {self.person_index.template_total} 个模板, "
+                f"耗时 {time.perf_counter() - started:.2f}s。"
+            )
+
+    def _iter_table_batches(self, batch_size: int) -> Iterator[Tuple[List[str], List[str], List[str], np.ndarray]]:
+        for batch in self.table.search().select(["uuid", "sn", "name", "vector"]).to_batches(batch_size):
+            batch_table = pa.Table.from_batches([batch])
+            yield (batch_table.column("uuid").to_pylist(), batch_table.column("sn").to_pylist(),
+                   batch_table.column("name").to_pylist(), _vectors_from_arrow(batch_table.column("vector")))
+
+    def _maybe_refresh_index(self):
+        """定期检查表版本，发现其他进程/实例写入时重建索引。"""
+        now = time.monotonic()
+        if now - self._index_checked_at < self.index_refresh_seconds:
+            return
+        self._index_checked_at = now
+        try:
+            self.table.checkout_latest()
+            if self.table.version != self._index_version:
+                # 其他进程可能完成了特征重新提取，重新读取模型标记，快照据此决定能否复用旧向量
+                self.gallery_model = load_gallery_model(self.db_uri, self.table_name, self.recognition_model)
+                self.refresh_index()
+        except Exception as e:
+            app_logger.warning(f"检查 LanceDB 表版本失败: {e}")
+
+    def _mark_index_current(self):
+        # 本实例的写入已增量同步到索引，记录最新版本号避免触发全量重建
+        if self._has_memory_index:
+            self._index_version = self.table.version
+
 
     def create(self, name: str, sn: str, features: np.ndarray, image_path: Path) -> Dict[str, Any]:
         try:
-            new_record = LanceFaceSchema(uuid=str(uuid.uuid4()), vector=features, name=name, sn=sn,
-                                         image_path=str(image_path))
-            self.table.add([new_record.model_dump()])
+            self._open_changelog_before_write()
+            new_record = self.schema(uuid=str(uuid.uuid4()), vector=features, name=name, sn=sn,
+                                     image_path=str(image_path))
+            with self._index_lock:
+                self.table.add([new_record.model_dump()])
+                if self.compact_index is not None:
+                    self.compact_index.add([new_record.uuid], [sn], [name], np.asarray(features, dtype=np.float32))
+                if self.person_index is not None:
+                    self.person_index.add(sn, name, np.asarray(features, dtype=np.float32))
+                self._mark_index_current()
+            self._after_write()
+            record = new_record.model_dump()
+            self._record_change([{**record, "op": "create", "vector": np.asarray(features, dtype=np.float32),
+                                  "model": self.recognition_model or None}])
             app_logger.info(f"成功向 LanceDB 添加记录: SN={sn}, Name={name}")
-            return new_record.model_dump()
+            return record
         except Exception as e:
             app_logger.error(f"向 LanceDB 添加记录失败: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"数据库写入失败: {e}")
 
+    def iter_records(self, batch_size: int = 8192) -> Iterator[pa.RecordBatch]:
+        """按批次流式读取完整记录（含向量），用于整库导出。"""
+        yield from self.table.search().select(FACE_META_COLUMNS + ["vector"]).to_batches(batch_size)
+
+    def existing_uuids(self) -> set:
+        """读取全部记录的 uuid（只读这一列），供批量导入去重。"""
+        try:
+            return set(self.table.search().select(["uuid"]).to_arrow().column("uuid").to_pylist())
+        except Exception as e:
+            app_logger.error(f"读取 LanceDB 记录的 uuid 失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库读取失败: {e}")
+
+    def bulk_insert(self, records: pa.Table, model: Optional[str] = None) -> int:
+        """
+        以一次提交批量写入已校验、已去重的记录（uuid / vector / name / sn / image_path / registration_time，
+        可选 origin），随后重建内存索引、记入变更日志，并在后台合并新数据的索引。
+        model 为提取这些向量的识别模型（如归档文件中记录的模型），默认为当前配置的模型。
+        """
+        if records.num_rows == 0:
+            return 0
+        started = time.perf_counter()
+        count = records.num_rows
+        record_origin = records.column("origin") if "origin" in records.column_names else pa.nulls(count, pa.string())
+        records = records.drop([name for name in ("origin",) if name in records.column_names])
+        try:
+            self._open_changelog_before_write()
+            self.table.add(records.append_column("origin", record_origin.cast(pa.string()))
+                           .select(self.table.schema.names).cast(self.table.schema))
+            for column in list(self._pending_scalar_indices):
+                self._ensure_scalar_index(column)
+            self._start_optimize()
+            self.refresh_index()
+        except Exception as e:
+            app_logger.error(f"批量写入 LanceDB 失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库写入失败: {e}")
+        log = self.changelog
+        if log is not None:
+            try:
+                # 表中的 origin 是记录的来源节点，在日志中对应 record_origin；变更本身由本节点产生
+                log.append_arrow(records.append_column("op", pa.array(["create"] * count))
+                                 .append_column("record_origin", record_origin)
+                                 .append_column("model", pa.array([model or self.recognition_model or None] * count, pa.string())))
+            except Exception as e:
+                app_logger.error(f"写入人脸库变更日志失败，对等节点将无法同步本次导入: {e}", exc_info=True)
+        app_logger.info(f"✅ 批量写入 {count} 条人脸记录，耗时 {time.perf_counter() - started:.2f}s。")
+        return count
+
+    def replace_vectors(self, vectors: pa.Table, model: str) -> int:
+        """
+        按 uuid 以一次提交整体替换特征向量（vectors 只含 uuid / vector 两列），姓名等元数据不变，
+        期间被删除的记录自然跳过。用于更换识别模型后的原子切换：随后重建内存索引、把人脸库的模型标记更新为 model，
+        并把被替换的记录连同新特征作为 reembed 变更记入日志，对等节点据此更新同步过去的记录。返回被替换的记录数。
+        """
+        started = time.perf_counter()
+        replaced = 0
+        try:
+            if vectors.num_rows:
+                vector_type = self.table.schema.field("vector").type
+                source = pa.table({"uuid": vectors.column("uuid"), "vector": vectors.column("vector").cast(vector_type)})
+                replaced = self.table.merge_insert("uuid").when_matched_update_all().execute(source).num_updated_rows
+            save_gallery_model(self.db_uri, self.table_name, model)
+            self.gallery_model = model
+            if vectors.num_rows:
+                self._start_optimize()
+                if isinstance(self.compact_index, GallerySnapshot):
+                    # 快照按 uuid 复用已有向量，先移除被替换的记录，重建时从表中重新读取
+                    self.compact_index.remove_uuids(vectors.column("uuid").to_pylist())
+                self.refresh_index()
+        except Exception as e:
+            app_logger.error(f"批量替换 LanceDB 特征向量失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库写入失败: {e}")
+        log = self.changelog
+        if log is not None and replaced:
+            try:
+                self._log_reembedded(log, vectors, model)
+            except Exception as e:
+                app_logger.error(f"写入人脸库变更日志失败，对等节点将无法同步重新提取的特征: {e}", exc_info=True)
+        app_logger.info(f"✅ 已替换 {replaced} 条人脸记录的特征向量（模型 '{model}'），耗时 {time.perf_counter() - started:.2f}s。")
+        return replaced
+
+    def _log_reembedded(self, log: FaceChangeLog, vectors: pa.Table, model: str, chunk: int = 4096):
+        """按块读取被替换记录的当前元数据，与新特征一起作为 reembed 变更追加到日志。"""
+        uuids = vectors.column("uuid").to_pylist()
+        positions = {record_uuid: i for i, record_uuid in enumerate(uuids)}
+        for start in range(0, len(uuids), chunk):
+            rows = (self.table.search().where(f"uuid IN ({_sql_in(uuids[start:start + chunk])})")
+                    .select(FACE_META_COLUMNS + ["origin"]).to_arrow())
+            if rows.num_rows == 0:
+                continue
+            take = pa.array([positions[record_uuid] for record_uuid in rows.column("uuid").to_pylist()])
+            log.append_arrow(rows.drop(["origin"])
+                             .append_column("op", pa.array(["reembed"] * rows.num_rows))
+                             .append_column("vector", vectors.column("vector").take(take))
+                             .append_column("record_origin", rows.column("origin"))
+                             .append_column("model", pa.array([model] * rows.num_rows, pa.string())))
+
     def get_all(self) -> List[Dict[str, Any]]:
         try:
-            return self.table.to_pandas().to_dict('records')
+            return self.table.search().select(FACE_META_COLUMNS).to_arrow().to_pylist()
         except Exception as e:
             app_logger.error(f"从 LanceDB 读取所有记录失败: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"数据库读取失败: {e}")
 
+    def list_page(self, where: Optional[str], limit: int, offset: int = 0,
+                  cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按 uuid 顺序分页读取人脸元数据。指定 cursor（上一页最后一条记录的 uuid）时使用键集分页，
+        由 uuid 索引定位且排序在查询内、limit 之前完成，翻页代价与页码无关；否则使用 offset。
+        返回 (当前页, 下一页游标或 None)。
+        """
+        from lancedb.query import ColumnOrdering
+
+        try:
+            clauses = [c for c in (where, f"uuid > {_sql_str(cursor)}" if cursor is not None else None) if c]
+            query = self.table.search().select(FACE_META_COLUMNS)
+            if clauses:
+                query = query.where(" AND ".join(f"({c})" for c in clauses))
+            query = query.order_by([ColumnOrdering(column_name="uuid")])
+            if cursor is None and offset:
+                query = query.offset(offset)
+            # 多取一行用于判断是否还有下一页
+            rows = query.limit(limit + 1).to_arrow().to_pylist()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = rows[-1]["uuid"] if has_more and rows else None
+            return rows, next_cursor
+        except Exception as e:
+            app_logger.error(f"分页读取 LanceDB 记录失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库读取失败: {e}")
+
+    def iter_meta(self, where: Optional[str] = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """按批次流式读取人脸元数据，内存占用与表大小无关。"""
+        query = self.table.search().select(FACE_META_COLUMNS)
+        if where:
+            query = query.where(where)
+        for batch in query.to_batches(batch_size):
+            yield from batch.to_pylist()
+
+    def count(self, where: Optional[str] = None) -> int:
+        try:
+            return self.table.count_rows(where) if where else self.table.count_rows()
+        except Exception as e:
+            app_logger.error(f"统计 LanceDB 记录数失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库查询失败: {e}")
+
     def get_features_by_sn(self, sn: str) -> List[Dict[str, Any]]:
+        """按 SN 查询人脸元数据（经 sn 标量索引定位，不读取向量列）。"""
         try:
-            results_df = self.table.search().where(f"sn = '{sn}'").to_pandas()
-            return results_df.to_dict('records')
+            return self.table.search().where(_sn_filter(sn)).select(FACE_META_COLUMNS).to_arrow().to_pylist()
         except Exception as e:
             app_logger.error(f"根据 SN='{sn}' 从 LanceDB 查询失败: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"数据库查询失败: {e}")
 
-    def delete_by_sn(self, sn: str) -> int:
-        """使用正确的方式统计待删除的记录数。"""
+    def count_by_sn(self, sn: str) -> int:
+        """只统计行数，不物化任何列。"""
         try:
-            # 先用 search + where 查询，再用 len() 统计数量
-            records_to_delete = self.table.search().where(f"sn = '{sn}'").to_df()
-            count_to_delete = len(records_to_delete)
+            return self.table.count_rows(_sn_filter(sn))
+        except Exception as e:
+            app_logger.error(f"统计 SN='{sn}' 的记录数失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"数据库查询失败: {e}")
 
+    def delete_by_sn(self, sn: str, expected_count: Optional[int] = None) -> int:
+        """删除指定 SN 的全部记录。调用方已查询过匹配行数时可通过 expected_count 传入，避免重复统计。"""
+        try:
+            count_to_delete = self.count_by_sn(sn) if expected_count is None else expected_count
             if count_to_delete == 0:
                 return 0
-                
-            self.table.delete(f"sn = '{sn}'")
+
+            self._open_changelog_before_write()
+            with self._index_lock:
+                keys = self._record_keys(_sn_filter(sn)) if self.changelog is not None else []
+                self.table.delete(_sn_filter(sn))
+                if self.compact_index is not None:
+                    self.compact_index.remove_sn(sn)
+                if self.person_index is not None:
+                    self.person_index.remove(sn)
+                self._mark_index_current()
+            self._after_write()
+            self._record_change([{"op": "delete", "uuid": record_uuid, "sn": sn, "record_origin": origin}
+                                 for origin, record_uuid in keys])
             app_logger.info(f"成功从 LanceDB 中删除 {count_to_delete} 条 SN 为 '{sn}' 的记录。")
             return count_to_delete
         except Exception as e:
             app_logger.error(f"从 LanceDB 删除 SN='{sn}' 的记录失败: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"数据库删除失败: {e}")
 
-    def update_by_sn(self, sn: str, update_data: Dict[str, Any]) -> int:
-        """使用正确的方式统计待更新的记录数，并保留原生 update 的安全性。"""
+    def update_by_sn(self, sn: str, update_data: Dict[str, Any], expected_count: Optional[int] = None) -> int:
+        """更新指定 SN 的记录，保留原生 update 的安全性。expected_count 语义同 delete_by_sn。"""
         app_logger.info(f"正在为 SN='{sn}' 更新记录，更新内容: {update_data}")
         
         values_to_update = {}
@@ -122,23 +947,45 @@ class LanceDBFaceDataDAO(FaceDataDAO):
             return 0
         
         try:
-            # 使用正确的方法来统计将要被更新的记录数
-            count_to_update = len(self.table.search().where(f"sn = '{sn}'").to_df())
+            # 经 sn 标量索引统计将要被更新的记录数，不物化任何列
+            count_to_update = self.count_by_sn(sn) if expected_count is None else expected_count
             if count_to_update == 0:
                 app_logger.warning(f"尝试更新一个不存在的 SN: '{sn}'，操作已取消。")
                 return 0
 
             # 执行原生、安全的更新操作
-            self.table.update(where=f"sn = '{sn}'", values=values_to_update)
+            self._open_changelog_before_write()
+            with self._index_lock:
+                keys = self._record_keys(_sn_filter(sn)) if self.changelog is not None else []
+                self.table.update(where=_sn_filter(sn), values=values_to_update)
+                if self.compact_index is not None:
+                    self.compact_index.rename_sn(sn, values_to_update['name'])
+                if self.person_index is not None:
+                    self.person_index.rename(sn, values_to_update['name'])
+                self._mark_index_current()
+            self._after_write()
+            self._record_change([{"op": "update", "uuid": record_uuid, "sn": sn, "name": values_to_update['name'],
+                                  "record_origin": origin} for origin, record_uuid in keys])
             app_logger.info(f"✅ 成功提交了对 {count_to_update} 条 SN 为 '{sn}' 的记录的更新请求。")
             return count_to_update
         except Exception as e:
             app_logger.error(f"更新 SN='{sn}' 时发生错误: {e}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"数据库更新操作失败: {e}")
 
+    @traced("face_dao.search")
     def search(self, embedding: np.ndarray, threshold: float, top_k: int = 1) -> Optional[Tuple[str, str, float]]:
         try:
+            if self.person_index is not None:
+                return self._search_persons(embedding, threshold)
+            if self.compact_index is not None:
+                return self._search_compact(embedding, threshold)
             if self.table.count_rows() == 0: return None
+            if self.vector_storage == "float16":
+                # 半精度存储：多取若干候选，再对取回的 float16 向量在 float32 下计算余弦相似度重排；
+                # 表中没有 float32 原始向量，重排不能消除半精度舍入误差
+                search_result = self.table.search(embedding).metric("cosine").limit(max(top_k, self.rerank_candidates)).to_list()
+                if not search_result: return None
+                return self._rerank(embedding, search_result, threshold)
             search_result = self.table.search(embedding).metric("cosine").limit(top_k).to_list()
             if not search_result: return None
             best_match = search_result[0]
@@ -149,6 +996,78 @@ class LanceDBFaceDataDAO(FaceDataDAO):
         except Exception:
             return None
 
+    def _search_persons(self, embedding: np.ndarray, threshold: float) -> Optional[Tuple[str, str, float]]:
+        """先按人员质心粗排，再只对候选人员的代表模板精确比对。"""
+        self._maybe_refresh_index()
+        # 只读取一次引用：重建期间继续使用旧索引，替换后下一次检索即使用新索引
+        person_index = self.person_index
+        matches = person_index.search(embedding, self.person_candidates)
+        if not matches:
+            return None
+        sn, name, similarity = matches[0]
+        if similarity >= threshold:
+            return name, sn, similarity
+        return None
+
+    def _search_compact(self, embedding: np.ndarray, threshold: float) -> Optional[Tuple[str, str, float]]:
+        """先在紧凑索引上取近似 Top-N 候选，再取回候选在表中存储的向量重排（float32 存储时为精确相似度）。"""
+        self._maybe_refresh_index()
+        compact_index = self.compact_index
+        candidates = compact_index.candidates(embedding, self.rerank_candidates)
+        if not candidates:
+            return None
+        if isinstance(compact_index, GallerySnapshot):
+            # 快照保存的就是表中存储的向量（float16 存储时为其 float32 展开），得分与回表重排一致，无需回表
+            _, sn, name, similarity = candidates[0]
+            return (name, sn, similarity) if similarity >= threshold else None
+        rows = (self.table.search()
+                .where(f"uuid IN ({_sql_in([c[0] for c in candidates])})")
+                .select(["uuid", "name", "sn", "vector"])
+                .to_list())
+        return self._rerank(embedding, rows, threshold)
+
+    @staticmethod
+    def _rerank(embedding: np.ndarray, rows: List[Dict[str, Any]], threshold: float) -> Optional[Tuple[str, str, float]]:
+        if not rows:
+            return None
+        vectors = l2_normalize(np.asarray([row["vector"] for row in rows], dtype=np.float32))
+        similarities = vectors @ l2_normalize(embedding).reshape(-1)
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity >= threshold:
+            return rows[best]["name"], rows[best]["sn"], similarity
+        return None
+
     def dispose(self):
-        app_logger.info("LanceDB DAO 无需显式资源释放。")
-        pass
\ No newline at end of file
+        # 把本进程运行期间的增量写入合并到快照，下次启动可直接映射
+        if isinstance(self.compact_index, GallerySnapshot) and self.compact_index.dirty:
+            try:
+                self.table.checkout_latest()
+                self.compact_index.sync(self.table, self.gallery_model)
+            except Exception as e:
+                app_logger.warning(f"关闭时同步人脸库快照失败: {e}")
+        # 后台合并仍在写表目录时等待其结束，之后目录可以安全地移动或删除
+        if self._optimize_thread is not None:
+            self._optimize_thread.join()
+        app_logger.info("LanceDB DAO 资源已释放。")
+
+
+def create_face_dao(settings: AppSettings) -> FaceDataDAO:
+    """根据配置创建人脸数据访问对象。同一进程内应共享同一个实例，使写入对所有读取方立即可见。"""
+    cfg = settings.degirum
+    return LanceDBFaceDataDAO(
+        db_uri=cfg.lancedb_uri,
+        table_name=cfg.lancedb_table_name,
+        vector_storage=cfg.vector_storage,
+        vector_index=cfg.vector_index,
+        rerank_candidates=cfg.rerank_candidates,
+        index_refresh_seconds=cfg.index_refresh_seconds,
+        person_index=cfg.person_index,
+        person_exemplars=cfg.person_exemplars,
+        person_candidates=cfg.person_candidates,
+        snapshot_dir=cfg.snapshot_dir,
+        index_optimize_writes=cfg.index_optimize_writes,
+        changelog=settings.sync.changelog_enabled,
+        node_id=settings.sync.node_id,
+        recognition_model=cfg.recognition_model_name,
+    )
@@ -0,0 +1,185 @@
+# app/service/face_image_store.py
+import hashlib
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from app.cfg.config import FaceImageConfig
+from app.cfg.logging import app_logger
+from app.core.feed_variants import resize_to_width
+
+# 内容寻址的原图与缩略图目录（位于人脸图片根目录下，历史的 <sn>/ 子目录保持不变）
+OBJECTS_DIR = "_cas"
+THUMBS_DIR = "_thumbs"
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def object_path(root: Path, key: str, suffix: str = ".jpg") -> Path:
+    """内容哈希对应的存储路径：<root>/_cas/<前两位>/<哈希><扩展名>。"""
+    return Path(root) / OBJECTS_DIR / key[:2] / f"{key}{suffix}"
+
+
+def atomic_write(path: Path, data: bytes, fsync: bool = True):
+    """先写同目录下的临时文件再原子替换，读者不会看到写了一半的图片。"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def put_image_bytes(root: Path, data: bytes, suffix: str = ".jpg", fsync: bool = True) -> Path:
+    """同步保存已编码的图片（如批量导入时归档中附带的图片），按字节内容寻址去重，返回存储路径。"""
+    path = object_path(root, hashlib.blake2b(data, digest_size=16).hexdigest(), suffix)
+    if not path.exists():
+        atomic_write(path, data, fsync)
+    return path
+
+
+class FaceImageStore:
+    """
+    注册人脸图片的存储：
+
+    - 按内容寻址：以裁剪图像素（含形状）的 blake2b 哈希命名，存放在 _cas/<前两位>/<哈希>.jpg，
+      同一张裁剪图重复注册只存一份，已存在或正在写入的图片直接复用；
+    - save() 只计算哈希并把图片放入有界队列，立即返回最终路径；后台线程负责 JPEG 编码、原子写入（可选 fsync），
+      并一次性生成缩略图 (_thumbs/ 下与原图相同的相对路径)。队列满时退化为在调用线程中直接写入，不丢图片；
+    - 缩略图按需补生成：历史图片或尚未写完的图片在首次请求缩略图时生成并保存。
+    """
+
+    def __init__(self, cfg: FaceImageConfig, root: Path):
+        self.cfg = cfg
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._queue: "queue.Queue[Optional[Tuple[Path, np.ndarray]]]" = queue.Queue(maxsize=cfg.queue_size)
+        self._lock = threading.Lock()
+        self._pending: Set[Path] = set()
+        self._cancelled: Set[Path] = set()
+        self.stats_counters = {"saved": 0, "deduplicated": 0, "written": 0, "inline_writes": 0,
+                               "thumbnails": 0, "errors": 0}
+        self._worker = threading.Thread(target=self._worker_loop, name="FaceImageWriter", daemon=True)
+        self._worker.start()
+
+    # --- 路径 ---
+    @staticmethod
+    def content_key(face_img: np.ndarray) -> str:
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(str(face_img.shape).encode())
+        hasher.update(np.ascontiguousarray(face_img).data)
+        return hasher.hexdigest()
+
+    def relative_path(self, image_path: str) -> Optional[Path]:
+        """返回图片相对于人脸图片根目录的路径；不在根目录下（或含 ..）时返回 None。"""
+        try:
+            relative = Path(image_path).resolve().relative_to(self.root.resolve())
+        except (ValueError, OSError):
+            return None
+        return relative if relative.suffix.lower() in IMAGE_SUFFIXES else None
+
+    def thumbnail_path(self, relative: Path) -> Path:
+        ext = ".webp" if self.cfg.thumbnail_format == "webp" else ".jpg"
+        return self.root / THUMBS_DIR / relative.with_suffix(ext)
+
+    # --- 写入 ---
+    def save(self, face_img: np.ndarray) -> Path:
+        """登记一张人脸裁剪图并返回其存储路径（文件由后台线程写入）。"""
+        path = object_path(self.root, self.content_key(face_img))
+        self.stats_counters["saved"] += 1
+        with self._lock:
+            self._cancelled.discard(path)
+            if path in self._pending or path.exists():
+                self.stats_counters["deduplicated"] += 1
+                return path
+            self._pending.add(path)
+        try:
+            self._queue.put_nowait((path, np.ascontiguousarray(face_img).copy()))
+        except queue.Full:
+            self.stats_counters["inline_writes"] += 1
+            self._write(path, face_img)
+        return path
+
+    def _worker_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._write(*item)
+
+    def _write(self, path: Path, face_img: np.ndarray):
+        try:
+            with self._lock:
+                if path in self._cancelled:
+                    self._cancelled.discard(path)
+                    return
+            flag, encoded = cv2.imencode(".jpg", face_img, [cv2.IMWRITE_JPEG_QUALITY, self.cfg.jpeg_quality])
+            if not flag:
+                raise ValueError("JPEG 编码失败")
+            atomic_write(path, encoded.tobytes(), self.cfg.fsync)
+            self.stats_counters["written"] += 1
+            self._make_thumbnail(face_img, self.thumbnail_path(path.relative_to(self.root)))
+        except Exception as e:
+            self.stats_counters["errors"] += 1
+            app_logger.error(f"❌ 写入人脸图片 {path} 失败: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def _make_thumbnail(self, image: np.ndarray, thumb_path: Path):
+        height, width = image.shape[:2]
+        size = self.cfg.thumbnail_size
+        if max(height, width) > size:
+            image = resize_to_width(image, max(1, int(round(width * size / max(height, width)))))
+        if self.cfg.thumbnail_format == "webp":
+            flag, encoded = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, self.cfg.thumbnail_quality])
+        else:
+            flag, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.cfg.thumbnail_quality])
+        if not flag:
+            raise ValueError("缩略图编码失败")
+        atomic_write(thumb_path, encoded.tobytes(), self.cfg.fsync)
+        self.stats_counters["thumbnails"] += 1
+
+    # --- 读取与删除 ---
+    def thumbnail(self, relative: Path) -> Optional[Path]:
+        """返回缩略图路径；不存在时由原图生成一次。原图不存在（或尚未写完）时返回 None。"""
+        thumb_path = self.thumbnail_path(relative)
+        if thumb_path.exists():
+            return thumb_path
+        image = cv2.imread(str(self.root / relative), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        try:
+            self._make_thumbnail(image, thumb_path)
+        except (ValueError, OSError) as e:
+            app_logger.warning(f"生成缩略图 {thumb_path} 失败: {e}")
+            return None
+        return thumb_path
+
+    def remove(self, image_path: str):
+        """删除原图及其缩略图；仍在队列中的图片标记为取消，不再写入。调用方负责确认已无记录引用该图片。"""
+        path = Path(image_path)
+        with self._lock:
+            if path in self._pending:
+                self._cancelled.add(path)
+        relative = self.relative_path(image_path)
+        targets = [path] + ([self.thumbnail_path(relative)] if relative is not None else [])
+        for target in targets:
+            try:
+                target.unlink(missing_ok=True)
+            except OSError as e:
+                app_logger.warning(f"删除人脸图片 {target} 失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.stats_counters, "pending": self._queue.qsize()}
+
+    def close(self, timeout: float = 10.0):
+        """写完队列中剩余的图片后停止后台线程。"""
+        self._queue.put(None)
+        self._worker.join(timeout=timeout)
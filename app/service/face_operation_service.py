@@ -1,68 +1,75 @@
 # app/service/face_operation_service.py
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Any, Iterator, Optional
 from pathlib import Path
+from datetime import datetime
 import numpy as np
-import os
-from fastapi import HTTPException, status
+import shutil
+import uuid
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 
 from app.cfg.config import AppSettings
-from app.service.face_dao import FaceDataDAO, LanceDBFaceDataDAO
-from app.schema.face_schema import FaceInfo, FaceRecognitionResult, UpdateFaceRequest
+from app.service.face_dao import FaceDataDAO, create_face_dao, build_face_filter
+from app.service.gallery_archive import archive_format, export_gallery, import_gallery
+from app.service.face_image_store import FaceImageStore
+from app.service.face_changelog import is_remote_image
+from app.schema.face_schema import (
+    FaceInfo, FaceRecognitionResult, UpdateFaceRequest, FaceListFilter, GetAllFacesResponseData
+)
 from app.cfg.logging import app_logger
 # 导入 ModelPool
 from app.core.model_manager import ModelPool
-from app.core.image_utils import align_and_crop, decode_image, save_face_image
+from app.core.image_utils import align_and_crop, decode_image
+from app.core.embedding_cache import EmbeddingCache, FaceEntries
+from app.core.face_quality import FaceQualityScorer
+from app.core.tracing import span
 
 class FaceOperationService:
     """
     通过向模型池借用/归还模型来处理人脸静态业务。
     """
-    def __init__(self, settings: AppSettings, model_pool: ModelPool):
+    def __init__(self, settings: AppSettings, model_pool: ModelPool, face_dao: Optional[FaceDataDAO] = None):
         app_logger.info("正在初始化 FaceOperationService (使用模型池)...")
         self.settings = settings
         # 持有对模型池的引用
         self.model_pool = model_pool
 
-        self.face_dao: FaceDataDAO = LanceDBFaceDataDAO(
-            db_uri=self.settings.degirum.lancedb_uri,
-            table_name=self.settings.degirum.lancedb_table_name,
-        )
+        # 优先使用应用级共享的 DAO，保证注册/删除对视频流识别立即可见
+        self.face_dao: FaceDataDAO = face_dao or create_face_dao(self.settings)
         self.image_db_path = Path(self.settings.degirum.image_db_path)
         self.image_db_path.mkdir(parents=True, exist_ok=True)
+        # 注册图片由后台线程按内容寻址落盘并生成缩略图，注册请求不等待磁盘写入
+        self.image_store = FaceImageStore(self.settings.face_image, self.image_db_path)
 
-    async def register_face(self, name: str, sn: str, image_bytes: bytes) -> FaceInfo:
-        models = None
-        try:
-            # 从池中获取一套模型
-            models = self.model_pool.acquire()
-            if models is None:
-                raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "服务正忙，请稍后再试。")
-            
-            detection_model, recognition_model = models
+        # 内容哈希缓存：与当前模型组合绑定，模型变更时自动失效
+        cache_cfg = self.settings.embedding_cache
+        self.embedding_cache = EmbeddingCache(
+            max_entries=cache_cfg.max_entries,
+            ttl_seconds=cache_cfg.ttl_seconds,
+            model_signature=self.model_signature,
+            enabled=cache_cfg.enabled,
+        )
 
+        self.quality_scorer = FaceQualityScorer(self.settings.face_quality)
+
+    @property
+    def model_signature(self) -> str:
+        """当前检测/识别模型组合的签名，用作缓存失效依据。"""
+        return f"{self.settings.degirum.detection_model_name}|{self.settings.degirum.recognition_model_name}"
+
+    def _extract_faces(self, image_bytes: bytes, img: Optional[np.ndarray] = None) -> FaceEntries:
+        """
+        检测图像中的人脸并提取特征向量，返回 [(检测元数据, 特征向量或None), ...]。
+        优先命中内容哈希缓存；仅在未命中时才从模型池借用模型占用 NPU。
+        """
+        image_key = self.embedding_cache.image_key(image_bytes)
+        cached_faces = self.embedding_cache.get_image(image_key)
+        if cached_faces is not None:
+            return cached_faces
+
+        if img is None:
             img = decode_image(image_bytes)
-            detection_result = detection_model.predict(img)
-            faces = detection_result.results
-            if not faces:
-                raise HTTPException(status_code=400, detail="未在图像中检测到任何人脸。")
-            if len(faces) > 1:
-                raise HTTPException(status_code=400, detail=f"检测到 {len(faces)} 张人脸，注册时必须确保只有一张。")
-            face = faces[0]
-            landmarks = [lm["landmark"] for lm in face.get("landmarks", [])]
-            aligned_face, _ = align_and_crop(img, landmarks)
-            recognition_result = recognition_model.predict(aligned_face)
-            embedding = recognition_result.results[0]['data'][0]
-            x1, y1, x2, y2 = map(int, face["bbox"])
-            face_img_to_save = img[y1:y2, x1:x2]
-            saved_path = save_face_image(face_img_to_save, sn, self.image_db_path)
-            new_record = self.face_dao.create(name, sn, np.array(embedding), saved_path)
-            return FaceInfo.model_validate(new_record)
-        finally:
-            # 确保无论成功或失败，都将模型归还到池中
-            if models:
-                self.model_pool.release(models)
 
-    async def recognize_face(self, image_bytes: bytes) -> List[FaceRecognitionResult]:
         models = None
         try:
             # 从池中获取一套模型
@@ -71,62 +78,184 @@ class FaceOperationService:
                 raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "服务正忙，请稍后再试。")
 
             detection_model, recognition_model = models
-            # ... 后续的检测、识别逻辑完全不变 ...
-            img = decode_image(image_bytes)
-            detection_result = detection_model.predict(img)
-            detected_faces_data = detection_result.results
-            if not detected_faces_data: return []
-            aligned_faces, valid_faces_meta = [], []
-            for face_data in detected_faces_data:
+            with span("detect.predict"):
+                detected_faces_data = detection_model.predict(img).results
+            faces: FaceEntries = [(face_data, None) for face_data in detected_faces_data]
+
+            # 对齐人脸并做质量评估，合格的人脸再以裁剪图哈希查询人脸级缓存，只对未命中的人脸做特征提取
+            pending_faces, pending_indices, pending_keys = [], [], []
+            for i, face_data in enumerate(detected_faces_data):
                 landmarks = [lm["landmark"] for lm in face_data.get("landmarks", [])]
-                if len(landmarks) == 5:
-                    aligned_face, _ = align_and_crop(img, landmarks)
-                    if aligned_face.size > 0:
-                        aligned_faces.append(aligned_face)
-                        valid_faces_meta.append(face_data)
-            if not aligned_faces: return []
-            final_results = []
-            batch_rec_results = recognition_model.predict_batch(aligned_faces)
-            for i, rec_result in enumerate(batch_rec_results):
-                embedding = np.array(rec_result.results[0]['data'][0])
-                face_meta = valid_faces_meta[i]
-                search_res = self.face_dao.search(embedding, self.settings.degirum.recognition_similarity_threshold)
-                if search_res:
-                    name, sn, similarity = search_res
-                    final_results.append(FaceRecognitionResult(
-                        name=name, sn=sn, similarity=similarity,
-                        box=list(map(int, face_meta["bbox"])),
-                        detection_confidence=float(face_meta.get("score", 0.0)),
-                        landmark=[lm["landmark"] for lm in face_meta.get("landmarks", [])]
-                    ))
-            return final_results
+                if len(landmarks) != 5:
+                    continue
+                aligned_face, _ = align_and_crop(img, landmarks)
+                if aligned_face.size == 0:
+                    continue
+                quality = self.quality_scorer.assess(face_data, aligned_face)
+                face_data = {**face_data, "quality": quality.score, "quality_issue": quality.issue}
+                faces[i] = (face_data, None)
+                if quality.issue is not None:
+                    continue
+                crop_key = self.embedding_cache.crop_key(aligned_face)
+                cached_embedding = self.embedding_cache.get_crop(crop_key)
+                if cached_embedding is not None:
+                    faces[i] = (face_data, cached_embedding)
+                else:
+                    pending_faces.append(aligned_face)
+                    pending_indices.append(i)
+                    pending_keys.append(crop_key)
+
+            if pending_faces:
+                with span("recognize.predict_batch", faces=len(pending_faces)):
+                    # predict_batch 返回惰性生成器，在 span 内取完结果才能计入真实推理耗时
+                    batch_rec_results = list(recognition_model.predict_batch(pending_faces))
+                for face_index, crop_key, rec_result in zip(pending_indices, pending_keys, batch_rec_results):
+                    embedding = np.array(rec_result.results[0]['data'][0], dtype=np.float32)
+                    self.embedding_cache.put_crop(crop_key, embedding)
+                    faces[face_index] = (faces[face_index][0], embedding)
         finally:
-            # 确保模型被归还
+            # 确保无论成功或失败，都将模型归还到池中
             if models:
                 self.model_pool.release(models)
 
-    # 其他纯数据库操作的方法 (get_all_faces, delete_face_by_sn 等) 无需修改
-    async def get_all_faces(self) -> List[FaceInfo]:
-        all_faces_data = self.face_dao.get_all()
-        return [FaceInfo.model_validate(face) for face in all_faces_data]
+        self.embedding_cache.put_image(image_key, faces)
+        return faces
+
+    async def register_face(self, name: str, sn: str, image_bytes: bytes) -> FaceInfo:
+        img = decode_image(image_bytes)
+        faces = self._extract_faces(image_bytes, img)
+        if not faces:
+            raise HTTPException(status_code=400, detail="未在图像中检测到任何人脸。")
+        if len(faces) > 1:
+            raise HTTPException(status_code=400, detail=f"检测到 {len(faces)} 张人脸，注册时必须确保只有一张。")
+        face, embedding = faces[0]
+        if face.get("quality_issue"):
+            raise HTTPException(status_code=400, detail=f"人脸质量不合格，无法注册: {face['quality_issue']}。")
+        if embedding is None:
+            raise HTTPException(status_code=400, detail="人脸关键点不完整，无法完成对齐与特征提取。")
+        x1, y1, x2, y2 = map(int, face["bbox"])
+        face_img_to_save = img[y1:y2, x1:x2]
+        saved_path = self.image_store.save(face_img_to_save)
+        new_record = self.face_dao.create(name, sn, np.array(embedding), saved_path)
+        return self._face_info(new_record)
+
+    async def recognize_face(self, image_bytes: bytes) -> List[FaceRecognitionResult]:
+        faces = self._extract_faces(image_bytes)
+        final_results = []
+        for face_meta, embedding in faces:
+            if embedding is None:
+                continue
+            search_res = self.face_dao.search(embedding, self.settings.degirum.recognition_similarity_threshold)
+            if search_res:
+                name, sn, similarity = search_res
+                final_results.append(FaceRecognitionResult(
+                    name=name, sn=sn, similarity=similarity,
+                    box=list(map(int, face_meta["bbox"])),
+                    detection_confidence=float(face_meta.get("score", 0.0)),
+                    landmark=[lm["landmark"] for lm in face_meta.get("landmarks", [])],
+                    quality=face_meta.get("quality"),
+                ))
+        return final_results
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        return self.embedding_cache.stats()
+
+    def _face_info(self, record: Dict[str, Any]) -> FaceInfo:
+        """把数据库记录转换为 FaceInfo，并附上本机图片目录下注册图片的缩略图地址。"""
+        face_info = FaceInfo.model_validate(record)
+        relative = self.image_store.relative_path(face_info.image_path) if face_info.image_path else None
+        if relative is not None:
+            face_info.thumbnail_url = f"/api/face/thumbnails/{relative.as_posix()}"
+        return face_info
+
+    def get_thumbnail(self, relative_path: str) -> Path:
+        """返回注册图片的缩略图文件（首次访问时生成），路径越出图片目录或图片不存在时返回 404。"""
+        relative = self.image_store.relative_path(str(self.image_db_path / relative_path))
+        thumbnail = self.image_store.thumbnail(relative) if relative is not None else None
+        if thumbnail is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="未找到该人脸图片。")
+        return thumbnail
+
+    async def list_faces(self, filters: FaceListFilter, limit: int, offset: int = 0,
+                         cursor: Optional[str] = None) -> GetAllFacesResponseData:
+        """分页获取人脸元数据（不含特征向量），支持游标与偏移两种翻页方式。"""
+        cursor_value = None
+        if cursor:
+            try:
+                cursor_value = str(uuid.UUID(cursor))
+            except ValueError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标。")
+        where = build_face_filter(**filters.model_dump())
+        rows, next_cursor = self.face_dao.list_page(where, limit, offset=offset, cursor=cursor_value)
+        return GetAllFacesResponseData(
+            count=self.face_dao.count(where),
+            faces=[self._face_info(row) for row in rows],
+            next_cursor=next_cursor,
+        )
+
+    def stream_faces(self, filters: FaceListFilter) -> Iterator[bytes]:
+        """以 NDJSON（每行一个人脸）流式输出全部匹配的人脸元数据，内存占用恒定。"""
+        where = build_face_filter(**filters.model_dump())
+        for row in self.face_dao.iter_meta(where):
+            yield self._face_info(row).model_dump_json().encode("utf-8") + b"\n"
+
+    # 其他纯数据库操作的方法 (delete_face_by_sn 等) 无需修改
     async def get_face_by_sn(self, sn: str) -> List[FaceInfo]:
         faces_data = self.face_dao.get_features_by_sn(sn)
         if not faces_data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"未找到SN为 '{sn}' 的人脸记录。")
-        return [FaceInfo.model_validate(face) for face in faces_data]
+        return [self._face_info(face) for face in faces_data]
     async def update_face_by_sn(self, sn: str, update_data: UpdateFaceRequest) -> Tuple[int, FaceInfo]:
-        update_dict = update_data.model_dump(exclude_unset=True)
+        # 显式传入的 null 不是有效的更新值，与未提供同样处理
+        update_dict = update_data.model_dump(exclude_unset=True, exclude_none=True)
         if not update_dict:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="请求体中未提供任何更新数据。")
-        await self.get_face_by_sn(sn)
-        updated_count = self.face_dao.update_by_sn(sn, update_dict)
-        updated_face_info_list = self.face_dao.get_features_by_sn(sn)
-        return updated_count, FaceInfo.model_validate(updated_face_info_list[0])
+        # 只查询一次：既用于存在性校验，也作为更新后返回数据的基础（合并更新字段后重新校验）
+        records = await self.get_face_by_sn(sn)
+        updated_count = self.face_dao.update_by_sn(sn, update_dict, expected_count=len(records))
+        return updated_count, FaceInfo.model_validate({**records[0].model_dump(), **update_dict})
     async def delete_face_by_sn(self, sn: str) -> int:
         records_to_delete = await self.get_face_by_sn(sn)
-        deleted_count = self.face_dao.delete_by_sn(sn)
+        deleted_count = self.face_dao.delete_by_sn(sn, expected_count=len(records_to_delete))
         if deleted_count > 0:
-            for record_info in records_to_delete:
-                image_path = Path(record_info.image_path)
-                if image_path.exists(): os.remove(image_path)
-        return deleted_count
\ No newline at end of file
+            # 内容寻址的图片可能被其他记录共用（同一张照片注册到多个 SN），只删除已无记录引用的图片；
+            # 同步而来的记录的图片在来源节点上，本地没有可删除的文件
+            for image_path in {record_info.image_path for record_info in records_to_delete
+                               if record_info.image_path and not is_remote_image(record_info.image_path)}:
+                if self.face_dao.count(build_face_filter(image_path=image_path)) == 0:
+                    self.image_store.remove(image_path)
+        return deleted_count
+
+    def close(self):
+        """写完队列中尚未落盘的注册图片。"""
+        self.image_store.close()
+
+    # --- 人脸库整体导出/导入 ---
+    def export_gallery(self, fmt: str, include_images: bool = False, vector_dtype: str = "float32") -> Dict[str, Any]:
+        """把整个人脸库导出到临时目录下的归档文件，返回导出结果（含文件路径），文件由调用方在发送后删除。"""
+        cfg = self.settings.gallery_archive
+        path = Path(cfg.tmp_dir) / f"gallery-{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.{fmt}"
+        return export_gallery(self.face_dao, path, fmt, include_images=include_images, vector_dtype=vector_dtype,
+                              recognition_model=self.settings.degirum.recognition_model_name,
+                              batch_size=cfg.batch_size, compression=cfg.parquet_compression)
+
+    async def import_gallery(self, upload: UploadFile, write_images: bool = True, force: bool = False) -> Dict[str, Any]:
+        """把上传的归档文件落盘到临时目录后整体导入，不经过模型推理。"""
+        cfg = self.settings.gallery_archive
+        tmp_dir = Path(cfg.tmp_dir)
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fmt = archive_format(Path(upload.filename or ""))
+        path = tmp_dir / f"upload-{uuid.uuid4().hex}.{fmt}"
+        try:
+            def save_upload():
+                with open(path, "wb") as f:
+                    shutil.copyfileobj(upload.file, f, 1024 * 1024)
+            await run_in_threadpool(save_upload)
+            return await run_in_threadpool(
+                import_gallery, self.face_dao, path, self.image_db_path if write_images else None,
+                self.settings.degirum.recognition_model_name, force, cfg.batch_size,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        finally:
+            path.unlink(missing_ok=True)
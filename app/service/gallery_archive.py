@@ -0,0 +1,225 @@
+# app/service/gallery_archive.py
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from app.cfg.logging import app_logger
+from app.service.face_dao import FaceDataDAO
+from app.service.face_image_store import IMAGE_SUFFIXES, put_image_bytes
+
+ARCHIVE_FORMATS = ("parquet", "arrow")
+ARCHIVE_VERSION = "1"
+ARCHIVE_MEDIA_TYPES = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.file"}
+_SUFFIX_FORMATS = {".parquet": "parquet", ".pq": "parquet", ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow"}
+_REQUIRED_COLUMNS = ("uuid", "sn", "name", "vector")
+
+
+def archive_format(path: Path, fmt: Optional[str] = None) -> str:
+    """确定归档格式：显式指定优先，否则按扩展名判断，无法判断时使用 parquet。"""
+    if fmt:
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError(f"不支持的归档格式: {fmt}")
+        return fmt
+    return _SUFFIX_FORMATS.get(Path(path).suffix.lower(), "parquet")
+
+
+def archive_schema(vector_type: pa.DataType = pa.float32(), include_images: bool = False, dim: int = 512) -> pa.Schema:
+    fields = [
+        pa.field("uuid", pa.string(), nullable=False),
+        pa.field("sn", pa.string(), nullable=False),
+        pa.field("name", pa.string(), nullable=False),
+        pa.field("image_path", pa.string()),
+        pa.field("registration_time", pa.timestamp("us")),
+        pa.field("vector", pa.list_(vector_type, dim), nullable=False),
+    ]
+    if include_images:
+        fields.append(pa.field("image", pa.binary()))
+    return pa.schema(fields)
+
+
+def _read_image(path: Optional[str]) -> Optional[bytes]:
+    if not path:
+        return None
+    try:
+        return Path(path).read_bytes()
+    except OSError:
+        return None
+
+
+def export_gallery(face_dao: FaceDataDAO, path: Path, fmt: Optional[str] = None, include_images: bool = False,
+                   vector_dtype: str = "float32", recognition_model: str = "", batch_size: int = 8192,
+                   compression: str = "zstd") -> Dict[str, Any]:
+    """
+    流式导出整个人脸库（元数据 + 特征向量，可选附带人脸图片字节）到 Parquet 或 Arrow IPC 文件，内存占用与库大小无关。
+    提取向量的模型（人脸库当前的模型，重新提取特征的任务切换前仍是旧模型）写入文件元数据，导入时据此拒绝由其他模型提取的向量。
+    先写临时文件再原子替换，中断不会留下半个文件。
+    """
+    started = time.perf_counter()
+    path = Path(path)
+    fmt = archive_format(path, fmt)
+    vector_type = pa.float16() if vector_dtype == "float16" else pa.float32()
+    gallery_model = getattr(face_dao, "gallery_model", None) or recognition_model
+    metadata = {
+        "format_version": ARCHIVE_VERSION, "recognition_model": recognition_model, "gallery_model": gallery_model,
+        "vector_dim": "512",
+        "vector_dtype": vector_dtype, "exported_at": datetime.now().isoformat(timespec="seconds"),
+        "node_id": getattr(face_dao, "node_id", None) or "",
+    }
+    schema = archive_schema(vector_type, include_images).with_metadata(metadata)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    rows = images = 0
+    try:
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(tmp_path, schema, compression=None if compression == "none" else compression)
+            write = writer.write_table
+        else:
+            writer = pa.ipc.new_file(str(tmp_path), schema)
+            write = writer.write_table
+        with writer:
+            for batch in face_dao.iter_records(batch_size):
+                columns = {name: batch.column(name) for name in ("uuid", "sn", "name", "image_path", "registration_time")}
+                columns["vector"] = batch.column("vector").cast(pa.list_(vector_type, 512))
+                if include_images:
+                    blobs = [_read_image(p) for p in batch.column("image_path").to_pylist()]
+                    images += sum(blob is not None for blob in blobs)
+                    columns["image"] = pa.array(blobs, type=pa.binary())
+                write(pa.table(columns).cast(schema))
+                rows += batch.num_rows
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    result = {"format": fmt, "path": str(path), "rows": rows, "images": images, "bytes": path.stat().st_size,
+              "seconds": round(time.perf_counter() - started, 3)}
+    app_logger.info(f"人脸库已导出: {result}")
+    return result
+
+
+def _open_archive(path: Path, fmt: str, batch_size: int):
+    """返回 (schema, 记录批次迭代器)。Arrow IPC 文件以内存映射方式读取，不复制向量数据。"""
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        archive = pq.ParquetFile(path)
+        return archive.schema_arrow, archive.iter_batches(batch_size)
+    reader = pa.ipc.open_file(pa.memory_map(str(path), "r"))
+    return reader.schema, (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+
+def _batch_vectors(column: pa.FixedSizeListArray) -> np.ndarray:
+    """取出定长列表列的底层数据（含空行所占的槽位），以 float32 二维数组返回；元素为空时为 NaN。"""
+    dim = column.type.list_size
+    flat = column.values.slice(column.offset * dim, len(column) * dim).to_numpy(zero_copy_only=False)
+    return np.asarray(flat, dtype=np.float32).reshape(len(column), dim)
+
+
+def _valid_rows(batch: pa.RecordBatch, vectors: np.ndarray) -> np.ndarray:
+    """校验每一行：uuid / sn / name 非空，向量无缺失、均为有限值且不是零向量。"""
+    valid = np.ones(batch.num_rows, dtype=bool)
+    for name in ("uuid", "sn", "name", "vector"):
+        column = batch.column(name)
+        if column.null_count:
+            valid &= ~np.asarray(column.is_null().to_numpy(zero_copy_only=False))
+    for name in ("uuid", "sn"):
+        valid &= np.asarray(pc.fill_null(pc.greater(pc.utf8_length(batch.column(name)), 0), False).to_numpy(zero_copy_only=False))
+    with np.errstate(invalid="ignore", over="ignore"):
+        valid &= np.isfinite(vectors).all(axis=1) & (np.linalg.norm(vectors, axis=1) > 1e-6)
+    return valid
+
+
+def import_gallery(face_dao: FaceDataDAO, path: Path, image_db_path: Optional[Path] = None,
+                   recognition_model: str = "", force: bool = False, batch_size: int = 8192) -> Dict[str, Any]:
+    """
+    从 export_gallery 产生的文件导入人脸库：逐批校验向量、按 uuid 去重（与库中已有记录及文件内部），
+    合格的记录以一次提交批量写入，随后重建内存索引。文件带有人脸图片且指定了 image_db_path 时，
+    图片写入本地人脸图片目录并改写 image_path。提取向量的模型与本机人脸库的模型不一致时拒绝导入（force 可跳过该检查），
+    导入的记录连同该模型一起记入变更日志。
+    """
+    started = time.perf_counter()
+    path = Path(path)
+    fmt = archive_format(path)
+    try:
+        schema, batches = _open_archive(path, fmt, batch_size)
+    except (OSError, pa.ArrowInvalid) as e:
+        raise ValueError(f"无法读取 {fmt} 归档文件: {e}")
+    missing = [name for name in _REQUIRED_COLUMNS if name not in schema.names]
+    if missing:
+        raise ValueError(f"归档文件缺少必要的列: {missing}")
+    vector_type = schema.field("vector").type
+    if not pa.types.is_fixed_size_list(vector_type) or vector_type.list_size != 512:
+        raise ValueError(f"向量列必须是 512 维的定长列表，实际为 {vector_type}")
+    metadata = {k.decode(): v.decode() for k, v in (schema.metadata or {}).items()}
+    # 旧版本的归档只记录了导出时配置的识别模型
+    archived_model = metadata.get("gallery_model") or metadata.get("recognition_model")
+    local_model = getattr(face_dao, "gallery_model", None) or recognition_model
+    if archived_model and local_model and archived_model != local_model and not force:
+        raise ValueError(f"归档文件的特征由模型 '{archived_model}' 提取，与本机人脸库的模型 '{local_model}' 不一致。")
+    write_images = image_db_path is not None and "image" in schema.names
+
+    seen = face_dao.existing_uuids()
+    stats = {"total": 0, "imported": 0, "duplicates": 0, "invalid": 0, "images_written": 0}
+    accepted = []
+    for batch in _iter_batches(batches):
+        stats["total"] += batch.num_rows
+        vectors = _batch_vectors(batch.column("vector"))
+        valid = _valid_rows(batch, vectors)
+        stats["invalid"] += int((~valid).sum())
+        uuids = batch.column("uuid").to_pylist()
+        keep = np.zeros(batch.num_rows, dtype=bool)
+        for i in np.flatnonzero(valid):
+            if uuids[i] in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(uuids[i])
+            keep[i] = True
+        if not keep.any():
+            continue
+        batch = batch.filter(pa.array(keep))
+        now = pa.scalar(datetime.now(), type=pa.timestamp("us"))
+        image_paths = batch.column("image_path") if "image_path" in batch.schema.names else pa.nulls(batch.num_rows, pa.string())
+        if write_images:
+            image_paths = pa.array(_write_images(batch, Path(image_db_path), stats), type=pa.string())
+        registration = (batch.column("registration_time").cast(pa.timestamp("us"))
+                        if "registration_time" in batch.schema.names else pa.nulls(batch.num_rows, pa.timestamp("us")))
+        accepted.append(pa.table({
+            "uuid": batch.column("uuid"),
+            "vector": batch.column("vector").cast(pa.list_(pa.float32(), 512)),
+            "name": batch.column("name"),
+            "sn": batch.column("sn"),
+            "image_path": pc.fill_null(image_paths.cast(pa.string()), ""),
+            "registration_time": pc.fill_null(registration, now),
+        }))
+    if accepted:
+        stats["imported"] = face_dao.bulk_insert(pa.concat_tables(accepted), model=archived_model or local_model or None)
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    app_logger.info(f"人脸库已从 {path} 导入: {stats}")
+    return stats
+
+
+def _iter_batches(batches) -> Iterator[pa.RecordBatch]:
+    try:
+        yield from batches
+    except (OSError, pa.ArrowInvalid) as e:
+        raise ValueError(f"归档文件已损坏: {e}")
+
+
+def _write_images(batch: pa.RecordBatch, image_db_path: Path, stats: Dict[str, Any]) -> list:
+    """把归档中的人脸图片按内容寻址写入本地图片目录（与注册时的存储方式一致），返回新的 image_path 列。"""
+    paths = []
+    original = batch.column("image_path").to_pylist() if "image_path" in batch.schema.names else [None] * batch.num_rows
+    for blob, old_path in zip(batch.column("image").to_pylist(), original):
+        if blob is None:
+            paths.append(old_path)
+            continue
+        suffix = Path(old_path or "").suffix.lower()
+        # 批量导入不逐张 fsync，避免成千上万次同步写盘拖慢导入
+        paths.append(str(put_image_bytes(image_db_path, blob, suffix if suffix in IMAGE_SUFFIXES else ".jpg", fsync=False)))
+        stats["images_written"] += 1
+    return paths
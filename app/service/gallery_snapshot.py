@@ -0,0 +1,290 @@
+# app/service/gallery_snapshot.py
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from app.cfg.logging import app_logger
+from app.service.vector_index import l2_normalize
+
+_CURRENT_FILE = "CURRENT"
+_VECTORS_FILE = "vectors.npy"
+_META_FILE = "meta.arrow"
+_MANIFEST_FILE = "manifest.json"
+
+
+class GallerySnapshot:
+    """
+    人脸库的内存映射快照：按 LanceDB 表版本号落盘为一个目录，
+    包含连续的 float32 归一化向量块 (vectors.npy) 与 uuid/sn/name 附表 (meta.arrow)。
+
+    - 启动时直接 np.load(mmap_mode="r") 打开，无需把向量反序列化为 Python 对象；
+    - 多个进程映射同一文件时共享操作系统页缓存，不再各自持有一份私有副本；
+    - 表版本变化时只读取 uuid/sn/name 三列做差异比对，仅为新增行取回向量，增量生成新版本；
+    - 本进程的写入先记入内存增量，下一次同步时合并落盘；被替换向量的记录先从快照中移除，同步时重新取回；
+    - 清单中记录提取向量的识别模型，与人脸库的模型不一致时（如其他进程完成了重新提取）不复用任何旧向量。
+
+    检索对表中存储的向量计算 float32 余弦相似度（float16 存储时含半精度舍入误差），接口与 CompactVectorIndex 一致。
+    """
+
+    _CHUNK_ROWS = 32768
+    _KEEP_VERSIONS = 2
+
+    def __init__(self, root: Path, dim: int = 512):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.dtype = "snapshot"
+        self._lock = threading.RLock()
+        self.version = -1
+        self.model = ""
+        self._vectors: np.ndarray = np.zeros((0, dim), dtype=np.float32)
+        self._valid = np.zeros((0,), dtype=bool)
+        self.uuids: List[str] = []
+        self.sns: List[str] = []
+        self.names: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._reset_delta()
+
+    def _reset_delta(self):
+        self._delta_vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._delta_uuids: List[str] = []
+        self._delta_sns: List[str] = []
+        self._delta_names: List[str] = []
+
+    def __len__(self) -> int:
+        return int(self._valid.sum()) + len(self._delta_uuids)
+
+    @property
+    def nbytes(self) -> int:
+        """私有内存占用（不含被多进程共享的映射文件）。"""
+        return int(self._delta_vectors.nbytes + self._valid.nbytes)
+
+    @property
+    def mapped_bytes(self) -> int:
+        return int(self._vectors.nbytes)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._delta_uuids) or not bool(self._valid.all())
+
+    # --- 快照读写 ---
+    def open(self) -> bool:
+        """打开 CURRENT 指向的快照版本，成功返回 True。"""
+        current = self.root / _CURRENT_FILE
+        if not current.exists():
+            return False
+        try:
+            version_dir = self.root / current.read_text().strip()
+            manifest = json.loads((version_dir / _MANIFEST_FILE).read_text())
+            vectors = np.load(version_dir / _VECTORS_FILE, mmap_mode="r")
+            with pa.memory_map(str(version_dir / _META_FILE)) as source:
+                meta = pa.ipc.open_file(source).read_all()
+        except Exception as e:
+            app_logger.warning(f"打开人脸库快照失败，将从 LanceDB 重建: {e}")
+            return False
+        if vectors.shape != (manifest["rows"], self.dim) or meta.num_rows != manifest["rows"]:
+            app_logger.warning(f"人脸库快照 {version_dir.name} 数据不完整，将从 LanceDB 重建。")
+            return False
+        with self._lock:
+            self.version = int(manifest["version"])
+            self.model = manifest.get("model") or ""
+            self._vectors = vectors
+            self._valid = np.ones(len(vectors), dtype=bool)
+            self.uuids = meta.column("uuid").to_pylist()
+            self.sns = meta.column("sn").to_pylist()
+            self.names = meta.column("name").to_pylist()
+            self._positions = {record_uuid: i for i, record_uuid in enumerate(self.uuids)}
+            self._reset_delta()
+        return True
+
+    def sync(self, table, model: str = "") -> bool:
+        """
+        使快照与 LanceDB 表的当前版本一致，返回是否生成了新版本。
+        先尝试打开已有快照（可能已由其他进程生成），再按 uuid 做增量合并；
+        model 为人脸库当前的识别模型，与快照记录的模型不一致时全部向量重新读取。
+        """
+        model = model or ""
+        table_version = table.version
+        if self.version != table_version or self.model != model:
+            self.open()
+        if self.version == table_version and self.model == model and not self.dirty:
+            return False
+
+        started = time.perf_counter()
+        meta = table.search().select(["uuid", "sn", "name"]).to_arrow()
+        uuids = meta.column("uuid").to_pylist()
+        with self._lock:
+            previous = ({u: i for i, u in enumerate(self.uuids) if self._valid[i]}
+                        if self.model == model else {})
+            old_vectors = self._vectors
+        missing = [u for u in uuids if u not in previous]
+        fetched = self._fetch_vectors(table, missing)
+        if len(fetched) < len(missing):
+            # 比对与取向量之间有行被并发删除，从附表中剔除
+            present = [u in previous or u in fetched for u in uuids]
+            meta = meta.filter(pa.array(present))
+            uuids = meta.column("uuid").to_pylist()
+
+        version_name = f"v{table_version}"
+        final_dir = self.root / version_name
+        tmp_dir = self.root / f"{version_name}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        try:
+            out = np.lib.format.open_memmap(tmp_dir / _VECTORS_FILE, mode="w+", dtype=np.float32, shape=(len(uuids), self.dim))
+            for start in range(0, len(uuids), self._CHUNK_ROWS):
+                chunk = uuids[start:start + self._CHUNK_ROWS]
+                out[start:start + len(chunk)] = np.stack([
+                    old_vectors[previous[u]] if u in previous else fetched[u] for u in chunk
+                ]) if chunk else np.zeros((0, self.dim), dtype=np.float32)
+            out.flush()
+            del out
+            with pa.OSFile(str(tmp_dir / _META_FILE), "wb") as sink:
+                with pa.ipc.new_file(sink, meta.schema) as writer:
+                    writer.write_table(meta)
+            (tmp_dir / _MANIFEST_FILE).write_text(json.dumps({
+                "version": table_version, "rows": len(uuids), "dim": self.dim, "model": model,
+                "created_at": time.time(),
+            }))
+            if final_dir.exists() and json.loads((final_dir / _MANIFEST_FILE).read_text()).get("model", "") == model:
+                # 同一版本已由其他进程生成，直接复用
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            elif final_dir.exists():
+                # 同一表版本的旧快照由其他模型的向量生成（只更换了模型标记），替换掉
+                stale_dir = self.root / f"{version_name}.stale-{os.getpid()}"
+                os.replace(final_dir, stale_dir)
+                os.replace(tmp_dir, final_dir)
+                shutil.rmtree(stale_dir, ignore_errors=True)
+            else:
+                os.replace(tmp_dir, final_dir)
+            current_tmp = self.root / f"{_CURRENT_FILE}.tmp-{os.getpid()}"
+            current_tmp.write_text(version_name)
+            os.replace(current_tmp, self.root / _CURRENT_FILE)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self.open()
+        self._prune_versions()
+        app_logger.info(
+            f"人脸库快照已更新至版本 {table_version}: {len(uuids)} 条 (复用 {len(uuids) - len(missing)}, 新取 {len(missing)}), "
+            f"耗时 {time.perf_counter() - started:.2f}s。"
+        )
+        return True
+
+    def _fetch_vectors(self, table, uuids: List[str], chunk: int = 512) -> dict:
+        from app.service.face_dao import _sql_in, _vectors_from_arrow
+
+        fetched = {}
+        for start in range(0, len(uuids), chunk):
+            part = uuids[start:start + chunk]
+            rows = table.search().where(f"uuid IN ({_sql_in(part)})").select(["uuid", "vector"]).to_arrow()
+            vectors = l2_normalize(_vectors_from_arrow(rows.column("vector")))
+            fetched.update(zip(rows.column("uuid").to_pylist(), vectors))
+        return fetched
+
+    def _prune_versions(self):
+        current = (self.root / _CURRENT_FILE).read_text().strip()
+        versions = sorted(
+            (p for p in self.root.iterdir() if p.is_dir() and p.name.startswith("v") and p.name[1:].isdigit()),
+            key=lambda p: int(p.name[1:]),
+        )
+        # 已映射旧版本文件的进程在 Linux 上不受删除影响；额外保留一个版本给正在切换的进程
+        for path in versions[:-self._KEEP_VERSIONS]:
+            if path.name != current:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def iter_batches(self, batch_size: int = 8192) -> Iterator[Tuple[List[str], List[str], List[str], np.ndarray]]:
+        """按批次遍历快照中的有效行（含内存增量），供其他索引构建使用。"""
+        with self._lock:
+            valid = np.flatnonzero(self._valid)
+            for start in range(0, len(valid), batch_size):
+                rows = valid[start:start + batch_size]
+                yield ([self.uuids[i] for i in rows], [self.sns[i] for i in rows], [self.names[i] for i in rows],
+                       np.asarray(self._vectors[rows], dtype=np.float32))
+            if self._delta_uuids:
+                yield list(self._delta_uuids), list(self._delta_sns), list(self._delta_names), self._delta_vectors.copy()
+
+    # --- 与 CompactVectorIndex 一致的增量维护与检索接口 ---
+    def add(self, uuids: List[str], sns: List[str], names: List[str], vectors: np.ndarray):
+        normalized = l2_normalize(np.atleast_2d(vectors))
+        with self._lock:
+            self._delta_vectors = np.vstack([self._delta_vectors, normalized])
+            self._delta_uuids.extend(uuids)
+            self._delta_sns.extend(sns)
+            self._delta_names.extend(names)
+
+    def remove_sn(self, sn: str) -> int:
+        with self._lock:
+            removed = 0
+            for i, row_sn in enumerate(self.sns):
+                if row_sn == sn and self._valid[i]:
+                    self._valid[i] = False
+                    removed += 1
+            keep = [i for i, row_sn in enumerate(self._delta_sns) if row_sn != sn]
+            removed += len(self._delta_sns) - len(keep)
+            self._delta_vectors = self._delta_vectors[keep]
+            self._delta_uuids = [self._delta_uuids[i] for i in keep]
+            self._delta_sns = [self._delta_sns[i] for i in keep]
+            self._delta_names = [self._delta_names[i] for i in keep]
+            return removed
+
+    def rename_sn(self, sn: str, name: str):
+        with self._lock:
+            for names, sns in ((self.names, self.sns), (self._delta_names, self._delta_sns)):
+                for i, row_sn in enumerate(sns):
+                    if row_sn == sn:
+                        names[i] = name
+
+    def remove_uuids(self, uuids: List[str]) -> int:
+        """按 uuid 移除条目（快照中的行标记为无效，内存增量直接删除），下一次同步时从表中重新取回仍存在的记录。"""
+        targets = set(uuids)
+        with self._lock:
+            removed = 0
+            for record_uuid in targets:
+                i = self._positions.get(record_uuid)
+                if i is not None and self._valid[i]:
+                    self._valid[i] = False
+                    removed += 1
+            keep = [i for i, record_uuid in enumerate(self._delta_uuids) if record_uuid not in targets]
+            removed += len(self._delta_uuids) - len(keep)
+            self._delta_vectors = self._delta_vectors[keep]
+            self._delta_uuids = [self._delta_uuids[i] for i in keep]
+            self._delta_sns = [self._delta_sns[i] for i in keep]
+            self._delta_names = [self._delta_names[i] for i in keep]
+            return removed
+
+    def candidates(self, query: np.ndarray, k: int) -> List[Tuple[str, str, str, float]]:
+        """返回精确余弦相似度最高的 k 个条目 [(uuid, sn, name, 相似度), ...]。"""
+        q = l2_normalize(query).reshape(-1)
+        with self._lock:
+            total = len(self._vectors) + len(self._delta_uuids)
+            if total == 0:
+                return []
+            scores = np.empty(total, dtype=np.float32)
+            for start in range(0, len(self._vectors), self._CHUNK_ROWS):
+                end = min(start + self._CHUNK_ROWS, len(self._vectors))
+                scores[start:end] = self._vectors[start:end] @ q
+            scores[:len(self._vectors)][~self._valid] = -np.inf
+            scores[len(self._vectors):] = self._delta_vectors @ q
+            k = min(k, total)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            base = len(self._vectors)
+            result = []
+            for i in top:
+                if not np.isfinite(scores[i]):
+                    continue
+                if i < base:
+                    result.append((self.uuids[i], self.sns[i], self.names[i], float(scores[i])))
+                else:
+                    j = i - base
+                    result.append((self._delta_uuids[j], self._delta_sns[j], self._delta_names[j], float(scores[i])))
+            return result
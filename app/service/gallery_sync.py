@@ -0,0 +1,143 @@
+# app/service/gallery_sync.py
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pyarrow as pa
+
+from app.cfg.config import SyncConfig
+from app.cfg.logging import app_logger
+from app.service.face_changelog import SYNC_MEDIA_TYPE, decode_changes
+from app.service.face_dao import FaceDataDAO
+
+SYNC_CHANGES_PATH = "/api/face/sync/changes"
+
+
+class GallerySyncService:
+    """
+    人脸库增量同步（拉模式）：后台线程每隔 interval 秒依次向各对等节点拉取新变更并批量应用。
+
+    - 每个对等节点记录已应用到的版本号 (seq) 与对方的节点标识，保存在状态文件中，重启后从断点继续；
+    - 每页变更应用完成后才推进版本号；中途失败时下一轮从同一页重拉，create 按 uuid 去重，update/delete 本身幂等；
+    - 请求时带上本节点标识，对方不会把源自本节点的变更再发回来；请求携带共享的同步令牌 (sync.token)；
+    - 对方的节点标识变化（数据库被重建）或版本号回退时，从头开始同步；
+    - 与本节点人脸库模型不一致的向量被拒绝（计入 rejected），本节点更换模型后从头重新拉取，接收对方重新提取的特征。
+    """
+
+    def __init__(self, cfg: SyncConfig, face_dao: FaceDataDAO, node_id: str):
+        self.cfg = cfg
+        self.face_dao = face_dao
+        self.node_id = node_id
+        self.state_path = Path(cfg.state_file)
+        self._state: Dict[str, Dict[str, Any]] = self._load_state()
+        self._round_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.stats_counters = {"rounds": 0, "requests": 0, "created": 0, "updated": 0, "deleted": 0,
+                               "reembedded": 0, "rejected": 0, "skipped": 0, "errors": 0}
+        self._worker = threading.Thread(target=self._worker_loop, name="GallerySync", daemon=True)
+        self._worker.start()
+
+    # --- 状态持久化 ---
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            app_logger.warning(f"无法读取人脸库同步状态文件 {self.state_path}，将从头同步: {e}")
+            return {}
+
+    def _save_state(self):
+        tmp_path = self.state_path.with_name(f".{self.state_path.name}.tmp")
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(self._state, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            app_logger.error(f"写入人脸库同步状态失败: {e}")
+
+    # --- 拉取 ---
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            self.pull_once()
+            self._stop_event.wait(self.cfg.interval_seconds)
+
+    def pull_once(self) -> List[Dict[str, Any]]:
+        """对所有对等节点各执行一轮拉取，直到追上对方的最新版本。返回各节点的同步状态。"""
+        with self._round_lock:
+            self.stats_counters["rounds"] += 1
+            for url in self.cfg.peers:
+                if self._stop_event.is_set():
+                    break
+                self._pull_peer(url.rstrip("/"))
+            return self.status()
+
+    def _fetch(self, peer: str, since: int) -> Tuple[pa.Table, Dict[str, str]]:
+        query = urllib.parse.urlencode({"since": since, "limit": self.cfg.batch_size,
+                                        "exclude_origin": self.node_id, "vector_dtype": self.cfg.vector_dtype})
+        headers = {"Accept": SYNC_MEDIA_TYPE, **self.cfg.headers}
+        if self.cfg.token:
+            headers["Authorization"] = f"Bearer {self.cfg.token}"
+        request = urllib.request.Request(f"{peer}{SYNC_CHANGES_PATH}?{query}", headers=headers)
+        self.stats_counters["requests"] += 1
+        with urllib.request.urlopen(request, timeout=self.cfg.timeout_seconds) as response:
+            return decode_changes(response.read())
+
+    def _pull_peer(self, peer: str):
+        state = self._state.setdefault(peer, {"node_id": None, "seq": 0})
+        try:
+            while not self._stop_event.is_set():
+                started = time.perf_counter()
+                changes, meta = self._fetch(peer, int(state["seq"]))
+                peer_node, latest = meta["node_id"], int(meta["latest_seq"])
+                if peer_node == self.node_id:
+                    raise ValueError("对等节点地址指向本节点")
+                if state["node_id"] not in (None, peer_node) or latest < int(state["seq"]):
+                    app_logger.warning(f"【人脸库同步】{peer} 的节点标识或版本号已变化 "
+                                       f"({state['node_id']}@{state['seq']} -> {peer_node}@{latest})，从头同步。")
+                    state.update(node_id=peer_node, seq=0)
+                    continue
+                # 本节点人脸库更换模型后，此前因模型不一致被拒绝的变更需要重新拉取
+                gallery_model = getattr(self.face_dao, "gallery_model", "") or None
+                if state.get("model", gallery_model) != gallery_model:
+                    app_logger.warning(f"【人脸库同步】本节点人脸库的模型已变为 '{gallery_model}'，从头拉取 {peer} 的变更。")
+                    state.update(seq=0, model=gallery_model)
+                    continue
+                result = self.face_dao.apply_changes(changes, source_model=meta.get("gallery_model") or None)
+                for key, value in result.items():
+                    self.stats_counters[key] += value
+                state.update(node_id=peer_node, seq=int(meta["next_since"]), latest_seq=latest, model=gallery_model,
+                             last_sync=datetime.now().isoformat(timespec="seconds"), error=None)
+                self._save_state()
+                if changes.num_rows:
+                    app_logger.info(f"【人脸库同步】从 {peer} 应用了 {changes.num_rows} 条变更 {result}，"
+                                    f"版本 {state['seq']}/{latest}，耗时 {time.perf_counter() - started:.2f}s。")
+                if meta.get("has_more") != "true":
+                    break
+        except urllib.error.HTTPError as e:
+            self._mark_error(state, peer, f"HTTP {e.code}")
+        except Exception as e:
+            self._mark_error(state, peer, str(getattr(e, "detail", e)))
+
+    def _mark_error(self, state: Dict[str, Any], peer: str, error: str):
+        self.stats_counters["errors"] += 1
+        state["error"] = error
+        app_logger.warning(f"【人脸库同步】从 {peer} 拉取变更失败: {error}")
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [{"peer": url.rstrip("/"), **self._state.get(url.rstrip("/"), {"node_id": None, "seq": 0})}
+                for url in self.cfg.peers]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"node_id": self.node_id, **self.stats_counters, "peers": self.status()}
+
+    def close(self, timeout: float = 10.0):
+        self._stop_event.set()
+        self._worker.join(timeout=timeout)
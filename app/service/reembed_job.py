@@ -0,0 +1,329 @@
+# app/service/reembed_job.py
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pyarrow as pa
+
+from app.cfg.config import ReembedConfig
+from app.cfg.logging import app_logger
+from app.core.image_utils import align_and_crop
+from app.service.face_dao import FaceDataDAO, build_face_filter
+
+if TYPE_CHECKING:
+    from app.core.model_manager import ModelPool
+
+STAGING_SCHEMA = pa.schema([
+    pa.field("uuid", pa.string(), nullable=False),
+    pa.field("vector", pa.list_(pa.float32(), 512), nullable=False),
+])
+
+
+def staging_table_name(table_name: str, model: str) -> str:
+    """按目标模型命名的暂存表，不同模型的重新提取结果互不混用。"""
+    return f"{table_name}__reembed_{re.sub(r'[^A-Za-z0-9_.-]', '_', model)}"
+
+
+class ReembedJob:
+    """
+    更换识别模型后的人脸特征重新提取任务：
+
+    - 读取任务开始前在本节点注册的每条记录对应的人脸图片，补边后重新检测、对齐并批量提取特征，
+      结果按 uuid 写入以目标模型命名的暂存表；开始之后注册的记录已由新模型提取，无需处理；
+      同步而来的记录的图片在来源节点上，由来源节点重新提取后经同步替换；
+    - 与实时识别共用模型池：借用超时即视为繁忙并退避，每批处理后按占用比例上限休眠，把模型让给实时流量；
+    - 每累计 checkpoint_rows 条写入暂存表并保存进度文件，中断或重启后跳过已完成的记录继续；
+    - 切换前重新查询，补上处理期间才出现的早于任务开始时间的记录（如导入的归档、其他进程的写入），直到没有遗漏；
+    - 全部处理完后由 DAO 以一次提交按 uuid 替换人脸表中的特征向量（期间的改名、删除不受影响），更新模型标记，
+      并把替换记入变更日志，对等节点据此更新同步过去的记录。
+      图片缺失或重新检测不到人脸的记录保留旧特征，uuid 与原因记录在进度文件中，需重新注册。
+    """
+
+    def __init__(self, cfg: ReembedConfig, face_dao: FaceDataDAO, model_pool: "ModelPool",
+                 db_uri: str, table_name: str, recognition_model: str):
+        self.cfg = cfg
+        self.face_dao = face_dao
+        self.model_pool = model_pool
+        self.db_uri = db_uri
+        self.table_name = table_name
+        self.recognition_model = recognition_model
+        self.state_path = Path(cfg.state_file)
+        self._state: Dict[str, Any] = self._load_state()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._pause_requested = False
+        self._worker: Optional[threading.Thread] = None
+        self._db = None
+        self._rate: Tuple[float, int] = (time.monotonic(), 0)
+        self.stats_counters = {"batches": 0, "busy_waits": 0, "busy_seconds": 0.0}
+
+    @property
+    def gallery_model(self) -> str:
+        """人脸库现有特征所属的识别模型，由 DAO 维护。"""
+        return getattr(self.face_dao, "gallery_model", None) or self.recognition_model
+
+    @property
+    def needed(self) -> bool:
+        """人脸库现有特征是否由其他识别模型提取。"""
+        return self.gallery_model != self.recognition_model
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    # --- 进度持久化 ---
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            app_logger.warning(f"无法读取特征重新提取进度文件 {self.state_path}，将从头开始: {e}")
+            return {}
+
+    def _save_state(self):
+        tmp_path = self.state_path.with_name(f".{self.state_path.name}.tmp")
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(self._state, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            app_logger.error(f"写入特征重新提取进度失败: {e}")
+
+    # --- 暂存表 ---
+    @property
+    def db(self):
+        if self._db is None:
+            import lancedb
+            self._db = lancedb.connect(self.db_uri)
+        return self._db
+
+    def _open_staging(self, name: str):
+        if name in self.db.table_names():
+            return self.db.open_table(name)
+        return self.db.create_table(name, schema=STAGING_SCHEMA)
+
+    def _drop_staging(self, name: Optional[str]):
+        if name and name in self.db.table_names():
+            self.db.drop_table(name)
+
+    # --- 启停 ---
+    def start(self, force: bool = False) -> Dict[str, Any]:
+        """
+        开始或继续重新提取。进度文件中有同一目标模型未完成的任务时从断点继续；否则新建任务，
+        人脸库特征已由当前模型提取时需要 force。已在运行时直接返回当前状态。
+        """
+        with self._lock:
+            if self.running:
+                return self.status()
+            resumable = (self._state.get("target_model") == self.recognition_model
+                         and self._state.get("status") in ("running", "paused", "failed"))
+            if not resumable:
+                if not self.needed and not force:
+                    raise ValueError(f"人脸库特征已由当前识别模型 '{self.recognition_model}' 提取，无需重新提取。")
+                self._new_state()
+            self._state.update(status="running", error=None)
+            self._save_state()
+            self._stop_event.clear()
+            self._pause_requested = False
+            self._rate = (time.monotonic(), int(self._state["done"]))
+            self._worker = threading.Thread(target=self._run, name="ReembedJob", daemon=True)
+            self._worker.start()
+        app_logger.info(f"【特征重新提取】开始: {self._state['source_model']} -> {self.recognition_model}, "
+                        f"进度 {self._state['done']}/{self._state['total']}。")
+        return self.status()
+
+    def maybe_start(self):
+        """启动时调用：继续上次未完成的任务，或在模型不一致且配置了 auto_start 时自动开始。"""
+        if self._state.get("target_model") == self.recognition_model and self._state.get("status") == "running":
+            self.start()
+        elif self.needed:
+            if self.cfg.auto_start:
+                self.start()
+            else:
+                app_logger.warning(f"⚠️ 人脸库特征由模型 '{self.gallery_model}' 提取，与当前识别模型 "
+                                   f"'{self.recognition_model}' 不一致，识别结果不可靠。请启动特征重新提取任务。")
+
+    def _new_state(self):
+        self._drop_staging(self._state.get("staging_table"))
+        staging = staging_table_name(self.table_name, self.recognition_model)
+        # 进度文件丢失或损坏时可能残留同名暂存表，无法确认其中结果对应的任务，一并清除
+        self._drop_staging(staging)
+        started_at = datetime.now()
+        self._state = {
+            "status": "running", "source_model": self.gallery_model, "target_model": self.recognition_model,
+            "staging_table": staging, "started_at": started_at.isoformat(),
+            "total": self.face_dao.count(build_face_filter(registered_before=started_at, local_only=True)),
+            "done": 0, "failed": {}, "switched": 0, "finished_at": None, "error": None,
+        }
+
+    def pause(self) -> Dict[str, Any]:
+        """暂停任务（保存已完成的部分），之后可再次 start 从断点继续。"""
+        self._pause_requested = True
+        self._stop_event.set()
+        if self._worker is not None:
+            self._worker.join()
+        return self.status()
+
+    def close(self, timeout: float = 10.0):
+        """停止后台线程；任务状态保持为 running，下次启动时自动继续。"""
+        self._stop_event.set()
+        if self._worker is not None:
+            self._worker.join(timeout=timeout)
+
+    # --- 执行 ---
+    def _run(self):
+        state = self._state
+        try:
+            staging = self._open_staging(state["staging_table"])
+            skip = set(staging.search().select(["uuid"]).to_arrow().column("uuid").to_pylist()) | set(state["failed"])
+            where = build_face_filter(registered_before=datetime.fromisoformat(state["started_at"]), local_only=True)
+            # 每轮处理完后重新查询：处理期间可能写入了早于开始时间的记录，切换前必须一并处理
+            while not self._stop_event.is_set():
+                todo = [(row["uuid"], row["image_path"]) for row in self.face_dao.iter_meta(where)
+                        if row["uuid"] not in skip]
+                if not todo:
+                    break
+                state["total"] = len(skip) + len(todo)
+                self._process(staging, todo)
+                skip.update(uuid_ for uuid_, _ in todo)
+            if self._stop_event.is_set():
+                if self._pause_requested:
+                    state["status"] = "paused"
+                    self._save_state()
+                app_logger.info(f"【特征重新提取】已{'暂停' if self._pause_requested else '停止'}，"
+                                f"进度 {state['done']}/{state['total']}。")
+                return
+            self._switch(staging)
+        except Exception as e:
+            state.update(status="failed", error=str(getattr(e, "detail", e)))
+            self._save_state()
+            app_logger.error(f"❌ 【特征重新提取】任务失败，可再次启动从断点继续: {e}", exc_info=True)
+
+    def _process(self, staging, todo: List[Tuple[str, Optional[str]]]):
+        """分批重新提取 todo 中的记录，每累计 checkpoint_rows 条写入暂存表；任务停止时保存已完成的部分后返回。"""
+        state = self._state
+        uuids: List[str] = []
+        vectors: List[np.ndarray] = []
+        for start in range(0, len(todo), self.cfg.batch_size):
+            results = self._embed_batch(todo[start:start + self.cfg.batch_size])
+            if results is None:
+                break
+            for (uuid_, _), (vector, reason) in zip(todo[start:start + self.cfg.batch_size], results):
+                if vector is None:
+                    state["failed"][uuid_] = reason
+                else:
+                    uuids.append(uuid_)
+                    vectors.append(vector)
+            if len(uuids) >= self.cfg.checkpoint_rows:
+                self._flush(staging, uuids, vectors)
+                uuids, vectors = [], []
+            if self._stop_event.is_set():
+                break
+        self._flush(staging, uuids, vectors)
+
+    def _flush(self, staging, uuids: List[str], vectors: List[np.ndarray]):
+        """把一批结果写入暂存表并保存进度（检查点）。"""
+        if uuids:
+            values = pa.array(np.stack(vectors).astype(np.float32).reshape(-1))
+            staging.add(pa.table({"uuid": pa.array(uuids, pa.string()),
+                                  "vector": pa.FixedSizeListArray.from_arrays(values, 512)}, schema=STAGING_SCHEMA))
+            self._state["done"] += len(uuids)
+        self._save_state()
+
+    def _acquire(self):
+        """从模型池借用一套模型；池中没有空闲模型时退避，优先保证实时识别。任务停止时返回 None。"""
+        while not self._stop_event.is_set():
+            models = self.model_pool.acquire(timeout=self.cfg.acquire_timeout_seconds)
+            if models is not None:
+                return models
+            self.stats_counters["busy_waits"] += 1
+            self._stop_event.wait(self.cfg.busy_backoff_seconds)
+        return None
+
+    def _load_padded(self, image_path: Optional[str]) -> Optional[np.ndarray]:
+        """读取注册时保存的人脸裁剪图，四周补边，使检测模型能看到完整的人脸轮廓与关键点。"""
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR) if image_path else None
+        if image is None:
+            return None
+        pad = int(round(max(image.shape[:2]) * self.cfg.crop_padding))
+        return cv2.copyMakeBorder(image, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=(0, 0, 0))
+
+    def _embed_batch(self, batch: List[Tuple[str, Optional[str]]]) -> Optional[List[Tuple[Optional[np.ndarray], str]]]:
+        """对一批记录重新检测、对齐并提取特征，返回与输入一一对应的 (特征向量或 None, 失败原因)。"""
+        images = [self._load_padded(image_path) for _, image_path in batch]
+        results: List[Tuple[Optional[np.ndarray], str]] = [(None, "图片不存在或无法读取")] * len(batch)
+        indices = [i for i, image in enumerate(images) if image is not None]
+        if not indices:
+            return results
+        models = self._acquire()
+        if models is None:
+            return None
+        started = time.perf_counter()
+        try:
+            detection_model, recognition_model = models
+            aligned, aligned_indices = [], []
+            for i, detection in zip(indices, detection_model.predict_batch([images[i] for i in indices])):
+                faces = [face for face in detection.results if len(face.get("landmarks", [])) == 5]
+                if not faces:
+                    results[i] = (None, "未检测到人脸")
+                    continue
+                face = max(faces, key=lambda f: f.get("score", 0.0))
+                aligned_face, _ = align_and_crop(images[i], [lm["landmark"] for lm in face["landmarks"]])
+                if aligned_face.size == 0:
+                    results[i] = (None, "人脸对齐失败")
+                    continue
+                aligned.append(aligned_face)
+                aligned_indices.append(i)
+            if aligned:
+                for i, rec_result in zip(aligned_indices, recognition_model.predict_batch(aligned)):
+                    results[i] = (np.array(rec_result.results[0]["data"][0], dtype=np.float32), "")
+        finally:
+            self.model_pool.release(models)
+        busy = time.perf_counter() - started
+        self.stats_counters["batches"] += 1
+        self.stats_counters["busy_seconds"] += busy
+        # 按占用比例上限休眠：占用 busy 秒后让出 busy * (1 - d) / d 秒
+        duty = self.cfg.max_duty_cycle
+        if duty < 1:
+            self._stop_event.wait(busy * (1 - duty) / duty)
+        return results
+
+    def _switch(self, staging):
+        """以一次提交用暂存表中的特征替换人脸表中的特征（DAO 同时更新模型标记并记入变更日志），再删除暂存表。"""
+        state = self._state
+        started = time.perf_counter()
+        switched = self.face_dao.replace_vectors(staging.to_arrow(), state["target_model"])
+        self._drop_staging(state["staging_table"])
+        state.update(status="completed", switched=switched, finished_at=datetime.now().isoformat())
+        self._save_state()
+        app_logger.info(f"✅ 【特征重新提取】已切换到模型 '{self.gallery_model}': 替换 {switched} 条特征，"
+                        f"耗时 {time.perf_counter() - started:.2f}s。")
+        if state["failed"]:
+            app_logger.warning(f"⚠️ 【特征重新提取】{len(state['failed'])} 条记录未能重新提取（保留旧特征），"
+                               f"请根据 {self.state_path} 中的列表重新注册。")
+
+    def status(self) -> Dict[str, Any]:
+        state = {key: value for key, value in self._state.items() if key != "failed"}
+        result = {
+            "status": "idle", "gallery_model": self.gallery_model, "recognition_model": self.recognition_model,
+            "running": self.running, **state, "failed": len(self._state.get("failed", {})),
+            "rows_per_second": None, "eta_seconds": None, **self.stats_counters,
+        }
+        if self.running:
+            since, done_at_start = self._rate
+            elapsed = time.monotonic() - since
+            processed = int(self._state["done"]) - done_at_start
+            if elapsed > 0 and processed > 0:
+                rate = processed / elapsed
+                remaining = int(self._state["total"]) - int(self._state["done"]) - result["failed"]
+                result.update(rows_per_second=round(rate, 2), eta_seconds=round(max(0, remaining) / rate))
+        result["busy_seconds"] = round(result["busy_seconds"], 2)
+        return result
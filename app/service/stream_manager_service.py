@@ -1,9 +1,13 @@
 # app/service/stream_manager_service.py
 import asyncio
+import collections
 import queue
+import re
 import threading
+import time
 import uuid
-from typing import List, Dict, Any
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 
 from fastapi import HTTPException, status
@@ -14,23 +18,128 @@ from app.core.pipeline import FaceStreamPipeline
 from app.schema.face_schema import ActiveStreamInfo, StreamStartRequest
 # 导入 ModelPool
 from app.core.model_manager import ModelPool
+from app.core.stream_worker import StreamWorkerPool, RemoteStreamHandle
+from app.core.shm_ring import RingFeedReader
+from app.service.face_dao import FaceDataDAO
+from app.service.event_sink import RecognitionEventSink
+from app.service.webhook_dispatcher import WebhookDispatcher
+from app.core.video_encoder import HLS_PLAYLIST
+from app.core.feed_variants import FrameBroadcast, VariantKey, downscale_jpeg
+
+# HLS 目录中允许对外提供的文件：播放列表与分段
+_HLS_FILE_PATTERN = re.compile(r"^(index\.m3u8|seg_\d+\.ts)$")
+# 默认画面暂停编码时，快照请求等待新一帧的最长时间（秒）
+_SNAPSHOT_WAIT_SECONDS = 1.5
+
 
 class StreamManagerService:
     """
     【核心修改】负责管理视频流的生命周期，使用线程模型，并将模型池注入每个管道。
     """
-    def __init__(self, settings: AppSettings, model_pool: ModelPool):
+    def __init__(self, settings: AppSettings, model_pool: ModelPool, face_dao: Optional[FaceDataDAO] = None,
+                 event_sink: Optional[RecognitionEventSink] = None, webhook: Optional[WebhookDispatcher] = None):
         app_logger.info("正在初始化 StreamManagerService (使用线程+模型池)...")
         self.settings = settings
         # 持有对模型池的引用
         self.model_pool = model_pool
+        # 所有线程模式的流水线共享同一个 DAO（及其内存索引）
+        self.face_dao = face_dao
+        self.event_sink = event_sink
+        self.webhook = webhook
         self.active_streams: Dict[str, Dict[str, Any]] = {}
         self.stream_lock = asyncio.Lock()
+        # 多进程模式：流水线运行在独立工作进程中，帧通过共享内存环回传
+        self.worker_pool: Optional[StreamWorkerPool] = None
+        if self.settings.stream_worker.enabled:
+            self.worker_pool = StreamWorkerPool(settings)
+
+    def _start_in_worker(self, stream_id: str, req: StreamStartRequest) -> RemoteStreamHandle:
+        try:
+            return self.worker_pool.start_stream(stream_id, req.model_dump())
+        except RuntimeError as e:
+            app_logger.warning(f"无法为流 {stream_id} 分配工作进程: {e}")
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "服务正忙，无法启动新的视频流，请稍后再试。")
+
+    def _variant_key(self, max_width: Optional[int], quality: Optional[int]) -> Optional[VariantKey]:
+        """把观众请求的画质参数归一化为变体键；与默认画面一致时返回 None（直接使用默认推流）。"""
+        cfg = self.settings.feed
+        quality = quality or cfg.jpeg_quality
+        if max_width is None and quality == cfg.jpeg_quality:
+            return None
+        if max_width is not None and max_width < cfg.min_width:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"max_width 不能小于 {cfg.min_width}。")
+        return max_width, quality
+
+    def _acquire_variant(self, stream_context: Dict[str, Any], key: VariantKey):
+        """登记一个变体观众，返回其读取游标；该变体的第一个观众到来时才通知流水线开始编码。调用方需持有 stream_lock。"""
+        variants = stream_context["variants"]
+        entry = variants.get(key)
+        if entry is None:
+            if len(variants) >= self.settings.feed.max_variants_per_stream:
+                raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, "该视频流的画质变体数已达上限，请使用已有的分辨率/质量组合。")
+            pipeline = stream_context["pipeline"]
+            if isinstance(pipeline, RemoteStreamHandle):
+                ring = pipeline.add_feed_variant(key)
+                open_reader = lambda: RingFeedReader(ring)
+            else:
+                broadcast = FrameBroadcast()
+                pipeline.add_feed_variant(key, broadcast)
+                open_reader = broadcast.open_reader
+            entry = variants[key] = {"viewers": 0, "open_reader": open_reader}
+        entry["viewers"] += 1
+        return entry["open_reader"]()
+
+    async def _release_variant(self, stream_context: Dict[str, Any], key: VariantKey):
+        async with self.stream_lock:
+            entry = stream_context["variants"].get(key)
+            if entry is None:
+                return
+            entry["viewers"] -= 1
+            if entry["viewers"] <= 0:
+                # 最后一个观众离开后立即停止编码该变体
+                del stream_context["variants"][key]
+                stream_context["pipeline"].remove_feed_variant(key)
+
+    @staticmethod
+    def _release_stream_context(stream_context: Dict[str, Any]):
+        pipeline = stream_context["pipeline"]
+        if isinstance(pipeline, RemoteStreamHandle):
+            pipeline.release()
 
     async def start_stream(self, req: StreamStartRequest) -> ActiveStreamInfo:
         stream_id = str(uuid.uuid4())
         lifetime = req.lifetime_minutes if req.lifetime_minutes is not None else self.settings.app.stream_default_lifetime_minutes
+        video_output = req.video_output or self.settings.video_output.default_format
         
+        if self.worker_pool is not None:
+            # 共享内存环只保留最新的数据，无法保证 fMP4 分片按序完整送达；HLS 以文件形式输出，不受影响
+            if video_output == "fmp4":
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "多进程视频流模式下不支持 fmp4 输出，请使用 hls 或 mjpeg。")
+            handle = self._start_in_worker(stream_id, req)
+            pipeline, process_thread, feed = handle, handle, handle.open_reader
+        else:
+            pipeline, process_thread, feed = self._start_in_thread(stream_id, req)
+
+        # 短暂等待以确认流水线是否立即失败 (例如，因无法获取模型)
+        await asyncio.sleep(0.2)
+        if not process_thread.is_alive():
+            self._release_stream_context({"pipeline": pipeline})
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "服务正忙，无法启动新的视频流，请稍后再试。")
+
+        async with self.stream_lock:
+            started_at = datetime.now()
+            expires_at = None if lifetime == -1 else started_at + timedelta(minutes=lifetime)
+            stream_info = ActiveStreamInfo(stream_id=stream_id, source=req.source, started_at=started_at, expires_at=expires_at, lifetime_minutes=lifetime,
+                                         video_output=video_output)
+            self.active_streams[stream_id] = {
+                "info": stream_info, "feed": feed, "pipeline": pipeline, "thread": process_thread, "variants": {},
+                # 缩小后的快照缓存：宽度 -> (帧序号, JPEG)，按最近使用淘汰
+                "snapshots": collections.OrderedDict(), "snapshot_lock": asyncio.Lock(),
+            }
+            app_logger.info(f"🚀 视频流处理任务已启动: ID={stream_id}, Source={req.source}")
+            return stream_info
+
+    def _start_in_thread(self, stream_id: str, req: StreamStartRequest):
         app_logger.info(f"准备为流 {stream_id} 启动一个新线程 (它将从池中获取模型)...")
         
         try:
@@ -43,7 +152,11 @@ class StreamManagerService:
                 stream_id=stream_id,
                 video_source=req.source,
                 model_pool=self.model_pool, # 注入模型池
-                output_queue=frame_queue
+                output_queue=frame_queue,
+                options=req,
+                face_dao=self.face_dao,
+                event_sink=self.event_sink,
+                webhook=self.webhook,
             )
 
             # 3. 创建线程，目标是流水线的 start 方法
@@ -56,21 +169,7 @@ class StreamManagerService:
 
         # 4. 启动线程
         process_thread.start()
-
-        # 短暂等待以确认线程是否立即失败 (例如，因无法获取模型)
-        await asyncio.sleep(0.2)
-        if not process_thread.is_alive():
-             raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "服务正忙，无法启动新的视频流，请稍后再试。")
-
-        async with self.stream_lock:
-            started_at = datetime.now()
-            expires_at = None if lifetime == -1 else started_at + timedelta(minutes=lifetime)
-            stream_info = ActiveStreamInfo(stream_id=stream_id, source=req.source, started_at=started_at, expires_at=expires_at, lifetime_minutes=lifetime)
-            self.active_streams[stream_id] = {
-                "info": stream_info, "queue": frame_queue, "pipeline": pipeline, "thread": process_thread,
-            }
-            app_logger.info(f"🚀 视频流处理线程已启动: ID={stream_id}, Source={req.source}")
-            return stream_info
+        return pipeline, process_thread, lambda: frame_queue
 
     async def stop_stream(self, stream_id: str) -> bool:
         async with self.stream_lock:
@@ -83,26 +182,160 @@ class StreamManagerService:
         if thread.is_alive():
             pipeline.stop()
             await asyncio.to_thread(thread.join, timeout=5.0)
+        self._release_stream_context(stream_context)
         
         return True
 
-    async def get_stream_feed(self, stream_id: str):
-        
-        try:
+    async def get_stream_feed(self, stream_id: str, max_width: Optional[int] = None, quality: Optional[int] = None):
+        """
+        返回 MJPEG 推流的异步生成器。指定 max_width / quality 时订阅对应的画质变体：
+        同一变体的观众共享每帧一次的编码结果，没有观众的变体不会被编码。
+        """
+        key = self._variant_key(max_width, quality)
+        async with self.stream_lock:
+            if stream_id not in self.active_streams:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found.")
+            stream_data = self.active_streams[stream_id]
+            variants = stream_data["variants"]
+            if key is not None and key not in variants and len(variants) >= self.settings.feed.max_variants_per_stream:
+                raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, "该视频流的画质变体数已达上限，请使用已有的分辨率/质量组合。")
+            thread = stream_data["thread"]
+            pipeline = stream_data["pipeline"]
+
+        async def generate():
+            # 观众在生成器首次迭代时才登记：客户端在响应开始前断开时生成器不会运行，也就不会留下无人释放的计数
             async with self.stream_lock:
-                if stream_id not in self.active_streams:
-                    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found.")
-                stream_data = self.active_streams[stream_id]
-                frame_queue = stream_data["queue"]
-                thread = stream_data["thread"]
-            while True:
-                if not thread.is_alive() and frame_queue.empty(): break
                 try:
-                    frame_bytes = await asyncio.to_thread(frame_queue.get, timeout=0.02)
-                    if frame_bytes is None: break
-                    yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                except queue.Empty: await asyncio.sleep(0.01)
-        except asyncio.CancelledError: pass
+                    if key is None:
+                        frame_queue = stream_data["feed"]()
+                        pipeline.add_feed_viewer()
+                    else:
+                        frame_queue = self._acquire_variant(stream_data, key)
+                except HTTPException:
+                    # 预检之后变体数已被其他观众占满
+                    return
+            try:
+                while True:
+                    if not thread.is_alive() and frame_queue.empty(): break
+                    try:
+                        frame_bytes = await asyncio.to_thread(frame_queue.get, timeout=0.02)
+                        if frame_bytes is None: break
+                        yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                    except queue.Empty: await asyncio.sleep(0.01)
+            except asyncio.CancelledError: pass
+            finally:
+                if key is None:
+                    pipeline.remove_feed_viewer()
+                else:
+                    await self._release_variant(stream_data, key)
+        return generate()
+
+
+    @staticmethod
+    def _latest_frame(stream_context: Dict[str, Any]) -> Optional[Tuple[int, bytes]]:
+        pipeline = stream_context["pipeline"]
+        if isinstance(pipeline, RemoteStreamHandle):
+            return pipeline.ring.read_latest(0)
+        return pipeline.latest_frame
+
+    async def get_snapshot(self, stream_id: str, max_width: Optional[int] = None,
+                           if_none_match: Optional[str] = None) -> Tuple[Optional[bytes], str]:
+        """
+        返回最近一帧已绘制结果的画面及其 ETag（由帧序号与宽度决定）。
+        客户端的 If-None-Match 与当前 ETag 一致时返回 (None, etag)，由调用方响应 304；
+        缩小后的快照在同一帧内只编码一次。
+        """
+        async with self.stream_lock:
+            stream_context = self.active_streams.get(stream_id)
+        if not stream_context:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found.")
+        latest = self._latest_frame(stream_context)
+        if not stream_context["pipeline"].touch_feed():
+            # 没有观众时默认画面不编码，已有的画面可能早已过时：等待编码恢复后的第一帧
+            deadline = time.monotonic() + _SNAPSHOT_WAIT_SECONDS
+            previous_seq = latest[0] if latest is not None else None
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                fresh = self._latest_frame(stream_context)
+                if fresh is not None and (previous_seq is None or fresh[0] != previous_seq):
+                    latest = fresh
+                    break
+        if latest is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="视频流尚未产生画面，请稍后重试。",
+                                headers={"Retry-After": "1"})
+        seq, data = latest
+        etag = f'"{seq}-{max_width or "full"}"'
+        if if_none_match:
+            tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+            if etag in tags or "*" in tags:
+                return None, etag
+        if max_width is None:
+            return data, etag
+
+        cache: "collections.OrderedDict[int, Tuple[int, bytes]]" = stream_context["snapshots"]
+        async with stream_context["snapshot_lock"]:
+            cached = cache.get(max_width)
+            if cached is None or cached[0] != seq:
+                image = await asyncio.to_thread(downscale_jpeg, data, max_width, self.settings.feed.snapshot_jpeg_quality)
+                cached = cache[max_width] = (seq, image)
+            cache.move_to_end(max_width)
+            while len(cache) > self.settings.feed.snapshot_cache_widths:
+                cache.popitem(last=False)
+        return cached[1], etag
+
+    async def _get_stream_context(self, stream_id: str, video_output: str) -> Dict[str, Any]:
+        async with self.stream_lock:
+            stream_context = self.active_streams.get(stream_id)
+        if not stream_context:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found.")
+        if stream_context["info"].video_output != video_output:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"该视频流未启用 {video_output} 输出。")
+        return stream_context
+
+    async def get_video_feed(self, stream_id: str):
+        """以分片 MP4 推送 H.264 视频：该流的所有观众共享同一个编码器的输出。"""
+        stream_context = await self._get_stream_context(stream_id, "fmp4")
+        encoder = stream_context["pipeline"].video_encoder
+
+        async def generate():
+            sub = encoder.subscribe()
+            try:
+                while True:
+                    try:
+                        data = await asyncio.to_thread(sub.get, 0.5)
+                    except queue.Empty:
+                        continue
+                    if data is None:
+                        break
+                    yield data
+            except asyncio.CancelledError:
+                pass
+            finally:
+                encoder.unsubscribe(sub)
+        return generate()
+
+    async def get_hls_file(self, stream_id: str, filename: str) -> Path:
+        """返回 HLS 播放列表或分段文件的路径（由 ffmpeg 在编码时滚动写入）。"""
+        stream_context = await self._get_stream_context(stream_id, "hls")
+        if not _HLS_FILE_PATTERN.match(filename):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found.")
+        # 每次请求都视为有观众，编码器未运行时在下一帧启动
+        stream_context["pipeline"].touch_video_output()
+        path = Path(self.settings.video_output.hls_dir) / stream_id / filename
+        if not path.is_file():
+            # 编码器启动后的第一个分段写完之前，播放列表尚不存在
+            detail = "播放列表尚未生成，请稍后重试。" if filename == HLS_PLAYLIST else "File not found."
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+        return path
+
+    async def get_stream_stats(self, stream_id: str) -> Dict[str, Any]:
+        async with self.stream_lock:
+            stream_context = self.active_streams.get(stream_id)
+            if not stream_context:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found.")
+            pipeline: FaceStreamPipeline = stream_context["pipeline"]
+            return pipeline.get_stats()
+
     async def get_all_active_streams_info(self) -> List[ActiveStreamInfo]:
         
         async with self.stream_lock:
@@ -110,7 +343,7 @@ class StreamManagerService:
             dead_stream_ids = [sid for sid, s_ctx in self.active_streams.items() if not s_ctx["thread"].is_alive()]
             for stream_id, stream in self.active_streams.items():
                 if stream["thread"].is_alive(): active_infos.append(stream["info"])
-            for sid in dead_stream_ids: self.active_streams.pop(sid, None)
+            for sid in dead_stream_ids: self._release_stream_context(self.active_streams.pop(sid))
             return active_infos
     async def cleanup_expired_streams(self):
         
@@ -123,4 +356,9 @@ class StreamManagerService:
     async def stop_all_streams(self):
         
         async with self.stream_lock: all_ids = list(self.active_streams.keys())
-        if all_ids: await asyncio.gather(*[self.stop_stream(sid) for sid in all_ids])
\ No newline at end of file
+        if all_ids: await asyncio.gather(*[self.stop_stream(sid) for sid in all_ids])
+
+    async def shutdown(self):
+        """关闭视频流工作进程池（仅多进程模式）。应在 stop_all_streams 之后调用。"""
+        if self.worker_pool is not None:
+            await asyncio.to_thread(self.worker_pool.shutdown)
\ No newline at end of file
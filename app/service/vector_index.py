@@ -0,0 +1,299 @@
+# app/service/vector_index.py
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化（对一维向量同样适用），零向量保持为零。"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class CompactVectorIndex:
+    """
+    常驻内存的紧凑人脸特征索引，用于在大规模人脸库上快速筛选候选。
+
+    - float16：直接存储半精度归一化向量，内存为 float32 的 1/2；
+    - int8：逐向量对称标量量化（scale = max|v| / 127），内存约为 float32 的 1/4。
+
+    该索引只负责给出近似得分最高的候选行号，最终相似度由调用方使用数据库中存储的向量重排，
+    阈值判断不受索引量化误差影响；数据库本身为 float16 存储时，重排得分仍带有半精度舍入误差。
+    """
+
+    _CHUNK_ROWS = 32768
+
+    def __init__(self, dim: int = 512, dtype: str = "int8"):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"不支持的索引精度: {dtype}")
+        self.dim = dim
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        self._codes = np.zeros((0, dim), dtype=np.int8 if dtype == "int8" else np.float16)
+        self._scales = np.zeros((0,), dtype=np.float32)
+        self._valid = np.zeros((0,), dtype=bool)
+        self.uuids: List[str] = []
+        self.sns: List[str] = []
+        self.names: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return int(self._valid[:self._size].sum())
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._codes[:self._size].nbytes + self._scales[:self._size].nbytes)
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        normalized = l2_normalize(np.atleast_2d(vectors))
+        if self.dtype == "float16":
+            return normalized.astype(np.float16), np.ones(len(normalized), dtype=np.float32)
+        scales = np.maximum(np.abs(normalized).max(axis=1), 1e-12) / 127.0
+        codes = np.clip(np.rint(normalized / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _ensure_capacity(self, extra: int):
+        needed = self._size + extra
+        if needed <= len(self._codes):
+            return
+        capacity = max(needed, 2 * len(self._codes), 1024)
+        for attr in ("_codes", "_scales", "_valid"):
+            old = getattr(self, attr)
+            grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, attr, grown)
+
+    def build(self, uuids: List[str], sns: List[str], names: List[str], vectors: np.ndarray):
+        """用全量数据重建索引。"""
+        with self._lock:
+            self._codes = self._codes[:0]
+            self._scales = self._scales[:0]
+            self._valid = self._valid[:0]
+            self.uuids, self.sns, self.names = [], [], []
+            self._positions = {}
+            self._size = 0
+            if len(uuids):
+                self.add(uuids, sns, names, vectors)
+
+    def add(self, uuids: List[str], sns: List[str], names: List[str], vectors: np.ndarray):
+        codes, scales = self._encode(vectors)
+        with self._lock:
+            self._ensure_capacity(len(codes))
+            end = self._size + len(codes)
+            self._codes[self._size:end] = codes
+            self._scales[self._size:end] = scales
+            self._valid[self._size:end] = True
+            self._positions.update(zip(uuids, range(self._size, end)))
+            self.uuids.extend(uuids)
+            self.sns.extend(sns)
+            self.names.extend(names)
+            self._size = end
+
+    def remove_sn(self, sn: str) -> int:
+        """将指定 SN 的全部条目标记为无效，并在无效条目过多时压缩。"""
+        with self._lock:
+            removed = 0
+            for i in range(self._size):
+                if self._valid[i] and self.sns[i] == sn:
+                    self._valid[i] = False
+                    removed += 1
+            if removed and self._size and len(self) < 0.75 * self._size:
+                self._compact()
+            return removed
+
+    def rename_sn(self, sn: str, name: str):
+        with self._lock:
+            for i in range(self._size):
+                if self.sns[i] == sn:
+                    self.names[i] = name
+
+    def remove_uuids(self, uuids: List[str]) -> int:
+        """按 uuid 将条目标记为无效（用于逐条应用同步的删除与向量替换），返回移除的条数。"""
+        with self._lock:
+            removed = 0
+            for record_uuid in uuids:
+                i = self._positions.pop(record_uuid, None)
+                if i is not None and self._valid[i]:
+                    self._valid[i] = False
+                    removed += 1
+            if removed and self._size and len(self) < 0.75 * self._size:
+                self._compact()
+            return removed
+
+    def _compact(self):
+        keep = np.flatnonzero(self._valid[:self._size])
+        self._codes = self._codes[keep].copy()
+        self._scales = self._scales[keep].copy()
+        self._valid = np.ones(len(keep), dtype=bool)
+        self.uuids = [self.uuids[i] for i in keep]
+        self.sns = [self.sns[i] for i in keep]
+        self.names = [self.names[i] for i in keep]
+        self._positions = {record_uuid: i for i, record_uuid in enumerate(self.uuids)}
+        self._size = len(keep)
+
+    def candidates(self, query: np.ndarray, k: int) -> List[Tuple[str, str, str, float]]:
+        """返回近似得分最高的 k 个候选 [(uuid, sn, name, 近似余弦相似度), ...]。"""
+        q = l2_normalize(query).reshape(-1)
+        with self._lock:
+            if self._size == 0:
+                return []
+            scores = np.empty(self._size, dtype=np.float32)
+            # 分块反量化计算，避免一次性把整个库展开成 float32 造成内存峰值
+            for start in range(0, self._size, self._CHUNK_ROWS):
+                end = min(start + self._CHUNK_ROWS, self._size)
+                scores[start:end] = (self._codes[start:end].astype(np.float32) @ q) * self._scales[start:end]
+            scores[~self._valid[:self._size]] = -np.inf
+            k = min(k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.uuids[i], self.sns[i], self.names[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+class PersonTemplateIndex:
+    """
+    按人员 (sn) 聚合的模板索引：同一个人注册多张照片后仍只占用一行。
+
+    - 质心：该人全部模板归一化后求和再归一化，用于第一阶段粗排，检索量与人数成正比；
+    - 代表模板：最多 max_exemplars 个彼此差异最大的原始模板（float32），
+      用于对粗排候选做精确比对，返回的相似度与真实模板一致。
+
+    注册时增量更新质心与代表模板；删除按 sn 整体移除。
+    """
+
+    def __init__(self, dim: int = 512, max_exemplars: int = 5):
+        self.dim = dim
+        self.max_exemplars = max(1, max_exemplars)
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        dim = self.dim
+        self._rows: Dict[str, int] = {}
+        self._centroids = np.zeros((0, dim), dtype=np.float32)
+        self._sums = np.zeros((0, dim), dtype=np.float32)
+        self._valid = np.zeros((0,), dtype=bool)
+        self.sns: List[str] = []
+        self.names: List[str] = []
+        self.template_counts: List[int] = []
+        self.exemplars: List[np.ndarray] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return int(self._centroids[:self._size].nbytes + self._sums[:self._size].nbytes
+                       + sum(e.nbytes for e in self.exemplars))
+
+    @property
+    def template_total(self) -> int:
+        with self._lock:
+            return sum(self.template_counts[row] for row in self._rows.values())
+
+    def _ensure_capacity(self):
+        if self._size < len(self._centroids):
+            return
+        capacity = max(1024, 2 * len(self._centroids))
+        for attr in ("_centroids", "_sums", "_valid"):
+            old = getattr(self, attr)
+            grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, attr, grown)
+
+    def _merge_exemplar(self, exemplars: np.ndarray, vector: np.ndarray) -> np.ndarray:
+        """把新模板并入代表集合：未满直接加入；已满时若新模板比最相近的一对更“独特”，则替换其中冗余的一个。"""
+        if len(exemplars) < self.max_exemplars:
+            return np.vstack([exemplars, vector[None, :]])
+        pairwise = exemplars @ exemplars.T
+        np.fill_diagonal(pairwise, -np.inf)
+        i, j = np.unravel_index(int(np.argmax(pairwise)), pairwise.shape)
+        if float(np.max(exemplars @ vector)) >= float(pairwise[i, j]):
+            return exemplars
+        np.fill_diagonal(pairwise, 0.0)
+        redundant = i if pairwise[i].sum() >= pairwise[j].sum() else j
+        exemplars = exemplars.copy()
+        exemplars[redundant] = vector
+        return exemplars
+
+    def add(self, sn: str, name: str, vectors: np.ndarray):
+        """为指定人员增加一个或多个模板。"""
+        normalized = l2_normalize(np.atleast_2d(vectors))
+        with self._lock:
+            row = self._rows.get(sn)
+            if row is None:
+                self._ensure_capacity()
+                row = self._size
+                self._size += 1
+                self._rows[sn] = row
+                self._sums[row] = 0.0
+                self._valid[row] = True
+                self.sns.append(sn)
+                self.names.append(name)
+                self.template_counts.append(0)
+                self.exemplars.append(np.zeros((0, self.dim), dtype=np.float32))
+            self.names[row] = name
+            exemplars = self.exemplars[row]
+            for vector in normalized:
+                exemplars = self._merge_exemplar(exemplars, vector)
+            self.exemplars[row] = exemplars
+            self._sums[row] += normalized.sum(axis=0)
+            self._centroids[row] = l2_normalize(self._sums[row])
+            self.template_counts[row] += len(normalized)
+
+    def remove(self, sn: str) -> bool:
+        with self._lock:
+            row = self._rows.pop(sn, None)
+            if row is None:
+                return False
+            self._valid[row] = False
+            self.exemplars[row] = np.zeros((0, self.dim), dtype=np.float32)
+            if self._size and len(self._rows) < 0.75 * self._size:
+                self._compact()
+            return True
+
+    def rename(self, sn: str, name: str):
+        with self._lock:
+            row = self._rows.get(sn)
+            if row is not None:
+                self.names[row] = name
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._valid[:self._size])
+        self._centroids = self._centroids[keep].copy()
+        self._sums = self._sums[keep].copy()
+        self._valid = np.ones(len(keep), dtype=bool)
+        self.sns = [self.sns[i] for i in keep]
+        self.names = [self.names[i] for i in keep]
+        self.template_counts = [self.template_counts[i] for i in keep]
+        self.exemplars = [self.exemplars[i] for i in keep]
+        self._size = len(keep)
+        self._rows = {sn: row for row, sn in enumerate(self.sns)}
+
+    def search(self, query: np.ndarray, candidates: int = 10) -> List[Tuple[str, str, float]]:
+        """
+        先按质心粗排取前 candidates 个人员，再与各自的代表模板精确比对，
+        返回按相似度降序排列的 [(sn, name, 相似度), ...]。
+        """
+        q = l2_normalize(query).reshape(-1)
+        with self._lock:
+            if not self._rows:
+                return []
+            scores = self._centroids[:self._size] @ q
+            scores[~self._valid[:self._size]] = -np.inf
+            k = min(candidates, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            refined = [
+                (self.sns[row], self.names[row], float(np.max(self.exemplars[row] @ q)))
+                for row in top if np.isfinite(scores[row])
+            ]
+        refined.sort(key=lambda item: item[2], reverse=True)
+        return refined
@@ -0,0 +1,320 @@
+# app/service/webhook_dispatcher.py
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.cfg.config import WebhookConfig
+from app.cfg.logging import app_logger
+
+# 这些状态码视为接收方暂时不可用，其余 4xx 重试也不会成功
+_RETRYABLE_STATUS = {408, 425, 429}
+
+
+def _url_key(url: str) -> str:
+    """暂存文件名中标识目标地址的短哈希，各地址只认领自己的暂存批次。"""
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=6).hexdigest()
+
+
+class _Delivery:
+    """一个待投递到指定地址的事件批次。"""
+    __slots__ = ("url", "events", "attempts", "next_at")
+
+    def __init__(self, url: str, events: List[Dict[str, Any]], attempts: int = 0, next_at: float = 0.0):
+        self.url = url
+        self.events = events
+        self.attempts = attempts
+        self.next_at = next_at
+
+
+class _Endpoint:
+    """
+    单个 Webhook 地址的投递通道：独立的有界队列、后台线程、重试列表与暂存文件，
+    一个地址长时间无响应只会阻塞它自己的线程，不影响其他地址。
+    """
+
+    def __init__(self, dispatcher: "WebhookDispatcher", url: str):
+        self.dispatcher = dispatcher
+        self.cfg = dispatcher.cfg
+        self.url = url
+        self.key = _url_key(url)
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=self.cfg.max_pending)
+        # 保护 retries 与 drained：关闭时由 close() 接管剩余批次，避免与仍在运行的线程重复或遗漏落盘
+        self.lock = threading.Lock()
+        self.retries: List[_Delivery] = []
+        self.drained = False
+        self._next_spool_scan = 0.0
+        self.worker = threading.Thread(target=self._worker_loop, name=f"WebhookDispatcher-{self.key}", daemon=True)
+        self.worker.start()
+
+    # --- 投递线程 ---
+    def _worker_loop(self):
+        batch: List[Dict[str, Any]] = []
+        deadline = None
+        stop_event = self.dispatcher.stop_event
+        while not stop_event.is_set():
+            now = time.monotonic()
+            wait = 0.5
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+            with self.lock:
+                if self.retries:
+                    wait = min(wait, min(d.next_at for d in self.retries) - now)
+            try:
+                batch.append(self.queue.get(timeout=max(0.01, wait)))
+                if deadline is None:
+                    deadline = time.monotonic() + self.cfg.max_delay_seconds
+            except queue.Empty:
+                pass
+            if batch and (len(batch) >= self.cfg.batch_size or time.monotonic() >= deadline):
+                self._attempt(_Delivery(self.url, batch))
+                batch, deadline = [], None
+            self._run_due_retries()
+            self._load_spool()
+
+        # 关闭：剩余事件尝试投递一次，仍未成功的批次写入磁盘等待下次启动
+        batch.extend(self._take_queued())
+        for start in range(0, len(batch), self.cfg.batch_size):
+            self._attempt(_Delivery(self.url, batch[start:start + self.cfg.batch_size]))
+        self.drain()
+
+    def _take_queued(self) -> List[Dict[str, Any]]:
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _attempt(self, delivery: _Delivery):
+        with self.lock:
+            drained = self.drained
+        if drained:
+            # close() 已接管（本线程超时未退出）时不再发请求，直接落盘
+            self.dispatcher.spool(delivery, self.key)
+            return
+        result = self.dispatcher.post(delivery.url, delivery.events)
+        if result:
+            self.dispatcher.count("delivered", len(delivery.events))
+            return
+        delivery.attempts += 1
+        if result is False or delivery.attempts > self.cfg.max_retries:
+            self.dispatcher.count("failed", len(delivery.events))
+            if result is None:
+                app_logger.error(f"Webhook {delivery.url} 连续 {delivery.attempts} 次投递失败，丢弃 {len(delivery.events)} 条事件。")
+            return
+        backoff = min(self.cfg.max_backoff_seconds, self.cfg.retry_backoff_seconds * 2 ** (delivery.attempts - 1))
+        # 加入少量随机抖动，避免多个工作进程同时重试
+        delivery.next_at = time.monotonic() + backoff * random.uniform(1.0, 1.2)
+        self.dispatcher.count("retried")
+        with self.lock:
+            if not self.drained and len(self.retries) < self.cfg.max_retry_batches:
+                self.retries.append(delivery)
+                return
+        self.dispatcher.spool(delivery, self.key)
+
+    def _run_due_retries(self):
+        now = time.monotonic()
+        with self.lock:
+            due = [d for d in self.retries if d.next_at <= now]
+            if not due:
+                return
+            self.retries = [d for d in self.retries if d.next_at > now]
+        for i, delivery in enumerate(due):
+            if self.dispatcher.stop_event.is_set():
+                with self.lock:
+                    if not self.drained:
+                        self.retries.extend(due[i:])
+                        return
+                for rest in due[i:]:
+                    self.dispatcher.spool(rest, self.key)
+                return
+            self._attempt(delivery)
+
+    def _load_spool(self):
+        """内存重试队列有空位时，从磁盘认领本地址暂存的批次（文件名以纳秒时间戳开头，按时间顺序处理）。"""
+        now = time.monotonic()
+        with self.lock:
+            room = self.cfg.max_retry_batches - len(self.retries)
+        if now < self._next_spool_scan or room <= self.cfg.max_retry_batches // 2:
+            return
+        self._next_spool_scan = now + 5.0
+        loaded: List[_Delivery] = []
+        for path in sorted(self.dispatcher.spool_dir.glob(f"*-{self.key}.json")):
+            if len(loaded) >= room:
+                break
+            # 先改名认领，多个工作进程共用目录时同一批次只会被一个进程取走
+            claimed = path.with_name(f".{path.name}.claimed-{os.getpid()}")
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                data = json.loads(claimed.read_text(encoding="utf-8"))
+                loaded.append(_Delivery(self.url, data["events"], int(data["attempts"]), now))
+            except (OSError, ValueError, KeyError) as e:
+                app_logger.warning(f"无法读取 Webhook 暂存批次 {path.name}，已丢弃: {e}")
+            claimed.unlink(missing_ok=True)
+        if loaded:
+            with self.lock:
+                if not self.drained:
+                    self.retries.extend(loaded)
+                    return
+            for delivery in loaded:
+                self.dispatcher.spool(delivery, self.key)
+
+    # --- 关闭 ---
+    def drain(self):
+        """把队列中剩余的事件与全部待重试批次写入磁盘；只生效一次，投递线程与 close() 谁先到谁执行。"""
+        with self.lock:
+            if self.drained:
+                return
+            self.drained = True
+            pending, self.retries = self.retries, []
+        events = self._take_queued()
+        for start in range(0, len(events), self.cfg.batch_size):
+            pending.append(_Delivery(self.url, events[start:start + self.cfg.batch_size]))
+        for delivery in pending:
+            self.dispatcher.spool(delivery, self.key)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"pending": self.queue.qsize(), "retrying": len(self.retries)}
+
+
+class WebhookDispatcher:
+    """
+    识别事件的 Webhook 推送器。
+
+    - publish_results() 只做去抖判断并放入各地址的有界内存队列，从不阻塞视频流水线；队列满时丢弃并计数；
+    - 同一视频流内同一人员 (stream_id, sn) 在 cooldown 窗口内只推送一次；
+    - 每个地址有独立的后台线程，按 batch_size 条或 max_delay 秒打包成一个 JSON 请求投递，
+      某个地址无响应或持续失败不会拖慢其他地址；
+    - 投递失败的批次按指数退避重试；内存中的重试批次超过上限时写入磁盘暂存目录，
+      关闭时未完成的批次也会落盘，下次启动后继续投递。
+    """
+
+    def __init__(self, cfg: WebhookConfig):
+        self.cfg = cfg
+        self.spool_dir = Path(cfg.spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._cooldown_lock = threading.Lock()
+        self._last_sent: Dict[Tuple[str, str], float] = {}
+        self._last_prune = time.monotonic()
+        self._spool_seq = itertools.count(1)
+        self._stats_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.stats_counters = {
+            "published": 0, "debounced": 0, "dropped": 0, "delivered": 0, "requests": 0,
+            "retried": 0, "failed": 0, "spooled": 0,
+        }
+        self._endpoints = [_Endpoint(self, url) for url in dict.fromkeys(cfg.urls)]
+
+    def count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats_counters[key] += n
+
+    # --- 提交端（运行在流水线线程中） ---
+    def _in_cooldown(self, stream_id: str, sn: str, now: float) -> bool:
+        key = (stream_id, sn)
+        with self._cooldown_lock:
+            last = self._last_sent.get(key)
+            if last is not None and now - last < self.cfg.cooldown_seconds:
+                return True
+            self._last_sent[key] = now
+            if now - self._last_prune > max(60.0, self.cfg.cooldown_seconds):
+                self._last_prune = now
+                self._last_sent = {k: t for k, t in self._last_sent.items() if now - t < self.cfg.cooldown_seconds}
+            return False
+
+    def publish_results(self, stream_id: str, results: List[Dict[str, Any]], timestamp: Optional[datetime] = None):
+        """把一帧中已识别的人脸转换为待推送事件，冷却期内重复出现的人员会被跳过。"""
+        timestamp = timestamp or datetime.now()
+        now = time.monotonic()
+        for res in results:
+            sn = res.get("sn")
+            if sn is None:
+                continue
+            if self._in_cooldown(stream_id, sn, now):
+                self.count("debounced")
+                continue
+            event = {
+                "timestamp": timestamp.isoformat(timespec="milliseconds"), "stream_id": stream_id, "sn": sn,
+                "name": res.get("name"), "similarity": res.get("similarity"), "bbox": res.get("box"),
+            }
+            self.count("published")
+            for endpoint in self._endpoints:
+                try:
+                    endpoint.queue.put_nowait(event)
+                except queue.Full:
+                    self.count("dropped")
+
+    # --- 投递（在各地址的线程中调用） ---
+    def post(self, url: str, events: List[Dict[str, Any]]) -> Optional[bool]:
+        """发送一个批次。成功返回 True，可重试的失败返回 None，不可重试的失败返回 False。"""
+        body = json.dumps({"count": len(events), "events": events}, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json", **self.cfg.headers})
+        self.count("requests")
+        try:
+            with urllib.request.urlopen(request, timeout=self.cfg.timeout_seconds) as response:
+                response.read()
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code < 500 and e.code not in _RETRYABLE_STATUS:
+                app_logger.error(f"Webhook {url} 拒绝了 {len(events)} 条事件 (HTTP {e.code})，不再重试。")
+                return False
+            app_logger.warning(f"Webhook {url} 暂时不可用 (HTTP {e.code})。")
+        except (urllib.error.URLError, OSError) as e:
+            app_logger.warning(f"Webhook {url} 请求失败: {e}")
+        return None
+
+    # --- 磁盘暂存 ---
+    def spool(self, delivery: _Delivery, key: str):
+        name = f"{time.time_ns()}-{os.getpid()}-{next(self._spool_seq):06d}-{key}.json"
+        tmp_path = self.spool_dir / f".{name}.tmp"
+        try:
+            tmp_path.write_text(json.dumps({"url": delivery.url, "attempts": delivery.attempts, "events": delivery.events},
+                                           ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self.spool_dir / name)
+            self.count("spooled")
+        except OSError as e:
+            self.count("failed", len(delivery.events))
+            app_logger.error(f"Webhook 待重试批次写入磁盘失败，丢弃 {len(delivery.events)} 条事件: {e}")
+            return
+        files = sorted(self.spool_dir.glob("*.json"))
+        for path in files[:max(0, len(files) - self.cfg.max_spool_files)]:
+            try:
+                events = len(json.loads(path.read_text(encoding="utf-8"))["events"])
+                path.unlink()
+                self.count("failed", events)
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def close(self, timeout: float = 15.0):
+        """
+        停止各地址的后台线程：剩余事件尝试投递一次，未成功的批次写入磁盘。
+        超时仍未退出的线程（卡在无响应的地址上）由这里接管，把其队列与重试批次落盘后再返回。
+        """
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for endpoint in self._endpoints:
+            endpoint.worker.join(timeout=max(0.0, deadline - time.monotonic()))
+        for endpoint in self._endpoints:
+            endpoint.drain()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self.stats_counters)
+        endpoint_stats = [endpoint.stats() for endpoint in self._endpoints]
+        return {**counters, "pending": sum(s["pending"] for s in endpoint_stats),
+                "retrying": sum(s["retrying"] for s in endpoint_stats), "urls": len(self._endpoints)}
@@ -0,0 +1,52 @@
+# app/tools/capture_bench.py
+import time
+from typing import Any, Dict, List, Optional
+
+from app.cfg.config import CaptureConfig
+from app.core.capture import create_capture
+
+
+def benchmark_capture(source: str, cfg: CaptureConfig, backend: str, max_frames: int = 500,
+                      width: Optional[int] = None, height: Optional[int] = None,
+                      decode_threads: Optional[int] = None, low_delay: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    以最快速度从视频源读取 max_frames 帧，统计单个采集后端的吞吐与单帧读取耗时。
+    OpenCV 后端输出的是原始分辨率，为公平起见这里额外计入缩放到相同工作分辨率的耗时。
+    """
+    import cv2
+
+    cap = create_capture(source, cfg, backend=backend, width=width, height=height,
+                         decode_threads=decode_threads, low_delay=low_delay, buffer_count=4)
+    if not cap.isOpened():
+        return {"backend": backend, "error": f"无法打开视频源: {source}"}
+
+    read_times: List[float] = []
+    frame_shape = None
+    started = time.perf_counter()
+    try:
+        for _ in range(max_frames):
+            t0 = time.perf_counter()
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if backend == "opencv" and width:
+                target_h = height or int(round(frame.shape[0] * width / frame.shape[1]))
+                frame = cv2.resize(frame, (width, target_h), interpolation=cv2.INTER_LINEAR)
+            read_times.append(time.perf_counter() - t0)
+            frame_shape = frame.shape
+    finally:
+        cap.release()
+    elapsed = time.perf_counter() - started
+
+    if not read_times:
+        return {"backend": backend, "error": "未读取到任何帧。"}
+    read_times.sort()
+    return {
+        "backend": backend,
+        "frames": len(read_times),
+        "seconds": round(elapsed, 3),
+        "fps": round(len(read_times) / elapsed, 1),
+        "avg_read_ms": round(1000 * sum(read_times) / len(read_times), 2),
+        "p95_read_ms": round(1000 * read_times[int(0.95 * (len(read_times) - 1))], 2),
+        "frame_shape": list(frame_shape),
+    }
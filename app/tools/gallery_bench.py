@@ -0,0 +1,111 @@
+# app/tools/gallery_bench.py
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# (磁盘存储精度, 检索索引, 是否启用人员索引) 的对比组合
+BENCH_CONFIGS: List[Tuple[str, str, bool]] = [
+    ("float32", "lancedb", False),
+    ("float16", "lancedb", False),
+    ("float32", "float16", False),
+    ("float32", "int8", False),
+    ("float16", "int8", False),
+    ("float32", "snapshot", False),
+    ("float32", "lancedb", True),
+]
+
+
+def _synthetic_gallery(persons: int, templates: int, queries: int, noise: float, seed: int):
+    """生成合成人脸库：每个人一个身份中心，模板与查询均为中心加噪声后的单位向量。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((persons, 512)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    owners = np.repeat(np.arange(persons), templates)
+    gallery = centers[owners] + noise * rng.standard_normal((len(owners), 512)).astype(np.float32) / np.sqrt(512)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    query_owners = rng.integers(0, persons, size=queries)
+    query_vectors = centers[query_owners] + noise * rng.standard_normal((queries, 512)).astype(np.float32) / np.sqrt(512)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return owners, gallery, query_vectors
+
+
+def _arrow_table(schema, owners: np.ndarray, vectors: np.ndarray):
+    import pyarrow as pa
+
+    arrow_schema = schema.to_arrow_schema()
+    vector_type = arrow_schema.field("vector").type
+    vector_column = pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), 512).cast(vector_type)
+    now = datetime.now()
+    return pa.Table.from_arrays([
+        pa.array([str(uuid.uuid4()) for _ in range(len(owners))]),
+        vector_column,
+        pa.array([f"person-{o}" for o in owners]),
+        pa.array([f"SN{o:07d}" for o in owners]),
+        pa.array([""] * len(owners)),
+        pa.array([now] * len(owners), type=arrow_schema.field("registration_time").type),
+        pa.nulls(len(owners), pa.string()),
+    ], schema=arrow_schema)
+
+
+def benchmark_gallery(persons: int = 5000, templates: int = 4, queries: int = 200, rerank_candidates: int = 20,
+                      noise: float = 0.8, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    在临时目录中构建同一份合成人脸库的多种存储/索引组合，
+    以 float32 全量暴力检索结果为基准，统计 Top-1 一致率、相似度误差、检索延迟与内存/磁盘占用。
+    """
+    import lancedb
+    from app.service.face_dao import FACE_SCHEMAS, LanceDBFaceDataDAO
+
+    owners, gallery, query_vectors = _synthetic_gallery(persons, templates, queries, noise, seed)
+    exact_scores = query_vectors @ gallery.T
+    exact_best = exact_scores.argmax(axis=1)
+    expected_sn = [f"SN{owners[i]:07d}" for i in exact_best]
+    expected_sim = exact_scores[np.arange(queries), exact_best]
+
+    workdir = Path(tempfile.mkdtemp(prefix="gallery_bench_"))
+    results: List[Dict[str, Any]] = []
+    try:
+        for storage, index, person_index in BENCH_CONFIGS:
+            table_name = f"bench_{storage}_{index}" + ("_persons" if person_index else "")
+            db_uri = str(workdir / table_name)
+            lancedb.connect(db_uri).create_table(table_name, data=_arrow_table(FACE_SCHEMAS[storage], owners, gallery))
+
+            started = time.perf_counter()
+            dao = LanceDBFaceDataDAO(db_uri, table_name, vector_storage=storage, vector_index=index,
+                                     rerank_candidates=rerank_candidates, index_refresh_seconds=3600,
+                                     person_index=person_index, snapshot_dir=str(workdir / "snapshots"))
+            load_seconds = time.perf_counter() - started
+
+            latencies, hits, sim_errors = [], 0, []
+            for i, query in enumerate(query_vectors):
+                t0 = time.perf_counter()
+                match = dao.search(query, threshold=-1.0)
+                latencies.append(time.perf_counter() - t0)
+                if match is not None:
+                    hits += int(match[1] == expected_sn[i])
+                    sim_errors.append(abs(match[2] - float(expected_sim[i])))
+            latencies.sort()
+            disk_bytes = sum(f.stat().st_size for f in Path(db_uri).rglob("*") if f.is_file())
+            results.append({
+                "storage": storage,
+                "index": "persons" if person_index else index,
+                "vectors": len(owners),
+                "load_seconds": round(load_seconds, 3),
+                "top1_agreement": round(hits / queries, 4),
+                "max_similarity_error": round(max(sim_errors) if sim_errors else float("nan"), 6),
+                "avg_ms": round(1000 * sum(latencies) / len(latencies), 2),
+                "p95_ms": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 2),
+                "index_mb": round(sum(i.nbytes for i in (dao.compact_index, dao.person_index) if i) / 1024 / 1024, 2),
+                "searched_rows": len(dao.person_index) if dao.person_index else len(owners),
+                "disk_mb": round(disk_bytes / 1024 / 1024, 2),
+            })
+            dao.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
@@ -0,0 +1,264 @@
+# app/tools/load_test.py
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+API_PREFIX = "/api/face"
+OPERATIONS = ("recognize", "register", "list")
+_IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+_FRAME_MARKER = b"--frame\r\n"
+# 未指定图片目录时，以自检人脸图片为基础生成增强副本
+DEFAULT_FACE_IMAGE = Path(__file__).resolve().parents[1] / "static" / "self_test_face.jpg"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """解析 "recognize=8,register=1,list=1" 形式的请求配比，返回归一化后的权重。"""
+    weights: Dict[str, float] = {}
+    for part in filter(None, (p.strip() for p in mix.split(","))):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise ValueError(f"未知的请求类型: {op}，可选: {', '.join(OPERATIONS)}")
+        weights[op] = float(weight) if weight else 1.0
+    total = sum(w for w in weights.values() if w > 0)
+    if total <= 0:
+        raise ValueError("请求配比中至少需要一种权重大于 0 的请求类型。")
+    return {op: w / total for op, w in weights.items() if w > 0}
+
+
+def augment_face_image(image_bytes: bytes, count: int = 32, seed: int = 0, max_side: int = 640) -> List[bytes]:
+    """
+    以一张人脸图片生成 count 张轻度增强的副本（翻转、小角度旋转、缩放、平移、亮度/对比度与 JPEG 质量扰动），
+    每张内容都不同，不会全部命中服务端的内容哈希缓存，同时仍能检测到人脸、通过注册的质量检查。
+    """
+    import cv2
+
+    base = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if base is None:
+        raise ValueError("无法解码用于生成压测负载的人脸图片。")
+    height, width = base.shape[:2]
+    if max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        base = cv2.resize(base, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        height, width = base.shape[:2]
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        img = base
+        if i > 0:
+            if rng.random() < 0.5:
+                img = cv2.flip(img, 1)
+            matrix = cv2.getRotationMatrix2D((width / 2, height / 2), float(rng.uniform(-8, 8)), float(rng.uniform(0.9, 1.1)))
+            matrix[:, 2] += rng.uniform(-0.04, 0.04, size=2) * (width, height)
+            img = cv2.warpAffine(img, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+            img = cv2.convertScaleAbs(img, alpha=float(rng.uniform(0.85, 1.15)), beta=float(rng.uniform(-20, 20)))
+        quality = int(rng.integers(80, 96))
+        images.append(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    return images
+
+
+def load_images(image_dir: Optional[str] = None, count: int = 32, seed: int = 0) -> List[bytes]:
+    """读取目录中的图片作为请求负载；未指定目录时使用自检人脸图片的增强副本。"""
+    if image_dir:
+        files = sorted(p for p in Path(image_dir).rglob("*") if p.suffix.lower() in _IMAGE_SUFFIXES)
+        if not files:
+            raise ValueError(f"目录中没有可用的图片: {image_dir}")
+        return [p.read_bytes() for p in files]
+    if not DEFAULT_FACE_IMAGE.exists():
+        raise ValueError(f"未找到默认的人脸图片 {DEFAULT_FACE_IMAGE}，请通过 --images 指定人脸图片目录。")
+    return augment_face_image(DEFAULT_FACE_IMAGE.read_bytes(), count, seed)
+
+
+def check_result(result: Dict[str, Any]) -> List[str]:
+    """检查压测结果是否有效，返回问题描述列表（为空表示通过）。"""
+    problems = []
+    register = result["operations"].get("register")
+    if register and register["ok"] == 0:
+        problems.append(f"注册请求全部失败 (状态码 {register['statuses']})，请确认压测图片中包含可注册的人脸。")
+    return problems
+
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "avg_ms": None, "max_ms": None}
+    values = 1000 * np.asarray(latencies)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2),
+            "avg_ms": round(float(values.mean()), 2), "max_ms": round(float(values.max()), 2)}
+
+
+class _Recorder:
+    """按请求类型累计延迟与状态码。"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.statuses: Dict[str, Dict[str, int]] = {op: {} for op in OPERATIONS}
+
+    def record(self, op: str, status: str, seconds: float):
+        self.latencies[op].append(seconds)
+        self.statuses[op][status] = self.statuses[op].get(status, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        result = {}
+        for op in OPERATIONS:
+            statuses = self.statuses[op]
+            total = sum(statuses.values())
+            if not total:
+                continue
+            ok = sum(n for s, n in statuses.items() if s.startswith("2"))
+            busy = statuses.get("503", 0)
+            result[op] = {
+                "requests": total,
+                "throughput_rps": round(total / elapsed, 2),
+                "ok": ok,
+                "error_rate": round((total - ok - busy) / total, 4),
+                "rate_503": round(busy / total, 4),
+                "statuses": dict(sorted(statuses.items())),
+                **_latency_summary(self.latencies[op]),
+            }
+        return result
+
+
+async def _request_worker(client, op_names: List[str], op_weights: List[float], images: List[bytes],
+                          deadline: float, recorder: _Recorder, registered: List[str], run_id: str, rng: random.Random):
+    while time.perf_counter() < deadline:
+        op = rng.choices(op_names, weights=op_weights)[0]
+        image = rng.choice(images)
+        started = time.perf_counter()
+        try:
+            if op == "recognize":
+                response = await client.post(f"{API_PREFIX}/recognize",
+                                             files={"image_file": ("load.jpg", image, "image/jpeg")})
+            elif op == "register":
+                sn = f"LOADTEST-{run_id}-{len(registered)}"
+                registered.append(sn)
+                response = await client.post(f"{API_PREFIX}/faces", data={"name": sn, "sn": sn},
+                                             files={"image_file": ("load.jpg", image, "image/jpeg")})
+            else:
+                response = await client.get(f"{API_PREFIX}/faces", params={"limit": 50})
+            status = str(response.status_code)
+        except Exception as e:
+            status = type(e).__name__
+        recorder.record(op, status, time.perf_counter() - started)
+
+
+async def _feed_viewer(client, stream_id: str, deadline: float) -> Dict[str, Any]:
+    """持续读取 MJPEG 推流直到压测结束，按分隔符计数收到的帧，统计实际送达帧率。"""
+    state: Dict[str, Any] = {"frames": 0, "first_frame_ms": None, "error": None}
+    started = time.perf_counter()
+
+    async def consume():
+        tail = b""
+        async with client.stream("GET", f"{API_PREFIX}/streams/feed/{stream_id}", timeout=None) as response:
+            if response.status_code != 200:
+                state["error"] = f"HTTP {response.status_code}"
+                return
+            async for chunk in response.aiter_bytes():
+                data = tail + chunk
+                count = data.count(_FRAME_MARKER)
+                if count and state["first_frame_ms"] is None:
+                    state["first_frame_ms"] = round(1000 * (time.perf_counter() - started), 1)
+                state["frames"] += count
+                # 保留末尾不完整的分隔符，避免跨块时漏计
+                tail = data[-(len(_FRAME_MARKER) - 1):]
+
+    try:
+        # 推流停顿时 aiter_bytes 不会返回，用超时保证观看者按时结束
+        await asyncio.wait_for(consume(), timeout=max(0.0, deadline - time.perf_counter()))
+    except asyncio.TimeoutError:
+        pass
+    except Exception as e:
+        state["error"] = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - started
+    return {"stream_id": stream_id, "frames": state["frames"], "seconds": round(elapsed, 2),
+            "fps": round(state["frames"] / elapsed, 2) if elapsed > 0 else 0.0,
+            "first_frame_ms": state["first_frame_ms"], "error": state["error"]}
+
+
+async def run_load_test(base_url: str, duration: float = 30.0, concurrency: int = 8, mix: str = "recognize=8,register=1,list=1",
+                        viewers: int = 0, stream_ids: Optional[List[str]] = None, stream_source: Optional[str] = None,
+                        image_dir: Optional[str] = None, timeout: float = 30.0, keep_registered: bool = False,
+                        label: Optional[str] = None, seed: int = 0) -> Dict[str, Any]:
+    """
+    对运行中的服务施加混合负载：concurrency 个并发请求循环按配比发送识别/注册/列表请求，
+    同时 viewers 个客户端观看 MJPEG 推流（平均分配到给定的流；提供 stream_source 时自动启动一路并在结束后停止）。
+    返回可保存为 JSON 的结果，便于不同版本之间对比。
+    """
+    import httpx
+
+    weights = parse_mix(mix)
+    images = load_images(image_dir, seed=seed)
+    run_id = uuid.uuid4().hex[:8]
+    rng = random.Random(seed)
+    recorder = _Recorder()
+    registered: List[str] = []
+    started_streams: List[str] = []
+    stream_ids = list(stream_ids or [])
+
+    limits = httpx.Limits(max_connections=concurrency + viewers + 4, max_keepalive_connections=concurrency + viewers + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        server_profile = None
+        try:
+            ready = await client.get(f"{API_PREFIX}/ready")
+            server_profile = ready.json().get("data") if ready.status_code == 200 else None
+        except Exception:
+            pass
+
+        if viewers and stream_source:
+            response = await client.post(f"{API_PREFIX}/streams/start", json={"source": stream_source, "lifetime_minutes": -1})
+            response.raise_for_status()
+            started_streams.append(response.json()["data"]["stream_id"])
+            stream_ids.append(started_streams[-1])
+        if viewers and not stream_ids:
+            raise ValueError("观看推流需要提供 stream_ids 或 stream_source。")
+
+        started = time.perf_counter()
+        deadline = started + duration
+        viewer_tasks = [asyncio.create_task(_feed_viewer(client, stream_ids[i % len(stream_ids)], deadline))
+                        for i in range(viewers)]
+        worker_tasks = [
+            asyncio.create_task(_request_worker(client, list(weights), list(weights.values()), images, deadline,
+                                                recorder, registered, run_id, random.Random(rng.random())))
+            for _ in range(concurrency)
+        ]
+        await asyncio.gather(*worker_tasks)
+        viewer_results = await asyncio.gather(*viewer_tasks)
+        elapsed = time.perf_counter() - started
+
+        for stream_id in started_streams:
+            await client.post(f"{API_PREFIX}/streams/stop/{stream_id}")
+        if not keep_registered:
+            for sn in registered:
+                try:
+                    await client.delete(f"{API_PREFIX}/faces/{sn}")
+                except Exception:
+                    pass
+
+    operations = recorder.summary(elapsed)
+    total = sum(op["requests"] for op in operations.values())
+    fps = [v["fps"] for v in viewer_results if v["error"] is None]
+    return {
+        "label": label,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "base_url": base_url,
+        "config": {"duration": duration, "concurrency": concurrency, "mix": weights, "viewers": viewers,
+                   "stream_ids": stream_ids, "images": len(images), "image_dir": image_dir},
+        "elapsed_seconds": round(elapsed, 2),
+        "total_requests": total,
+        "throughput_rps": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        "operations": operations,
+        "viewers": {
+            "count": viewers,
+            "avg_fps": round(sum(fps) / len(fps), 2) if fps else None,
+            "min_fps": min(fps) if fps else None,
+            "details": viewer_results,
+        },
+        "server_startup": server_profile,
+    }
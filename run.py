@@ -2,7 +2,7 @@
 import os
 import socket
 from pathlib import Path
-from typing import Annotated, Optional
+from typing import Annotated, List, Optional
 
 import typer
 import uvicorn
@@ -162,6 +162,225 @@ def start_server(
         logger.critical(f"⚠️ Uvicorn 服务器启动失败: {e}", exc_info=True)
         raise typer.Exit(code=1)
 
+@app.command(name="bench-capture")
+def bench_capture(
+        ctx: typer.Context,
+        source: Annotated[str, typer.Argument(help="用于测试的本地视频文件路径。")],
+        frames: Annotated[int, typer.Option("--frames", "-n", help="每个后端读取的最大帧数。")] = 500,
+        width: Annotated[Optional[int], typer.Option("--width", help="工作分辨率宽度（ffmpeg 在解码时缩放，opencv 解码后缩放）。")] = None,
+        height: Annotated[Optional[int], typer.Option("--height", help="工作分辨率高度，不填则按宽高比计算。")] = None,
+        threads: Annotated[Optional[int], typer.Option("--threads", help="ffmpeg 解码线程数，0 表示自动。")] = None,
+        low_delay: Annotated[bool, typer.Option("--low-delay", help="启用 ffmpeg 低延迟解码标志。")] = False,
+):
+    """
+    对比 OpenCV 与 ffmpeg 两种采集后端在本地视频文件上的解码吞吐。
+    """
+    from app.tools.capture_bench import benchmark_capture
+
+    settings: AppSettings = ctx.obj
+    if not Path(source).exists():
+        logger.error(f"视频文件不存在: {source}")
+        raise typer.Exit(code=1)
+
+    logger.info(f"\n--- 🎞️ 采集后端基准测试: {source} (最多 {frames} 帧) ---")
+    for backend in ("opencv", "ffmpeg"):
+        result = benchmark_capture(source, settings.capture, backend, max_frames=frames, width=width,
+                                   height=height, decode_threads=threads, low_delay=low_delay)
+        if "error" in result:
+            logger.warning(f"  - {backend}: {result['error']}")
+            continue
+        logger.info(
+            f"  - {backend:<7}: {result['frames']} 帧 / {result['seconds']}s = {result['fps']} FPS, "
+            f"平均读帧 {result['avg_read_ms']} ms, P95 {result['p95_read_ms']} ms, 输出尺寸 {result['frame_shape']}"
+        )
+
+
+
+@app.command(name="bench-gallery")
+def bench_gallery(
+        persons: Annotated[int, typer.Option("--persons", help="合成人脸库中的人数。")] = 5000,
+        templates: Annotated[int, typer.Option("--templates", help="每人的特征模板数量。")] = 4,
+        queries: Annotated[int, typer.Option("--queries", "-q", help="检索次数。")] = 200,
+        rerank: Annotated[int, typer.Option("--rerank", help="按表中存储的向量重排的候选数量。")] = 20,
+):
+    """
+    对比 float32 / float16 存储与 float16 / int8 紧凑索引在合成人脸库上的准确率、延迟与内存占用。
+    """
+    from app.tools.gallery_bench import benchmark_gallery
+
+    logger.info(f"\n--- 🗂️ 人脸库检索基准测试: {persons} 人 x {templates} 模板, {queries} 次检索 ---")
+    for r in benchmark_gallery(persons=persons, templates=templates, queries=queries, rerank_candidates=rerank):
+        logger.info(
+            f"  - 存储 {r['storage']:<7} 索引 {r['index']:<7}: Top-1 一致率 {r['top1_agreement']:.2%}, "
+            f"最大相似度误差 {r['max_similarity_error']}, 平均 {r['avg_ms']} ms, P95 {r['p95_ms']} ms, "
+            f"加载 {r['load_seconds']}s, 内存索引 {r['index_mb']} MB, 磁盘 {r['disk_mb']} MB, 粗排行数 {r['searched_rows']}"
+        )
+
+
+@app.command(name="load-test")
+def load_test(
+        ctx: typer.Context,
+        url: Annotated[Optional[str], typer.Option("--url", help="被测服务地址，默认使用配置中的端口访问本机。")] = None,
+        duration: Annotated[float, typer.Option("--duration", "-d", help="压测持续时间（秒）。")] = 30.0,
+        concurrency: Annotated[int, typer.Option("--concurrency", "-c", help="并发请求数。")] = 8,
+        mix: Annotated[str, typer.Option("--mix", help="请求配比，如 recognize=8,register=1,list=1。")] = "recognize=8,register=1,list=1",
+        viewers: Annotated[int, typer.Option("--viewers", help="同时观看 MJPEG 推流的客户端数。")] = 0,
+        stream_ids: Annotated[Optional[List[str]], typer.Option("--stream-id", help="观看已存在的视频流，可重复指定。")] = None,
+        stream_source: Annotated[Optional[str], typer.Option("--stream-source", help="压测前自动启动一路视频流的视频源，结束后停止。")] = None,
+        images: Annotated[Optional[str], typer.Option("--images", help="请求使用的人脸图片目录，不填则使用自检人脸图片的增强副本。")] = None,
+        keep: Annotated[bool, typer.Option("--keep-registered", help="保留压测中注册的人员（默认结束后删除）。")] = False,
+        label: Annotated[Optional[str], typer.Option("--label", help="本次结果的标签，如构建版本号。")] = None,
+        output: Annotated[Optional[Path], typer.Option("--output", "-o", help="结果 JSON 路径，默认写入 data/loadtest/。")] = None,
+):
+    """
+    对运行中的服务施加识别/注册/列表混合负载并同时观看推流，输出吞吐、延迟分位、错误率与推流帧率。
+    """
+    import asyncio
+    import json
+    from datetime import datetime
+    from app.cfg.config import DATA_DIR
+    from app.tools.load_test import check_result, run_load_test
+
+    settings: AppSettings = ctx.obj
+    base_url = url or f"http://127.0.0.1:{settings.server.port}"
+    logger.info(f"\n--- 🔥 负载测试: {base_url}, {concurrency} 并发 ({mix}), {viewers} 个推流观看者, {duration}s ---")
+    try:
+        result = asyncio.run(run_load_test(base_url, duration=duration, concurrency=concurrency, mix=mix, viewers=viewers,
+                                           stream_ids=stream_ids, stream_source=stream_source, image_dir=images,
+                                           keep_registered=keep, label=label))
+    except ValueError as e:
+        logger.error(str(e))
+        raise typer.Exit(code=1)
+
+    logger.info(f"  - 总计 {result['total_requests']} 个请求, 吞吐 {result['throughput_rps']} req/s")
+    for op, r in result["operations"].items():
+        logger.info(
+            f"  - {op:<9}: {r['requests']} 次, {r['throughput_rps']} req/s, P50 {r['p50_ms']} ms, P95 {r['p95_ms']} ms, "
+            f"P99 {r['p99_ms']} ms, 错误率 {r['error_rate']:.2%}, 503 比例 {r['rate_503']:.2%}, 状态码 {r['statuses']}"
+        )
+    for v in result["viewers"]["details"]:
+        logger.info(f"  - 推流 {v['stream_id']}: {v['frames']} 帧, {v['fps']} FPS, 首帧 {v['first_frame_ms']} ms"
+                    + (f", 错误: {v['error']}" if v["error"] else ""))
+
+    output = output or DATA_DIR / "loadtest" / f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    problems = check_result(result)
+    if problems:
+        for problem in problems:
+            logger.error(f"❌ {problem}")
+        logger.error(f"压测结果无效，结果已保存: {output}")
+        raise typer.Exit(code=1)
+    logger.info(f"✅ 结果已保存: {output}")
+
+
+@app.command(name="gallery-export")
+def gallery_export(
+        ctx: typer.Context,
+        output: Annotated[Path, typer.Argument(help="输出文件路径，按扩展名 (.parquet / .arrow) 选择格式。")],
+        fmt: Annotated[Optional[str], typer.Option("--format", "-f", help="强制指定格式：parquet 或 arrow。")] = None,
+        include_images: Annotated[bool, typer.Option("--include-images", help="附带注册时保存的人脸图片。")] = False,
+        vector_dtype: Annotated[str, typer.Option("--vector-dtype", help="特征向量的存储精度：float32 或 float16。")] = "float32",
+):
+    """
+    将整个人脸库（特征向量 + 元数据，可选人脸图片）导出为 Parquet / Arrow 文件，用于新设备开通。
+    """
+    from app.service.face_dao import create_face_dao
+    from app.service.gallery_archive import export_gallery
+
+    settings: AppSettings = ctx.obj
+    cfg = settings.gallery_archive
+    face_dao = create_face_dao(settings)
+    try:
+        result = export_gallery(face_dao, output, fmt, include_images=include_images, vector_dtype=vector_dtype,
+                                recognition_model=settings.degirum.recognition_model_name,
+                                batch_size=cfg.batch_size, compression=cfg.parquet_compression)
+    except ValueError as e:
+        logger.error(str(e))
+        raise typer.Exit(code=1)
+    finally:
+        face_dao.dispose()
+    logger.info(f"✅ 已导出 {result['rows']} 条记录 ({result['images']} 张图片) 到 {result['path']}: "
+                f"{result['bytes'] / 1024 / 1024:.1f} MB, 耗时 {result['seconds']}s")
+
+
+@app.command(name="gallery-import")
+def gallery_import(
+        ctx: typer.Context,
+        source: Annotated[Path, typer.Argument(help="由 gallery-export 或导出接口生成的归档文件。")],
+        no_images: Annotated[bool, typer.Option("--no-images", help="不写入归档中附带的人脸图片。")] = False,
+        force: Annotated[bool, typer.Option("--force", help="忽略识别模型不一致的检查。")] = False,
+):
+    """
+    从 Parquet / Arrow 归档批量导入人脸库：校验向量、按 uuid 去重、一次性写入并重建索引，不经过模型推理。
+    服务运行中也可导入，服务会在下次检查表版本时重建内存索引。
+    """
+    from app.service.face_dao import create_face_dao
+    from app.service.gallery_archive import import_gallery
+
+    settings: AppSettings = ctx.obj
+    if not source.exists():
+        logger.error(f"归档文件不存在: {source}")
+        raise typer.Exit(code=1)
+    face_dao = create_face_dao(settings)
+    try:
+        result = import_gallery(face_dao, source, None if no_images else Path(settings.degirum.image_db_path),
+                                recognition_model=settings.degirum.recognition_model_name, force=force,
+                                batch_size=settings.gallery_archive.batch_size)
+    except ValueError as e:
+        logger.error(str(e))
+        raise typer.Exit(code=1)
+    finally:
+        face_dao.dispose()
+    logger.info(f"✅ 导入完成: 共 {result['total']} 条, 写入 {result['imported']} 条, 重复 {result['duplicates']} 条, "
+                f"无效 {result['invalid']} 条, 图片 {result['images_written']} 张, 耗时 {result['seconds']}s")
+
+
+@app.command(name="reembed")
+def reembed(
+        ctx: typer.Context,
+        force: Annotated[bool, typer.Option("--force", help="人脸库特征已由当前模型提取时仍全部重新提取。")] = False,
+        duty: Annotated[float, typer.Option("--duty", help="占用模型的时间比例上限 (0, 1]，服务停机时可用 1 全速运行。")] = 1.0,
+        pool_size: Annotated[int, typer.Option("--pool-size", help="加载的模型套数。")] = 1,
+):
+    """
+    更换识别模型后，用已保存的人脸图片重新提取全部特征并原子切换（离线执行）。
+    与服务共用进度文件，中断后再次执行从断点继续；服务运行时请改用 /api/face/reembed 接口。
+    """
+    import time
+    from app.core.model_manager import ModelPool
+    from app.service.face_dao import create_face_dao
+    from app.service.reembed_job import ReembedJob
+
+    settings: AppSettings = ctx.obj
+    cfg = settings.degirum
+    model_pool = ModelPool(settings=settings, pool_size=pool_size)
+    face_dao = create_face_dao(settings)
+    job = ReembedJob(settings.reembed.model_copy(update={"max_duty_cycle": min(max(duty, 0.01), 1.0)}), face_dao,
+                     model_pool, cfg.lancedb_uri, cfg.lancedb_table_name, cfg.recognition_model_name)
+    try:
+        job.start(force=force)
+        while job.running:
+            time.sleep(5)
+            status = job.status()
+            logger.info(f"  - 进度 {status['done']}/{status['total']}, 失败 {status['failed']}, "
+                        f"{status['rows_per_second']} 条/秒, 预计剩余 {status['eta_seconds']}s")
+    except ValueError as e:
+        logger.error(str(e))
+        raise typer.Exit(code=1)
+    except KeyboardInterrupt:
+        job.pause()
+        logger.info("已暂停，再次执行该命令从断点继续。")
+    finally:
+        face_dao.dispose()
+        model_pool.dispose()
+    status = job.status()
+    if status["status"] == "failed":
+        logger.error(f"特征重新提取失败: {status['error']}")
+        raise typer.Exit(code=1)
+    if status["status"] == "completed":
+        logger.info(f"✅ 已切换到模型 '{status['gallery_model']}': 替换 {status['switched']} 条特征, 失败 {status['failed']} 条。")
+
 # 【核心修正】导入 multiprocessing 并设置启动方式
 import multiprocessing as mp
 if __name__ == "__main__":
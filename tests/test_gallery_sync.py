@@ -0,0 +1,208 @@
+# tests/test_gallery_sync.py
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pyarrow as pa
+import uvicorn
+from fastapi import FastAPI
+
+from app.cfg.config import SyncConfig
+from app.router.face_router import router
+from app.service.face_dao import LanceDBFaceDataDAO
+from app.service.gallery_sync import SYNC_CHANGES_PATH, GallerySyncService
+
+TOKEN = "shared-secret"
+
+
+def _vector(seed: int) -> np.ndarray:
+    vector = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _Node:
+    """一个独立的节点：临时目录中的人脸库，加上只挂载人脸路由的本地 HTTP 服务。"""
+
+    def __init__(self, root: Path, node_id: str, token: str = TOKEN, vector_index: str = "lancedb",
+                 recognition_model: str = ""):
+        self.node_id = node_id
+        self.root = root / node_id
+        self.dao = LanceDBFaceDataDAO(str(self.root / "db"), "faces", vector_index=vector_index,
+                                      index_refresh_seconds=3600, node_id=node_id, recognition_model=recognition_model,
+                                      snapshot_dir=str(self.root / "snapshots"))
+        app = FastAPI()
+        app.include_router(router, prefix="/api/face")
+        app.state.face_dao = self.dao
+        app.state.settings = SimpleNamespace(sync=SyncConfig(token=token))
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [sock]}, daemon=True)
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.services = []
+
+    def syncer(self, *peers: "_Node", token: str = TOKEN, service_cls=GallerySyncService) -> GallerySyncService:
+        cfg = SyncConfig(peers=[peer.url for peer in peers], token=token, interval_seconds=3600,
+                         state_file=str(self.root / "sync_state.json"))
+        service = service_cls(cfg, self.dao, self.node_id)
+        self.services.append(service)
+        return service
+
+    def records(self, sn: str):
+        return sorted(self.dao.get_features_by_sn(sn), key=lambda r: r["name"])
+
+    def close(self):
+        for service in self.services:
+            service.close()
+        self.server.should_exit = True
+        self.thread.join(5)
+        self.dao.dispose()
+
+
+class GallerySyncTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.close()
+        self.tmp.cleanup()
+
+    def _node(self, node_id: str, **kwargs) -> _Node:
+        node = _Node(Path(self.tmp.name), node_id, **kwargs)
+        self.nodes.append(node)
+        return node
+
+    def test_create_update_delete_propagate_by_record(self):
+        a, b = self._node("A"), self._node("B", vector_index="int8")
+        a.dao.create("Alice", "S1", _vector(1), Path("/srv/faces/_cas/aa/alice.jpg"))
+        a.dao.create("Bob", "S2", _vector(2), Path("/srv/faces/_cas/bb/bob.jpg"))
+        syncer = b.syncer(a)
+        syncer.pull_once()
+        self.assertEqual(b.dao.count(), 2)
+        synced = b.records("S1")[0]
+        self.assertEqual(synced["image_path"], "remote://A/srv/faces/_cas/aa/alice.jpg")
+        self.assertEqual(b.dao.search(_vector(2), threshold=0.9)[:2], ("Bob", "S2"))
+
+        # B 本地为同一个 sn 注册的记录不应被 A 的改名与删除波及
+        b.dao.create("Alice-B", "S1", _vector(3), Path("/srv/faces/_cas/cc/alice-b.jpg"))
+        a.dao.update_by_sn("S1", {"name": "Alice2"})
+        a.dao.delete_by_sn("S2")
+        syncer.pull_once()
+        self.assertEqual([r["name"] for r in b.records("S1")], ["Alice-B", "Alice2"])
+        self.assertEqual(b.records("S2"), [])
+        self.assertIsNone(b.dao.search(_vector(2), threshold=0.9))
+
+        a.dao.delete_by_sn("S1")
+        syncer.pull_once()
+        self.assertEqual([r["name"] for r in b.records("S1")], ["Alice-B"])
+        self.assertEqual(b.dao.search(_vector(3), threshold=0.9)[:2], ("Alice-B", "S1"))
+        self.assertIsNone(b.dao.search(_vector(1), threshold=0.9))
+        self.assertEqual(syncer.stats()["deleted"], 2)
+        self.assertEqual(syncer.stats()["errors"], 0)
+
+    def test_exclude_origin_prevents_echo(self):
+        a, b = self._node("A"), self._node("B")
+        a_syncer, b_syncer = a.syncer(b), b.syncer(a)
+        a.dao.create("Alice", "S1", _vector(1), Path("alice.jpg"))
+        b_syncer.pull_once()
+        a_syncer.pull_once()
+        self.assertEqual(a.dao.count(), 1)
+        self.assertEqual(a_syncer.stats()["created"], 0)
+        changes, _, _ = b.dao.changes_since(0, 100, exclude_origin="A")
+        self.assertEqual(changes.num_rows, 0)
+
+        # B 修改由 A 注册的记录：A 应用到自己的记录上，之后 B 不会再收到这条变更
+        b.dao.update_by_sn("S1", {"name": "Alice2"})
+        a_syncer.pull_once()
+        self.assertEqual([r["name"] for r in a.records("S1")], ["Alice2"])
+        b_syncer.pull_once()
+        self.assertEqual(b_syncer.stats()["updated"], 0)
+        self.assertEqual(b.dao.count(), 1)
+
+    def test_pull_resumes_from_stored_seq_after_restart(self):
+        a, b = self._node("A"), self._node("B")
+        for i in range(3):
+            a.dao.create(f"P{i}", f"S{i}", _vector(i), Path(f"p{i}.jpg"))
+        first = b.syncer(a)
+        first.pull_once()
+        first.close()
+
+        requested = []
+
+        class RecordingSync(GallerySyncService):
+            def _fetch(self, peer, since):
+                requested.append(since)
+                return super()._fetch(peer, since)
+
+        a.dao.create("P3", "S3", _vector(3), Path("p3.jpg"))
+        restarted = b.syncer(a, service_cls=RecordingSync)
+        restarted.pull_once()
+        self.assertEqual(requested[0], 3)
+        self.assertEqual(b.dao.count(), 4)
+        self.assertEqual(restarted.stats()["created"], 1)
+
+    def test_reembedded_vectors_follow_model_switch(self):
+        a = self._node("A", recognition_model="m1")
+        b = self._node("B", recognition_model="m1", vector_index="snapshot")
+        record = a.dao.create("Alice", "S1", _vector(1), Path("alice.jpg"))
+        syncer = b.syncer(a)
+        syncer.pull_once()
+        self.assertEqual(b.dao.search(_vector(1), threshold=0.9)[:2], ("Alice", "S1"))
+
+        # A 换用新模型并替换特征：B 的人脸库仍是旧模型，拒绝新模型的向量
+        a.dao.replace_vectors(pa.table({"uuid": [record["uuid"]], "vector": [_vector(9).tolist()]}), "m2")
+        syncer.pull_once()
+        self.assertEqual(syncer.stats()["rejected"], 1)
+        self.assertEqual(b.dao.search(_vector(1), threshold=0.9)[:2], ("Alice", "S1"))
+
+        # B 也切换到新模型后从头重新拉取：旧模型的 create 被拒绝，A 重新提取的特征替换同步过来的记录
+        b.dao.replace_vectors(pa.table({"uuid": pa.array([], pa.string()), "vector": pa.array([], pa.list_(pa.float32()))}), "m2")
+        syncer.pull_once()
+        stats = syncer.stats()
+        self.assertEqual((stats["rejected"], stats["reembedded"], stats["errors"]), (2, 1, 0))
+        self.assertEqual(b.dao.count(), 1)
+        self.assertEqual(b.dao.search(_vector(9), threshold=0.9)[:2], ("Alice", "S1"))
+        self.assertIsNone(b.dao.search(_vector(1), threshold=0.9))
+        self.assertEqual(syncer.status()[0]["model"], "m2")
+
+    def test_changes_require_shared_token(self):
+        a = self._node("A")
+        open_node = self._node("C", token=None)
+        a.dao.create("Alice", "S1", _vector(1), Path("alice.jpg"))
+
+        def status_of(node: _Node, authorization=None) -> int:
+            headers = {"Authorization": authorization} if authorization else {}
+            request = urllib.request.Request(f"{node.url}{SYNC_CHANGES_PATH}?since=0", headers=headers)
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+
+        self.assertEqual(status_of(a), 401)
+        self.assertEqual(status_of(a, "Bearer wrong"), 403)
+        self.assertEqual(status_of(a, f"Bearer {TOKEN}"), 200)
+        self.assertEqual(status_of(open_node, f"Bearer {TOKEN}"), 403)
+
+        b = self._node("B")
+        syncer = b.syncer(a, token="wrong")
+        syncer.pull_once()
+        self.assertEqual(b.dao.count(), 0)
+        self.assertEqual(syncer.status()[0]["error"], "HTTP 403")
+
+
+if __name__ == "__main__":
+    unittest.main()
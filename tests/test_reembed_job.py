@@ -0,0 +1,214 @@
+# tests/test_reembed_job.py
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pyarrow as pa
+
+from app.cfg.config import ReembedConfig
+from app.service.face_dao import LanceDBFaceDataDAO, gallery_model_path, save_gallery_model
+from app.service.reembed_job import ReembedJob
+
+# 112x112 对齐模板上的 5 个关键点，测试图片为 112x112，补边后仍落在图中
+_LANDMARKS = [[38.3, 51.7], [73.5, 51.5], [56.0, 71.7], [41.5, 92.4], [70.7, 92.2]]
+
+
+def _vector(seed: int) -> np.ndarray:
+    vector = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+NEW_VECTOR = _vector(100)
+
+
+class _Detector:
+    def predict_batch(self, images):
+        for _ in images:
+            yield SimpleNamespace(results=[{"score": 0.9, "landmarks": [{"landmark": p} for p in _LANDMARKS]}])
+
+
+class _Recognizer:
+    def predict_batch(self, faces):
+        for _ in faces:
+            yield SimpleNamespace(results=[{"data": [NEW_VECTOR]}])
+
+
+class _Pool:
+    """代替 ModelPool：记录处理过的图片数，可在每次借用时调用 on_acquire 钩子（用于在批次之间阻塞任务）。"""
+
+    def __init__(self, on_acquire=None):
+        self.on_acquire = on_acquire
+        self.acquired = 0
+
+    def acquire(self, timeout: float = 0.1):
+        self.acquired += 1
+        if self.on_acquire is not None:
+            self.on_acquire(self.acquired)
+        return _Detector(), _Recognizer()
+
+    def release(self, models):
+        pass
+
+
+class ReembedJobTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.db_uri = str(self.root / "db")
+        # 人脸库由旧模型提取，当前配置为新模型
+        save_gallery_model(self.db_uri, "faces", "old")
+        self.dao = self._dao()
+        self.cfg = ReembedConfig(batch_size=1, max_duty_cycle=1.0, checkpoint_rows=1,
+                                 state_file=str(self.root / "reembed_state.json"))
+        self.jobs = []
+
+    def tearDown(self):
+        for job in self.jobs:
+            job.close()
+        self.dao.dispose()
+        self.tmp.cleanup()
+
+    def _dao(self, **kwargs) -> LanceDBFaceDataDAO:
+        return LanceDBFaceDataDAO(self.db_uri, "faces", index_refresh_seconds=3600, node_id="A",
+                                  recognition_model="new", snapshot_dir=str(self.root / "snapshots"), **kwargs)
+
+    def _image(self, name: str) -> str:
+        path = self.root / "faces" / f"{name}.jpg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), np.random.default_rng(len(name)).integers(0, 255, (112, 112, 3), dtype=np.uint8))
+        return str(path)
+
+    def _insert(self, names, registration_time: datetime, origin=None, seed: int = 0):
+        self.dao.bulk_insert(pa.table({
+            "uuid": [f"u-{name}" for name in names],
+            "vector": pa.FixedSizeListArray.from_arrays(
+                pa.array(np.stack([_vector(seed + i) for i in range(len(names))]).reshape(-1)), 512),
+            "name": list(names),
+            "sn": [f"S-{name}" for name in names],
+            "image_path": [self._image(name) for name in names],
+            "registration_time": pa.array([registration_time] * len(names), pa.timestamp("us")),
+            "origin": pa.array([origin] * len(names), pa.string()),
+        }), model="old")
+
+    def _job(self, pool: _Pool) -> ReembedJob:
+        job = ReembedJob(self.cfg, self.dao, pool, self.db_uri, "faces", "new")
+        self.jobs.append(job)
+        return job
+
+    def _vectors(self):
+        rows = self.dao.table.search().select(["uuid", "vector"]).to_arrow().to_pylist()
+        return {row["uuid"]: np.asarray(row["vector"], dtype=np.float32) for row in rows}
+
+    def _wait(self, job: ReembedJob):
+        job._worker.join(10)
+        self.assertFalse(job.running)
+
+    def test_switch_replaces_local_vectors_and_logs_reembed(self):
+        earlier = datetime.now() - timedelta(minutes=5)
+        self._insert(["a", "b"], earlier)
+        self._insert(["x"], earlier, origin="X", seed=10)
+        job = self._job(_Pool())
+        self.assertTrue(job.needed)
+        job.start()
+        self._wait(job)
+
+        status = job.status()
+        self.assertEqual(status["status"], "completed")
+        self.assertEqual((status["total"], status["done"], status["switched"]), (2, 2, 2))
+        vectors = self._vectors()
+        np.testing.assert_allclose(vectors["u-a"], NEW_VECTOR, atol=1e-6)
+        np.testing.assert_allclose(vectors["u-b"], NEW_VECTOR, atol=1e-6)
+        # 同步而来的记录由来源节点重新提取，本节点不处理
+        np.testing.assert_allclose(vectors["u-x"], _vector(10), atol=1e-6)
+        self.assertEqual(self.dao.gallery_model, "new")
+        self.assertEqual(job.gallery_model, "new")
+        self.assertEqual(gallery_model_path(self.db_uri, "faces").read_text(encoding="utf-8"), "new")
+
+        changes, _, _ = self.dao.changes_since(0, 100)
+        reembeds = [row for row in changes.to_pylist() if row["op"] == "reembed"]
+        self.assertEqual(sorted(row["uuid"] for row in reembeds), ["u-a", "u-b"])
+        self.assertTrue(all(row["model"] == "new" and row["record_origin"] == "A" for row in reembeds))
+        np.testing.assert_allclose(np.asarray(reembeds[0]["vector"], dtype=np.float32), NEW_VECTOR, atol=1e-6)
+
+    def test_switch_refreshes_snapshot_index(self):
+        self.dao.dispose()
+        self.dao = self._dao(vector_index="snapshot")
+        self._insert(["a", "b"], datetime.now() - timedelta(minutes=5))
+        self.assertEqual(self.dao.search(_vector(0), threshold=0.9)[:2], ("a", "S-a"))
+        job = self._job(_Pool())
+        job.start()
+        self._wait(job)
+
+        self.assertIsNone(self.dao.search(_vector(0), threshold=0.9))
+        self.assertIn(self.dao.search(NEW_VECTOR, threshold=0.9)[:2], [("a", "S-a"), ("b", "S-b")])
+        # 落盘的快照同样是新向量，重启后直接映射也不会用到旧向量
+        self.dao.dispose()
+        self.dao = self._dao(vector_index="snapshot")
+        self.assertIsNone(self.dao.search(_vector(0), threshold=0.9))
+        self.assertIsNotNone(self.dao.search(NEW_VECTOR, threshold=0.9))
+
+    def test_rows_written_during_run_are_processed_before_switch(self):
+        earlier = datetime.now() - timedelta(minutes=5)
+        self._insert(["a", "b"], earlier)
+        entered, proceed = threading.Event(), threading.Event()
+
+        def block_first(count):
+            if count == 1:
+                entered.set()
+                proceed.wait(10)
+
+        job = self._job(_Pool(on_acquire=block_first))
+        job.start()
+        self.assertTrue(entered.wait(10))
+        # 任务开始后才写入、但注册时间早于开始时间的记录（如导入的归档）
+        self._insert(["late"], earlier, seed=20)
+        proceed.set()
+        self._wait(job)
+
+        status = job.status()
+        self.assertEqual(status["status"], "completed")
+        self.assertEqual((status["total"], status["switched"]), (3, 3))
+        np.testing.assert_allclose(self._vectors()["u-late"], NEW_VECTOR, atol=1e-6)
+
+    def test_pause_then_resume_from_checkpoint(self):
+        self._insert(["a", "b", "c"], datetime.now() - timedelta(minutes=5))
+        entered, proceed = threading.Event(), threading.Event()
+
+        def block_first(count):
+            if count == 1:
+                entered.set()
+                proceed.wait(10)
+
+        first = self._job(_Pool(on_acquire=block_first))
+        first.start()
+        self.assertTrue(entered.wait(10))
+        pausing = threading.Thread(target=first.pause)
+        pausing.start()
+        while not first._stop_event.is_set():
+            pass
+        proceed.set()
+        pausing.join(10)
+
+        status = first.status()
+        self.assertEqual((status["status"], status["done"]), ("paused", 1))
+        self.assertEqual(self.dao.gallery_model, "old")
+        np.testing.assert_allclose(self._vectors()["u-b"], _vector(1), atol=1e-6)
+
+        # 新实例读取同一个进度文件，从断点继续，只处理剩余的记录
+        pool = _Pool()
+        resumed = self._job(pool)
+        resumed.start()
+        self._wait(resumed)
+        status = resumed.status()
+        self.assertEqual(pool.acquired, 2)
+        self.assertEqual((status["status"], status["done"], status["switched"]), ("completed", 3, 3))
+        self.assertTrue(all(np.allclose(vector, NEW_VECTOR, atol=1e-6) for vector in self._vectors().values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
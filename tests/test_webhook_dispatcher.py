@@ -0,0 +1,152 @@
+# tests/test_webhook_dispatcher.py
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from app.cfg.config import WebhookConfig
+from app.service.webhook_dispatcher import WebhookDispatcher
+
+
+class _Receiver:
+    """本地 HTTP 接收端：记录收到的事件，可设置响应状态码与响应延迟。"""
+
+    def __init__(self, status: int = 200, delay: float = 0.0):
+        self.status = status
+        self.delay = delay
+        self.events = []
+        self.requests = 0
+        self.received = threading.Event()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                receiver.requests += 1
+                if receiver.delay:
+                    time.sleep(receiver.delay)
+                if receiver.status == 200:
+                    receiver.events.extend(body["events"])
+                    receiver.received.set()
+                self.send_response(receiver.status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _result(sn: str):
+    return {"sn": sn, "name": f"name-{sn}", "similarity": 0.9, "box": [1, 2, 3, 4]}
+
+
+class WebhookDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.receivers = []
+
+    def tearDown(self):
+        for receiver in self.receivers:
+            receiver.close()
+        self.tmp.cleanup()
+
+    def _receiver(self, **kwargs) -> _Receiver:
+        receiver = _Receiver(**kwargs)
+        self.receivers.append(receiver)
+        return receiver
+
+    def _config(self, urls, **overrides) -> WebhookConfig:
+        values = dict(enabled=True, urls=urls, max_delay_seconds=0.05, timeout_seconds=2.0,
+                      retry_backoff_seconds=0.05, max_backoff_seconds=0.2, cooldown_seconds=10.0,
+                      spool_dir=str(Path(self.tmp.name) / "spool"))
+        values.update(overrides)
+        return WebhookConfig(**values)
+
+    def test_batches_and_debounces(self):
+        receiver = self._receiver()
+        dispatcher = WebhookDispatcher(self._config([receiver.url]))
+        dispatcher.publish_results("cam1", [_result("A"), _result("B"), {"sn": None}])
+        dispatcher.publish_results("cam1", [_result("A")])
+        dispatcher.publish_results("cam2", [_result("A")])
+        self.assertTrue(receiver.received.wait(3))
+        dispatcher.close()
+        self.assertEqual(sorted((e["stream_id"], e["sn"]) for e in receiver.events),
+                         [("cam1", "A"), ("cam1", "B"), ("cam2", "A")])
+        stats = dispatcher.stats()
+        self.assertEqual(stats["debounced"], 1)
+        self.assertEqual(stats["delivered"], 3)
+
+    def test_slow_endpoint_does_not_stall_others(self):
+        slow = self._receiver(delay=1.5)
+        fast = self._receiver()
+        dispatcher = WebhookDispatcher(self._config([slow.url, fast.url], timeout_seconds=5.0))
+        dispatcher.publish_results("cam1", [_result("A")])
+        time.sleep(0.2)
+        started = time.monotonic()
+        dispatcher.publish_results("cam1", [_result("B")])
+        self.assertTrue(fast.received.wait(1.0))
+        while len(fast.events) < 2 and time.monotonic() - started < 1.0:
+            time.sleep(0.01)
+        self.assertEqual([e["sn"] for e in fast.events], ["A", "B"])
+        self.assertLess(time.monotonic() - started, 1.0)
+        dispatcher.close()
+
+    def test_retries_after_server_error(self):
+        receiver = self._receiver(status=503)
+        dispatcher = WebhookDispatcher(self._config([receiver.url]))
+        dispatcher.publish_results("cam1", [_result("A")])
+        deadline = time.monotonic() + 3
+        while receiver.requests < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        receiver.status = 200
+        self.assertTrue(receiver.received.wait(3))
+        dispatcher.close()
+        self.assertEqual([e["sn"] for e in receiver.events], ["A"])
+        self.assertGreaterEqual(dispatcher.stats()["retried"], 1)
+
+    def test_close_spools_undelivered_batches_and_next_start_delivers_them(self):
+        receiver = self._receiver(status=503)
+        cfg = self._config([receiver.url], retry_backoff_seconds=30.0, max_backoff_seconds=30.0)
+        dispatcher = WebhookDispatcher(cfg)
+        dispatcher.publish_results("cam1", [_result("A"), _result("B")])
+        deadline = time.monotonic() + 3
+        while dispatcher.stats()["retrying"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        dispatcher.close()
+        spooled = list(Path(cfg.spool_dir).glob("*.json"))
+        self.assertEqual(len(spooled), 1)
+        self.assertEqual(len(json.loads(spooled[0].read_text(encoding="utf-8"))["events"]), 2)
+
+        receiver.status = 200
+        restarted = WebhookDispatcher(cfg)
+        self.assertTrue(receiver.received.wait(3))
+        restarted.close()
+        self.assertEqual(sorted(e["sn"] for e in receiver.events), ["A", "B"])
+        self.assertEqual(list(Path(cfg.spool_dir).glob("*.json")), [])
+
+    def test_close_spools_queue_of_unresponsive_endpoint(self):
+        slow = self._receiver(delay=2.0)
+        cfg = self._config([slow.url], timeout_seconds=5.0)
+        dispatcher = WebhookDispatcher(cfg)
+        dispatcher.publish_results("cam1", [_result("A")])
+        time.sleep(0.3)
+        dispatcher.publish_results("cam1", [_result("B")])
+        dispatcher.close(timeout=0.2)
+        spooled = [json.loads(p.read_text(encoding="utf-8")) for p in Path(cfg.spool_dir).glob("*.json")]
+        self.assertEqual([e["sn"] for batch in spooled for e in batch["events"]], ["B"])
+
+
+if __name__ == "__main__":
+    unittest.main()
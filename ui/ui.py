@@ -98,6 +98,7 @@ def initialize_session_state():
         "api_url": f"{backend_host}:12010",  # 默认指向后端的12010端口
         "api_status": (False, "尚未连接"),
         "faces_data": None,
+        "faces_cursors": [None],  # 人脸库管理页的游标栈：栈顶为当前页的游标，None 表示第一页
         "show_register_dialog": False,
         "active_page": "仪表盘",
         "viewing_stream_info": None,
@@ -183,18 +184,26 @@ def api_request(method: str, endpoint: str, **kwargs) -> Tuple[bool, Any, str]:
         return False, None, f"网络请求失败，请检查后端地址或服务状态: {e}"
 
 
-def refresh_all_data():
-    """从API获取最新的人脸库数据。"""
-    st.session_state.faces_data = {"count": 0, "faces": [], "unique_sns": []}  # 先清空
+FACES_PAGE_SIZE = 60
+
+
+def refresh_all_data(reset_cursor: bool = True):
+    """通过游标分页接口获取当前页的人脸库数据（只包含元数据），不再一次性加载整个人脸库。"""
+    if reset_cursor:
+        st.session_state.faces_cursors = [None]
+    st.session_state.faces_data = {"count": 0, "faces": [], "unique_sns": [], "next_cursor": None}  # 先清空
+    params = {"limit": FACES_PAGE_SIZE}
+    if st.session_state.faces_cursors[-1]:
+        params["cursor"] = st.session_state.faces_cursors[-1]
     with st.spinner("正在从服务器同步最新数据..."):
-        success, data, msg = api_request('GET', API_ENDPOINTS['FACES'])
+        success, data, msg = api_request('GET', API_ENDPOINTS['FACES'], params=params)
         if success and data:
-            all_faces = data.get('faces', [])
-            unique_sns = sorted(list({face['sn'] for face in all_faces}))
+            faces = data.get('faces', [])
             st.session_state.faces_data = {
-                "count": data.get('count', 0),
-                "faces": all_faces,
-                "unique_sns": unique_sns
+                "count": data.get('count', len(faces)),
+                "faces": faces,
+                "unique_sns": sorted({face['sn'] for face in faces}),
+                "next_cursor": data.get('next_cursor'),
             }
             st.toast("人脸库数据已同步!", icon="🔄")
         else:
@@ -205,6 +214,9 @@ def convert_path_to_url(server_path: str) -> str:
     """将后端返回的文件路径智能地转换为可访问的URL。"""
     if not server_path or not isinstance(server_path, str):
         return "https://via.placeholder.com/150?text=No+Path"
+    if server_path.startswith("remote://"):
+        # 从其他节点同步而来的记录，图片保存在来源节点上
+        return "https://via.placeholder.com/150?text=Remote"
     # 使用 as_posix() 确保是 / 分隔符
     p = Path(server_path).as_posix()
     if 'data/' in p:
@@ -306,7 +318,7 @@ def render_dashboard_page():
 
     # 确保 faces_data 不是 None，如果 st.session_state.get 返回 None，则使用空字典
     faces_data = st.session_state.get("faces_data") or {}
-    unique_sns_count = len(faces_data.get('unique_sns', []))
+    faces_count = faces_data.get('count', 0)
     api_status, api_color = ("在线", "#28a745") if st.session_state.api_status[0] else ("离线", "#dc3545")
 
     # 获取视频流数量
@@ -318,8 +330,8 @@ def render_dashboard_page():
         st.html(f"""
         <div class="info-card">
             <div class="icon">👥</div>
-            <div class="title">人脸库人员总数</div>
-            <div class="value">{unique_sns_count}</div>
+            <div class="title">人脸库人脸总数</div>
+            <div class="value">{faces_count}</div>
         </div>""")
     with col2:
         st.html(f"""
@@ -384,7 +396,19 @@ def render_management_page():
 
     unique_sns = faces_data.get('unique_sns', [])
     all_faces_info = faces_data.get('faces', [])
-    st.subheader(f"👥 人员列表 (共 {len(unique_sns)} 人)")
+    page_number = len(st.session_state.faces_cursors)
+    st.subheader(f"👥 人员列表 (共 {faces_data.get('count', 0)} 张人脸，第 {page_number} 页)")
+
+    # 游标翻页：下一页压入服务端返回的 next_cursor，上一页弹出栈顶
+    prev_col, next_col = st.columns(2)
+    if prev_col.button("⬅️ 上一页", disabled=page_number <= 1, use_container_width=True):
+        st.session_state.faces_cursors.pop()
+        refresh_all_data(reset_cursor=False)
+        st.rerun()
+    if next_col.button("下一页 ➡️", disabled=not faces_data.get('next_cursor'), use_container_width=True):
+        st.session_state.faces_cursors.append(faces_data['next_cursor'])
+        refresh_all_data(reset_cursor=False)
+        st.rerun()
 
     num_cols = 3
     cols = st.columns(num_cols)
@@ -400,7 +424,9 @@ def render_management_page():
 
             # 使用更紧凑的图像展示
             img_captions = [f"ID: ...{face['uuid'][-4:]}" for face in person_faces]
-            img_urls = [convert_path_to_url(face.get('image_path')) for face in person_faces]
+            # 列表只加载缩略图；旧版后端未返回缩略图地址时退回原图
+            img_urls = [f"http://{st.session_state.api_url}{face['thumbnail_url']}" if face.get('thumbnail_url')
+                        else convert_path_to_url(face.get('image_path')) for face in person_faces]
             st.image(img_urls, width=60, caption=img_captions)
 
             with st.expander("⚙️ 管理此人"):
@@ -457,7 +483,8 @@ def render_monitoring_page():
         stream_info = st.session_state.viewing_stream_info
         st.subheader(f"正在播放: `{stream_info['source']}`")
         st.caption(f"Stream ID: `{stream_info['stream_id']}`")
-        st.image(stream_info['feed_url'], caption=f"实时视频流 | 源: {stream_info['source']}")
+        # 仪表盘中的画面尺寸有限，订阅缩小、降低质量的画质变体以节省带宽
+        st.image(f"{stream_info['feed_url']}?max_width=960&quality=75", caption=f"实时视频流 | 源: {stream_info['source']}")
     else:
         st.info("当前未选择任何视频流进行观看。请从下面的列表中选择一个，或启动一个新的监测任务。")
 